@@ -0,0 +1,157 @@
+r"""Simulate the global scheduler on a synthetic cluster, without GPUs.
+
+Replays joins, leaves, silent failures and a request arrival process against the real
+scheduler (see `scheduling.simulator`), and reports throughput, TTFT / TPOT percentiles and
+the number of global rebalances. Use it to compare layer allocation and routing strategies:
+
+    python src/backend/benchmark/simulate_scheduler.py \
+        --model Qwen/Qwen3-0.6B \
+        --gpus a100-80g:4 rtx4090:8 \
+        --num-regions 2 \
+        --strategy beam \
+        --routing-strategy rr \
+        --num-prompts 1000 \
+        --request-rate 16 \
+        --fail rtx4090-3@30 --join rtx5090@60
+
+`--model` accepts a Hugging Face model id or a local directory containing config.json.
+"""
+
+import argparse
+import random
+from typing import Dict, List, Tuple
+
+from backend.server.static_config import get_model_info
+from scheduling.model_info import ModelInfo
+from scheduling.node import Node, NodeHardwareInfo
+from scheduling.scheduler import Scheduler
+from scheduling.simulator import ClusterSimulator, poisson_arrivals
+
+# name: (tflops_fp16, memory_gb, memory_bandwidth_gbps, device)
+GPU_PRESETS: Dict[str, Tuple[float, float, float, str]] = {
+    "a100-80g": (312.0, 80.0, 2039.0, "cuda"),
+    "a100-40g": (312.0, 40.0, 1935.0, "cuda"),
+    "h100-80g": (989.0, 80.0, 3350.0, "cuda"),
+    "rtx5090": (104.8, 32.0, 1792.0, "cuda"),
+    "rtx4090": (82.6, 24.0, 1008.0, "cuda"),
+    "m3-max-128g": (28.4, 128.0, 400.0, "mlx"),
+}
+
+
+def build_node(node_id: str, gpu: str, model_info: ModelInfo, args: argparse.Namespace) -> Node:
+    if gpu not in GPU_PRESETS:
+        raise ValueError(f"Unknown GPU {gpu}; expected one of {list(GPU_PRESETS)}")
+    tflops, memory_gb, bandwidth, device = GPU_PRESETS[gpu]
+    hardware = NodeHardwareInfo(node_id, 1, tflops, gpu, memory_gb, bandwidth, device)
+    return Node(
+        node_id=node_id,
+        hardware=hardware,
+        model_info=model_info,
+        max_concurrent_requests=args.max_concurrent_requests,
+        max_sequence_length=args.max_sequence_length,
+    )
+
+
+def assign_rtts(nodes: List[Node], num_regions: int, rng: random.Random) -> None:
+    """Places nodes in random regions; RTTs grow with the distance between regions."""
+    centers = [(rng.uniform(0, 1), rng.uniform(0, 1)) for _ in range(num_regions)]
+    region = {node.node_id: rng.randrange(num_regions) for node in nodes}
+    for node in nodes:
+        node.rtt_to_nodes = {}
+        ax, ay = centers[region[node.node_id]]
+        for other in nodes:
+            if other is node:
+                continue
+            bx, by = centers[region[other.node_id]]
+            distance = ((ax - bx) ** 2 + (ay - by) ** 2) ** 0.5
+            # 2ms within a region, up to ~150ms across the map
+            node.rtt_to_nodes[other.node_id] = 2.0 + 100.0 * distance
+
+
+def parse_event(spec: str) -> Tuple[str, float]:
+    name, _, at_s = spec.rpartition("@")
+    if not name:
+        raise argparse.ArgumentTypeError(f"Expected NAME@SECONDS, got {spec}")
+    return name, float(at_s)
+
+
+def main(args: argparse.Namespace):
+    rng = random.Random(args.seed)
+    model_info = get_model_info(args.model)
+
+    nodes = []
+    for spec in args.gpus:
+        gpu, _, count = spec.partition(":")
+        for _ in range(int(count or 1)):
+            nodes.append(build_node(f"{gpu}-{len(nodes)}", gpu, model_info, args))
+    late_joins = []
+    for gpu, at_s in args.join:
+        node = build_node(f"{gpu}-{len(nodes) + len(late_joins)}", gpu, model_info, args)
+        late_joins.append((node, at_s))
+    assign_rtts(nodes + [node for node, _ in late_joins], args.num_regions, rng)
+
+    scheduler = Scheduler(
+        model_info,
+        [],
+        min_nodes_bootstrapping=args.min_nodes or len(nodes),
+        strategy=args.strategy,
+        routing_strategy=args.routing_strategy,
+        heartbeat_timeout=args.heartbeat_timeout,
+    )
+    sim = ClusterSimulator(scheduler, heartbeat_interval_s=args.heartbeat_interval)
+    for node in nodes:
+        sim.add_node(node)
+    for node, at_s in late_joins:
+        sim.add_node(node, at_s)
+    for node_id, at_s in args.leave:
+        sim.remove_node(node_id, at_s)
+    for node_id, at_s in args.fail:
+        sim.fail_node(node_id, at_s)
+    sim.add_requests(
+        poisson_arrivals(args.num_prompts, args.request_rate, args.burstiness, seed=args.seed),
+        prompt_len=args.input_len,
+        output_len=args.output_len,
+        range_ratio=args.range_ratio,
+        seed=args.seed,
+    )
+
+    report = sim.run(until_s=args.max_duration)
+    print(f"Allocations: {scheduler.list_node_allocations()}")
+    print(report.summary())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate the global scheduler offline.")
+    parser.add_argument("--model", type=str, required=True)
+    parser.add_argument(
+        "--gpus",
+        nargs="+",
+        default=["a100-80g:4"],
+        help=f"GPU:COUNT specs, GPU one of {list(GPU_PRESETS)}",
+    )
+    parser.add_argument("--num-regions", type=int, default=1)
+    parser.add_argument("--max-concurrent-requests", type=int, default=16)
+    parser.add_argument("--max-sequence-length", type=int, default=4096)
+    parser.add_argument("--strategy", choices=["greedy", "dp", "beam"], default="beam")
+    parser.add_argument("--routing-strategy", choices=["rr", "dp"], default="rr")
+    parser.add_argument("--min-nodes", type=int, default=None)
+    parser.add_argument("--heartbeat-interval", type=float, default=1.0)
+    parser.add_argument("--heartbeat-timeout", type=float, default=60.0)
+    parser.add_argument(
+        "--join", type=parse_event, nargs="*", default=[], help="GPU@SECONDS late joins"
+    )
+    parser.add_argument(
+        "--leave", type=parse_event, nargs="*", default=[], help="NODE_ID@SECONDS leaves"
+    )
+    parser.add_argument(
+        "--fail", type=parse_event, nargs="*", default=[], help="NODE_ID@SECONDS failures"
+    )
+    parser.add_argument("--num-prompts", type=int, default=1000)
+    parser.add_argument("--request-rate", type=float, default=float("inf"))
+    parser.add_argument("--burstiness", type=float, default=1.0)
+    parser.add_argument("--input-len", type=int, default=1024)
+    parser.add_argument("--output-len", type=int, default=128)
+    parser.add_argument("--range-ratio", type=float, default=0.0)
+    parser.add_argument("--max-duration", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
@@ -1,11 +1,11 @@
 ﻿import json
 import time
-from typing import Dict
+from typing import AsyncIterator, Dict, Iterator
 
 import aiohttp
+import anyio
 from fastapi import Request
 from fastapi.responses import JSONResponse, StreamingResponse
-from starlette.concurrency import iterate_in_threadpool
 
 from backend.server.constants import NODE_STATUS_AVAILABLE
 from backend.server.toolkit_event_log import append_inference_event
@@ -17,22 +17,37 @@ logger = get_logger(__name__)
 
 AIOHTTP_TIMEOUT = aiohttp.ClientTimeout(total=20 * 60 * 60)
 
+# Lattica stream iterators only offer blocking reads. They run under their own limiter
+# instead of Starlette's shared threadpool, whose 40 tokens would cap concurrent streams.
+STREAM_RELAY_LIMIT = 4096
+_END_OF_STREAM = object()
+
+
+async def relay_stream(
+    iterator: Iterator[bytes], limiter: anyio.CapacityLimiter
+) -> AsyncIterator[bytes]:
+    """Yield the chunks of a blocking iterator, read in worker threads under `limiter`."""
+    while True:
+        chunk = await anyio.to_thread.run_sync(next, iterator, _END_OF_STREAM, limiter=limiter)
+        if chunk is _END_OF_STREAM:
+            return
+        yield chunk
+
 
 class RequestHandler:
-    """HTTP request forwarder with scheduler-aware routing and retry logic.
+    """HTTP request forwarder with scheduler-aware routing.
 
-    Behavior for routing resolution:
-    - routing_table is None: scheduler has not decided yet -> treat as error for this attempt
-    - routing_table is []: all pipelines are full now -> retry up to max attempts
+    Behavior for routing resolution (awaited without blocking the event loop):
+    - routing_table is None: scheduler did not decide in time -> 503
+    - routing_table is []: pipelines stayed full while the request waited in line -> 429
     - routing_table is non-empty: forward to first hop
     """
 
-    MAX_ROUTING_RETRY = 20
-    RETRY_DELAY_SEC = 5
-
-    def __init__(self):
+    def __init__(self, stream_relay_limit: int = STREAM_RELAY_LIMIT):
         self.scheduler_manage = None
         self.stubs = {}
+        # Worker threads reading streams from the first hop, see `relay_stream`
+        self.stream_relay_limiter = anyio.CapacityLimiter(stream_relay_limit)
 
     def set_scheduler_manage(self, scheduler_manage):
         self.scheduler_manage = scheduler_manage
@@ -60,43 +75,25 @@ class RequestHandler:
                 status_code=500,
             )
 
-        # Try to resolve routing; retry if table is an empty list (capacity full)
-        attempts = 0
-        routing_table = None
-        while attempts < self.MAX_ROUTING_RETRY:
-            try:
-                routing_table = self.scheduler_manage.get_routing_table(request_id, received_ts)
-                logger.debug(
-                    f"get_routing_table for request {request_id} return: {routing_table} (attempt {attempts+1})"
-                )
-            except Exception as e:
-                logger.exception(f"get_routing_table error: {e}")
-                return JSONResponse(
-                    content={"error": "Get routing table error"},
-                    status_code=500,
-                )
-
-            # None -> scheduler has not set yet; treat as hard error (no waiting here)
-            if routing_table is None:
-                return JSONResponse(
-                    content={"error": "Routing pipelines not ready"},
-                    status_code=503,
-                )
-
-            # Non-empty -> proceed
-            if len(routing_table) > 0:
-                break
-
-            # Empty list -> capacity full now, retry after short delay
-            attempts += 1
-            if attempts < self.MAX_ROUTING_RETRY:
-                # small async delay before re-forwarding
-                import asyncio
+        # Resolve routing; while all pipelines are full the request waits in line
+        try:
+            routing_table = await self.scheduler_manage.route_request(request_id, received_ts)
+        except Exception as e:
+            logger.exception(f"route_request error: {e}")
+            return JSONResponse(
+                content={"error": "Get routing table error"},
+                status_code=500,
+            )
 
-                await asyncio.sleep(self.RETRY_DELAY_SEC)
+        # None -> scheduler did not decide in time
+        if routing_table is None:
+            return JSONResponse(
+                content={"error": "Routing pipelines not ready"},
+                status_code=503,
+            )
 
-        # If still empty after retries, return 429 Too Many Requests
-        if routing_table is not None and len(routing_table) == 0:
+        # Empty list -> no capacity freed up while waiting, return 429 Too Many Requests
+        if len(routing_table) == 0:
             return JSONResponse(
                 content={"error": "All pipelines are busy or not ready. Please retry later."},
                 status_code=429,
@@ -111,20 +108,24 @@ class RequestHandler:
             if is_stream:
 
                 async def stream_generator():
-                    response = stub.chat_completion(request_data)
+                    response = None
                     first_token_time = None
                     last_chunk = None
                     last_token_time = None
+                    done = False
+                    output_tokens = None
+                    tpot_ms = None
                     try:
-                        iterator = iterate_in_threadpool(response)
-                        async for chunk in iterator:
+                        response = stub.chat_completion(request_data)
+                        async for chunk in relay_stream(response, self.stream_relay_limiter):
                             last_token_time = time.time()
                             if first_token_time is None:
                                 first_token_time = last_token_time
-                            if chunk is not None and not chunk.decode("utf-8").startswith(
-                                "data: [DONE]"
-                            ):
-                                last_chunk = chunk
+                            if chunk is not None:
+                                if chunk.decode("utf-8").startswith("data: [DONE]"):
+                                    done = True
+                                else:
+                                    last_chunk = chunk
                             yield chunk
                     finally:
                         if last_chunk is not None:
@@ -140,6 +141,13 @@ class RequestHandler:
                                 logger.info(
                                     f"Request ID: {request_id} | TPS: {tps:.2f} |  TTFT: {ttft} ms | Output tokens: {output_tokens} | Input tokens: {input_tokens}"
                                 )
+                                # Decode time only; TPS would also count the prefill
+                                if output_tokens > 1:
+                                    tpot_ms = (
+                                        (last_token_time - first_token_time)
+                                        * 1000.0
+                                        / (output_tokens - 1)
+                                    )
                                 self._emit_inference_event(
                                     request_id=str(request_id),
                                     model=str(request_data.get("model") or "unknown"),
@@ -168,7 +176,15 @@ class RequestHandler:
                                 request=request,
                             )
                         logger.debug(f"client disconnected for {request_id}")
-                        response.cancel()
+                        if response is not None:
+                            response.cancel()
+                        self.scheduler_manage.notify_request_finished(
+                            str(request_id),
+                            routing_table,
+                            num_output_tokens=output_tokens,
+                            tpot_ms=tpot_ms,
+                            aborted=not done,
+                        )
 
                 resp = StreamingResponse(
                     stream_generator(),
@@ -181,24 +197,37 @@ class RequestHandler:
                 logger.debug(f"Streaming response initiated for {request_id}")
                 return resp
             else:
-                response = stub.chat_completion(request_data)
-                content = (await anext(iterate_in_threadpool(response))).decode()
-                logger.debug(f"Non-stream response completed for {request_id}")
-                # response is a JSON string; parse to Python object before returning
-                payload = json.loads(content)
                 tokens_in = None
                 tokens_out = None
+                completed = False
                 try:
-                    usage = payload.get("usage") if isinstance(payload, dict) else None
-                    if isinstance(usage, dict):
-                        pi = usage.get("prompt_tokens")
-                        po = usage.get("completion_tokens")
-                        if isinstance(pi, int):
-                            tokens_in = pi
-                        if isinstance(po, int):
-                            tokens_out = po
-                except Exception:
-                    pass
+                    response = stub.chat_completion(request_data)
+                    content = (
+                        await anext(relay_stream(response, self.stream_relay_limiter))
+                    ).decode()
+                    logger.debug(f"Non-stream response completed for {request_id}")
+                    # response is a JSON string; parse to Python object before returning
+                    payload = json.loads(content)
+                    completed = True
+                    try:
+                        usage = payload.get("usage") if isinstance(payload, dict) else None
+                        if isinstance(usage, dict):
+                            pi = usage.get("prompt_tokens")
+                            po = usage.get("completion_tokens")
+                            if isinstance(pi, int):
+                                tokens_in = pi
+                            if isinstance(po, int):
+                                tokens_out = po
+                    except Exception:
+                        pass
+                finally:
+                    # Prefill and decode are not told apart here, so no TPOT is reported
+                    self.scheduler_manage.notify_request_finished(
+                        str(request_id),
+                        routing_table,
+                        num_output_tokens=tokens_out,
+                        aborted=not completed,
+                    )
 
                 self._emit_inference_event(
                     request_id=str(request_id),
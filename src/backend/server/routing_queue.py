@@ -0,0 +1,151 @@
+"""
+Awaitable request routing for the backend gateway.
+
+The global scheduler decides routes on its dispatch thread. `RoutingQueue` turns that
+decision into an asyncio future, so HTTP handlers await it without blocking the event loop
+(and every open SSE stream with it).
+
+When all pipelines are full the scheduler answers with an empty route. Such requests wait
+in a bounded FIFO instead of sleeping and retrying on their own: only the head of the queue
+asks the scheduler again, whenever capacity may have been released or after a short retry
+interval, and new requests queue up behind it rather than overtaking.
+"""
+
+import asyncio
+from collections import deque
+from typing import Callable, Deque, List, Optional
+
+from parallax_utils.logging_config import get_logger
+from scheduling.node import RequestSignal
+
+logger = get_logger(__name__)
+
+
+class RoutingQueue:
+    """Resolves routes through the scheduler and queues requests while pipelines are full.
+
+    Must be used from a single event loop.
+    """
+
+    def __init__(
+        self,
+        submit: Callable[[RequestSignal], None],
+        max_waiting: int = 256,
+        decision_timeout_s: float = 5.0,
+        wait_timeout_s: float = 100.0,
+        retry_interval_s: float = 0.5,
+    ):
+        """
+        Args:
+            submit: Hands a request signal to the scheduler (e.g. `Scheduler.receive_request`);
+            max_waiting: Requests that may wait for capacity; further ones are rejected;
+            decision_timeout_s: Time the scheduler has to route a request;
+            wait_timeout_s: Time a request may wait for capacity before it is rejected;
+            retry_interval_s: Interval at which the head of the queue asks again when no
+                capacity release is signalled.
+        """
+        self.submit = submit
+        self.max_waiting = max_waiting
+        self.decision_timeout_s = decision_timeout_s
+        self.wait_timeout_s = wait_timeout_s
+        self.retry_interval_s = retry_interval_s
+        self._waiters: Deque[asyncio.Event] = deque()
+
+    @property
+    def num_waiting(self) -> int:
+        return len(self._waiters)
+
+    def notify_capacity(self) -> None:
+        """Signals that pipeline capacity may have been released, e.g. a request finished."""
+        if self._waiters:
+            self._waiters[0].set()
+
+    async def route(self, request_id: str, received_ts: float) -> Optional[List[str]]:
+        """Returns the route of a request, waiting in line while all pipelines are full.
+
+        Returns:
+            None if the scheduler did not decide in time, [] if no capacity freed up before
+            the request gave up (or the queue was full), otherwise the route.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout_s
+        waiter = None
+        try:
+            if self._waiters:
+                # Others are already waiting for capacity: queue up behind them
+                waiter = self._join()
+                if waiter is None or not await self._wait_turn(waiter, deadline):
+                    return []
+            while True:
+                routing_table = await self._request_route(request_id, received_ts)
+                if routing_table is None or len(routing_table) > 0:
+                    return routing_table
+                if waiter is None:
+                    waiter = self._join()
+                    if waiter is None:
+                        return []
+                if not await self._wait_turn(waiter, deadline):
+                    logger.debug(f"Request {request_id} gave up waiting for pipeline capacity")
+                    return []
+        finally:
+            if waiter is not None:
+                self._leave(waiter)
+
+    async def _request_route(self, request_id: str, received_ts: float) -> Optional[List[str]]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def _resolve(routing_table: List[str]):
+            if not future.done():
+                future.set_result(routing_table)
+
+        def _on_routed(signal: RequestSignal):
+            # Called on the scheduler's dispatch thread
+            try:
+                loop.call_soon_threadsafe(_resolve, signal.routing_table)
+            except RuntimeError:
+                # The event loop is gone, nobody is waiting anymore
+                pass
+
+        self.submit(RequestSignal(request_id, received_ts, on_routed=_on_routed))
+        try:
+            return await asyncio.wait_for(future, self.decision_timeout_s)
+        except asyncio.TimeoutError:
+            logger.debug(
+                f"Routing table not ready after {self.decision_timeout_s}s for {request_id}"
+            )
+            return None
+
+    def _join(self) -> Optional[asyncio.Event]:
+        if len(self._waiters) >= self.max_waiting:
+            return None
+        waiter = asyncio.Event()
+        self._waiters.append(waiter)
+        return waiter
+
+    def _leave(self, waiter: asyncio.Event) -> None:
+        was_head = self._waiters and self._waiters[0] is waiter
+        self._waiters.remove(waiter)
+        if was_head:
+            # The next in line tries right away
+            self.notify_capacity()
+
+    async def _wait_turn(self, waiter: asyncio.Event, deadline: float) -> bool:
+        """Waits until the waiter is at the head of the queue and may ask again."""
+        loop = asyncio.get_running_loop()
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            is_head = self._waiters[0] is waiter
+            timeout = min(remaining, self.retry_interval_s) if is_head else remaining
+            try:
+                # A release signalled while the waiter was asking counts as well
+                await asyncio.wait_for(waiter.wait(), timeout)
+            except asyncio.TimeoutError:
+                if is_head and loop.time() < deadline:
+                    return True
+                continue
+            waiter.clear()
+            if self._waiters[0] is waiter:
+                return True
@@ -1,9 +1,9 @@
 import json
 import time
 
-import httpx
 from lattica import ConnectionHandler, Lattica, rpc_method, rpc_stream, rpc_stream_iter
 
+from parallax.p2p.utils import HTTPRelay
 from parallax_utils.logging_config import get_logger
 from scheduling.node import Node, NodeHardwareInfo
 from scheduling.scheduler import Scheduler
@@ -27,6 +27,7 @@ class RPCConnectionHandler(ConnectionHandler):
         super().__init__(lattica)
         self.scheduler = scheduler
         self.http_port = http_port
+        self.http_relay = HTTPRelay()
 
     @rpc_stream
     def node_join(self, message):
@@ -106,22 +107,13 @@ class RPCConnectionHandler(ConnectionHandler):
     ):
         """Handle chat completion request"""
         logger.debug(f"Chat completion request: {request}, type: {type(request)}")
+        url = f"http://localhost:{self.http_port}/v1/chat/completions"
         try:
-            with httpx.Client(timeout=10 * 60, proxy=None, trust_env=False) as client:
-                if request.get("stream", False):
-                    with client.stream(
-                        "POST",
-                        f"http://localhost:{self.http_port}/v1/chat/completions",
-                        json=request,
-                    ) as response:
-                        for chunk in response.iter_bytes():
-                            if chunk:
-                                yield chunk
-                else:
-                    response = client.post(
-                        f"http://localhost:{self.http_port}/v1/chat/completions", json=request
-                    ).json()
-                    yield json.dumps(response).encode()
+            if request.get("stream", False):
+                yield from self.http_relay.stream("POST", url, json=request)
+            else:
+                response = self.http_relay.request("POST", url, json=request).json()
+                yield json.dumps(response).encode()
         except Exception as e:
             logger.exception(f"Error in chat completion: {e}")
             yield b"internal server error"
@@ -129,13 +121,9 @@ class RPCConnectionHandler(ConnectionHandler):
     @rpc_stream_iter
     def cluster_status(self):
         try:
-            with httpx.Client(timeout=10 * 60, proxy=None, trust_env=False) as client:
-                with client.stream(
-                    "GET", f"http://localhost:{self.http_port}/cluster/status"
-                ) as response:
-                    for chunk in response.iter_bytes():
-                        if chunk:
-                            yield chunk
+            yield from self.http_relay.stream(
+                "GET", f"http://localhost:{self.http_port}/cluster/status"
+            )
         except Exception as e:
             logger.exception(f"Error in cluster status: {e}")
             yield json.dumps({"error": "internal server error"}).encode()
@@ -1,10 +1,11 @@
 import threading
 import time
-from typing import List
+from typing import List, Optional
 
 from lattica import Lattica
 
 from backend.server.constants import NODE_STATUS_AVAILABLE, NODE_STATUS_WAITING
+from backend.server.routing_queue import RoutingQueue
 from backend.server.rpc_connection_handler import RPCConnectionHandler
 from backend.server.static_config import get_model_info, get_node_join_command
 from parallax.cli import PUBLIC_INITIAL_PEERS, PUBLIC_RELAY_SERVERS
@@ -49,6 +50,7 @@ class SchedulerManage:
         self.lattica = None
         self.stubs = {}
         self.is_local_network = False
+        self.routing_queue = RoutingQueue(self._submit_request_signal)
 
     def run(self, model_name, init_nodes_num, is_local_network=True):
         """
@@ -258,33 +260,46 @@ class SchedulerManage:
         )
         logger.debug("RPCConnectionHandler initialized")
 
-    def get_routing_table(self, request_id, received_ts):
-        """Block briefly until the scheduler assigns a routing path for the request.
+    def _submit_request_signal(self, request: RequestSignal):
+        # Resolved on every call, the scheduler is recreated when the model changes
+        self.scheduler.receive_request(request)
+
+    async def route_request(self, request_id, received_ts):
+        """Await the routing path the scheduler assigns to the request.
 
-        Distinguish three states via `RequestSignal.routing_table`:
-        - None: not yet decided, keep waiting up to timeout
-        - []: decided but no capacity (pipelines full), return immediately
-        - [..]: valid routing path, return immediately
+        Does not block the event loop. Distinguishes three outcomes:
+        - None: the scheduler did not decide in time
+        - []: no pipeline capacity freed up while the request waited in line
+        - [..]: valid routing path
         """
         logger.debug(f"Routing table requested for request_id={request_id}")
-        request = RequestSignal(request_id, received_ts)
-        self.scheduler.receive_request(request)
+        routing_table = await self.routing_queue.route(request_id, received_ts)
+        logger.debug(f"Routing table resolved for request_id={request_id}: {routing_table}")
+        return routing_table
 
-        # Wait up to 5 seconds, but return immediately if the routing table is set (including an empty list)
-        start_time = time.time()
-        while request.routing_table is None and (time.time() - start_time) < 5.0:
-            time.sleep(0.05)
+    def notify_request_finished(
+        self,
+        request_id: str,
+        routing_table: List[str],
+        *,
+        num_output_tokens: Optional[int] = None,
+        tpot_ms: Optional[float] = None,
+        aborted: bool = False,
+    ):
+        """Reports a finished or aborted request to the scheduler.
 
-        # Return the routing_table
-        if request.routing_table is None:
-            logger.debug(
-                f"Routing table not ready after {(time.time() - start_time):.2f}s for request_id={request_id}"
-            )
-        else:
-            logger.debug(
-                f"Routing table resolved for request_id={request_id}: {request.routing_table}"
+        Releases the request's slots on its pipeline, then lets the next request waiting
+        for pipeline capacity try again.
+        """
+        if self.scheduler is not None:
+            self.scheduler.enqueue_request_finished(
+                request_id,
+                routing_table,
+                num_output_tokens=num_output_tokens,
+                tpot_ms=tpot_ms,
+                aborted=aborted,
             )
-        return request.routing_table
+        self.routing_queue.notify_capacity()
 
     def get_schedule_status(self):
         """
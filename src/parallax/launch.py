@@ -59,8 +59,11 @@ def _stop_executor_processes(executor_subprocs):
 def _wait_executors_check_layer_change(shared_state: SharedState, executor_subprocs):
     """Wait for executor processes and check if layer allocation changed.
 
+    Executors that can switch layers in place clear the change flag themselves and keep
+    running. The others exit when it is set; once one has, the rest are stopped.
+
     Returns:
-        True if layer allocation changed (need to reload executors),
+        True if executors exited because layer allocation changed (need to reload executors),
         False if all executors exited normally.
     """
     while any(proc.is_alive() for proc in executor_subprocs):
@@ -68,7 +71,9 @@ def _wait_executors_check_layer_change(shared_state: SharedState, executor_subpr
             if proc.is_alive():
                 proc.join(timeout=1.0)  # Check every second
 
-        if shared_state.get_layer_allocation_changed():
+        if shared_state.get_layer_allocation_changed() and not all(
+            proc.is_alive() for proc in executor_subprocs
+        ):
             return True
 
     # Check race condition: layer allocation changed after all processes exited
@@ -133,7 +138,7 @@ if __name__ == "__main__":
                 max_sequence_length=args.max_sequence_length,
                 param_mem_ratio=args.param_mem_ratio,
                 kvcache_mem_ratio=args.kvcache_mem_ratio,
-                shared_state=shared_state.dict,  # Pass dict to subprocess
+                shared_state=shared_state,
                 log_level=args.log_level,
             )
 
@@ -145,7 +150,7 @@ if __name__ == "__main__":
                     target=run_executor_process,
                     args=(
                         args_copy,
-                        shared_state.dict,  # Pass dict to subprocess
+                        shared_state,
                     ),
                 )
                 proc.start()
@@ -159,7 +164,6 @@ if __name__ == "__main__":
                 proc.join()
         else:
             # Launch P2P server as subprocess (with scheduler)
-            # Pass dict to subprocess (multiprocessing requires serializable objects)
             p2p_server_process = launch_p2p_server_process(
                 initial_peers=args.initial_peers,
                 scheduler_addr=args.scheduler_addr,
@@ -181,7 +185,7 @@ if __name__ == "__main__":
                 max_sequence_length=args.max_sequence_length,
                 param_mem_ratio=args.param_mem_ratio,
                 kvcache_mem_ratio=args.kvcache_mem_ratio,
-                shared_state=shared_state.dict,  # Pass dict to subprocess
+                shared_state=shared_state,
                 log_level=args.log_level,
             )
 
@@ -230,7 +234,7 @@ if __name__ == "__main__":
                             target=run_executor_process,
                             args=(
                                 args_copy,
-                                shared_state.dict,  # Pass dict to subprocess
+                                shared_state,
                             ),
                         )
                         proc.start()
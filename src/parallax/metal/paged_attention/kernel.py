@@ -1,7 +1,8 @@
 import os
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
 import mlx.core as mx
+from mlx_lm.models.base import scaled_dot_product_attention
 
 # Cache for compiled kernels
 _KERNELS: Dict[str, object] = {}
@@ -386,3 +387,240 @@ def paged_attention(
 
     out = outputs[0]
     return out[:, :, None, :]
+
+
+def gather_paged_kv(
+    key_cache: mx.array,  # (1, num_blocks, num_kv_heads, block_size, k_head_dim)
+    value_cache: mx.array,  # (1, num_blocks, num_kv_heads, block_size, v_head_dim)
+    block_tables: mx.array,  # (batch, max_blocks)
+    num_tokens: int,
+) -> Tuple[mx.array, mx.array]:
+    """
+    Gathers the first `num_tokens` cached keys and values of every sequence in the batch.
+
+    Used by prefill chunks that start after an already cached prefix: the chunk's own K/V
+    have been written by `reshape_and_cache`, so the cache holds the whole attention context.
+    Positions past a sequence's context length contain stale data and must be masked out.
+
+    Returns:
+        keys: (batch, num_kv_heads, num_tokens, k_head_dim)
+        values: (batch, num_kv_heads, num_tokens, v_head_dim)
+    """
+    block_size = key_cache.shape[3]
+    num_blocks = (num_tokens + block_size - 1) // block_size
+    table = block_tables[:, :num_blocks]
+
+    def _gather(cache: mx.array) -> mx.array:
+        # (batch, num_blocks, heads, block_size, dim) -> (batch, heads, num_blocks * block_size, dim)
+        gathered = cache[0][table]
+        batch, blocks, heads, size, dim = gathered.shape
+        gathered = gathered.transpose(0, 2, 1, 3, 4).reshape(batch, heads, blocks * size, dim)
+        return gathered[:, :, :num_tokens, :]
+
+    return _gather(key_cache), _gather(value_cache)
+
+
+def apply_segmented_rope(
+    rope: Callable[..., mx.array],
+    x: mx.array,  # (1, num_heads, total_tokens, head_dim)
+    query_lens: List[int],
+    offsets: mx.array,  # (num_seqs,)
+) -> mx.array:
+    """
+    Applies RoPE to a flattened mixed batch, one segment of `query_lens[i]` tokens per
+    sequence starting at position `offsets[i]`.
+    """
+    rotated = []
+    start = 0
+    for query_len, offset in zip(query_lens, offsets.tolist()):
+        rotated.append(rope(x[:, :, start : start + query_len], offset=offset))
+        start += query_len
+    return mx.concatenate(rotated, axis=2)
+
+
+def ragged_paged_attention(
+    queries: mx.array,  # (1, num_heads, total_tokens, k_head_dim)
+    key_cache: mx.array,
+    value_cache: mx.array,
+    block_tables: mx.array,  # (num_seqs, max_blocks)
+    context_lengths: mx.array,  # (num_seqs,)
+    query_lens: List[int],
+    block_size: int,
+    scale: float,
+    num_kv_heads: int,
+    v_head_dim: Optional[int] = None,
+) -> mx.array:
+    """
+    Attention for a mixed prefill + decode batch flattened into a single row.
+
+    Sequence i owns a contiguous segment of `query_lens[i]` queries ending at its context
+    length, and its keys and values (including the segment's own) are already in the paged
+    cache. Single-token segments (decodes) share one `paged_attention` call; longer segments
+    (prefill chunks) use causal SDPA over their gathered context.
+
+    Returns:
+        output: (1, num_heads, total_tokens, v_head_dim)
+    """
+    starts = [0]
+    for query_len in query_lens:
+        starts.append(starts[-1] + query_len)
+
+    single = [i for i, query_len in enumerate(query_lens) if query_len == 1]
+    single_output = None
+    if single:
+        seq_idx = mx.array(single, dtype=mx.int32)
+        token_idx = mx.array([starts[i] for i in single], dtype=mx.int32)
+        # (num_single, num_heads, 1, k_head_dim)
+        single_queries = queries[0][:, token_idx].transpose(1, 0, 2)[:, :, None, :]
+        single_output = paged_attention(
+            single_queries,
+            key_cache,
+            value_cache,
+            block_tables[seq_idx],
+            context_lengths[seq_idx],
+            block_size,
+            scale,
+            num_kv_heads,
+            v_head_dim=v_head_dim,
+        )
+
+    context_lens = context_lengths.tolist()
+    outputs = []
+    num_single = 0
+    for i, query_len in enumerate(query_lens):
+        if query_len == 1:
+            outputs.append(single_output[num_single : num_single + 1])
+            num_single += 1
+            continue
+        keys, values = gather_paged_kv(
+            key_cache, value_cache, block_tables[i : i + 1], context_lens[i]
+        )
+        # Bottom-right aligned causal mask: the segment sees its cached prefix in full
+        outputs.append(
+            mx.fast.scaled_dot_product_attention(
+                queries[:, :, starts[i] : starts[i + 1]],
+                keys,
+                values,
+                scale=scale,
+                mask="causal",
+            )
+        )
+    return mx.concatenate(outputs, axis=2)
+
+
+def apply_batched_rope(
+    rope: Callable[..., mx.array],
+    queries: mx.array,  # (batch, num_heads, target_len, head_dim)
+    keys: mx.array,  # (batch, num_kv_heads, target_len, head_dim)
+    context_lengths: mx.array,  # (batch,)
+    prefix_lens: Optional[mx.array] = None,  # (batch,)
+    query_lens: Optional[List[int]] = None,
+) -> Tuple[mx.array, mx.array]:
+    """
+    Applies RoPE to the queries and keys of a batch at each sequence's position.
+
+    Decodes start at their last context position, prefill chunks after their cached prefix,
+    and the segments of a flattened mixed batch (`query_lens`) after their prefix.
+    """
+    if query_lens is not None:
+        return (
+            apply_segmented_rope(rope, queries, query_lens, prefix_lens),
+            apply_segmented_rope(rope, keys, query_lens, prefix_lens),
+        )
+    batch, _, target_len, _ = queries.shape
+    queries_rotated = []
+    keys_rotated = []
+    for i in range(batch):
+        if target_len == 1:
+            offset = int(context_lengths[i]) - 1
+        else:
+            offset = int(prefix_lens[i]) if prefix_lens is not None else 0
+        queries_rotated.append(rope(queries[i : i + 1], offset=offset))
+        keys_rotated.append(rope(keys[i : i + 1], offset=offset))
+    return mx.concatenate(queries_rotated, axis=0), mx.concatenate(keys_rotated, axis=0)
+
+
+def paged_attention_forward(
+    queries: mx.array,  # (batch, num_heads, target_len, k_head_dim)
+    keys: mx.array,  # (batch, num_kv_heads, target_len, k_head_dim)
+    values: mx.array,  # (batch, target_len, num_kv_heads, v_head_dim)
+    key_cache: mx.array,
+    value_cache: mx.array,
+    block_tables: mx.array,  # (batch, max_blocks)
+    context_lengths: mx.array,  # (batch,)
+    scale: float,
+    num_kv_heads: int,
+    mask: Optional[mx.array] = None,
+    slot_mapping: Optional[mx.array] = None,
+    prefix_lens: Optional[mx.array] = None,
+    query_lens: Optional[List[int]] = None,
+    rope: Optional[Callable[..., mx.array]] = None,
+) -> mx.array:
+    """
+    Attention of a layer over the paged KV cache, shared by the MLX models.
+
+    Applies `rope` (if given, see `apply_batched_rope`), writes the new keys and values
+    into the cache and attends with the kernel that fits the batch: `ragged_paged_attention`
+    for a flattened mixed batch, `paged_attention` for decodes, and SDPA for prefills, over
+    the gathered cache when the chunk follows a cached prefix.
+
+    Returns:
+        output: (batch, target_len, num_heads * v_head_dim)
+    """
+    batch, _, target_len, _ = queries.shape
+    if rope is not None:
+        queries, keys = apply_batched_rope(
+            rope, queries, keys, context_lengths, prefix_lens, query_lens
+        )
+    block_size = key_cache.shape[3]
+    v_head_dim = values.shape[-1]
+
+    reshape_and_cache(
+        keys.transpose(0, 2, 1, 3),
+        values,
+        key_cache,
+        value_cache,
+        block_tables,
+        context_lengths,
+        block_size,
+        slot_mapping=slot_mapping,
+    )
+
+    if query_lens is not None:
+        # Mixed batch: decodes share one paged attention call, prefill chunks use SDPA
+        output = ragged_paged_attention(
+            queries,
+            key_cache,
+            value_cache,
+            block_tables,
+            context_lengths,
+            query_lens,
+            block_size,
+            scale,
+            num_kv_heads,
+            v_head_dim=v_head_dim,
+        )
+    elif target_len == 1:
+        output = paged_attention(
+            queries,
+            key_cache,
+            value_cache,
+            block_tables,
+            context_lengths,
+            block_size,
+            scale,
+            num_kv_heads,
+            v_head_dim=v_head_dim,
+        )
+    else:
+        keys_attn = keys
+        values_attn = values.transpose(0, 2, 1, 3)
+        if prefix_lens is not None:
+            # Chunked prefill: also attend to the prompt prefix already in the paged cache
+            keys_attn, values_attn = gather_paged_kv(
+                key_cache, value_cache, block_tables, mask.shape[-1]
+            )
+        output = scaled_dot_product_attention(
+            queries, keys_attn, values_attn, scale=scale, mask=mask, cache=None
+        )
+    return output.transpose(0, 2, 1, 3).reshape(batch, target_len, -1)
@@ -5,12 +5,14 @@ hidden_dimefines the Qwen3 model.
 from typing import Any, List, Optional
 
 import mlx.core as mx
-from mlx_lm.models.base import scaled_dot_product_attention
 from mlx_lm.models.deepseek_v2 import DeepseekV2Attention as MLXDeepseekV2Attention
 from mlx_lm.models.deepseek_v2 import DeepseekV2DecoderLayer as MLXDeepseekV2Block
 from mlx_lm.models.deepseek_v2 import ModelArgs
 
-from parallax.metal.paged_attention.kernel import paged_attention, reshape_and_cache
+from parallax.metal.paged_attention.kernel import (
+    apply_batched_rope,
+    paged_attention_forward,
+)
 from parallax.server.cache.base import BaseCache
 
 
@@ -29,6 +31,8 @@ class ParallaxDeepSeekV2Attention(MLXDeepseekV2Attention):
         block_tables: Optional[mx.array] = None,
         context_lengths: Optional[mx.array] = None,
         slot_mapping: Optional[mx.array] = None,
+        prefix_lens: Optional[mx.array] = None,
+        query_lens: Optional[List[int]] = None,
         **kwargs,
     ) -> mx.array:
         """
@@ -41,6 +45,8 @@ class ParallaxDeepSeekV2Attention(MLXDeepseekV2Attention):
             block_tables: (batch, max_blocks) - PagedKV block tables.
             context_lengths: (batch,) - PagedKV sequence lengths.
             slot_mapping: (batch * target_len,) - Flattened slot mapping.
+            prefix_lens: (batch,) - Cached prompt tokens preceding a prefill chunk.
+            query_lens: Per-request query lengths of a flattened mixed batch (batch == 1).
 
         Returns:
             output_h: (batch, target_len, hidden_dim) - Output hidden states.
@@ -65,62 +71,28 @@ class ParallaxDeepSeekV2Attention(MLXDeepseekV2Attention):
         # q_pe = self.rope(q_pe, offset=offset)
         # k_pe = self.rope(k_pe, offset=offset)
         key_cache_global, value_cache_global = cache.get_cache()
-        q_pe_list = []
-        k_pe_list = []
-        for i in range(batch):
-            current_pos = int(context_lengths[i]) - 1 if target_len == 1 else 0
-            q_slice = q_pe[i : i + 1]
-            k_slice = k_pe[i : i + 1]
-            q_rot = self.rope(q_slice, offset=current_pos)
-            k_rot = self.rope(k_slice, offset=current_pos)
-            q_pe_list.append(q_rot)
-            k_pe_list.append(k_rot)
-        q_pe = mx.concatenate(q_pe_list, axis=0)
-        k_pe = mx.concatenate(k_pe_list, axis=0)
-
+        q_pe, k_pe = apply_batched_rope(
+            self.rope, q_pe, k_pe, context_lengths, prefix_lens, query_lens
+        )
         k_pe = mx.repeat(k_pe, self.num_heads, axis=1)
         queries = mx.concatenate([q_nope, q_pe], axis=-1)
-
-        # Construct full keys
         keys = mx.concatenate([k_nope, k_pe], axis=-1)
-
-        block_size = key_cache_global.shape[3]
-
-        reshape_and_cache(
-            keys.transpose(0, 2, 1, 3),
+        output = paged_attention_forward(
+            queries,
+            keys,
             values,
             key_cache_global,
             value_cache_global,
             block_tables,
             context_lengths,
-            block_size,
+            self.scale,
+            self.num_heads,
+            mask=mask,
             slot_mapping=slot_mapping,
+            prefix_lens=prefix_lens,
+            query_lens=query_lens,
         )
 
-        if target_len == 1:
-            output = paged_attention(
-                queries,
-                key_cache_global,
-                value_cache_global,
-                block_tables,
-                context_lengths,
-                block_size,
-                self.scale,
-                self.num_heads,  # num_kv_heads (MQA/MLA, here num_heads == num_kv_heads effectively after repeat?)
-                v_head_dim=values.shape[-1],
-            )
-            output = output.transpose(0, 2, 1, 3).reshape(batch, target_len, -1)
-        else:
-            output = scaled_dot_product_attention(
-                queries,
-                keys,
-                values.transpose(0, 2, 1, 3),
-                scale=self.scale,
-                mask=mask,
-                cache=None,
-            )
-            output = output.transpose(0, 2, 1, 3).reshape(batch, target_len, -1)
-
         return self.o_proj(output)
 
 
@@ -129,6 +101,9 @@ class ParallaxDeepSeekV2Block(MLXDeepseekV2Block):
     This version handles the KV cache explicitly and returns new K and V states.
     """
 
+    supports_chunked_prefill = True
+    supports_mixed_batch = True
+
     def __init__(self, args: ModelArgs, layer_idx: int, local_layer_idx: int):
         super().__init__(args, layer_idx=layer_idx)
         self.self_attn = ParallaxDeepSeekV2Attention(args)
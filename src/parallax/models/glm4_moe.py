@@ -1,12 +1,11 @@
 from typing import Any, List, Optional
 
 import mlx.core as mx
-from mlx_lm.models.base import scaled_dot_product_attention
 from mlx_lm.models.glm4_moe import Attention as MLXGLM4MoeAttention
 from mlx_lm.models.glm4_moe import DecoderLayer as MLXGLM4MoeBlock
 from mlx_lm.models.glm4_moe import ModelArgs
 
-from parallax.metal.paged_attention.kernel import paged_attention, reshape_and_cache
+from parallax.metal.paged_attention.kernel import paged_attention_forward
 from parallax.server.cache.base import BaseCache
 
 
@@ -19,6 +18,8 @@ class ParallaxGLM4MoeAttention(MLXGLM4MoeAttention):
         block_tables: Optional[mx.array] = None,
         context_lengths: Optional[mx.array] = None,
         slot_mapping: Optional[mx.array] = None,
+        prefix_lens: Optional[mx.array] = None,
+        query_lens: Optional[List[int]] = None,
         **kwargs,
     ) -> mx.array:
         batch, target_len, _ = x.shape
@@ -37,65 +38,29 @@ class ParallaxGLM4MoeAttention(MLXGLM4MoeAttention):
         values_new = values.reshape(batch, target_len, self.n_kv_heads, -1)
 
         key_cache_global, value_cache_global = cache.get_cache()
-
-        queries_rotated_list = []
-        keys_rotated_list = []
-
-        for i in range(batch):
-            current_pos = int(context_lengths[i]) - 1 if target_len == 1 else 0
-            q_slice = queries_new[i : i + 1]
-            k_slice = keys_new[i : i + 1]
-            q_rot = self.rope(q_slice, offset=current_pos)
-            k_rot = self.rope(k_slice, offset=current_pos)
-            queries_rotated_list.append(q_rot)
-            keys_rotated_list.append(k_rot)
-
-        queries_rotated = mx.concatenate(queries_rotated_list, axis=0)
-        keys_rotated = mx.concatenate(keys_rotated_list, axis=0)
-
-        block_size = key_cache_global.shape[3]
-
-        reshape_and_cache(
-            keys_rotated.transpose(0, 2, 1, 3),
+        output = paged_attention_forward(
+            queries_new,
+            keys_new,
             values_new,
             key_cache_global,
             value_cache_global,
             block_tables,
             context_lengths,
-            block_size,
+            self.scale,
+            self.n_kv_heads,
+            mask=mask,
             slot_mapping=slot_mapping,
+            prefix_lens=prefix_lens,
+            query_lens=query_lens,
+            rope=self.rope,
         )
 
-        # 3. Compute Attention
-        if target_len == 1:
-            # Decode Phase: Use Paged Attention Kernel
-            output = paged_attention(
-                queries_rotated,
-                key_cache_global,
-                value_cache_global,
-                block_tables,
-                context_lengths,
-                block_size,
-                self.scale,
-                self.n_kv_heads,
-            )
-            output = output.transpose(0, 2, 1, 3).reshape(batch, target_len, -1)
-        else:
-            # Prefill Phase: Use Standard Self-Attention on local data
-            output = scaled_dot_product_attention(
-                queries_rotated,
-                keys_rotated,
-                values_new.transpose(0, 2, 1, 3),
-                scale=self.scale,
-                mask=mask,
-                cache=None,
-            )
-            output = output.transpose(0, 2, 1, 3).reshape(batch, target_len, -1)
-
         return self.o_proj(output)
 
 
 class ParallaxGLM4MoeBlock(MLXGLM4MoeBlock):
+    supports_chunked_prefill = True
+    supports_mixed_batch = True
 
     def __init__(self, args: ModelArgs, layer_idx: int, local_layer_idx: int):
         super().__init__(args, layer_idx)
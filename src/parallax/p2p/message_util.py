@@ -3,12 +3,26 @@ Utility functions for message serialization and deserialization.
 
 This module contains utility functions for serializing and deserializing messages
 between the P2P server and the executor.
+
+Tensors are framed as a fixed header (dtype code, ndim, then ndim int64 dims) followed by
+the raw row-major buffer. Between the executor and its P2P server a forward message is a
+ZMQ multipart message [b"forward", ForwardRequest, header, buffer, header, buffer, ...],
+sent and received with copy=False, so hidden states are never staged through protobuf.
+Peers exchange a ForwardRequest over RPC, with header and buffer inlined in
+Req.hidden_states.
+
+Generated tokens go from the first peer's executor to the HTTP server as one msgpack
+message per step (see `TokenBatch`), with token ids, prompt lengths and finish reasons
+packed as fixed-width buffers.
 """
 
-import io
-from typing import Any, List, Optional
+import struct
+import warnings
+from typing import Any, List, Optional, Sequence, Tuple
 
 import mlx.core as mx
+import msgpack
+import numpy as np
 
 from parallax.p2p.proto import forward_pb2
 from parallax.server.request import IntermediateRequest, Request, RequestStatus
@@ -18,22 +32,27 @@ from parallax.server.sampling.sampling_params import SamplingParams
 def request_to_proto(
     requests: List[IntermediateRequest],
     device: Optional[str] = "mlx",
+    tensor_frames: Optional[List[Any]] = None,
 ) -> forward_pb2.ForwardRequest:
     """
     Convert a list of IntermediateRequest objects to a ForwardRequest protobuf message.
     IntermediateRequest contains request_id, current_position, status, and hidden_states.
+    A batch holding both prefill and decode requests is sent as a single MIXED message.
+
+    If `tensor_frames` is given, hidden states are appended to it as (header, buffer)
+    frame pairs instead of being copied into the message.
     """
     forward_request = forward_pb2.ForwardRequest()
     assert len(requests) > 0, "No requests to convert"
-    assert all(
-        request.status == requests[0].status for request in requests
-    ), "All requests must have the same status"
-    if requests[0].status == RequestStatus.PREFILLING:
+    statuses = {request.status for request in requests}
+    if statuses == {RequestStatus.PREFILLING}:
         forward_request.forward_mode = forward_pb2.ForwardMode.EXTEND
-    elif requests[0].status == RequestStatus.DECODING:
+    elif statuses == {RequestStatus.DECODING}:
         forward_request.forward_mode = forward_pb2.ForwardMode.DECODE
+    elif statuses == {RequestStatus.PREFILLING, RequestStatus.DECODING}:
+        forward_request.forward_mode = forward_pb2.ForwardMode.MIXED
     else:
-        raise ValueError(f"Invalid status: {requests[0].status}")
+        raise ValueError(f"Invalid status: {statuses}")
 
     for request in requests:
         proto_req = forward_pb2.Req()
@@ -43,9 +62,14 @@ def request_to_proto(
         proto_req.routing_table.extend(request.routing_table)
         proto_req.sampling_params.CopyFrom(sampling_params_to_proto(request.sampling_params))
         proto_req.lora_path = request.lora_path if request.lora_path is not None else ""
+        proto_req.priority = request.priority
 
         if request.hidden_states is not None:
-            proto_req.hidden_states = tensor_to_bytes(request.hidden_states, device=device)
+            if tensor_frames is None:
+                proto_req.hidden_states = tensor_to_bytes(request.hidden_states, device=device)
+            else:
+                tensor_frames.extend(tensor_to_frames(request.hidden_states, device=device))
+                proto_req.hidden_states_frame = len(tensor_frames) // 2
 
         if request.next_token_id is not None:
             proto_req.next_token_id = request.next_token_id
@@ -58,9 +82,11 @@ def request_to_proto(
 def proto_to_request(
     proto_request: forward_pb2.ForwardRequest,
     device: Optional[str] = "mlx",
+    tensor_frames: Optional[Sequence[Any]] = None,
 ) -> List[IntermediateRequest]:
     """
     Convert a ForwardRequest protobuf message to a IntermediateRequest object.
+    Hidden states are read from `tensor_frames` for requests that reference a frame pair.
     """
 
     requests = []
@@ -71,7 +97,10 @@ def proto_to_request(
         next_token_id = proto_req.next_token_id
 
         hidden_states = None
-        if proto_req.hidden_states:
+        if proto_req.hidden_states_frame > 0:
+            index = 2 * (proto_req.hidden_states_frame - 1)
+            hidden_states = frames_to_tensor(tensor_frames[index], tensor_frames[index + 1], device)
+        elif proto_req.hidden_states:
             hidden_states = bytes_to_tensor(proto_req.hidden_states, device)
 
         status = None
@@ -81,6 +110,12 @@ def proto_to_request(
             status = RequestStatus.PREFILLING
         elif proto_request.forward_mode == forward_pb2.ForwardMode.DECODE:
             status = RequestStatus.DECODING
+        elif proto_request.forward_mode == forward_pb2.ForwardMode.MIXED:
+            # Prefill chunks end within the prompt; decodes are past it
+            if proto_req.output_length > 0:
+                status = RequestStatus.DECODING
+            else:
+                status = RequestStatus.PREFILLING
         else:
             raise ValueError(f"Invalid forward mode: {proto_request.forward_mode}")
 
@@ -96,6 +131,7 @@ def proto_to_request(
             next_token_id=next_token_id,
             sampling_params=sampling_params,
             lora_path=proto_req.lora_path if proto_req.lora_path != "" else None,
+            priority=proto_req.priority,
         )
 
         requests.append(request)
@@ -180,38 +216,211 @@ def sampling_params_to_proto(params: SamplingParams) -> forward_pb2.SamplingPara
     return proto
 
 
-def tensor_to_bytes(tensor: Any, device: Optional[str] = "mlx") -> bytes:
-    """Convert tensor to protobuf Tensor using safetensor serialization."""
+def requests_to_multipart(
+    requests: List[IntermediateRequest], device: Optional[str] = "mlx"
+) -> List[Any]:
+    """Frames of a forward message: the serialized ForwardRequest, then its tensor frames."""
+    tensor_frames = []
+    forward_request = request_to_proto(requests, device, tensor_frames=tensor_frames)
+    return [forward_request.SerializeToString(), *tensor_frames]
+
+
+def multipart_to_requests(
+    frames: Sequence[Any], device: Optional[str] = "mlx"
+) -> List[IntermediateRequest]:
+    """Inverse of `requests_to_multipart`; frames may be zmq.Frame objects."""
+    forward_request = forward_pb2.ForwardRequest()
+    forward_request.ParseFromString(_frame_buffer(frames[0]))
+    tensor_frames = [_frame_buffer(frame) for frame in frames[1:]]
+    return proto_to_request(forward_request, device, tensor_frames=tensor_frames)
+
+
+def inline_tensor_frames(forward_request: forward_pb2.ForwardRequest, frames: Sequence[Any]):
+    """Moves tensor frames into Req.hidden_states, e.g. before an RPC to the next peer."""
+    for proto_req in forward_request.reqs:
+        if proto_req.hidden_states_frame > 0:
+            index = 2 * (proto_req.hidden_states_frame - 1)
+            proto_req.hidden_states = b"".join(
+                (_frame_buffer(frames[index]), _frame_buffer(frames[index + 1]))
+            )
+            proto_req.hidden_states_frame = 0
+
+
+def extract_tensor_frames(forward_request: forward_pb2.ForwardRequest) -> List[Any]:
+    """Moves inlined Req.hidden_states out into tensor frames (inverse of the above)."""
+    frames = []
+    for proto_req in forward_request.reqs:
+        if proto_req.hidden_states:
+            data = memoryview(proto_req.hidden_states)
+            header_size = _tensor_header_size(data)
+            frames.extend((data[:header_size], data[header_size:]))
+            proto_req.ClearField("hidden_states")
+            proto_req.hidden_states_frame = len(frames) // 2
+    return frames
+
+
+# Wire dtype codes are indices into this list; append only
+TENSOR_DTYPES = ["float32", "float16", "bfloat16", "int32", "int64", "uint8", "bool"]
+# numpy has no bfloat16, its raw bits are carried as uint16
+_NUMPY_DTYPES = {
+    "float32": np.float32,
+    "float16": np.float16,
+    "bfloat16": np.uint16,
+    "int32": np.int32,
+    "int64": np.int64,
+    "uint8": np.uint8,
+    "bool": np.bool_,
+}
+# dtype code, ndim; followed by ndim little-endian int64 dims
+_TENSOR_HEADER = struct.Struct("<BB")
+
+
+def _frame_buffer(frame: Any) -> memoryview:
+    """Zero-copy view of a zmq.Frame or any bytes-like object."""
+    return getattr(frame, "buffer", None) or memoryview(frame)
+
+
+def _tensor_header_size(data: memoryview) -> int:
+    return _TENSOR_HEADER.size + 8 * data[1]
+
+
+def tensor_to_frames(tensor: Any, device: Optional[str] = "mlx") -> Tuple[bytes, memoryview]:
+    """Splits a tensor into its header and a view of its raw buffer."""
     if device == "cuda":
-        from safetensors.torch import save
+        import torch
 
-        # Convert tensor to CPU
-        if tensor.device.type != "cpu":
-            cpu_tensor = tensor.cpu()
-        else:
-            cpu_tensor = tensor
-        # Store buffer using safetensor (dtype and size are automatically preserved)
-        serialized_data = save({"tensor": cpu_tensor.contiguous()})
-        return serialized_data
+        cpu_tensor = tensor.detach().to("cpu").contiguous()
+        shape = tuple(cpu_tensor.shape)
+        dtype_name = str(cpu_tensor.dtype).rsplit(".", 1)[-1]
+        # Byte view, since numpy can't represent bfloat16
+        payload = memoryview(cpu_tensor.reshape(-1).view(torch.uint8).numpy())
     else:
         assert tensor.size > 0, "Tensor must have size > 0"
-        buffer = io.BytesIO()
-        mx.save_safetensors(buffer, {"tensor": tensor})
-        return buffer.getvalue()
+        tensor = mx.contiguous(tensor)
+        shape = tuple(tensor.shape)
+        dtype_name = str(tensor.dtype).rsplit(".", 1)[-1]
+        payload = memoryview(tensor).cast("B")
+    if dtype_name not in _NUMPY_DTYPES:
+        raise ValueError(f"Unsupported tensor dtype: {dtype_name}")
+    header = _TENSOR_HEADER.pack(TENSOR_DTYPES.index(dtype_name), len(shape))
+    header += struct.pack(f"<{len(shape)}q", *shape)
+    return header, payload
+
+
+def frames_to_tensor(header: Any, payload: Any, device: Optional[str] = "mlx") -> Any:
+    """Rebuilds a tensor from its header and raw buffer, reading the buffer in place."""
+    header = memoryview(header)
+    dtype_code, ndim = _TENSOR_HEADER.unpack_from(header)
+    shape = struct.unpack_from(f"<{ndim}q", header, _TENSOR_HEADER.size)
+    dtype_name = TENSOR_DTYPES[dtype_code]
+    if device == "cuda":
+        import torch
+
+        with warnings.catch_warnings():
+            # The buffer may be read-only; it is only read before the copy to the device
+            warnings.simplefilter("ignore", UserWarning)
+            tensor = torch.frombuffer(payload, dtype=getattr(torch, dtype_name))
+        return tensor.reshape(shape).to(device)
+    array = np.frombuffer(payload, dtype=_NUMPY_DTYPES[dtype_name]).reshape(shape)
+    tensor = mx.array(array)
+    if dtype_name == "bfloat16":
+        tensor = tensor.view(mx.bfloat16)
+    return tensor
+
+
+def tensor_to_bytes(tensor: Any, device: Optional[str] = "mlx") -> bytes:
+    """Serializes a tensor as its header followed by its raw buffer."""
+    return b"".join(tensor_to_frames(tensor, device))
 
 
 def bytes_to_tensor(
     tensor: bytes,
     device: Optional[str] = "mlx",
 ) -> Any:
-    """Convert bytes (safetensor format) to tensor."""
-    if device == "cuda":
-        from safetensors.torch import load
+    """Convert bytes produced by `tensor_to_bytes` to a tensor."""
+    data = memoryview(tensor)
+    header_size = _tensor_header_size(data)
+    return frames_to_tensor(data[:header_size], data[header_size:], device)
 
-        tensor_dict = load(tensor)
-        tensor = tensor_dict["tensor"].to(device)
-    else:
-        buffer = io.BytesIO(tensor)
-        tensors_dict = mx.load(buffer, format="safetensors")
-        tensor = tensors_dict["tensor"]
-    return tensor
+
+# Executor -> HTTP server token stream. The first peer sends one message per step holding
+# every token produced in that step, instead of one pickled dict per token.
+TOKEN_BATCH = 0
+TOKEN_ERROR = 1
+
+FINISH_NONE = 0
+FINISH_EOS = 1
+FINISH_LENGTH = 2
+
+
+class TokenBatch:
+    """Accumulates the tokens produced in one step for a single `encode` call.
+
+    The encoded message is the msgpack array
+    [TOKEN_BATCH, rids, token_ids, prompt_tokens, finish_reasons], where rids is a list of
+    strings, token_ids and prompt_tokens are little-endian int32 buffers and finish_reasons
+    is a uint8 buffer of FINISH_* codes, all in the same order.
+    """
+
+    def __init__(self):
+        self.rids: List[str] = []
+        self.token_ids: List[int] = []
+        self.prompt_tokens: List[int] = []
+        self.finish_reasons: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.rids)
+
+    def append(self, rid: str, token_id: int, prompt_tokens: int, finish: int = FINISH_NONE):
+        self.rids.append(rid)
+        self.token_ids.append(token_id)
+        self.prompt_tokens.append(prompt_tokens)
+        self.finish_reasons.append(finish)
+
+    def clear(self):
+        self.rids.clear()
+        self.token_ids.clear()
+        self.prompt_tokens.clear()
+        self.finish_reasons.clear()
+
+    def encode(self) -> bytes:
+        return msgpack.packb(
+            [
+                TOKEN_BATCH,
+                self.rids,
+                np.asarray(self.token_ids, dtype="<i4").tobytes(),
+                np.asarray(self.prompt_tokens, dtype="<i4").tobytes(),
+                bytes(self.finish_reasons),
+            ]
+        )
+
+
+def encode_token_error(rid: str, error: str, error_type: str, status_code: int) -> bytes:
+    """Encodes a request failure for the HTTP server on the token stream."""
+    return msgpack.packb([TOKEN_ERROR, rid, error, error_type, status_code])
+
+
+def decode_token_message(message: Any) -> Tuple[int, Any]:
+    """Decodes a token stream message.
+
+    Returns (TOKEN_BATCH, [(rid, token_id, prompt_tokens, finish), ...]) for a token batch,
+    or (TOKEN_ERROR, error_dict) with keys type, rid, error, error_type and status_code.
+    """
+    kind, *fields = msgpack.unpackb(_frame_buffer(message))
+    if kind == TOKEN_ERROR:
+        rid, error, error_type, status_code = fields
+        return kind, {
+            "type": "error",
+            "rid": rid,
+            "error": error,
+            "error_type": error_type,
+            "status_code": status_code,
+        }
+    rids, token_ids, prompt_tokens, finish_reasons = fields
+    tokens = zip(
+        rids,
+        np.frombuffer(token_ids, dtype="<i4").tolist(),
+        np.frombuffer(prompt_tokens, dtype="<i4").tolist(),
+        finish_reasons,
+    )
+    return kind, list(tokens)
@@ -21,8 +21,9 @@ import zmq
 from lattica import ConnectionHandler, Lattica, rpc_method, rpc_stream, rpc_stream_iter
 
 from backend.server.rpc_connection_handler import RPCConnectionHandler
+from parallax.p2p.message_util import extract_tensor_frames, inline_tensor_frames
 from parallax.p2p.proto import forward_pb2
-from parallax.p2p.utils import AsyncWorker
+from parallax.p2p.utils import AsyncWorker, HTTPRelay
 from parallax.server.server_info import detect_node_hardware
 from parallax.utils.shared_state import SharedState
 from parallax.utils.utils import get_zmq_socket
@@ -118,6 +119,7 @@ class TransformerConnectionHandler(ConnectionHandler):
         self.block_end_index = block_end_index
         self.http_port = http_port
         self.notify_url = notify_url
+        self.http_relay = HTTPRelay()
         self._recv_from_peer = None
         self._recv_from_peer_lock = threading.Lock()
 
@@ -139,8 +141,12 @@ class TransformerConnectionHandler(ConnectionHandler):
             send_notify(
                 self.notify_url, self.block_start_index, self.block_end_index, request, "started"
             )
+            # Hand hidden states to the executor as separate frames, without copying them
+            tensor_frames = extract_tensor_frames(request)
             with self._recv_from_peer_lock:
-                self.recv_from_peer.send_multipart([b"forward", request.SerializeToString()])
+                self.recv_from_peer.send_multipart(
+                    [b"forward", request.SerializeToString(), *tensor_frames], copy=False
+                )
         except Exception as e:
             logger.exception(f"Error in rpc_pp_forward: {e}")
         return forward_pb2.ForwardResponse()
@@ -164,22 +170,13 @@ class TransformerConnectionHandler(ConnectionHandler):
     ):
         """Handle chat completion request"""
         logger.debug(f"Chat completion request: {request}, type: {type(request)}")
+        url = f"http://localhost:{self.http_port}/v1/chat/completions"
         try:
-            with httpx.Client(timeout=10 * 60, proxy=None, trust_env=False) as client:
-                if request.get("stream", False):
-                    with client.stream(
-                        "POST",
-                        f"http://localhost:{self.http_port}/v1/chat/completions",
-                        json=request,
-                    ) as response:
-                        for chunk in response.iter_bytes():
-                            if chunk:
-                                yield chunk
-                else:
-                    response = client.post(
-                        f"http://localhost:{self.http_port}/v1/chat/completions", json=request
-                    ).json()
-                    yield json.dumps(response).encode()
+            if request.get("stream", False):
+                yield from self.http_relay.stream("POST", url, json=request)
+            else:
+                response = self.http_relay.request("POST", url, json=request).json()
+                yield json.dumps(response).encode()
         except Exception as e:
             logger.exception(f"Error in chat completion: {e}")
             yield b"internal server error"
@@ -478,13 +475,17 @@ class GradientServer:
                     time.sleep(self.routing_table_update_interval)
                     continue
 
-                message_type, message_body = send_to_peer.recv_multipart()[:2]
+                frames = send_to_peer.recv_multipart(copy=False)
+                message_type, message_body = frames[0].bytes, frames[1].buffer
+                message_size = sum(len(frame) for frame in frames[1:])
 
                 if message_type == b"forward":
                     forward_request = forward_pb2.ForwardRequest()
                     forward_request.ParseFromString(message_body)
                     if len(forward_request.reqs) == 0:
                         raise RuntimeError("No requests in the forward request")
+                    # The RPC to the next peer carries hidden states inside the message
+                    inline_tensor_frames(forward_request, frames[2:])
 
                     requests = []
                     for req in forward_request.reqs:
@@ -525,9 +526,9 @@ class GradientServer:
 
                         logger.info(
                             f"Forwarding data to {next_peer_id}, "
-                            f"total size: {len(message_body) / (1024 * 1024):.3f} MB, "
+                            f"total size: {message_size / (1024 * 1024):.3f} MB, "
                             f"cost time: {(time.time() - start) * 1000:.3f} ms, "
-                            f"speed: {len(message_body) / (time.time() - start) / (1024 * 1024):.3f} MB/s"
+                            f"speed: {message_size / (time.time() - start) / (1024 * 1024):.3f} MB/s"
                         )
 
                 elif message_type == b"abort":
@@ -799,7 +800,7 @@ def _run_p2p_server_process(
     max_sequence_length: Optional[int] = None,
     param_mem_ratio: float = 0.65,
     kvcache_mem_ratio: float = 0.25,
-    shared_state: Optional[dict] = None,
+    shared_state: Optional[SharedState] = None,
     log_level: str = "INFO",
 ):
     """Run P2P server in subprocess"""
@@ -833,7 +834,6 @@ def _run_p2p_server_process(
         )
         # Attach shared state to server for syncing layer allocation
         if shared_state is not None:
-            shared_state = SharedState(shared_state)  # Auto-converts dict to SharedState
             server._shared_state = shared_state
             # Initialize shared state with current values
             shared_state.update(
@@ -875,14 +875,14 @@ def launch_p2p_server_process(
     max_sequence_length: Optional[int] = None,
     param_mem_ratio: float = 0.65,
     kvcache_mem_ratio: float = 0.25,
-    shared_state: Optional[dict] = None,
+    shared_state: Optional[SharedState] = None,
     log_level: str = "INFO",
 ) -> multiprocessing.Process:
     """Launch P2P server as a subprocess and return the process object
 
     Args:
-        shared_state: Optional shared dictionary for inter-process communication.
-                     If provided, layer allocation info will be synced to this dict.
+        shared_state: Optional shared state for inter-process communication.
+                     If provided, layer allocation info will be synced to it.
         log_level: Log level for the subprocess (default: INFO).
     """
     process = multiprocessing.Process(
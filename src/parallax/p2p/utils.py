@@ -8,8 +8,9 @@ import asyncio
 import os
 from concurrent.futures import Future
 from threading import Thread
-from typing import Awaitable
+from typing import AsyncIterator, Awaitable, Iterator, Optional
 
+import httpx
 import uvloop
 
 
@@ -57,3 +58,77 @@ class AsyncWorker:
         loop = self._event_loop_fut.result()
         future = asyncio.run_coroutine_threadsafe(coro, loop)
         return future if return_future else future.result()
+
+
+class HTTPRelay:
+    """
+    Pooled HTTP client for synchronous callers, such as lattica stream handlers.
+
+    One long-lived `httpx.AsyncClient` keeps connections to the local servers alive across
+    requests, and every response is read on the relay's own event loop. Callers only wait
+    for the next chunk, so a stream costs no TCP handshake and no blocking socket read of
+    its own.
+    """
+
+    def __init__(self, timeout: float = 10 * 60, max_connections: int = 1024) -> None:
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._worker = AsyncWorker()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Return the pooled client of the running loop; only called on the relay's loop."""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                proxy=None,
+                trust_env=False,
+            )
+            self._client_loop = loop
+        return self._client
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        return await self._get_client().request(method, url, **kwargs)
+
+    async def _stream(self, method: str, url: str, **kwargs) -> AsyncIterator[bytes]:
+        async with self._get_client().stream(method, url, **kwargs) as response:
+            async for chunk in response.aiter_bytes():
+                if chunk:
+                    yield chunk
+
+    @staticmethod
+    async def _next_chunk(chunks: AsyncIterator[bytes]) -> Optional[bytes]:
+        try:
+            return await chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    @staticmethod
+    async def _close(chunks) -> None:
+        await chunks.aclose()
+
+    def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request and return the fully read response."""
+        return self._worker.run_coroutine(self._request(method, url, **kwargs))
+
+    def stream(self, method: str, url: str, **kwargs) -> Iterator[bytes]:
+        """Send a request and yield the non-empty chunks of the response body.
+
+        Closing the iterator early, e.g. when the client went away, closes the response
+        and returns its connection to the pool.
+        """
+        chunks = self._stream(method, url, **kwargs)
+        try:
+            while True:
+                chunk = self._worker.run_coroutine(self._next_chunk(chunks))
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            self._worker.run_coroutine(self._close(chunks))
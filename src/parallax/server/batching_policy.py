@@ -0,0 +1,214 @@
+"""
+Batching policies for the node scheduler.
+
+Each forward step the scheduler asks its policy how to split the batch between prefill
+tokens and decode slots, and which of the two phases fills the batch first:
+    * PrefillFirstPolicy: prefills take what they need, ready decodes fill what is left.
+      Lowest time-to-first-token (TTFT), but a burst of prompts stalls streaming users;
+    * DecodeFirstPolicy: every ready decode gets its slot before any prefill is added.
+      Lowest time-per-output-token (TPOT), new prompts only use the leftover budget;
+    * SLOAwarePolicy: decodes go first and the prefill tokens riding along are capped so
+      that the step stays within a TPOT target. The cap is lifted once a waiting prompt
+      reaches its TTFT target.
+
+Requests also carry a priority class (higher is more urgent). Within each phase the
+scheduler admits and batches higher classes first, and preempts lower classes first.
+"""
+
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import List, Optional
+
+from parallax.server.request import Request
+
+
+@dataclass
+class BatchSplit:
+    """How the budget of one forward step is divided between prefills and decodes."""
+
+    # Whether prefills are picked before ready decodes
+    prefill_first: bool
+    # Prompt tokens that prefills may use in this step
+    max_prefill_tokens: int
+    # Ready decodes that may join this step
+    max_decode_slots: int
+
+
+class BatchingPolicy(ABC):
+    """Decides the prefill / decode split of every batch formed by the scheduler."""
+
+    name: str = ""
+
+    @abstractmethod
+    def split(
+        self,
+        prefill_candidates: List[Request],
+        num_decode_candidates: int,
+        max_num_tokens: int,
+        max_num_slots: int,
+        enable_chunked_prefill: bool = False,
+    ) -> BatchSplit:
+        """Returns the split for the next forward step.
+
+        Args:
+            prefill_candidates: Running prefill requests ready for their next chunk;
+            num_decode_candidates: Number of running requests ready to decode;
+            max_num_tokens: Token budget of the step (max_num_tokens_per_batch);
+            max_num_slots: Request budget of the step (micro_batch_size);
+            enable_chunked_prefill: Whether prompts are split to fit the prefill budget.
+        """
+
+    def observe_step(self, num_prefill_tokens: int, num_decodes: int, elapsed_s: float):
+        """Feeds back the wall time of a forward step. Ignored by default."""
+
+
+class PrefillFirstPolicy(BatchingPolicy):
+    """Prefills first, then ready decodes (the scheduler's historical behaviour)."""
+
+    name = "prefill_first"
+
+    def split(
+        self,
+        prefill_candidates: List[Request],
+        num_decode_candidates: int,
+        max_num_tokens: int,
+        max_num_slots: int,
+        enable_chunked_prefill: bool = False,
+    ) -> BatchSplit:
+        # Chunked prompts shrink to fit, so reserve one token per decode up front
+        decode_reserve = 0
+        if enable_chunked_prefill:
+            decode_reserve = min(num_decode_candidates, max_num_slots)
+        return BatchSplit(
+            prefill_first=True,
+            max_prefill_tokens=max_num_tokens - decode_reserve,
+            max_decode_slots=max_num_slots,
+        )
+
+
+class DecodeFirstPolicy(BatchingPolicy):
+    """Ready decodes first, prefills use whatever budget is left."""
+
+    name = "decode_first"
+
+    def split(
+        self,
+        prefill_candidates: List[Request],
+        num_decode_candidates: int,
+        max_num_tokens: int,
+        max_num_slots: int,
+        enable_chunked_prefill: bool = False,
+    ) -> BatchSplit:
+        return BatchSplit(
+            prefill_first=False,
+            max_prefill_tokens=max_num_tokens,
+            max_decode_slots=max_num_slots,
+        )
+
+
+class SLOAwarePolicy(BatchingPolicy):
+    """Keeps decode steps within a TPOT target without letting prompts miss their TTFT.
+
+    Step latency is modelled as a fixed decode cost plus a per prompt token cost, both
+    tracked as moving averages of the steps observed so far.
+    """
+
+    name = "slo"
+
+    def __init__(
+        self,
+        ttft_slo_ms: float = 1000.0,
+        tpot_slo_ms: float = 100.0,
+        ema_alpha: float = 0.2,
+    ):
+        """
+        Args:
+            ttft_slo_ms: Target time from a request's arrival to its first token;
+            tpot_slo_ms: Target duration of a step that carries decodes;
+            ema_alpha: Weight of the newest sample in the latency moving averages.
+        """
+        if ttft_slo_ms <= 0 or tpot_slo_ms <= 0:
+            raise ValueError("ttft_slo_ms and tpot_slo_ms must be positive")
+        self.ttft_slo_ms = ttft_slo_ms
+        self.tpot_slo_ms = tpot_slo_ms
+        self.ema_alpha = ema_alpha
+        # Latency model: step_ms ~= decode_step_ms + prefill_tokens * prefill_token_ms
+        self.decode_step_ms: Optional[float] = None
+        self.prefill_token_ms: Optional[float] = None
+
+    def _ema(self, current: Optional[float], sample: float) -> float:
+        if current is None:
+            return sample
+        return (1.0 - self.ema_alpha) * current + self.ema_alpha * sample
+
+    def observe_step(self, num_prefill_tokens: int, num_decodes: int, elapsed_s: float):
+        elapsed_ms = elapsed_s * 1000.0
+        if num_prefill_tokens == 0:
+            if num_decodes > 0:
+                self.decode_step_ms = self._ema(self.decode_step_ms, elapsed_ms)
+            return
+        base_ms = self.decode_step_ms if num_decodes > 0 and self.decode_step_ms else 0.0
+        sample = max(0.0, elapsed_ms - base_ms) / num_prefill_tokens
+        self.prefill_token_ms = self._ema(self.prefill_token_ms, sample)
+
+    def prefill_token_budget(self) -> Optional[int]:
+        """Prompt tokens that fit next to the decodes within the TPOT target, if known."""
+        if self.prefill_token_ms is None or self.prefill_token_ms <= 0:
+            return None
+        spare_ms = self.tpot_slo_ms - (self.decode_step_ms or 0.0)
+        return max(0, int(spare_ms / self.prefill_token_ms))
+
+    def split(
+        self,
+        prefill_candidates: List[Request],
+        num_decode_candidates: int,
+        max_num_tokens: int,
+        max_num_slots: int,
+        enable_chunked_prefill: bool = False,
+    ) -> BatchSplit:
+        num_decodes = min(num_decode_candidates, max_num_slots)
+        if num_decodes == 0:
+            return BatchSplit(True, max_num_tokens, max_num_slots)
+
+        now = time.time()
+        oldest_arrival = min((r.arrival_time for r in prefill_candidates), default=now)
+        if (now - oldest_arrival) * 1000.0 >= self.ttft_slo_ms:
+            # A prompt is due: serve it now, decodes keep one token each when chunking
+            reserve = num_decodes if enable_chunked_prefill else 0
+            return BatchSplit(True, max_num_tokens - reserve, max_num_slots)
+
+        max_prefill_tokens = max_num_tokens - num_decodes
+        budget = self.prefill_token_budget()
+        if budget is not None:
+            max_prefill_tokens = min(max_prefill_tokens, budget)
+        return BatchSplit(False, max_prefill_tokens, max_num_slots)
+
+
+BATCHING_POLICIES = {
+    PrefillFirstPolicy.name: PrefillFirstPolicy,
+    DecodeFirstPolicy.name: DecodeFirstPolicy,
+    SLOAwarePolicy.name: SLOAwarePolicy,
+}
+
+
+def create_batching_policy(
+    name: Optional[str] = None,
+    prefill_priority: int = 0,
+    ttft_slo_ms: float = 1000.0,
+    tpot_slo_ms: float = 100.0,
+) -> BatchingPolicy:
+    """Builds a batching policy by name.
+
+    Without a name, `prefill_priority` picks the policy: 0 runs prefills first and
+    1 runs decodes first.
+    """
+    if name is None:
+        name = DecodeFirstPolicy.name if prefill_priority else PrefillFirstPolicy.name
+    if name not in BATCHING_POLICIES:
+        raise ValueError(
+            f"Unknown batching policy {name}; expected one of {list(BATCHING_POLICIES)}"
+        )
+    if name == SLOAwarePolicy.name:
+        return SLOAwarePolicy(ttft_slo_ms=ttft_slo_ms, tpot_slo_ms=tpot_slo_ms)
+    return BATCHING_POLICIES[name]()
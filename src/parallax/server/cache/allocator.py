@@ -1,4 +1,6 @@
-from typing import List, Set
+from typing import List, Sequence
+
+import numpy as np
 
 from parallax_utils.logging_config import get_logger
 
@@ -6,66 +8,114 @@ logger = get_logger(__name__)
 
 
 class BlockAllocator:
-    """Manages allocation of physical block indices."""
-
-    def __init__(self, num_blocks: int, block_size: int):
+    """Manages allocation of physical block indices.
+
+    Free blocks live on a preallocated integer stack, so allocating or freeing n blocks is
+    a slice of the stack rather than n list operations. A refcount array doubles as the
+    ownership map: a block is allocated iff its count is positive, which makes double frees
+    cheap to detect.
+
+    Blocks are reference counted so that a block can be shared, e.g. by requests with a
+    common cached prefix. A block returns to the free stack once its last reference is freed.
+    """
+
+    def __init__(self, num_blocks: int, block_size: int, watermark: float = 0.0):
+        """
+        Args:
+            num_blocks: Number of physical blocks in the pool;
+            block_size: Tokens per block;
+            watermark: Fraction of the pool that admission of new requests keeps free, so
+                that running requests can grow without being preempted right away.
+        """
+        if not 0.0 <= watermark < 1.0:
+            raise ValueError(f"watermark must be in [0, 1), got {watermark}")
         self.num_blocks = num_blocks
         self.block_size = block_size
-        # Initialize free blocks stack
-        self.free_blocks: List[int] = list(range(num_blocks))
-        self.used_blocks: Set[int] = set()
+        self.watermark_blocks = int(watermark * num_blocks)
+        # Free stack, top at num_free; block 0 is handed out last
+        self.free_stack = np.arange(num_blocks, dtype=np.int32)
+        self.num_free = num_blocks
+        self.ref_counts = np.zeros(num_blocks, dtype=np.int32)
 
     def allocate(self, num_blocks_needed: int) -> List[int]:
         """Allocates `num_blocks_needed` physical blocks."""
-        if len(self.free_blocks) < num_blocks_needed:
+        if num_blocks_needed <= 0 or self.num_free < num_blocks_needed:
             return []
 
         # Pop blocks from the stack
-        split_idx = len(self.free_blocks) - num_blocks_needed
-        allocated = self.free_blocks[split_idx:]
-        self.free_blocks = self.free_blocks[:split_idx]
-
-        for b in allocated:
-            self.used_blocks.add(b)
-
-        return allocated
-
-    def free(self, blocks: List[int]):
-        """Frees the given physical blocks."""
-        for b in blocks:
-            if b in self.used_blocks:
-                self.used_blocks.remove(b)
-                self.free_blocks.append(b)
-            else:
-                logger.warning(f"Double free detected for block {b}")
+        self.num_free -= num_blocks_needed
+        allocated = self.free_stack[self.num_free : self.num_free + num_blocks_needed]
+        self.ref_counts[allocated] = 1
+        return allocated.tolist()
+
+    def incref(self, blocks: Sequence[int]):
+        """Adds a reference to each of the given allocated blocks."""
+        if len(blocks) == 0:
+            return
+        blocks = np.asarray(blocks, dtype=np.int32)
+        if not self.ref_counts[blocks].all():
+            unallocated = blocks[self.ref_counts[blocks] == 0]
+            raise ValueError(f"Cannot share unallocated blocks {unallocated.tolist()}")
+        np.add.at(self.ref_counts, blocks, 1)
+
+    def free(self, blocks: Sequence[int]):
+        """Drops a reference to each of the given blocks, freeing unreferenced ones.
+
+        A block may be listed once per reference held on it. Dropping more references than
+        a block has raises before any count is changed.
+        """
+        if len(blocks) == 0:
+            return
+        blocks, counts = np.unique(np.asarray(blocks, dtype=np.int32), return_counts=True)
+        over_freed = counts > self.ref_counts[blocks]
+        if over_freed.any():
+            raise ValueError(f"Double free detected for blocks {blocks[over_freed].tolist()}")
+        self.ref_counts[blocks] -= counts.astype(np.int32)
+        released = blocks[self.ref_counts[blocks] == 0]
+        if released.size:
+            self.free_stack[self.num_free : self.num_free + released.size] = released
+            self.num_free += released.size
+
+    def get_ref_count(self, block: int) -> int:
+        return int(self.ref_counts[block])
+
+    def is_allocated(self, block: int) -> bool:
+        return self.ref_counts[block] > 0
 
     def get_num_free_blocks(self) -> int:
-        return len(self.free_blocks)
+        return self.num_free
 
 
 class SlotAllocator:
-    """Manages allocation of request slots (indices)."""
+    """Manages allocation of request slots (indices).
+
+    Uses the same free stack as `BlockAllocator`, with an ownership bitmap instead of
+    refcounts since slots are never shared.
+    """
 
     def __init__(self, num_slots: int):
         self.num_slots = num_slots
-        self.free_slots: List[int] = list(range(num_slots))
-        self.used_slots: Set[int] = set()
+        self.free_stack = np.arange(num_slots, dtype=np.int32)
+        self.num_free = num_slots
+        self.used = np.zeros(num_slots, dtype=np.bool_)
 
     def allocate(self) -> int:
         """Allocates a single slot."""
-        if not self.free_slots:
+        if self.num_free == 0:
             return -1
-        slot = self.free_slots.pop()
-        self.used_slots.add(slot)
+        self.num_free -= 1
+        slot = int(self.free_stack[self.num_free])
+        self.used[slot] = True
         return slot
 
     def free(self, slot: int):
         """Frees the given slot."""
-        if slot in self.used_slots:
-            self.used_slots.remove(slot)
-            self.free_slots.append(slot)
-        else:
+        if not self.used[slot]:
             logger.warning(f"Double free detected for slot {slot}")
+            return
+        self.used[slot] = False
+        self.free_stack[self.num_free] = slot
+        self.num_free += 1
 
     def get_num_free_slots(self) -> int:
-        return len(self.free_slots)
+        return self.num_free
@@ -0,0 +1,123 @@
+"""
+Block-granular prefix cache for the paged KV cache.
+
+Every full KV block of a prompt is identified by a hash of its tokens chained with the hash
+of the block before it, so equal hashes mean equal prefixes. Cached blocks are shared
+through the `BlockAllocator` refcounts: the cache itself holds one reference per block, and
+each request whose prompt matches holds another. Blocks referenced only by the cache are
+kept in LRU order and evicted when the pool runs out of free blocks.
+"""
+
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from parallax.server.cache.allocator import BlockAllocator
+from parallax_utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+class BlockPrefixCache:
+    """Maps content hashes of full prompt blocks to shared physical blocks."""
+
+    def __init__(self, allocator: BlockAllocator, block_size: int):
+        self.allocator = allocator
+        self.block_size = block_size
+        self.hash_to_block: Dict[bytes, int] = {}
+        self.block_to_hash: Dict[int, bytes] = {}
+        # Cached blocks no request references, least recently used first
+        self.evictable_blocks: Dict[int, None] = OrderedDict()
+
+    @property
+    def num_cached_blocks(self) -> int:
+        return len(self.block_to_hash)
+
+    @property
+    def num_evictable_blocks(self) -> int:
+        return len(self.evictable_blocks)
+
+    def _block_hashes(
+        self, token_ids: List[int], num_blocks: int, salt: Optional[str] = None
+    ) -> List[bytes]:
+        """Chained hashes of the first `num_blocks` full blocks of `token_ids`."""
+        tokens = np.asarray(token_ids[: num_blocks * self.block_size], dtype=np.int64)
+        parent = hashlib.sha256((salt or "").encode()).digest()
+        hashes = []
+        for i in range(num_blocks):
+            block = tokens[i * self.block_size : (i + 1) * self.block_size]
+            parent = hashlib.sha256(parent + block.tobytes()).digest()
+            hashes.append(parent)
+        return hashes
+
+    def match(
+        self, token_ids: List[int], max_num_tokens: int, salt: Optional[str] = None
+    ) -> List[int]:
+        """Returns the cached blocks holding the longest prefix of `token_ids`.
+
+        Only full blocks within the first `max_num_tokens` tokens are matched. The blocks
+        are referenced on behalf of the caller, who releases them with `BlockAllocator.free`
+        followed by `release`.
+        """
+        num_blocks = min(len(token_ids), max_num_tokens) // self.block_size
+        if num_blocks <= 0 or not self.hash_to_block:
+            return []
+        blocks = []
+        for block_hash in self._block_hashes(token_ids, num_blocks, salt):
+            block = self.hash_to_block.get(block_hash)
+            if block is None:
+                break
+            blocks.append(block)
+        for block in blocks:
+            self.evictable_blocks.pop(block, None)
+        self.allocator.incref(blocks)
+        return blocks
+
+    def insert(
+        self,
+        token_ids: List[int],
+        blocks: List[int],
+        num_tokens: int,
+        salt: Optional[str] = None,
+    ):
+        """Caches the full blocks among the first `num_tokens` tokens, whose KV is computed."""
+        num_blocks = min(num_tokens, len(token_ids)) // self.block_size
+        num_blocks = min(num_blocks, len(blocks))
+        if num_blocks <= 0:
+            return
+        for block_hash, block in zip(self._block_hashes(token_ids, num_blocks, salt), blocks):
+            if block_hash in self.hash_to_block or block in self.block_to_hash:
+                # Already cached (possibly computed twice by concurrent requests)
+                continue
+            self.hash_to_block[block_hash] = block
+            self.block_to_hash[block] = block_hash
+            self.allocator.incref([block])
+
+    def release(self, blocks: List[int]):
+        """Marks cached blocks that only the cache still references as evictable.
+
+        Blocks are queued tail first, so a prompt's last blocks are evicted before the
+        blocks its prefix (and other prompts) depend on.
+        """
+        for block in reversed(blocks):
+            if block in self.block_to_hash and self.allocator.get_ref_count(block) == 1:
+                self.evictable_blocks.pop(block, None)
+                self.evictable_blocks[block] = None
+
+    def evict(self, num_blocks: int) -> int:
+        """Frees up to `num_blocks` least recently used unreferenced blocks.
+
+        Returns:
+            The number of blocks returned to the allocator.
+        """
+        num_evicted = 0
+        while num_evicted < num_blocks and self.evictable_blocks:
+            block, _ = self.evictable_blocks.popitem(last=False)
+            del self.hash_to_block[self.block_to_hash.pop(block)]
+            self.allocator.free([block])
+            num_evicted += 1
+        if num_evicted:
+            logger.debug(f"Evicted {num_evicted} prefix cache blocks")
+        return num_evicted
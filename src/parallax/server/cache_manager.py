@@ -1,12 +1,14 @@
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import mlx.core as mx
+import numpy as np
 
 from parallax.server.cache.allocator import BlockAllocator, SlotAllocator
 from parallax.server.cache.base import BaseCache
 from parallax.server.cache.dsa_cache import DeepSeekSparseCache
 from parallax.server.cache.kv_cache import KVCache
 from parallax.server.cache.linear_cache import LinearCache
+from parallax.server.cache.prefix_cache import BlockPrefixCache
 from parallax_utils.logging_config import get_logger
 
 logger = get_logger(__name__)
@@ -40,6 +42,12 @@ class CacheManager:
         linear_v_dim: Optional[int] = None,
         linear_num_k_heads: Optional[int] = None,
         linear_num_v_heads: Optional[int] = None,
+        # Preemption: KV blocks that may be swapped out of the paged pool (None: pool size)
+        num_swap_blocks: Optional[int] = None,
+        # Share full KV blocks of identical prompt prefixes between requests
+        enable_prefix_cache: bool = False,
+        # Fraction of KV blocks that admission of new requests leaves free for running ones
+        block_watermark: float = 0.01,
     ):
         self.num_layers = num_layers
         self.num_kv_heads = num_kv_heads
@@ -78,8 +86,16 @@ class CacheManager:
         self.num_gpu_blocks = num_gpu_blocks
 
         # 1. Initialize Allocators
-        self.allocator = BlockAllocator(num_gpu_blocks, block_size) if self.needs_blocks else None
+        self.allocator = (
+            BlockAllocator(num_gpu_blocks, block_size, watermark=block_watermark)
+            if self.needs_blocks
+            else None
+        )
         self.slot_allocator = SlotAllocator(max_num_seqs) if self.needs_slots else None
+        # Linear states can't be rebuilt from cached KV blocks, so hybrid layers opt out
+        self.prefix_cache = None
+        if enable_prefix_cache and self.needs_blocks and not self.needs_slots:
+            self.prefix_cache = BlockPrefixCache(self.allocator, block_size)
 
         # 2. Initialize Layer Caches
         self.caches: List[BaseCache] = []
@@ -101,10 +117,25 @@ class CacheManager:
         # 3. Request State Management
         # Mapping: request_id -> List of physical block indices
         self.block_tables: Dict[str, List[int]] = {}
+        # Mapping: request_id -> zero padded copy of the block table, grown by doubling and
+        # updated in place, so that batch inputs are built without per-token Python work
+        self.block_table_buffers: Dict[str, np.ndarray] = {}
         # Mapping: request_id -> current context length (number of tokens)
         self.context_lengths: Dict[str, int] = {}
+        # Mapping: request_id -> number of tokens whose KV has been written.
+        # Lags behind context_lengths while a prompt is being prefilled in chunks.
+        self.computed_lengths: Dict[str, int] = {}
         # Mapping: request_id -> state slot index
         self.request_slots: Dict[str, int] = {}
+        # Mapping: request_id -> (prompt ids, lora path) of prompts not inserted into the
+        # prefix cache yet; a prompt is cached once its KV is known to be computed
+        self.uncached_prompts: Dict[str, Tuple[List[int], Optional[str]]] = {}
+
+        # 4. Swap space for preempted requests
+        # Mapping: request_id -> host copy of the request's KV blocks and state slot
+        self.swapped_requests: Dict[str, Dict[str, Any]] = {}
+        self.num_swap_blocks = num_gpu_blocks if num_swap_blocks is None else num_swap_blocks
+        self.num_swapped_blocks = 0
 
     def _create_cache(self, layer_type: str) -> BaseCache:
         if layer_type == "attention":
@@ -228,14 +259,14 @@ class CacheManager:
 
         return num_gpu_blocks
 
-    def can_allocate(self, num_tokens: int) -> bool:
+    def can_allocate(self, num_tokens: int, num_reserved_blocks: int = 0) -> bool:
         if not self.needs_blocks:
             return (
                 self.slot_allocator.get_num_free_slots() > 0 if self.needs_slots else True
             )  # Should check slots
 
         num_blocks = (num_tokens + self.block_size - 1) // self.block_size
-        blocks_ok = self.allocator.get_num_free_blocks() >= num_blocks
+        blocks_ok = self.get_num_free_blocks() >= num_blocks + num_reserved_blocks
 
         slots_ok = True
         if self.needs_slots:
@@ -243,7 +274,32 @@ class CacheManager:
 
         return blocks_ok and slots_ok
 
-    def allocate_request(self, request_id: str, prompt_len: int) -> bool:
+    def _allocate_blocks(self, num_blocks: int) -> List[int]:
+        """Allocates blocks, evicting unreferenced prefix cache blocks if the pool is short."""
+        num_missing = num_blocks - self.allocator.get_num_free_blocks()
+        if num_missing > 0 and self.prefix_cache is not None:
+            self.prefix_cache.evict(num_missing)
+        return self.allocator.allocate(num_blocks)
+
+    def _free_blocks(self, blocks: List[int]):
+        self.allocator.free(blocks)
+        if self.prefix_cache is not None:
+            self.prefix_cache.release(blocks)
+
+    def allocate_request(
+        self,
+        request_id: str,
+        prompt_len: int,
+        prompt_ids: Optional[List[int]] = None,
+        max_cached_tokens: Optional[int] = None,
+        lora_path: Optional[str] = None,
+    ) -> bool:
+        """Allocates blocks for `prompt_len` tokens (and a state slot) for a new request.
+
+        With the prefix cache on and `prompt_ids` given, the longest cached prefix of at most
+        `max_cached_tokens` tokens (default: all but the last prompt token) is shared instead
+        of allocated, and counts as already computed (see `get_num_computed_tokens`).
+        """
         if request_id in self.block_tables:
             return True
 
@@ -254,22 +310,36 @@ class CacheManager:
             if slot == -1:
                 return False
 
-        # 2. Allocate Blocks (if needed)
+        # 2. Allocate Blocks (if needed), starting with the cached prefix
         blocks = []
+        cached_blocks = []
         if self.needs_blocks:
             num_blocks = (prompt_len + self.block_size - 1) // self.block_size
-            blocks = self.allocator.allocate(num_blocks)
-            if len(blocks) < num_blocks:
+            if self.prefix_cache is not None and prompt_ids:
+                if max_cached_tokens is None:
+                    max_cached_tokens = len(prompt_ids) - 1
+                cached_blocks = self.prefix_cache.match(
+                    prompt_ids, min(max_cached_tokens, prompt_len), lora_path
+                )
+            blocks = self._allocate_blocks(num_blocks - len(cached_blocks))
+            if len(blocks) < num_blocks - len(cached_blocks):
                 if blocks:
                     self.allocator.free(blocks)
+                if cached_blocks:
+                    self._free_blocks(cached_blocks)
                 if slot != -1:
                     self.slot_allocator.free(slot)
                 return False
+            blocks = cached_blocks + blocks
 
         # 3. Commit
         if self.needs_blocks:
             self.block_tables[request_id] = blocks
+            self._init_block_table_buffer(request_id, blocks)
             self.context_lengths[request_id] = prompt_len
+            self.computed_lengths[request_id] = len(cached_blocks) * self.block_size
+            if self.prefix_cache is not None and prompt_ids:
+                self.uncached_prompts[request_id] = (prompt_ids, lora_path)
 
         if self.needs_slots:
             self.request_slots[request_id] = slot
@@ -285,12 +355,22 @@ class CacheManager:
         return True
 
     def free_request(self, request_id: str):
+        swapped = self.swapped_requests.pop(request_id, None)
+        if swapped is not None:
+            self.num_swapped_blocks -= len(swapped["blocks"])
+            return
+        self._free_resident(request_id)
+
+    def _free_resident(self, request_id: str):
         if self.needs_blocks and request_id in self.block_tables:
             blocks = self.block_tables[request_id]
-            self.allocator.free(blocks)
+            self._free_blocks(blocks)
             del self.block_tables[request_id]
+            self.block_table_buffers.pop(request_id, None)
             if request_id in self.context_lengths:
                 del self.context_lengths[request_id]
+            self.computed_lengths.pop(request_id, None)
+            self.uncached_prompts.pop(request_id, None)
 
         if self.needs_slots and request_id in self.request_slots:
             slot = self.request_slots[request_id]
@@ -301,6 +381,9 @@ class CacheManager:
         self.free_request(request_id)
 
     def has_request(self, request_id: str) -> bool:
+        """Checks if the request owns cache state, either resident or swapped out."""
+        if request_id in self.swapped_requests:
+            return True
         if self.needs_blocks:
             return request_id in self.block_tables
         if self.needs_slots:
@@ -316,19 +399,242 @@ class CacheManager:
         if request_id not in self.block_tables:
             raise ValueError(f"Request {request_id} not found")
 
+        if request_id in self.uncached_prompts:
+            # Decoding means the whole prompt's KV has been computed
+            prompt_ids, lora_path = self.uncached_prompts.pop(request_id)
+            self.prefix_cache.insert(
+                prompt_ids,
+                self.block_tables[request_id],
+                self.context_lengths[request_id],
+                lora_path,
+            )
+
         current_len = self.context_lengths[request_id]
         if current_len % self.block_size == 0:
-            new_blocks = self.allocator.allocate(1)
+            new_blocks = self._allocate_blocks(1)
             if not new_blocks:
                 return False
-            self.block_tables[request_id].extend(new_blocks)
+            block_table = self.block_tables[request_id]
+            num_blocks = len(block_table)
+            buffer = self.block_table_buffers[request_id]
+            if num_blocks == buffer.shape[0]:
+                buffer = np.concatenate([buffer, np.zeros_like(buffer)])
+                self.block_table_buffers[request_id] = buffer
+            buffer[num_blocks] = new_blocks[0]
+            block_table.extend(new_blocks)
 
         self.context_lengths[request_id] += 1
+        self.computed_lengths[request_id] = self.context_lengths[request_id]
+        return True
+
+    def num_blocks_for_next_token(self, request_id: str) -> int:
+        """Number of new blocks `append_slot` would allocate for the request's next token."""
+        if not self.needs_blocks:
+            return 0
+        return 1 if self.context_lengths[request_id] % self.block_size == 0 else 0
+
+    def get_num_free_blocks(self) -> int:
+        """Blocks available to new allocations, including evictable prefix cache blocks."""
+        if not self.needs_blocks:
+            return 0
+        num_free = self.allocator.get_num_free_blocks()
+        if self.prefix_cache is not None:
+            num_free += self.prefix_cache.num_evictable_blocks
+        return num_free
+
+    def get_free_block_watermark(self) -> int:
+        """Free blocks that new requests should not be admitted into."""
+        if not self.needs_blocks:
+            return 0
+        return self.allocator.watermark_blocks
+
+    def is_swapped(self, request_id: str) -> bool:
+        return request_id in self.swapped_requests
+
+    def swap_out(self, request_id: str) -> bool:
+        """Copies a request's KV blocks (and state slot) out of the pool and frees them.
+
+        Only blocks that hold computed tokens are copied. Returns False if the request is
+        not resident or the swap space is full.
+        """
+        if request_id in self.swapped_requests or not self.has_request(request_id):
+            return False
+
+        blocks = self.block_tables.get(request_id, [])
+        computed = self.computed_lengths.get(request_id, 0)
+        num_copy = (computed + self.block_size - 1) // self.block_size
+        if self.num_swapped_blocks + num_copy > self.num_swap_blocks:
+            return False
+
+        copy_idx = mx.array(blocks[:num_copy], dtype=mx.int32) if num_copy > 0 else None
+        slot = self.request_slots.get(request_id, -1)
+        layers = []
+        for cache in self.caches:
+            if isinstance(cache, LinearCache):
+                conv_state, linear_state = cache.get_cache()
+                layers.append(
+                    (
+                        conv_state[:, slot] if conv_state is not None else None,
+                        linear_state[:, slot] if linear_state is not None else None,
+                    )
+                )
+            elif copy_idx is None:
+                layers.append(None)
+            else:
+                key_cache, value_cache = cache.get_cache()
+                indexer_cache = (
+                    cache.get_indexer_cache() if isinstance(cache, DeepSeekSparseCache) else None
+                )
+                layers.append(
+                    (
+                        key_cache[:, copy_idx],
+                        value_cache[:, copy_idx],
+                        indexer_cache[:, copy_idx] if indexer_cache is not None else None,
+                    )
+                )
+        # Materialize the copies before the pool blocks can be handed to other requests
+        mx.eval([a for layer in layers if layer is not None for a in layer if a is not None])
+
+        self.swapped_requests[request_id] = {
+            "blocks": blocks[:num_copy],
+            "num_blocks": len(blocks),
+            "context_length": self.context_lengths.get(request_id, 0),
+            "computed_length": computed,
+            "uncached_prompt": self.uncached_prompts.get(request_id),
+            "layers": layers,
+        }
+        self.num_swapped_blocks += num_copy
+        self._free_resident(request_id)
         return True
 
+    def can_swap_in(self, request_id: str, num_reserved_blocks: int = 0) -> bool:
+        """Checks if a swapped request fits back into the pool, keeping some blocks spare."""
+        swapped = self.swapped_requests[request_id]
+        if self.needs_blocks and (
+            self.get_num_free_blocks() < swapped["num_blocks"] + num_reserved_blocks
+        ):
+            return False
+        if self.needs_slots and self.slot_allocator.get_num_free_slots() == 0:
+            return False
+        return True
+
+    def swap_in(self, request_id: str) -> bool:
+        """Moves a swapped request back into the pool. Returns False if it does not fit."""
+        if request_id not in self.swapped_requests or not self.can_swap_in(request_id):
+            return False
+        swapped = self.swapped_requests.pop(request_id)
+        self.num_swapped_blocks -= len(swapped["blocks"])
+
+        slot = self.slot_allocator.allocate() if self.needs_slots else -1
+        blocks = self._allocate_blocks(swapped["num_blocks"]) if self.needs_blocks else []
+        num_copy = len(swapped["blocks"])
+        copy_idx = mx.array(blocks[:num_copy], dtype=mx.int32) if num_copy > 0 else None
+        for cache, layer in zip(self.caches, swapped["layers"]):
+            if layer is None:
+                continue
+            if isinstance(cache, LinearCache):
+                conv_state, linear_state = layer
+                if conv_state is not None:
+                    cache.conv_state_cache[:, slot] = conv_state
+                if linear_state is not None:
+                    cache.linear_state_cache[:, slot] = linear_state
+            else:
+                keys, values, indexer_keys = layer
+                cache.key_cache[:, copy_idx] = keys
+                cache.value_cache[:, copy_idx] = values
+                if indexer_keys is not None:
+                    cache.indexer_key_cache[:, copy_idx] = indexer_keys
+
+        if self.needs_blocks:
+            self.block_tables[request_id] = blocks
+            self._init_block_table_buffer(request_id, blocks)
+            self.context_lengths[request_id] = swapped["context_length"]
+            self.computed_lengths[request_id] = swapped["computed_length"]
+            if swapped["uncached_prompt"] is not None:
+                self.uncached_prompts[request_id] = swapped["uncached_prompt"]
+        if self.needs_slots:
+            self.request_slots[request_id] = slot
+        return True
+
+    def commit_prefill_tokens(self, request_id: str, num_tokens: int) -> int:
+        """Marks the next `num_tokens` prompt tokens as written by a prefill chunk.
+
+        Returns:
+            The context position the chunk starts at.
+        """
+        if not self.needs_blocks:
+            return 0
+        if request_id not in self.block_tables:
+            raise ValueError(f"Request {request_id} not found")
+
+        start = self.computed_lengths[request_id]
+        if start + num_tokens > self.context_lengths[request_id]:
+            raise ValueError(
+                f"Prefill chunk [{start}, {start + num_tokens}) of {request_id} exceeds "
+                f"allocated length {self.context_lengths[request_id]}"
+            )
+        self.computed_lengths[request_id] = start + num_tokens
+        return start
+
+    def get_num_computed_tokens(self, request_id: str) -> int:
+        return self.computed_lengths.get(request_id, 0)
+
+    def is_partially_prefilled(self, request_id: str) -> bool:
+        """Checks if a request still has prompt tokens whose KV is not written yet."""
+        return self.computed_lengths.get(request_id, 0) < self.context_lengths.get(request_id, 0)
+
     def get_block_table(self, request_id: str) -> List[int]:
         return self.block_tables.get(request_id, [])
 
+    def _init_block_table_buffer(self, request_id: str, blocks: List[int]):
+        capacity = 1 << max(0, len(blocks) - 1).bit_length()
+        buffer = np.zeros(capacity, dtype=np.int32)
+        buffer[: len(blocks)] = blocks
+        self.block_table_buffers[request_id] = buffer
+
+    def get_padded_block_tables(self, request_ids: List[str]) -> np.ndarray:
+        """Returns the block tables of `request_ids` as a zero padded (batch, max_blocks) array."""
+        num_blocks = [len(self.block_tables.get(rid, ())) for rid in request_ids]
+        max_blocks = max(max(num_blocks, default=0), 1)
+        block_tables = np.zeros((len(request_ids), max_blocks), dtype=np.int32)
+        for row, rid in enumerate(request_ids):
+            buffer = self.block_table_buffers.get(rid)
+            if buffer is None:
+                continue
+            block_tables[row, : min(buffer.shape[0], max_blocks)] = buffer[:max_blocks]
+        return block_tables
+
+    def get_slot_mapping(
+        self,
+        block_tables: np.ndarray,
+        start_positions: List[int],
+        num_tokens: List[int],
+        padded_len: Optional[int] = None,
+    ) -> np.ndarray:
+        """Maps the tokens at [start, start + num_tokens) of each request to their KV slots.
+
+        Args:
+            block_tables: (batch, max_blocks) padded block tables of the requests;
+            start_positions: Context position of each request's first new token;
+            num_tokens: Number of new tokens of each request;
+            padded_len: If set, returns (batch * padded_len,) slots with -1 for padding,
+                otherwise the slots of all new tokens back to back.
+        """
+        starts = np.asarray(start_positions, dtype=np.int64)[:, None]
+        lengths = np.asarray(num_tokens, dtype=np.int64)[:, None]
+        max_len = padded_len if padded_len is not None else int(lengths.max(initial=0))
+        offsets = np.arange(max_len, dtype=np.int64)[None, :]
+        positions = starts + offsets
+        valid = offsets < lengths
+        block_idx = np.minimum(positions // self.block_size, block_tables.shape[1] - 1)
+        rows = np.arange(block_tables.shape[0])[:, None]
+        slots = block_tables[rows, block_idx].astype(np.int64) * self.block_size + (
+            positions % self.block_size
+        )
+        if padded_len is None:
+            return slots[valid]
+        return np.where(valid, slots, -1).reshape(-1)
+
     def get_context_length(self, request_id: str) -> int:
         return self.context_lengths.get(request_id, 0)
 
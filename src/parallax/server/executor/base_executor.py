@@ -10,8 +10,8 @@ Executor handles
     - prepare the MLX tensor input
     - rebuild KV cache
     - feed to model runner;
-    For now we process prefill and decode requests separately.
-    Later when we have Ragged Paged Flash Attention kernel, we can process both in one batch.
+    Prefill and decode requests run as separate forwards, unless the backend supports
+    mixed batches, in which case both run in one ragged forward and travel as one message.
 6. Run model forward, our model will returned updated caches,
     kv cache manager will handle updating caches per layer;
 7. Get the hidden-states from the model execution.
@@ -27,22 +27,30 @@ from jinja2 import TemplateError
 from mlx_lm.server import convert_chat, process_message_content
 
 from parallax.p2p.message_util import (
+    FINISH_EOS,
+    FINISH_LENGTH,
+    FINISH_NONE,
+    TokenBatch,
     abort_request_to_proto,
+    encode_token_error,
+    multipart_to_requests,
     proto_to_abort_request,
-    proto_to_request,
-    request_to_proto,
+    requests_to_multipart,
 )
 from parallax.p2p.proto import forward_pb2
 from parallax.p2p.server import ServerState
+from parallax.server.batching_policy import create_batching_policy
 from parallax.server.request import (
     InitialRequest,
     IntermediateRequest,
     Request,
     RequestStatus,
 )
+from parallax.server.sampling.grammar import parse_json_schema
 from parallax.server.sampling.sampling_params import SamplingParams
 from parallax.server.scheduler import Scheduler
 from parallax.utils.shared_state import SharedState
+from parallax.utils.stop_strings import parse_stop_strs
 from parallax.utils.utils import get_current_device, get_device_dtype, get_zmq_socket
 from parallax_utils.logging_config import get_logger
 
@@ -52,6 +60,9 @@ logger = get_logger(__name__)
 class BaseExecutor:
     """High-level executor for managing model shards, scheduler, and cache pool on each Peer."""
 
+    # Seconds in-flight requests get to finish before an in-place layer reload aborts them
+    layer_reload_drain_s: float = 5.0
+
     def __init__(
         self,
         # Model Configs
@@ -66,9 +77,14 @@ class BaseExecutor:
         # Controlling perfill / decode ratio
         max_num_tokens_per_batch: int = 1024,
         prefill_priority: int = 0,
+        batching_policy: Optional[str] = None,
+        ttft_slo_ms: float = 1000.0,
+        tpot_slo_ms: float = 100.0,
         micro_batch_ratio: int = 2,
         scheduler_wait_ms: int = 500,
         request_timeout_s: Optional[int] = 600,
+        enable_chunked_prefill: bool = False,
+        enable_mixed_batch: bool = False,
         # Metrics Configs
         layer_latency_update_every: int = 4096,
         # Communication Configs
@@ -82,7 +98,7 @@ class BaseExecutor:
         tp_rank: Optional[int] = 0,
         tp_size: Optional[int] = 1,
         # Optional shared state for layer reallocation detection (when running in subprocess)
-        shared_state: Optional[dict] = None,
+        shared_state: Optional[SharedState] = None,
     ):
         # Backend
         if device is not None:
@@ -93,15 +109,17 @@ class BaseExecutor:
 
         # for window attention need to calculate causal mask size
         self.finished_batch = []
+        # Tokens generated this step, sent to the http server in a single message
+        self.output_tokens = TokenBatch()
         self.start_layer = start_layer
         self.end_layer = end_layer
         self._should_stop = False  # Flag to gracefully stop the executor
+        # Set while draining requests ahead of an in-place layer reload
+        self._layer_reload_deadline: Optional[float] = None
         # Reference to shared state for layer reallocation detection (when in subprocess mode)
-        if shared_state is not None:
-            self.shared_state = SharedState(shared_state)  # Auto-converts dict to SharedState
-        else:
-            self.shared_state = None
+        self.shared_state = shared_state
 
+        self.enable_mixed_batch = enable_mixed_batch
         self.is_first_peer = start_layer == 0
         self.is_last_peer = end_layer == self.config.get("num_hidden_layers")
         self.tp_size = tp_size
@@ -141,7 +159,12 @@ class BaseExecutor:
         self.scheduler = Scheduler(
             max_batch_size=max_batch_size,
             max_num_tokens_per_batch=max_num_tokens_per_batch,
-            prefill_priority=prefill_priority,
+            batching_policy=create_batching_policy(
+                batching_policy,
+                prefill_priority=prefill_priority,
+                ttft_slo_ms=ttft_slo_ms,
+                tpot_slo_ms=tpot_slo_ms,
+            ),
             scheduler_wait_ms=scheduler_wait_ms,
             micro_batch_ratio=micro_batch_ratio,
             is_first_peer=self.is_first_peer,
@@ -150,9 +173,10 @@ class BaseExecutor:
             cache_manager=self.cache_manager if self.device == "mlx" else None,
             request_timeout_s=request_timeout_s,
             shared_state=self.shared_state,
+            enable_chunked_prefill=enable_chunked_prefill,
         )
         logger.debug(
-            f"Scheduler initialized (max_batch_size={max_batch_size}, max_tokens={max_num_tokens_per_batch}, wait_ms={scheduler_wait_ms})"
+            f"Scheduler initialized (max_batch_size={max_batch_size}, max_tokens={max_num_tokens_per_batch}, wait_ms={scheduler_wait_ms}, policy={self.scheduler.batching_policy.name})"
         )
 
         # Communication Related
@@ -174,6 +198,12 @@ class BaseExecutor:
                 self.send_to_ipc_socket = get_zmq_socket(
                     self.zmq_context, zmq.PUSH, executor_output_ipc_addr, bind=False
                 )
+            # Lets an idle run loop sleep until one of the input sockets has data
+            self.poller = zmq.Poller()
+            if recv_from_peer_addr:
+                self.poller.register(self.recv_from_peer_socket, zmq.POLLIN)
+            if executor_input_ipc_addr:
+                self.poller.register(self.recv_from_ipc_socket, zmq.POLLIN)
         if self.shared_state is not None:
             self.shared_state.set_status(ServerState.READY.value)
 
@@ -207,6 +237,13 @@ class BaseExecutor:
     def _prepare_decode_batch(self, batched_requests: List[Request]) -> Dict[str, Any]:
         """Prepares inputs for ShardedModel from a batch of decode requests."""
 
+    def _prepare_mixed_batch(self, batched_requests: List[Request]) -> Dict[str, Any]:
+        """Prepares a single ragged input for a batch of prefill and decode requests.
+
+        Only called when the executor is created with `enable_mixed_batch`.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support mixed batches.")
+
     @abstractmethod
     def _gen_token_id_from_hidden(self, hidden_states) -> Tuple[int, Any]:
         """
@@ -233,7 +270,9 @@ class BaseExecutor:
                     logger.debug(
                         f"Received abort request from HTTP for request ID: {raw_request.get('rid')}"
                     )
-                    self.scheduler.cancel_request(raw_request.get("rid"))
+                    # A stop string may be matched after the request already finished here
+                    if self.scheduler.get_running_request(raw_request.get("rid")) is not None:
+                        self.scheduler.cancel_request(raw_request.get("rid"))
                 else:
                     # Normal request processing - do tokenization and form InitialRequest
                     req = self._handle_raw_request(raw_request)
@@ -253,13 +292,12 @@ class BaseExecutor:
             recv_reqs = []
             while True:
                 try:
-                    recv_req = self.recv_from_peer_socket.recv_multipart(zmq.NOBLOCK)
-                    assert len(recv_req) == 2, f"Received invalid request: {recv_req}"
-                    if recv_req[0] == b"forward":
-                        # Create a new ForwardRequest instance and parse from bytes
-                        forward_request = forward_pb2.ForwardRequest()
-                        forward_request.ParseFromString(recv_req[1])
-                        recv_req = proto_to_request(forward_request, self.device)
+                    frames = self.recv_from_peer_socket.recv_multipart(zmq.NOBLOCK, copy=False)
+                    assert len(frames) >= 2, f"Received invalid request: {frames}"
+                    message_type = frames[0].bytes
+                    if message_type == b"forward":
+                        # Hidden states are decoded straight from the received frames
+                        recv_req = multipart_to_requests(frames[1:], self.device)
 
                         # Convert hidden_states dtype if necessary
                         if recv_req is not None and len(recv_req) > 0:
@@ -283,13 +321,13 @@ class BaseExecutor:
                             for req in recv_req:
                                 req.current_position += 1
                         recv_reqs.extend(recv_req)
-                    elif recv_req[0] == b"abort":
+                    elif message_type == b"abort":
                         abort_request = forward_pb2.AbortRequest()
-                        abort_request.ParseFromString(recv_req[1])
+                        abort_request.ParseFromString(frames[1].bytes)
                         recv_req = proto_to_abort_request(abort_request)
                         recv_reqs.extend(recv_req)
                     else:
-                        raise ValueError(f"Unknown request type: {recv_req[0]}")
+                        raise ValueError(f"Unknown request type: {message_type}")
                     # First peer is responsible for tokenization
                     # if self.is_first_peer and isinstance(recv_req, InitialRequest):
                     #     recv_req.input_ids = self.tokenizer.encode(recv_req.prompt)
@@ -317,9 +355,8 @@ class BaseExecutor:
             The dictionary contains "prefill_batch" and "decode_batch",
             with the prepared inputs for the corresponding request type.
 
-            For now we process prefill and decode requests separately.
-            Later when we have Ragged Paged Flash Attention kernel,
-            we can process both in one batch.
+            With `enable_mixed_batch`, a batch holding both request types is prepared
+            as a single "mixed_batch" instead.
         """
         if len(batched_requests) == 0:
             return None
@@ -331,6 +368,13 @@ class BaseExecutor:
                 prefill_reqs.append(req)
             elif req.is_decoding:
                 decode_reqs.append(req)
+        if self.enable_mixed_batch and prefill_reqs and decode_reqs:
+            mixed_batch = self._prepare_mixed_batch(prefill_reqs + decode_reqs)
+            logger.debug(
+                f"Prepared mixed batch with {len(prefill_reqs)} prefill and "
+                f"{len(decode_reqs)} decode requests."
+            )
+            return {"prefill_batch": None, "decode_batch": None, "mixed_batch": mixed_batch}
         prefill_batch = self._prepare_prefill_batch(prefill_reqs)
         decode_batch = self._prepare_decode_batch(decode_reqs)
         if prefill_batch is None and decode_batch is None:
@@ -352,6 +396,13 @@ class BaseExecutor:
             batched_requests = []
             pre_length = 0
             for i, src_request in enumerate(requests):
+                if (
+                    self.is_last_peer
+                    and src_request.is_prefill
+                    and not src_request.is_last_prefill_chunk
+                ):
+                    # Only the final chunk of a chunked prefill produces a token
+                    continue
                 if self.is_last_peer:
                     # Last peer gets a 1D array of token IDs
                     hidden_state_for_req = hidden_states[i : i + 1]
@@ -380,6 +431,15 @@ class BaseExecutor:
 
         return batched_requests
 
+    def wait_for_requests(self):
+        """Blocks until new input arrives, the next request times out, or the wait window ends."""
+        if self.tp_rank != 0 or not getattr(self, "poller", None) or not self.poller.sockets:
+            return
+        try:
+            self.poller.poll(self.scheduler.get_idle_timeout_ms())
+        except zmq.ZMQError as e:
+            logger.debug(f"Polling input sockets failed: {e}")
+
     def release_and_evict_request(self, rid: str):
         """Release per-request resources and evict from scheduler. Best-effort, never raises."""
         # Release resources
@@ -391,6 +451,27 @@ class BaseExecutor:
         except Exception:
             pass
 
+    def _report_prefix_cache_misses(self):
+        """Asks the First Peer to prefill again the requests whose cached prefix is missing.
+
+        The miss travels as an abort, which the p2p server broadcasts along the routing
+        table: the First Peer restarts the prefill and the other peers drop the request.
+        """
+        misses = self.scheduler.pop_prefix_cache_misses()
+        if misses and self.tp_rank == 0:
+            self.send_to_peer_socket.send_multipart(
+                [b"abort", abort_request_to_proto(misses).SerializeToString()]
+            )
+
+    def _restart_prefill(self, rid: str):
+        """Prefills a request again from the start after a downstream prefix cache miss."""
+        req = self.scheduler.get_running_request(rid)
+        if req is None or not req.is_prefill:
+            logger.debug(f"Ignoring prefix cache miss of {rid}, it is not prefilling anymore.")
+            return
+        self._release_request(rid)
+        self.scheduler.restart_prefill(rid)
+
     def run_loop(self):
         """The main loop of the executor."""
         logger.debug(
@@ -408,6 +489,7 @@ class BaseExecutor:
             received_requests.extend(self.recv_requests_from_peer())
 
             self.handle_input_requests(received_requests)
+            self.flush_output_tokens()
 
             # Send finished batch to next peer
             if len(self.finished_batch) > 0 and self.is_first_peer and self.tp_rank == 0:
@@ -422,13 +504,36 @@ class BaseExecutor:
                 layer_changed = self.shared_state.get_layer_allocation_changed()
 
             if layer_changed:
-                logger.info(
-                    "Layer reallocation detected. Stopping executor to reload with new layers."
-                )
-                self._should_stop = True
-                break
-
-            # 5. Admit requests into running set up to capacity, then form batch
+                model_info = self.shared_state.get_model_info()
+                if not self.can_reload_layers(model_info):
+                    logger.info(
+                        "Layer reallocation detected. Stopping executor to reload with new layers."
+                    )
+                    self._should_stop = True
+                    break
+                if self._layer_reload_deadline is None:
+                    logger.info(
+                        "Layer reallocation detected. Draining in-flight requests before "
+                        "reloading layers in place."
+                    )
+                    self._layer_reload_deadline = time.time() + self.layer_reload_drain_s
+                    # Nothing new is admitted while draining
+                    self.scheduler.admission_paused = True
+                if (
+                    self.scheduler.num_running_requests == 0
+                    or time.time() >= self._layer_reload_deadline
+                ):
+                    self._layer_reload_deadline = None
+                    try:
+                        self._reload_layers_in_place(model_info)
+                    except Exception:
+                        logger.exception("Reloading layers in place failed, stopping executor.")
+                        self._should_stop = True
+                        break
+                    self.scheduler.admission_paused = False
+                    continue
+
+            # 5. Admit requests into running set up to capacity, then form batch.
             self.scheduler.admit_requests()
             # 5.1 Check for request timeouts and abort timed out requests
             try:
@@ -437,7 +542,7 @@ class BaseExecutor:
                     for req in timed_out_reqs:
                         rid = req.request_id
                         logger.warning(
-                            f"Request {rid} exceeded timeout ({req.timeout_s}s). Aborting and releasing resources."
+                            f"Request {rid} exceeded timeout ({self.scheduler.request_timeout_s}s). Aborting and releasing resources."
                         )
                         self.release_and_evict_request(rid)
 
@@ -448,16 +553,20 @@ class BaseExecutor:
                 # Non-fatal; continue serving
                 pass
             batch_to_process = self.scheduler.form_batch()
+            self._report_prefix_cache_misses()
             if not batch_to_process:
+                # Nothing to run until a peer or the HTTP server sends something
+                self.wait_for_requests()
                 continue
             logger.debug(f"Formed batch with {len(batch_to_process)} requests.")
 
             # 6. Process the batch
+            step_start_time = time.time()
             try:
                 prepared_inputs_dict = self.prepare_batch_inputs(batch_to_process)
 
-                # We will process prefill and decode batches separately for now
-                for batch_type in ["prefill_batch", "decode_batch"]:
+                # Prefill and decode batches run separately unless prepared as one mixed batch
+                for batch_type in ["prefill_batch", "decode_batch", "mixed_batch"]:
                     if prepared_inputs_dict and prepared_inputs_dict.get(batch_type):
                         prepared_inputs = prepared_inputs_dict[batch_type]
 
@@ -487,35 +596,84 @@ class BaseExecutor:
                         next_batch = self.prepare_next_batch_requests(
                             requests=prepared_inputs["requests"],
                             hidden_states=output,
-                            context_lengths=prepared_inputs.get("context_lengths"),
+                            context_lengths=prepared_inputs.get(
+                                "input_lengths", prepared_inputs.get("context_lengths")
+                            ),
                         )
+                        for req in prepared_inputs["requests"]:
+                            if req.is_prefill and not req.is_last_prefill_chunk:
+                                self.scheduler.commit_prefill_chunk(req)
 
                         # 8. Dispatch to the appropriate destination
-                        if self.tp_rank == 0:
+                        if self.tp_rank == 0 and next_batch:
                             if self.is_last_peer and self.is_first_peer:
                                 # Single node: handle locally
                                 self.handle_input_requests(next_batch)
+                                self.flush_output_tokens()
                             else:
                                 # Send output to next peer
                                 self.send_to_peer_socket.send_multipart(
-                                    [
-                                        b"forward",
-                                        request_to_proto(
-                                            next_batch, self.device
-                                        ).SerializeToString(),
-                                    ]
+                                    [b"forward", *requests_to_multipart(next_batch, self.device)],
+                                    copy=False,
                                 )
                                 logger.debug(
                                     f"Processed batch of type {batch_type} with {len(next_batch)} requests "
                                     f"in {(time.time() - start_time) * 1000:.3f} ms"
                                 )
 
+                self.scheduler.record_step_latency(time.time() - step_start_time)
             except Exception as e:
                 logger.exception(f"Error processing batch: {e}")
                 # Naive error handling: release and evict all requests in the batch
                 for req in batch_to_process:
                     self.release_and_evict_request(req.request_id)
 
+    def can_reload_layers(self, model_info: Dict[str, Any]) -> bool:
+        """Whether the executor can switch to the allocation in `model_info` without exiting.
+
+        Backends that support it override this together with `reload_layers`.
+        """
+        return False
+
+    def reload_layers(self, start_layer: int, end_layer: int):
+        """Swaps the model shard and KV pool over to [start_layer, end_layer)."""
+        raise NotImplementedError
+
+    def _reload_layers_in_place(self, model_info: Dict[str, Any]):
+        """Aborts whatever is left in flight and reloads the shard for the new allocation."""
+        start_layer = model_info["block_start_index"]
+        end_layer = model_info["block_end_index"]
+        aborted = self.scheduler.drain()
+        for req in aborted:
+            self._release_request(req.request_id)
+            if self.is_first_peer and not self.is_last_peer:
+                self.finished_batch.append(req)
+            if self.is_first_peer and getattr(self, "send_to_ipc_socket", None) is not None:
+                self.send_to_ipc_socket.send(
+                    encode_token_error(
+                        req.request_id,
+                        "Layer allocation changed while the request was in flight",
+                        "ServiceUnavailableError",
+                        HTTPStatus.SERVICE_UNAVAILABLE.value,
+                    )
+                )
+        logger.info(
+            f"Reloading layers [{self.start_layer}, {self.end_layer}) -> "
+            f"[{start_layer}, {end_layer}), aborted {len(aborted)} requests"
+        )
+
+        t0 = time.time()
+        self.reload_layers(start_layer, end_layer)
+        self.start_layer = start_layer
+        self.end_layer = end_layer
+        self.num_shard_layers = end_layer - start_layer
+        self.is_last_peer = end_layer == self.config.get("num_hidden_layers")
+        logger.info(f"Reloaded layers [{start_layer}, {end_layer}) in {time.time() - t0:.1f} s")
+        if not self.shared_state.finish_layer_reallocation(
+            start_layer, end_layer, ServerState.READY.value
+        ):
+            logger.info("Layer allocation changed again while reloading.")
+
     def run_loop_in_background(self):
         """Run the executor loop in the background."""
 
@@ -528,14 +686,7 @@ class BaseExecutor:
         time.sleep(0.1)  # Give run_loop a moment to exit gracefully
 
         try:
-            all_requests = [req for _, _, _, req in self.scheduler._request_queue] + list(
-                self.scheduler._running_requests.values()
-            )
-            for req in all_requests:
-                try:
-                    self.scheduler.evict_request(req.request_id, RequestStatus.CANCELLED)
-                except Exception:
-                    pass
+            self.scheduler.drain()
         except Exception:
             pass
 
@@ -611,6 +762,12 @@ class BaseExecutor:
                 sampling_params.top_p = raw_sampling_params["top_p"]
             if "ignore_eos" in raw_sampling_params:
                 sampling_params.ignore_eos = raw_sampling_params["ignore_eos"]
+            for penalty in ("repetition_penalty", "presence_penalty", "frequency_penalty"):
+                if penalty in raw_sampling_params:
+                    setattr(sampling_params, penalty, float(raw_sampling_params[penalty]))
+        # Matched on the detokenized output by the http server, which aborts the request
+        sampling_params.stop_strs = parse_stop_strs(raw_request)
+        sampling_params.json_schema = parse_json_schema(raw_request)
 
         req = InitialRequest(
             request_id=rid,
@@ -620,11 +777,30 @@ class BaseExecutor:
             max_new_tokens=max_new_tokens,
             max_total_length=max_total_length,
             lora_path=lora_path,
+            priority=int(raw_request.get("priority") or 0),
         )
         if "routing_table" in raw_request:
             req.routing_table = raw_request["routing_table"]
         return req
 
+    def _add_output_token(self, req: IntermediateRequest, original_req: Request):
+        """Queues the token just sampled for `original_req` for the http server."""
+        if original_req.status == RequestStatus.FINISHED_EOS:
+            finish = FINISH_EOS
+        elif original_req.status == RequestStatus.FINISHED_MAX_LENGTH:
+            finish = FINISH_LENGTH
+        else:
+            finish = FINISH_NONE
+        self.output_tokens.append(req.request_id, req.next_token_id, len(req.input_ids), finish)
+
+    def flush_output_tokens(self):
+        """Sends the tokens queued during this step to the http server as one message."""
+        if len(self.output_tokens) == 0:
+            return
+        if getattr(self, "send_to_ipc_socket", None) is not None:
+            self.send_to_ipc_socket.send(self.output_tokens.encode())
+        self.output_tokens.clear()
+
     def _notify_http_request_error(self, raw_request: Optional[Dict], error: Exception):
         """Best-effort notification to HTTP server when request parsing fails."""
         if not hasattr(self, "send_to_ipc_socket") or self.send_to_ipc_socket is None:
@@ -641,15 +817,9 @@ class BaseExecutor:
             if isinstance(error, ValueError) or is_template_error
             else HTTPStatus.INTERNAL_SERVER_ERROR
         )
-        payload = {
-            "type": "error",
-            "rid": rid,
-            "error": str(error),
-            "error_type": error.__class__.__name__,
-            "status_code": status.value,
-        }
+        payload = encode_token_error(rid, str(error), error.__class__.__name__, status.value)
         try:
-            self.send_to_ipc_socket.send_pyobj(payload)
+            self.send_to_ipc_socket.send(payload)
         except Exception:  # pragma: no cover - best effort notification
             logger.debug("Failed to send error notification to HTTP handler", exc_info=True)
 
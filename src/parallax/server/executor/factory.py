@@ -5,6 +5,7 @@ Creates executor from factory for different backends.
 import argparse
 from typing import Optional
 
+from parallax.utils.shared_state import SharedState
 from parallax.utils.utils import get_current_device
 from parallax_utils.logging_config import get_logger, set_log_level
 
@@ -26,6 +27,9 @@ def create_executor_config(args: argparse.Namespace, shared_state=None):
         "enable_prefix_cache": args.enable_prefix_cache,
         "max_num_tokens_per_batch": args.max_num_tokens_per_batch,
         "prefill_priority": args.prefill_priority,
+        "batching_policy": args.batching_policy if "batching_policy" in args else None,
+        "ttft_slo_ms": args.ttft_slo_ms if "ttft_slo_ms" in args else 1000.0,
+        "tpot_slo_ms": args.tpot_slo_ms if "tpot_slo_ms" in args else 100.0,
         "micro_batch_ratio": args.micro_batch_ratio,
         "scheduler_wait_ms": args.scheduler_wait_ms,
         "send_to_peer_addr": args.send_to_peer_addr if "send_to_peer_addr" in args else None,
@@ -54,7 +58,7 @@ def create_executor_config(args: argparse.Namespace, shared_state=None):
 
 def create_from_args(
     args,
-    shared_state: Optional[dict] = None,
+    shared_state: Optional[SharedState] = None,
     device: Optional[str] = None,
 ):
     """
@@ -2,6 +2,7 @@
 MLX-LM backend implementation of high level executor
 """
 
+import gc
 import time
 from typing import Any, Dict, List, Optional, Tuple
 
@@ -13,13 +14,16 @@ from parallax.server.request import (
     InitialRequest,
     IntermediateRequest,
     Request,
-    RequestStatus,
 )
+from parallax.server.sampling.grammar import GrammarConstraints, compile_json_schema
+from parallax.server.sampling.penalizer import Penalizer
 from parallax.server.sampling.sampler import SamplingBatchInfo
 from parallax.server.shard_loader import MLXModelLoader
+from parallax.utils.shared_state import SharedState
 from parallax.utils.utils import (
     combine_padding_and_causal_masks,
     create_causal_mask,
+    create_prefix_causal_mask,
     get_device_dtype,
     get_layer_types,
     pad_inputs,
@@ -47,6 +51,9 @@ class MLXExecutor(BaseExecutor):
         # Controlling perfill / decode ratio
         max_num_tokens_per_batch: int = 1024,
         prefill_priority: int = 0,
+        batching_policy: Optional[str] = None,
+        ttft_slo_ms: float = 1000.0,
+        tpot_slo_ms: float = 100.0,
         micro_batch_ratio: int = 2,
         scheduler_wait_ms: int = 500,
         request_timeout_s: Optional[int] = 600,
@@ -80,7 +87,7 @@ class MLXExecutor(BaseExecutor):
         tp_size: Optional[int] = 1,
         nccl_port: Optional[int] = 4000,
         # Optional shared state for layer reallocation detection (when running in subprocess)
-        shared_state: Optional[dict] = None,
+        shared_state: Optional[SharedState] = None,
     ):
         logger.debug(
             f"Initializing MLX sharded model loader for repo={model_repo}, layers=[{start_layer}, {end_layer})"
@@ -94,10 +101,10 @@ class MLXExecutor(BaseExecutor):
         t0 = time.time()
         self.model_shard, self.config, self.tokenizer = self.shard_loader.load()
 
-        adapters = lora_paths[0] if lora_paths else None
-        if adapters:
-            logger.debug(f"mlx adapters is: {adapters}")
-            self.model_shard = self.shard_loader.load_lora(self.model_shard, adapters)
+        self.lora_adapters = lora_paths[0] if lora_paths else None
+        if self.lora_adapters:
+            logger.debug(f"mlx adapters is: {self.lora_adapters}")
+            self.model_shard = self.shard_loader.load_lora(self.model_shard, self.lora_adapters)
 
         logger.debug(
             f"MLX sharded model loaded in {(time.time() - t0) * 1000:.1f} ms; num_layers={self.config.get('num_hidden_layers')}"
@@ -140,16 +147,9 @@ class MLXExecutor(BaseExecutor):
         indexer_key_head_dim = self.config.get("indexer_key_head_dim", None)
         indexer_num_kv_heads = self.config.get("indexer_num_kv_heads", None)
 
-        layer_types = get_layer_types(self.config, start_layer, end_layer)
-        logger.debug(f"layer_types: {layer_types}")
         time.sleep(5)
-        logger.debug(
-            "Initializing CacheManager (mlx) with block_size=%d, layers=%d",
-            kv_block_size,
-            self.num_shard_layers,
-        )
-        self.cache_manager = CacheManager(
-            num_layers=self.num_shard_layers,
+        # Everything but the layer range, reused when the KV pool is rebuilt for new layers
+        self.cache_manager_kwargs = dict(
             num_kv_heads=num_key_value_heads,
             head_dim=head_dim,
             dtype=self.dtype,
@@ -158,7 +158,8 @@ class MLXExecutor(BaseExecutor):
             head_dim_v=v_head_dim,
             indexer_key_head_dim=indexer_key_head_dim,
             indexer_num_kv_heads=indexer_num_kv_heads,
-            layer_types=layer_types,
+            # Cached prefixes are skipped like already prefilled chunks
+            enable_prefix_cache=enable_prefix_cache and self.model_shard.supports_chunked_prefill,
             max_num_seqs=max_batch_size // micro_batch_ratio,
             conv_dim=conv_dim,
             conv_kernel_size=linear_conv_kernel_dim,
@@ -167,6 +168,11 @@ class MLXExecutor(BaseExecutor):
             linear_num_k_heads=linear_num_key_heads,
             linear_num_v_heads=linear_num_value_heads,
         )
+        self.cache_manager = self._create_cache_manager(start_layer, end_layer)
+        # Output token counts of requests with repetition/presence/frequency penalties
+        self.penalizer = Penalizer()
+        # Automaton states of requests with a json_schema
+        self.grammar_constraints = GrammarConstraints(self.tokenizer)
         super().__init__(
             start_layer=start_layer,
             end_layer=end_layer,
@@ -176,9 +182,14 @@ class MLXExecutor(BaseExecutor):
             max_sequence_length=max_sequence_length,
             max_num_tokens_per_batch=max_num_tokens_per_batch,
             prefill_priority=prefill_priority,
+            batching_policy=batching_policy,
+            ttft_slo_ms=ttft_slo_ms,
+            tpot_slo_ms=tpot_slo_ms,
             micro_batch_ratio=micro_batch_ratio,
             scheduler_wait_ms=scheduler_wait_ms,
             request_timeout_s=request_timeout_s,
+            enable_chunked_prefill=self.model_shard.supports_chunked_prefill,
+            enable_mixed_batch=self.model_shard.supports_mixed_batch,
             layer_latency_update_every=layer_latency_update_every,
             send_to_peer_addr=send_to_peer_addr,
             recv_from_peer_addr=recv_from_peer_addr,
@@ -194,21 +205,69 @@ class MLXExecutor(BaseExecutor):
         except Exception:
             logger.warning("Using mlx without metal backend.")
 
-        # Prefix Cache Manager
-        self.enable_prefix_cache = enable_prefix_cache
-        # self.prefix_cache = RadixCache(
-        #     num_kv_heads=num_key_value_heads,
-        #     head_dim=head_dim,
-        #     head_dim_v=v_head_dim,
-        #     num_layers=self.num_shard_layers,
-        #     dtype=self.dtype,
-        #     page_size=1,
-        # )
+        # Prefix caching is handled by the CacheManager at block granularity
+        self.enable_prefix_cache = self.cache_manager.prefix_cache is not None
 
         logger.debug(
             f"CacheManager ready; wired_limit set; prefix_cache={'on' if self.enable_prefix_cache else 'off'}"
         )
 
+    def _create_cache_manager(self, start_layer: int, end_layer: int) -> CacheManager:
+        """Builds the KV pool for layers [start_layer, end_layer)."""
+        layer_types = get_layer_types(self.config, start_layer, end_layer)
+        logger.debug(f"layer_types: {layer_types}")
+        logger.debug(
+            "Initializing CacheManager (mlx) with block_size=%d, layers=%d",
+            self.cache_manager_kwargs["block_size"],
+            end_layer - start_layer,
+        )
+        return CacheManager(
+            num_layers=end_layer - start_layer,
+            layer_types=layer_types,
+            **self.cache_manager_kwargs,
+        )
+
+    def can_reload_layers(self, model_info: Dict[str, Any]) -> bool:
+        """Layers can be swapped in place while the model and the head node stay the same.
+
+        The HTTP server only runs next to the first layer, so a node becoming or ceasing to
+        be the head still restarts.
+        """
+        start_layer = model_info["block_start_index"]
+        end_layer = model_info["block_end_index"]
+        model_name = model_info["model_name"]
+        return (
+            start_layer is not None
+            and end_layer is not None
+            and start_layer < end_layer
+            and (start_layer == 0) == self.is_first_peer
+            and model_name in (None, self.shard_loader.model_path_str)
+            and model_info["tp_size"] in (None, self.tp_size)
+        )
+
+    def reload_layers(self, start_layer: int, end_layer: int):
+        """Keeps the weights of retained layers, loads the gained ones and rebuilds the KV pool."""
+        kept_weights = self.shard_loader.checkpoint_weights(
+            self.model_shard, start_layer, end_layer
+        )
+        # Free the dropped layers and the old KV pool before loading anything
+        self.model_shard = None
+        self.cache_manager = None
+        self.scheduler.cache_manager = None
+        gc.collect()
+        mx.clear_cache()
+
+        self.shard_loader.start_layer = start_layer
+        self.shard_loader.end_layer = end_layer
+        self.model_shard, _, _ = self.shard_loader.load(
+            reuse_weights=kept_weights, tokenizer=self.tokenizer
+        )
+        if self.lora_adapters:
+            self.model_shard = self.shard_loader.load_lora(self.model_shard, self.lora_adapters)
+        self.cache_manager = self._create_cache_manager(start_layer, end_layer)
+        self.scheduler.cache_manager = self.cache_manager
+        self.penalizer = Penalizer()
+
     def handle_input_requests(self, requests: List[Request]):
         """Update requests states and status in scheduler and cache manager."""
         if not requests:
@@ -220,6 +279,10 @@ class MLXExecutor(BaseExecutor):
                 if isinstance(req, InitialRequest):
                     self.scheduler.enque_request(req)
                 elif isinstance(req, IntermediateRequest):
+                    if req.is_finished and req.next_token_id is None:
+                        # Abort from a downstream peer missing the prefix this peer skipped
+                        self._restart_prefill(req.request_id)
+                        continue
                     original_req = self.scheduler.get_running_request(req.request_id)
                     if original_req is None:
                         logger.warning(
@@ -243,7 +306,7 @@ class MLXExecutor(BaseExecutor):
 
                     # Check for termination.
                     if self.scheduler.check_and_update_request_status(original_req):
-                        self.cache_manager.release_request(original_req.request_id)
+                        self._release_request(original_req.request_id)
                         logger.debug(
                             f"Released resources for finished request {req.request_id}, "
                             f"memory usage: {mx.get_active_memory() / 1024**3 :.3f} GB"
@@ -253,19 +316,9 @@ class MLXExecutor(BaseExecutor):
                     else:
                         self.scheduler.enque_request(original_req)
 
-                    # detokenize and send to http server
+                    # Queue the token for the http server, sent once per step
                     if self.tp_rank == 0:
-                        req_dict = {
-                            "prompt_tokens": len(req.input_ids),
-                            "next_token_id": req.next_token_id,
-                            "rid": req.request_id,
-                        }
-                        if original_req.status == RequestStatus.FINISHED_EOS:
-                            req_dict["eos"] = True
-                        if original_req.status == RequestStatus.FINISHED_MAX_LENGTH:
-                            req_dict["length"] = True
-                        if hasattr(self, "send_to_ipc_socket"):
-                            self.send_to_ipc_socket.send_pyobj(req_dict)
+                        self._add_output_token(req, original_req)
                 else:
                     raise TypeError(f"First peer received unexpected request type: {type(req)}")
 
@@ -276,17 +329,12 @@ class MLXExecutor(BaseExecutor):
                     req, IntermediateRequest
                 ), "Non-first peers must receive IntermediateRequests."
                 if req.is_finished or req.hidden_states is None:
-                    if self.enable_prefix_cache:
-                        keys, values = self.cache_manager.gather_kv_cache(req.request_id)
-                        self.prefix_cache.cache_finished_request(req, keys, values)
-                        self.prefix_cache.evict_request(req.request_id)
-
-                    self.cache_manager.release_request(req.request_id)
+                    # Aborts are broadcast, so the request may not have reached this peer
+                    self.release_and_evict_request(req.request_id)
                     logger.debug(
                         f"Released resources for finished request {req.request_id}, "
                         f"memory usage: {mx.get_active_memory() / 1024**3 :.3f} GB"
                     )
-                    self.scheduler.evict_request(req.request_id)
                     if not self.is_last_peer:
                         self.finished_batch.append(req)
                 else:
@@ -307,6 +355,8 @@ class MLXExecutor(BaseExecutor):
             context_lengths=prepared_inputs.get("context_lengths"),
             slot_mapping=prepared_inputs.get("slot_mapping"),
             state_slot_mapping=prepared_inputs.get("state_slot_mapping"),
+            prefix_lens=prepared_inputs.get("prefix_lens"),
+            query_lens=prepared_inputs.get("query_lens"),
         )
 
         logger.debug(
@@ -315,40 +365,59 @@ class MLXExecutor(BaseExecutor):
             f"hidden_states shape: {hidden_states.shape}"
         )
 
-        lengths = mx.zeros((len(prepared_inputs["requests"]),), dtype=mx.int32)
         requests = prepared_inputs["requests"]
+        query_lens = prepared_inputs.get("query_lens")
+        if query_lens is not None:
+            # Mixed batch: the last peer samples from each request's final token, other
+            # peers pass the flattened (total_tokens, D) hidden states on
+            if return_decoded_tokens:
+                last_token_indices = mx.cumsum(mx.array(query_lens, dtype=mx.int32)) - 1
+                hidden_states = hidden_states[0, last_token_indices][:, None, :]
+                sampling_info = SamplingBatchInfo.from_reqs(
+                    requests, self.penalizer, self.grammar_constraints
+                )
+                return mx.array(
+                    self.model_shard.logits_to_tokens(hidden_states, None, sampling_info)
+                )
+            return hidden_states[0]
+
+        lengths = mx.zeros((len(prepared_inputs["requests"]),), dtype=mx.int32)
         for i, req in enumerate(requests):
             if req.is_prefill:
-                lengths[i] = prepared_inputs.get("context_lengths")[i]
+                lengths[i] = prepared_inputs.get("input_lengths")[i]
             elif req.is_decoding:
                 lengths[i] = 1
             else:
                 continue
 
         # Note: With PagedAttention, we don't need to explicitly update requests with new K/V
-        # because they are written in-place to the global cache.
-        # self.cache_manager.update_requests(...) is REMOVED.
-
-        # Update prefix cache (TODO: Adapt to PagedKV)
-        if self.enable_prefix_cache:
-            pass
-            # for _, req in enumerate(requests):
-            #    if req.is_prefill:
-            #        keys, values = self.cache_manager.gather_kv_cache(req.request_id)
-            #        self.prefix_cache.cache_unfinished_request(req, keys, values)
+        # because they are written in-place to the global cache. Prompt blocks enter the
+        # prefix cache once the request decodes (see CacheManager.append_slot).
 
         # Process last peer: need additional sampling + detokenization
         if return_decoded_tokens:
-            sampling_info = SamplingBatchInfo.from_reqs(requests)
+            sampling_info = SamplingBatchInfo.from_reqs(
+                requests, self.penalizer, self.grammar_constraints
+            )
             return mx.array(
                 self.model_shard.logits_to_tokens(hidden_states, lengths, sampling_info)
             )
 
         return hidden_states
 
+    def _handle_raw_request(self, raw_request: Dict) -> InitialRequest:
+        req = super()._handle_raw_request(raw_request)
+        if req.sampling_params.json_schema:
+            # Rejects unsupported schemas before any peer works on the request
+            compile_json_schema(req.sampling_params.json_schema)
+        return req
+
     def _release_request(self, rid: str):
         """Release per-request resources in MLX."""
         try:
+            if hasattr(self, "penalizer"):
+                self.penalizer.release(rid)
+                self.grammar_constraints.release(rid)
             if hasattr(self, "cache_manager") and self.cache_manager is not None:
                 self.cache_manager.release_request(rid)
         except Exception:
@@ -365,34 +434,50 @@ class MLXExecutor(BaseExecutor):
         return next_token_id, hidden_states
 
     def _prepare_prefill_batch(self, batched_requests: List[Request]) -> Dict[str, Any]:
-        """Prepares inputs for ShardedModel from a batch of prefill requests."""
+        """Prepares inputs for ShardedModel from a batch of prefill requests.
+
+        Each request contributes the prompt chunk [prefill_offset, prefill_chunk_end); a whole
+        prompt is the special case of a single chunk starting at 0. Chunks that follow an
+        already cached prefix get `prefix_lens` so attention also covers the cached tokens.
+        """
         batch_size = len(batched_requests)
         if batch_size == 0:
             return None
 
         h_or_tokens_list = []
-        block_tables_list = []
         context_lengths_list = []
-
-        # TODO: Adapt Prefix Cache to PagedKV
+        prefix_lens_list = []
+        input_lengths_list = []
 
         for req in batched_requests:
             assert req.is_prefill, f"Request {req.request_id} is not a prefill request."
+            chunk_start = req.prefill_offset
+            chunk_end = req.prefill_chunk_end
             if self.is_first_peer:
-                h_or_tokens_list.append(req.input_ids)
+                h_or_tokens_list.append(req.input_ids[chunk_start:chunk_end])
             else:
                 h_or_tokens_list.append(req.hidden_states)
 
-            # Allocate Paged KV blocks
-            # For first peer and intermediate peers, we allocate based on prompt length
-            success = self.cache_manager.allocate_request(req.request_id, req.total_length)
+            # Allocate Paged KV blocks for the whole prompt (no-op for later chunks)
+            success = self.cache_manager.allocate_request(
+                req.request_id, max(req.total_length, req.prompt_len)
+            )
             if not success:
                 raise RuntimeError(f"OOM during prefill allocation for {req.request_id}")
 
-            block_table = self.cache_manager.get_block_table(req.request_id)
-            block_tables_list.append(block_table)
-            # For prefill, context length after this step will be total_length
-            context_lengths_list.append(req.total_length)
+            # Downstream prefix cache misses never get here, see Scheduler.admit_requests
+            cached = self.cache_manager.get_num_computed_tokens(req.request_id)
+            if cached != chunk_start:
+                raise RuntimeError(
+                    f"Prefill chunk of {req.request_id} starts at {chunk_start}, "
+                    f"but {cached} tokens are cached"
+                )
+            self.cache_manager.commit_prefill_tokens(req.request_id, chunk_end - chunk_start)
+
+            # Context length after this step covers the cached prefix and the new chunk
+            context_lengths_list.append(chunk_end)
+            prefix_lens_list.append(chunk_start)
+            input_lengths_list.append(chunk_end - chunk_start)
 
         if self.is_first_peer:
             padded_inputs, padding_mask = pad_inputs(
@@ -401,41 +486,30 @@ class MLXExecutor(BaseExecutor):
         else:
             padded_inputs, padding_mask = pad_inputs(0, h_or_tokens_list, self.dtype)
 
-        # Generate slot_mapping (Batch * MaxLen) for prefill
-        max_len = padded_inputs.shape[1]
-        slot_mapping_flat = []
-
-        for i, req in enumerate(batched_requests):
-            block_table = block_tables_list[i]
-            length = req.total_length
-
-            for seq_idx in range(max_len):
-                if seq_idx < length:
-                    # Valid token
-                    block_idx = seq_idx // self.cache_manager.block_size
-                    block_offset = seq_idx % self.cache_manager.block_size
-                    physical_block = block_table[block_idx]
-                    slot = physical_block * self.cache_manager.block_size + block_offset
-                    slot_mapping_flat.append(slot)
-                else:
-                    # Padding token
-                    # Map to -1. The kernel should ignore this.
-                    slot_mapping_flat.append(-1)
-
-        slot_mapping_tensor = mx.array(slot_mapping_flat, dtype=mx.int64)
-
-        # Pad block tables
-        max_blocks = max(len(bt) for bt in block_tables_list)
-        padded_block_tables = []
-        for bt in block_tables_list:
-            padded_block_tables.append(bt + [0] * (max_blocks - len(bt)))
-
-        block_tables_tensor = mx.array(padded_block_tables, dtype=mx.int32)
+        block_tables = self.cache_manager.get_padded_block_tables(
+            [r.request_id for r in batched_requests]
+        )
+        # Generate slot_mapping (Batch * MaxLen) for prefill, padding tokens map to -1
+        # and are ignored by the kernel
+        slot_mapping = self.cache_manager.get_slot_mapping(
+            block_tables, prefix_lens_list, input_lengths_list, padded_len=padded_inputs.shape[1]
+        )
+        slot_mapping_tensor = mx.array(slot_mapping)
+        block_tables_tensor = mx.array(block_tables)
         context_lengths_tensor = mx.array(context_lengths_list, dtype=mx.int32)
+        input_lengths_tensor = mx.array(input_lengths_list, dtype=mx.int32)
 
-        # Create mask for standard attention (used during Prefill computation)
-        causal_mask = create_causal_mask(padded_inputs.shape[1], padded_inputs.shape[1], self.dtype)
-        mask = combine_padding_and_causal_masks(padding_mask, causal_mask, self.dtype)
+        prefix_lens_tensor = None
+        if any(prefix_lens_list):
+            # Chunked prefill: queries attend to the cached prefix plus the causal chunk
+            prefix_lens_tensor = mx.array(prefix_lens_list, dtype=mx.int32)
+            mask = create_prefix_causal_mask(prefix_lens_list, input_lengths_list, self.dtype)
+        else:
+            # Create mask for standard attention (used during Prefill computation)
+            causal_mask = create_causal_mask(
+                padded_inputs.shape[1], padded_inputs.shape[1], self.dtype
+            )
+            mask = combine_padding_and_causal_masks(padding_mask, causal_mask, self.dtype)
 
         # Prepare state slot mapping if needed
         state_slot_mapping = None
@@ -451,12 +525,99 @@ class MLXExecutor(BaseExecutor):
             "requests": batched_requests,
             "block_tables": block_tables_tensor,
             "context_lengths": context_lengths_tensor,
+            "input_lengths": input_lengths_tensor,
+            "prefix_lens": prefix_lens_tensor,
             "slot_mapping": slot_mapping_tensor,
             "state_slot_mapping": state_slot_mapping,
         }
         logger.debug(f"Prepared MLX prefill batch (size={batch_size})")
         return ret
 
+    def _prepare_mixed_batch(self, batched_requests: List[Request]) -> Dict[str, Any]:
+        """Prepares one ragged input for a batch of prefill chunks and decodes.
+
+        All tokens are flattened into a single row of shape (1, total_tokens[, D]). A decode is
+        a one-token segment on top of its cached context, so every request is described by its
+        `prefix_lens` (tokens already cached) and `query_lens` (tokens computed this step).
+        """
+        h_or_tokens_list = []
+        context_lengths_list = []
+        prefix_lens_list = []
+        query_lens = []
+
+        for req in batched_requests:
+            if req.is_prefill:
+                chunk_start = req.prefill_offset
+                chunk_end = req.prefill_chunk_end
+                if self.is_first_peer:
+                    h_or_tokens_list.extend(req.input_ids[chunk_start:chunk_end])
+                else:
+                    h_or_tokens_list.append(req.hidden_states)
+
+                success = self.cache_manager.allocate_request(
+                    req.request_id, max(req.total_length, req.prompt_len)
+                )
+                if not success:
+                    raise RuntimeError(f"OOM during prefill allocation for {req.request_id}")
+                cached = self.cache_manager.get_num_computed_tokens(req.request_id)
+                if cached != chunk_start:
+                    raise RuntimeError(
+                        f"Prefill chunk of {req.request_id} starts at {chunk_start}, "
+                        f"but {cached} tokens are cached"
+                    )
+                self.cache_manager.commit_prefill_tokens(req.request_id, chunk_end - chunk_start)
+                context_length = chunk_end
+                query_len = chunk_end - chunk_start
+            else:
+                assert req.is_decoding, f"Request {req.request_id} is not a decode request."
+                if self.is_first_peer:
+                    h_or_tokens_list.append(req.output_ids[-1])
+                else:
+                    h_or_tokens_list.append(req.hidden_states)
+
+                success = self.cache_manager.append_slot(req.request_id)
+                if not success:
+                    raise RuntimeError(f"OOM during decode for {req.request_id}")
+                context_length = self.cache_manager.get_context_length(req.request_id)
+                query_len = 1
+
+            context_lengths_list.append(context_length)
+            prefix_lens_list.append(context_length - query_len)
+            query_lens.append(query_len)
+
+        if self.is_first_peer:
+            inputs = mx.array([h_or_tokens_list], dtype=mx.int32)  # (1, total_tokens)
+        else:
+            inputs = mx.concatenate(h_or_tokens_list, axis=0)[None]  # (1, total_tokens, D)
+
+        block_tables = self.cache_manager.get_padded_block_tables(
+            [r.request_id for r in batched_requests]
+        )
+        slot_mapping = self.cache_manager.get_slot_mapping(
+            block_tables, prefix_lens_list, query_lens
+        )
+
+        state_slot_mapping = None
+        if self.cache_manager.needs_slots:
+            slots = [self.cache_manager.get_slot(r.request_id) for r in batched_requests]
+            state_slot_mapping = mx.array(slots, dtype=mx.int32)
+
+        ret = {
+            "h_or_tokens": inputs,
+            "cache": self.cache_manager.get_caches(),
+            "mask": None,
+            "requests": batched_requests,
+            "block_tables": mx.array(block_tables),
+            "context_lengths": mx.array(context_lengths_list, dtype=mx.int32),
+            "input_lengths": mx.array(query_lens, dtype=mx.int32),
+            "prefix_lens": mx.array(prefix_lens_list, dtype=mx.int32),
+            "query_lens": query_lens,
+            "slot_mapping": mx.array(slot_mapping),
+            "state_slot_mapping": state_slot_mapping,
+        }
+        logger.debug(f"Prepared MLX mixed batch (size={len(batched_requests)})")
+        return ret
+
     def _prepare_decode_batch(self, batched_requests: List[Request]) -> Optional[Dict[str, Any]]:
         """Prepares inputs for ShardedModel from a batch of decode requests."""
         batch_size = len(batched_requests)
@@ -464,7 +625,6 @@ class MLXExecutor(BaseExecutor):
             return None
 
         h_or_tokens_list = []
-        block_tables_list = []
         context_lengths_list = []
 
         for req in batched_requests:
@@ -476,15 +636,11 @@ class MLXExecutor(BaseExecutor):
             else:
                 h_or_tokens_list.append(req.hidden_states)
 
-            # TODO: Prefix cache update
-
             # Allocate slot for new token
             success = self.cache_manager.append_slot(req.request_id)
             if not success:
                 raise RuntimeError(f"OOM during decode for {req.request_id}")
 
-            block_table = self.cache_manager.get_block_table(req.request_id)
-            block_tables_list.append(block_table)
             context_lengths_list.append(self.cache_manager.get_context_length(req.request_id))
 
         if isinstance(h_or_tokens_list[0], list):
@@ -495,13 +651,9 @@ class MLXExecutor(BaseExecutor):
             padded_inputs = mx.concatenate(h_or_tokens_list, axis=0)  # (Batch, D)
             padded_inputs = padded_inputs.reshape(batch_size, 1, -1)  # (Batch, 1, D)
 
-        # Pad block tables
-        max_blocks = max(len(bt) for bt in block_tables_list)
-        padded_block_tables = []
-        for bt in block_tables_list:
-            padded_block_tables.append(bt + [0] * (max_blocks - len(bt)))
-
-        block_tables_tensor = mx.array(padded_block_tables, dtype=mx.int32)
+        block_tables_tensor = mx.array(
+            self.cache_manager.get_padded_block_tables([r.request_id for r in batched_requests])
+        )
         context_lengths_tensor = mx.array(context_lengths_list, dtype=mx.int32)
 
         # Prepare state slot mapping if needed
@@ -16,7 +16,6 @@ from parallax.server.request import (
     InitialRequest,
     IntermediateRequest,
     Request,
-    RequestStatus,
 )
 from parallax.sglang.batch_info import (
     form_sgl_batch_decode,
@@ -24,6 +23,7 @@ from parallax.sglang.batch_info import (
     release_sglang_request,
 )
 from parallax.sglang.model_runner import initialize_sgl_model_runner
+from parallax.utils.shared_state import SharedState
 from parallax_utils.logging_config import get_logger
 
 logger = get_logger(__name__)
@@ -47,6 +47,9 @@ class SGLExecutor(BaseExecutor):
         # Controlling perfill / decode ratio
         max_num_tokens_per_batch: int = 1024,
         prefill_priority: int = 0,
+        batching_policy: Optional[str] = None,
+        ttft_slo_ms: float = 1000.0,
+        tpot_slo_ms: float = 100.0,
         micro_batch_ratio: int = 2,
         scheduler_wait_ms: int = 500,
         request_timeout_s: Optional[int] = 600,
@@ -80,7 +83,7 @@ class SGLExecutor(BaseExecutor):
         tp_size: Optional[int] = 1,
         nccl_port: Optional[int] = 4000,
         # Optional shared state for layer reallocation detection (when running in subprocess)
-        shared_state: Optional[dict] = None,
+        shared_state: Optional[SharedState] = None,
     ):
 
         self.enable_lora = True if lora_paths is not None else enable_lora
@@ -142,6 +145,9 @@ class SGLExecutor(BaseExecutor):
             max_sequence_length=max_sequence_length,
             max_num_tokens_per_batch=max_num_tokens_per_batch,
             prefill_priority=prefill_priority,
+            batching_policy=batching_policy,
+            ttft_slo_ms=ttft_slo_ms,
+            tpot_slo_ms=tpot_slo_ms,
             micro_batch_ratio=micro_batch_ratio,
             scheduler_wait_ms=scheduler_wait_ms,
             request_timeout_s=request_timeout_s,
@@ -288,19 +294,9 @@ class SGLExecutor(BaseExecutor):
                     else:
                         self.scheduler.enque_request(original_req)
 
-                    # detokenize and send to http server
+                    # Queue the token for the http server, sent once per step
                     if self.tp_rank == 0:
-                        req_dict = {
-                            "prompt_tokens": len(req.input_ids),
-                            "next_token_id": req.next_token_id,
-                            "rid": req.request_id,
-                        }
-                        if original_req.status == RequestStatus.FINISHED_EOS:
-                            req_dict["eos"] = True
-                        if original_req.status == RequestStatus.FINISHED_MAX_LENGTH:
-                            req_dict["length"] = True
-                        if hasattr(self, "send_to_ipc_socket"):
-                            self.send_to_ipc_socket.send_pyobj(req_dict)
+                        self._add_output_token(req, original_req)
                 else:
                     raise TypeError(f"First peer received unexpected request type: {type(req)}")
         else:
@@ -12,8 +12,8 @@ from parallax.server.request import (
     InitialRequest,
     IntermediateRequest,
     Request,
-    RequestStatus,
 )
+from parallax.utils.shared_state import SharedState
 from parallax.vllm.batch_info import (
     compute_expected_intermediate_tokens,
     form_vllm_batch_decode,
@@ -45,6 +45,9 @@ class VLLMExecutor(BaseExecutor):
         # Controlling perfill / decode ratio
         max_num_tokens_per_batch: int = 1024,
         prefill_priority: int = 0,
+        batching_policy: Optional[str] = None,
+        ttft_slo_ms: float = 1000.0,
+        tpot_slo_ms: float = 100.0,
         micro_batch_ratio: int = 2,
         scheduler_wait_ms: int = 500,
         request_timeout_s: Optional[int] = 600,
@@ -78,7 +81,7 @@ class VLLMExecutor(BaseExecutor):
         tp_size: Optional[int] = 1,
         nccl_port: Optional[int] = 4000,
         # Optional shared state for layer reallocation detection (when running in subprocess)
-        shared_state: Optional[dict] = None,
+        shared_state: Optional[SharedState] = None,
     ):
         model_runner_params = {
             "model_repo": model_repo,
@@ -119,6 +122,9 @@ class VLLMExecutor(BaseExecutor):
             max_sequence_length=max_sequence_length,
             max_num_tokens_per_batch=max_num_tokens_per_batch,
             prefill_priority=prefill_priority,
+            batching_policy=batching_policy,
+            ttft_slo_ms=ttft_slo_ms,
+            tpot_slo_ms=tpot_slo_ms,
             micro_batch_ratio=micro_batch_ratio,
             scheduler_wait_ms=scheduler_wait_ms,
             request_timeout_s=request_timeout_s,
@@ -170,19 +176,9 @@ class VLLMExecutor(BaseExecutor):
                     else:
                         self.scheduler.enque_request(original_req)
 
-                    # detokenize and send to http server
+                    # Queue the token for the http server, sent once per step
                     if self.tp_rank == 0:
-                        req_dict = {
-                            "prompt_tokens": len(req.input_ids),
-                            "next_token_id": req.next_token_id,
-                            "rid": req.request_id,
-                        }
-                        if original_req.status == RequestStatus.FINISHED_EOS:
-                            req_dict["eos"] = True
-                        if original_req.status == RequestStatus.FINISHED_MAX_LENGTH:
-                            req_dict["length"] = True
-                        if hasattr(self, "send_to_ipc_socket"):
-                            self.send_to_ipc_socket.send_pyobj(req_dict)
+                        self._add_output_token(req, original_req)
                 else:
                     raise TypeError(f"First peer received unexpected request type: {type(req)}")
         else:
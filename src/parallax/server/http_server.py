@@ -22,7 +22,7 @@ import traceback
 import uuid
 from dataclasses import dataclass, field
 from http import HTTPStatus
-from typing import Dict, Optional
+from typing import Dict, Optional, Union
 
 import fastapi
 import uvicorn
@@ -34,13 +34,24 @@ from mlx_lm.utils import load_config
 from pydantic import BaseModel
 from starlette.datastructures import State
 
+from parallax.p2p.message_util import (
+    FINISH_EOS,
+    FINISH_LENGTH,
+    FINISH_NONE,
+    TOKEN_ERROR,
+    decode_token_message,
+)
 from parallax.utils.selective_download import download_metadata_only
+from parallax.utils.stop_strings import StopStringMatcher, parse_stop_strs
 from parallax.utils.tokenizer_utils import load_detokenizer, load_tokenizer
 from parallax.utils.utils import get_zmq_socket
 from parallax_utils.logging_config import get_logger
 
 logger = get_logger(__name__)
 
+# How often waiting non-streaming requests check whether their client went away
+DISCONNECT_CHECK_INTERVAL_S = 1.0
+
 
 def get_exception_traceback():
     """Traceback function to handle asyncio function errors"""
@@ -75,15 +86,19 @@ class HTTPRequestInfo:
     create_time: float = 0.0
     update_time: float = 0.0
     logprobs: float = None
-    matched_stop: int = None
+    # EOS token id, or the stop string that ended the output
+    matched_stop: Optional[Union[int, str]] = None
     # usage
     prompt_tokens: int = 0
     completion_tokens: int = 0
     # helper
     is_finish: bool = False
+    # Set together with is_finish, awaited by non-streaming requests
+    finished: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
     # Queue for streaming tokens one by one
     token_queue: Optional[asyncio.Queue] = field(default=None, repr=False)
     detokenizer: StreamingDetokenizer = None
+    stop_matcher: Optional[StopStringMatcher] = None
     error_message: Optional[str] = None
     error_type: Optional[str] = None
     error_status: HTTPStatus = HTTPStatus.INTERNAL_SERVER_ERROR
@@ -143,6 +158,9 @@ class HTTPHandler:
         )
         if stream:
             request_info.token_queue = asyncio.Queue()
+        stop_strs = parse_stop_strs(request)
+        if stop_strs:
+            request_info.stop_matcher = StopStringMatcher(stop_strs)
         self.processing_requests[rid] = request_info
 
     def release_request(self, rid: str):
@@ -301,6 +319,7 @@ class HTTPHandler:
         request_info.error_status = status
         request_info.finish_reason = "error"
         request_info.is_finish = True
+        request_info.finished.set()
 
         if request_info.stream and request_info.token_queue is not None:
             payload = {
@@ -311,53 +330,81 @@ class HTTPHandler:
             await request_info.token_queue.put({"type": "error", "payload": payload})
             await request_info.token_queue.put(None)
 
+    async def _recv_token_messages(self):
+        """Waits for one message from the executor, then drains whatever else has arrived."""
+        messages = [await self.recv_from_executor.recv(copy=False)]
+        while True:
+            try:
+                messages.append(await self.recv_from_executor.recv(zmq.NOBLOCK, copy=False))
+            except zmq.Again:
+                return messages
+
     async def _handle_loop(self):
         """The event loop that handles returned requests"""
         while True:
-            recv_dict = await self.recv_from_executor.recv_pyobj()
-            rid = recv_dict["rid"]
-            if rid not in self.processing_requests:
-                continue
-
-            if recv_dict.get("type") == "error":
-                await self._handle_executor_error(rid, recv_dict)
-                continue
-
-            request_info = self.processing_requests[rid]
-            request_info.update_time = time.time()
-            request_info.prompt_tokens = recv_dict["prompt_tokens"]
-            next_token_id = recv_dict["next_token_id"]
-            request_info.completion_tokens += 1
-            request_info.detokenizer.add_token(next_token_id)
-            output = request_info.detokenizer.last_segment
-
-            is_finished = recv_dict.get("eos", False) or recv_dict.get("length", False)
-
-            # Only process and send non-EOS tokens
-            if not is_finished and len(output) > 0:
-                # Accumulate full text for non-streaming and potentially for logging
-                request_info.text += output
-
-                # For streaming, put the individual token into the queue.
-                if request_info.stream:
-                    await request_info.token_queue.put(output)
-
-            # If it is the end of the stream, update status and send sentinel
+            for message in await self._recv_token_messages():
+                kind, payload = decode_token_message(message)
+                if kind == TOKEN_ERROR:
+                    if payload["rid"] in self.processing_requests:
+                        await self._handle_executor_error(payload["rid"], payload)
+                    continue
+                now = time.time()
+                for rid, next_token_id, prompt_tokens, finish in payload:
+                    request_info = self.processing_requests.get(rid)
+                    # Tokens still in flight after a stop string finished the request
+                    if request_info is None or request_info.is_finish:
+                        continue
+                    request_info.update_time = now
+                    request_info.prompt_tokens = prompt_tokens
+                    self._add_token(request_info, next_token_id, finish)
+
+    def _add_token(self, request_info: HTTPRequestInfo, next_token_id: int, finish: int):
+        """Applies one generated token to its request."""
+        request_info.completion_tokens += 1
+        request_info.detokenizer.add_token(next_token_id)
+        output = request_info.detokenizer.last_segment
+
+        is_finished = finish != FINISH_NONE
+        matched_stop = None
+        stop_matcher = request_info.stop_matcher
+        if stop_matcher is not None:
             if is_finished:
-                if recv_dict.get("length", False):
-                    logger.debug(f"Request {rid} finished with length")
-                    request_info.finish_reason = "length"
-                elif recv_dict.get("eos", False):
-                    logger.debug(f"Request {rid} finished with eos")
-                    request_info.finish_reason = "eos"
-                    request_info.matched_stop = next_token_id
-                else:
-                    logger.debug(f"Request {rid} finished with unknown reason")
-                    request_info.finish_reason = "unknown"
-
-                request_info.is_finish = True
-                if request_info.stream:
-                    await request_info.token_queue.put(None)  # Sentinel for stream end
+                output = stop_matcher.flush()
+            else:
+                output, matched_stop = stop_matcher.feed(output)
+
+        # Only process and send non-EOS tokens
+        if (not is_finished or stop_matcher is not None) and len(output) > 0:
+            # Accumulate full text for non-streaming and potentially for logging
+            request_info.text += output
+
+            # For streaming, put the individual token into the queue.
+            if request_info.stream:
+                request_info.token_queue.put_nowait(output)
+
+        # If it is the end of the stream, update status and send sentinel
+        if is_finished or matched_stop is not None:
+            if matched_stop is not None:
+                # Stop the pipeline from decoding past the stop string
+                logger.debug(f"Request {request_info.id} finished with stop string")
+                request_info.finish_reason = "stop"
+                request_info.matched_stop = matched_stop
+                self.abort_request(request_info.id)
+            elif finish == FINISH_LENGTH:
+                logger.debug(f"Request {request_info.id} finished with length")
+                request_info.finish_reason = "length"
+            elif finish == FINISH_EOS:
+                logger.debug(f"Request {request_info.id} finished with eos")
+                request_info.finish_reason = "eos"
+                request_info.matched_stop = next_token_id
+            else:
+                logger.debug(f"Request {request_info.id} finished with unknown reason")
+                request_info.finish_reason = "unknown"
+
+            request_info.is_finish = True
+            request_info.finished.set()
+            if request_info.stream:
+                request_info.token_queue.put_nowait(None)  # Sentinel for stream end
 
     async def create_handle_loop(self):
         """Create asyncio event loop task function"""
@@ -402,6 +449,12 @@ async def init_app_states(
     )
 
 
+async def wait_for_disconnect(raw_request: fastapi.Request):
+    """Returns once the client of `raw_request` has disconnected."""
+    while not await raw_request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_CHECK_INTERVAL_S)
+
+
 async def v1_chat_completions(raw_request: fastapi.Request):
     """
     Handles the v1/chat/completions requests asynchronously.
@@ -436,25 +489,23 @@ async def v1_chat_completions(raw_request: fastapi.Request):
         )
     else:
         try:
-            # For non-streaming requests, we poll for completion. This is simpler
-            # than event-based synchronization and acceptable for requests that
-            # are expected to be relatively short.
-            while True:
-                # Check if client is still connected
-                if await raw_request.is_disconnected():
-                    logger.warning(f"Client disconnected for non-streaming request {request_id}")
-                    if request_id in app.state.http_handler.processing_requests:
-                        app.state.http_handler.abort_request(request_id)
-                        app.state.http_handler.release_request(request_id)
-                    return create_error_response("Client disconnected", "ClientDisconnectedError")
-
-                await asyncio.sleep(0.01)
-                req = app.state.http_handler.processing_requests.get(request_id)
-                if req is None:  # Request might have been cleaned up due to error
-                    return create_error_response("Request not found", "RequestNotFoundError")
-                is_finish = req.is_finish
-                if is_finish:
-                    break
+            # Wait for the handle loop to finish the request, while a low-frequency
+            # watcher checks whether the client is still connected
+            finished = asyncio.ensure_future(req.finished.wait())
+            disconnected = asyncio.ensure_future(wait_for_disconnect(raw_request))
+            try:
+                await asyncio.wait({finished, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                finished.cancel()
+                disconnected.cancel()
+            if not req.is_finish:
+                logger.warning(f"Client disconnected for non-streaming request {request_id}")
+                if request_id in app.state.http_handler.processing_requests:
+                    app.state.http_handler.abort_request(request_id)
+                    app.state.http_handler.release_request(request_id)
+                return create_error_response("Client disconnected", "ClientDisconnectedError")
+            if request_id not in app.state.http_handler.processing_requests:
+                return create_error_response("Request not found", "RequestNotFoundError")
             if req.error_message:
                 response = create_error_response(
                     req.error_message,
@@ -69,6 +69,16 @@ class ShardedModel(nn.Module):
             self.norm = None
             self.lm_head = None
 
+    @property
+    def supports_chunked_prefill(self) -> bool:
+        """Whether blocks can run a prefill chunk on top of an already cached prompt prefix."""
+        return getattr(self.block_class, "supports_chunked_prefill", False)
+
+    @property
+    def supports_mixed_batch(self) -> bool:
+        """Whether blocks can run prefill chunks and decodes as one flattened (ragged) row."""
+        return getattr(self.block_class, "supports_mixed_batch", False)
+
     def logits_to_tokens(
         self,
         logits: mx.array,
@@ -130,6 +140,9 @@ class ShardedModel(nn.Module):
             block_tables: (batch, max_blocks) for PagedAttention.
             context_lengths: (batch,) for PagedAttention.
             slot_mapping: (total_tokens,) for PagedAttention.
+            prefix_lens: (batch,) cached prompt tokens preceding each prefill chunk (kwargs).
+            query_lens: per-request token counts of a mixed batch flattened into
+                (1, total_tokens), which needs no mask (kwargs).
         """
         h = h_or_tokens
         target_len = h.shape[1]
@@ -141,7 +154,7 @@ class ShardedModel(nn.Module):
             if self.has_norm_in and self.norm_in:
                 h = self.norm_in(h)
 
-        if target_len > 1 and mask is None:
+        if target_len > 1 and mask is None and kwargs.get("query_lens") is None:
             raise ValueError("ShardedModel: mask cannot be None for prefill.")
 
         for _, layer_module in enumerate(self.layers):
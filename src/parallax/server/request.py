@@ -58,6 +58,7 @@ TODO:
     2. Accepts more generation configs like repetition penalties.
 """
 
+import time
 import uuid
 from enum import Enum
 from typing import Any, List, Optional
@@ -95,6 +96,7 @@ class Request:
         routing_table: Optional[List[str]] = [],
         sampling_params: Optional[SamplingParams] = None,
         lora_path: Optional[str] = None,
+        priority: int = 0,
     ):
         self.request_id = request_id or str(uuid.uuid4())
         self.status = status
@@ -108,6 +110,13 @@ class Request:
         self.last_updated_time: Optional[float] = None
         self.lora_id: Optional[str] = None
         self.lora_path = lora_path
+        # Scheduling class (higher is served first) and arrival time at this peer
+        self.priority = priority
+        self.arrival_time = time.time()
+        # Chunked prefill: prompt tokens already written to this peer's KV cache, and the
+        # number of prompt tokens scheduled for the current step (None: the whole remainder).
+        self.prefill_offset = 0
+        self.prefill_chunk_len: Optional[int] = None
 
     @property
     def is_finished(self) -> bool:
@@ -129,6 +138,18 @@ class Request:
         """Checks if the request is in the decoding stage."""
         return self.status == RequestStatus.DECODING
 
+    @property
+    def prefill_chunk_end(self) -> int:
+        """Prompt position reached once the current prefill chunk has been computed."""
+        if self.prefill_chunk_len is None:
+            return len(self.input_ids)
+        return self.prefill_offset + self.prefill_chunk_len
+
+    @property
+    def is_last_prefill_chunk(self) -> bool:
+        """Checks if the current prefill step covers the rest of the prompt."""
+        return self.prefill_chunk_end >= len(self.input_ids)
+
     def update_status(self, new_status: RequestStatus = RequestStatus.DECODING):
         """
         Update the status of the request.
@@ -158,6 +179,7 @@ class InitialRequest(Request):
         max_total_length: int = 1024,
         status: RequestStatus = RequestStatus.PREFILLING,
         lora_path: Optional[str] = None,
+        priority: int = 0,
     ):
         if not prompt and not input_ids:
             raise ValueError("prompt or input_ids cannot be empty.")
@@ -168,6 +190,7 @@ class InitialRequest(Request):
             input_ids=input_ids,
             sampling_params=sampling_params,
             lora_path=lora_path,
+            priority=priority,
         )
         self.prompt = prompt
 
@@ -262,14 +285,17 @@ class IntermediateRequest(Request):
         routing_table: Optional[List[str]] = [],
         sampling_params: Optional[SamplingParams] = None,
         lora_path: Optional[str] = None,
+        priority: int = 0,
     ):
         super().__init__(
             request_id=request_id,
             status=status,
+            prompt_len=len(input_ids) if input_ids else 0,
             routing_table=routing_table,
             input_ids=input_ids,
             sampling_params=sampling_params,
             lora_path=lora_path,
+            priority=priority,
         )
         # Hidden states from the previous peer's computation.
         # Shape:
@@ -284,6 +310,12 @@ class IntermediateRequest(Request):
         self.hidden_states = hidden_states
         self.next_token_id = next_token_id
 
+        # A prefill packet carries the hidden states of one prompt chunk ending at
+        # `current_position`; a whole-prompt prefill is simply a chunk starting at 0.
+        if self.is_prefill and hidden_states is not None and hidden_states.ndim == 2:
+            self.prefill_chunk_len = hidden_states.shape[0]
+            self.prefill_offset = current_position - self.prefill_chunk_len
+
     @property
     def input_length(self) -> int:
         """Length of the input sequence (hidden_states)."""
@@ -328,11 +360,16 @@ class IntermediateRequest(Request):
             status=initial_request.status,
             input_ids=initial_request.input_ids,
             next_token_id=next_token_id,
-            current_position=initial_request.total_length,
+            current_position=(
+                initial_request.prefill_chunk_end
+                if initial_request.is_prefill
+                else initial_request.total_length
+            ),
             hidden_states=hidden_states,
             sampling_params=initial_request.sampling_params,
             routing_table=initial_request.routing_table,
             lora_path=lora_path,
+            priority=initial_request.priority,
         )
 
     @classmethod
@@ -356,6 +393,7 @@ class IntermediateRequest(Request):
             routing_table=old_request.routing_table,
             sampling_params=old_request.sampling_params,
             lora_path=lora_path,
+            priority=old_request.priority,
         )
 
     def __repr__(self):
@@ -0,0 +1,826 @@
+"""
+JSON-schema constrained decoding for the batched sampler on the last peer.
+
+Components:
+    compile_json_schema: Compiles a schema into a character-level automaton (cached).
+    JSONSchemaAutomaton: DFA over characters, with states built lazily from an NFA.
+    TokenGrammar: Token-level view of an automaton; allowed-token masks per DFA state.
+    GrammarConstraints: Per-request automaton states, kept across steps by the executor.
+    GrammarBatchInfo: The constrained rows of one batch; masks their logits and advances
+        their states with the sampled tokens.
+
+A schema is compiled once into an NFA. DFA states (sets of NFA states) and their
+transitions are created on first use and shared by every request with the same schema.
+The allowed tokens of a DFA state are found by walking a trie of the vocabulary alongside
+the automaton, pruning every prefix the automaton rejects, and are kept as a mask, so a
+decode step costs a cached lookup instead of a vocabulary scan.
+
+Bounded repetitions (minLength/maxLength, minItems/maxItems) are unrolled, which makes a
+DFA state per position. Each of them also gets an unbounded twin that is never entered:
+a position behaves like its twin for tokens too short to reach a bound, so its mask is
+the twin's mask with only the longer tokens (and those that could leave the repetition
+too early) walked again. A vocabulary walk is then paid once per repetition, not once per
+position.
+
+Supported keywords: type (incl. lists), properties, required, items, minItems, maxItems,
+minLength, maxLength, enum, const, anyOf, oneOf, $ref to local $defs/definitions, and
+empty schemas (any JSON value up to a nesting depth). Properties are generated in schema
+order and whitespace is limited to a single optional space between tokens.
+"""
+
+import dataclasses
+import json
+import math
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Sequence, Set, Tuple
+
+import mlx.core as mx
+import numpy as np
+
+from parallax.server.request import Request
+
+DEAD_STATE = -1
+# Nesting depth of values allowed by schemas that leave them unconstrained
+ANY_VALUE_DEPTH = 3
+MAX_CACHED_GRAMMARS = 32
+# Per-state token masks kept across the grammars of the last peer, one vocab-sized bool
+# array each (about 38 MB for a 150k vocabulary)
+MAX_CACHED_MASKS = 256
+
+# (chars, negated): matches `ch` iff (ch in chars) != negated
+CharClass = Tuple[FrozenSet[str], bool]
+# Builds the states of a fragment in front of a continuation state; returns its start
+Builder = Callable[["_NFA", int], int]
+
+
+@dataclasses.dataclass
+class _Repeat:
+    """A bounded repetition unrolled into the NFA"""
+
+    min_count: int
+    max_count: Optional[int]
+    # Fewest characters one iteration takes
+    item_chars: int
+    # Characters that may follow the repetition, or None if any character may
+    exit_chars: Optional[FrozenSet[str]]
+
+
+class _NFA:
+    """Thompson-style NFA with character class edges"""
+
+    def __init__(self):
+        self.edges: List[List[Tuple[CharClass, int]]] = []
+        self.epsilons: List[List[int]] = []
+        self.repeats: List[_Repeat] = []
+        # States of unrolled iterations -> the same state of their unbounded twin
+        self.twins: Dict[int, int] = {}
+        # State -> (repeat, iterations done at the end of the current one, fewest
+        # characters to that end) for every unrolled iteration the state is part of
+        self.iterations: Dict[int, List[Tuple[int, int, int]]] = {}
+
+    def new_state(self) -> int:
+        self.edges.append([])
+        self.epsilons.append([])
+        return len(self.edges) - 1
+
+
+def _chars(chars: str, negated: bool = False) -> Builder:
+    char_class = (frozenset(chars), negated)
+
+    def build(nfa: _NFA, cont: int) -> int:
+        start = nfa.new_state()
+        nfa.edges[start].append((char_class, cont))
+        return start
+
+    return build
+
+
+def _lit(text: str) -> Builder:
+    return _seq(*[_chars(ch) for ch in text])
+
+
+def _seq(*builders: Builder) -> Builder:
+    def build(nfa: _NFA, cont: int) -> int:
+        for builder in reversed(builders):
+            cont = builder(nfa, cont)
+        return cont
+
+    return build
+
+
+def _alt(*builders: Builder) -> Builder:
+    def build(nfa: _NFA, cont: int) -> int:
+        start = nfa.new_state()
+        nfa.epsilons[start].extend(builder(nfa, cont) for builder in builders)
+        return start
+
+    return build
+
+
+def _opt(builder: Builder) -> Builder:
+    return _alt(builder, _seq())
+
+
+def _star(builder: Builder) -> Builder:
+    def build(nfa: _NFA, cont: int) -> int:
+        loop = nfa.new_state()
+        nfa.epsilons[loop].extend([cont, builder(nfa, loop)])
+        return loop
+
+    return build
+
+
+def _repeat(builder: Builder, min_count: int, max_count: Optional[int]) -> Builder:
+    """`builder` repeated min_count to max_count (None: unbounded) times.
+
+    Iterations are unrolled up to the bounds, followed by the unbounded loop if there is
+    no maximum. The loop is also built on its own as the twin of the unrolled iterations
+    (see `JSONSchemaAutomaton.relax`).
+    """
+    if min_count == 0 and max_count is None:
+        return _star(builder)
+
+    def build(nfa: _NFA, cont: int) -> int:
+        twin = _star(builder)(nfa, cont)
+        body_size = len(nfa.edges) - twin - 1
+        repeat = len(nfa.repeats)
+        nfa.repeats.append(_Repeat(min_count, max_count, 0, _first_chars(nfa, cont)))
+
+        def iteration(done: int, end: int) -> int:
+            first = len(nfa.edges)
+            start = builder(nfa, end)
+            assert len(nfa.edges) - first == body_size, "Builders must be deterministic"
+            chars_to_end = _chars_to(nfa, range(first, len(nfa.edges)), end)
+            for state in range(first, len(nfa.edges)):
+                nfa.twins[state] = twin + 1 + state - first
+                if state in chars_to_end:
+                    nfa.iterations.setdefault(state, []).append(
+                        (repeat, done + 1, chars_to_end[state])
+                    )
+            nfa.repeats[repeat].item_chars = chars_to_end[start]
+            return start
+
+        # Built back to front: optional iterations offer leaving before each of them
+        state = cont if max_count is not None else twin
+        for done in reversed(range(min_count, max_count if max_count is not None else 0)):
+            start = iteration(done, state)
+            state = nfa.new_state()
+            nfa.epsilons[state].extend([start, cont])
+            nfa.twins[state] = twin
+            nfa.iterations[state] = [(repeat, done, 0)]
+        for done in reversed(range(min_count)):
+            state = iteration(done, state)
+        return state
+
+    return build
+
+
+def _first_chars(nfa: _NFA, state: int) -> Optional[FrozenSet[str]]:
+    """Characters that can be read first from `state`, or None if any character can."""
+    chars: Set[str] = set()
+    seen, stack = {state}, [state]
+    while stack:
+        current = stack.pop()
+        for (char_class, negated), _ in nfa.edges[current]:
+            if negated:
+                return None
+            chars |= char_class
+        for nxt in nfa.epsilons[current]:
+            if nxt not in seen:
+                seen.add(nxt)
+                stack.append(nxt)
+    return frozenset(chars)
+
+
+def _chars_to(nfa: _NFA, states: range, end: int) -> Dict[int, int]:
+    """Fewest characters from each of `states` to `end` (0-1 BFS over reversed edges)."""
+    reverse: Dict[int, List[Tuple[int, int]]] = {}
+    for state in states:
+        for _, target in nfa.edges[state]:
+            reverse.setdefault(target, []).append((state, 1))
+        for target in nfa.epsilons[state]:
+            reverse.setdefault(target, []).append((state, 0))
+    distances = {end: 0}
+    queue = deque([end])
+    while queue:
+        state = queue.popleft()
+        for prev, cost in reverse.get(state, []):
+            distance = distances[state] + cost
+            if distance < distances.get(prev, distance + 1):
+                distances[prev] = distance
+                if cost:
+                    queue.append(prev)
+                else:
+                    queue.appendleft(prev)
+    return distances
+
+
+def _separated(
+    item: Builder, separator: Builder, min_count: int, max_count: Optional[int]
+) -> Builder:
+    """min_count to max_count items with a separator between consecutive items."""
+    if max_count == 0:
+        return _seq()
+    rest_max = None if max_count is None else max_count - 1
+    items = _seq(item, _repeat(_seq(separator, item), max(min_count - 1, 0), rest_max))
+    return items if min_count > 0 else _opt(items)
+
+
+_WS = _opt(_lit(" "))
+_DIGITS = "0123456789"
+_INTEGER = _seq(_opt(_lit("-")), _alt(_lit("0"), _seq(_chars("123456789"), _star(_chars(_DIGITS)))))
+_NUMBER = _seq(
+    _INTEGER,
+    _opt(_seq(_lit("."), _chars(_DIGITS), _star(_chars(_DIGITS)))),
+    _opt(_seq(_chars("eE"), _opt(_chars("+-")), _chars(_DIGITS), _star(_chars(_DIGITS)))),
+)
+_STRING_CHAR = _alt(
+    _chars('"\\' + "".join(chr(i) for i in range(0x20)), negated=True),
+    _seq(
+        _lit("\\"),
+        _alt(_chars('"\\/bfnrt'), _seq(_lit("u"), *[_chars("0123456789abcdefABCDEF")] * 4)),
+    ),
+)
+
+
+def _string(min_length: int = 0, max_length: Optional[int] = None) -> Builder:
+    return _seq(_lit('"'), _repeat(_STRING_CHAR, min_length, max_length), _lit('"'))
+
+
+def _literal_values(values: Sequence[Any]) -> Builder:
+    return _alt(*[_lit(json.dumps(value, ensure_ascii=False)) for value in values])
+
+
+class _SchemaCompiler:
+    """Turns a JSON schema into NFA builders"""
+
+    def __init__(self, root: Dict[str, Any]):
+        self.root = root
+        self.ref_depth = 0
+
+    def value(self, schema: Any, depth: int = ANY_VALUE_DEPTH) -> Builder:
+        if schema is True or schema == {}:
+            return self.any_value(depth)
+        if not isinstance(schema, dict):
+            raise ValueError(f"Unsupported JSON schema: {schema!r}")
+        for keyword in ("pattern", "allOf", "not", "if", "patternProperties"):
+            if keyword in schema:
+                raise ValueError(f"Unsupported JSON schema keyword: {keyword}")
+
+        if "$ref" in schema:
+            return self.ref(schema["$ref"], depth)
+        if "const" in schema:
+            return _literal_values([schema["const"]])
+        if "enum" in schema:
+            return _literal_values(schema["enum"])
+        for keyword in ("anyOf", "oneOf"):
+            if keyword in schema:
+                return _alt(*[self.value(option, depth) for option in schema[keyword]])
+
+        schema_type = schema.get("type")
+        if isinstance(schema_type, list):
+            return _alt(*[self.value({**schema, "type": t}, depth) for t in schema_type])
+        if schema_type is None:
+            if "properties" in schema:
+                schema_type = "object"
+            elif "items" in schema:
+                schema_type = "array"
+            else:
+                return self.any_value(depth)
+
+        if schema_type == "object":
+            return self.object(schema, depth)
+        if schema_type == "array":
+            items = schema.get("items", {})
+            return _seq(
+                _lit("["),
+                _WS,
+                _separated(
+                    self.value(items, depth - 1),
+                    _seq(_WS, _lit(","), _WS),
+                    schema.get("minItems", 0),
+                    schema.get("maxItems"),
+                ),
+                _WS,
+                _lit("]"),
+            )
+        if schema_type == "string":
+            return _string(schema.get("minLength", 0), schema.get("maxLength"))
+        if schema_type == "integer":
+            return _INTEGER
+        if schema_type == "number":
+            return _NUMBER
+        if schema_type == "boolean":
+            return _alt(_lit("true"), _lit("false"))
+        if schema_type == "null":
+            return _lit("null")
+        raise ValueError(f"Unsupported JSON schema type: {schema_type!r}")
+
+    def ref(self, ref: str, depth: int) -> Builder:
+        if not ref.startswith("#/"):
+            raise ValueError(f"Only local JSON schema references are supported: {ref}")
+        target = self.root
+        for part in ref[2:].split("/"):
+            target = target[part.replace("~1", "/").replace("~0", "~")]
+        # Recursive schemas are unrolled up to the nesting depth
+        if self.ref_depth >= ANY_VALUE_DEPTH:
+            return _lit("null")
+        self.ref_depth += 1
+        try:
+            return self.value(target, depth)
+        finally:
+            self.ref_depth -= 1
+
+    def object(self, schema: Dict[str, Any], depth: int) -> Builder:
+        properties = schema.get("properties")
+        if not properties:
+            return self.any_object(depth)
+        required = set(schema.get("required", []))
+        members = [
+            (
+                _seq(
+                    _lit(json.dumps(name, ensure_ascii=False)),
+                    _WS,
+                    _lit(":"),
+                    _WS,
+                    self.value(prop, depth - 1),
+                ),
+                name in required,
+            )
+            for name, prop in properties.items()
+        ]
+        separator = _seq(_WS, _lit(","), _WS)
+
+        def build(nfa: _NFA, cont: int) -> int:
+            # after[i]/first[i]: members from i on, with/without a member emitted before
+            end = _seq(_WS, _lit("}"))(nfa, cont)
+            after = first = end
+            for member, is_required in reversed(members):
+                next_after = nfa.new_state()
+                nfa.epsilons[next_after].append(_seq(separator, member)(nfa, after))
+                next_first = nfa.new_state()
+                nfa.epsilons[next_first].append(member(nfa, after))
+                if not is_required:
+                    nfa.epsilons[next_after].append(after)
+                    nfa.epsilons[next_first].append(first)
+                after, first = next_after, next_first
+            return _seq(_lit("{"), _WS)(nfa, first)
+
+        return build
+
+    def any_object(self, depth: int) -> Builder:
+        member = _seq(_string(), _WS, _lit(":"), _WS, self.any_value(depth - 1))
+        return _seq(
+            _lit("{"), _WS, _separated(member, _seq(_WS, _lit(","), _WS), 0, None), _WS, _lit("}")
+        )
+
+    def any_value(self, depth: int) -> Builder:
+        scalars = [_string(), _NUMBER, _literal_values([True, False, None])]
+        if depth <= 0:
+            return _alt(*scalars)
+        array = _seq(
+            _lit("["),
+            _WS,
+            _separated(self.any_value(depth - 1), _seq(_WS, _lit(","), _WS), 0, None),
+            _WS,
+            _lit("]"),
+        )
+        return _alt(*scalars, self.any_object(depth), array)
+
+
+class JSONSchemaAutomaton:
+    """Character-level DFA accepting the JSON documents valid under a schema."""
+
+    def __init__(self, schema: Dict[str, Any]):
+        self.nfa = _NFA()
+        self.final = self.nfa.new_state()
+        start = _seq(_WS, _SchemaCompiler(schema).value(schema), _WS)(self.nfa, self.final)
+
+        self._state_ids: Dict[FrozenSet[int], int] = {}
+        self._states: List[FrozenSet[int]] = []
+        self._transitions: List[Dict[str, int]] = []
+        self._relaxations: Dict[int, Optional[Relaxation]] = {}
+        self.accepting: List[bool] = []
+        self.start = self._state_id(self._closure([start]))
+
+    def _closure(self, states: Sequence[int]) -> FrozenSet[int]:
+        seen: Set[int] = set(states)
+        stack = list(states)
+        while stack:
+            for nxt in self.nfa.epsilons[stack.pop()]:
+                if nxt not in seen:
+                    seen.add(nxt)
+                    stack.append(nxt)
+        return frozenset(seen)
+
+    def _state_id(self, states: FrozenSet[int]) -> int:
+        state = self._state_ids.get(states)
+        if state is None:
+            state = len(self._states)
+            self._state_ids[states] = state
+            self._states.append(states)
+            self._transitions.append({})
+            self.accepting.append(self.final in states)
+        return state
+
+    def step(self, state: int, ch: str) -> int:
+        """The state after reading `ch` in `state`, or DEAD_STATE."""
+        if state == DEAD_STATE:
+            return DEAD_STATE
+        transitions = self._transitions[state]
+        nxt = transitions.get(ch)
+        if nxt is None:
+            targets = [
+                target
+                for nfa_state in self._states[state]
+                for (chars, negated), target in self.nfa.edges[nfa_state]
+                if (ch in chars) != negated
+            ]
+            nxt = self._state_id(self._closure(targets)) if targets else DEAD_STATE
+            transitions[ch] = nxt
+        return nxt
+
+    def walk(self, state: int, text: str) -> int:
+        for ch in text:
+            state = self.step(state, ch)
+            if state == DEAD_STATE:
+                break
+        return state
+
+    def relax(self, state: int) -> Optional["Relaxation"]:
+        """The state with its bounded repetitions unbounded, or None if it is inside none.
+
+        Reading text from `state` and from the relaxed state ends up in a dead state alike,
+        unless the text is at least `max_horizon` characters long, or at least
+        `min_horizon` long and contains one of `exit_chars` (None: any character).
+        """
+        if state in self._relaxations:
+            return self._relaxations[state]
+        nfa = self.nfa
+        max_horizon = min_horizon = math.inf
+        exit_chars: Optional[Set[str]] = set()
+        for nfa_state in self._states[state]:
+            for repeat_index, done, chars_to_end in nfa.iterations.get(nfa_state, []):
+                repeat = nfa.repeats[repeat_index]
+                if repeat.max_count is not None:
+                    # The twin may start another iteration once the maximum is done
+                    chars = chars_to_end + (repeat.max_count - done) * repeat.item_chars + 1
+                    max_horizon = min(max_horizon, chars)
+                if done < repeat.min_count:
+                    # The twin may leave after this iteration, the minimum not being done
+                    min_horizon = min(min_horizon, chars_to_end + 1)
+                    if exit_chars is not None and repeat.exit_chars is not None:
+                        exit_chars |= repeat.exit_chars
+                    else:
+                        exit_chars = None
+        relaxation = None
+        if max_horizon != math.inf or min_horizon != math.inf:
+            relaxation = Relaxation(
+                state=self._state_id(self._free_closure(self._states[state])),
+                max_horizon=max_horizon,
+                min_horizon=min_horizon,
+                exit_chars=None if exit_chars is None else frozenset(exit_chars),
+            )
+        self._relaxations[state] = relaxation
+        return relaxation
+
+    def _free_closure(self, states: Sequence[int]) -> FrozenSet[int]:
+        """Epsilon closure that replaces every state of a bounded repetition by its twin.
+
+        Mapping while following epsilons keeps the closure from re-entering the unrolled
+        iterations of a repetition that starts at one of the states, so the result never
+        relaxes any further.
+        """
+        nfa = self.nfa
+        seen: Set[int] = set()
+        stack = list(states)
+        while stack:
+            nfa_state = stack.pop()
+            while nfa_state in nfa.twins:
+                nfa_state = nfa.twins[nfa_state]
+            if nfa_state not in seen:
+                seen.add(nfa_state)
+                stack.extend(nfa.epsilons[nfa_state])
+        return frozenset(seen)
+
+
+@dataclasses.dataclass
+class Relaxation:
+    """A DFA state without bounds on its repetitions, see `JSONSchemaAutomaton.relax`"""
+
+    state: int
+    max_horizon: float
+    min_horizon: float
+    exit_chars: Optional[FrozenSet[str]]
+
+
+@lru_cache(maxsize=MAX_CACHED_GRAMMARS)
+def compile_json_schema(json_schema: str) -> JSONSchemaAutomaton:
+    """Compiles a JSON schema string; raises ValueError if it is invalid or unsupported."""
+    try:
+        schema = json.loads(json_schema)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"json_schema is not valid JSON: {e}") from e
+    return JSONSchemaAutomaton(schema)
+
+
+def parse_json_schema(raw_request: Dict) -> Optional[str]:
+    """JSON schema of a chat completion request as a string, or None if unconstrained.
+
+    Accepts `json_schema` in the request's `sampling_params`, or an OpenAI
+    `response_format` of type json_schema or json_object.
+    """
+    schema = (raw_request.get("sampling_params") or {}).get("json_schema")
+    response_format = raw_request.get("response_format") or {}
+    if schema is None and response_format.get("type") == "json_schema":
+        schema = (response_format.get("json_schema") or {}).get("schema", {})
+    elif schema is None and response_format.get("type") == "json_object":
+        schema = {"type": "object"}
+    if schema is None or isinstance(schema, str):
+        return schema
+    return json.dumps(schema)
+
+
+class _TokenTrie:
+    """Prefix tree over the text of the vocabulary"""
+
+    def __init__(self, token_strings: Sequence[Optional[str]]):
+        self.token_strings = token_strings
+        self.token_lengths = np.array([len(text or "") for text in token_strings])
+        self._containing: Dict[str, np.ndarray] = {}
+        # Per node: children by character, and the token ids ending there
+        self.children: List[Dict[str, int]] = [{}]
+        self.token_ids: List[List[int]] = [[]]
+        for token_id, text in enumerate(token_strings):
+            if not text:
+                continue
+            node = 0
+            for ch in text:
+                child = self.children[node].get(ch)
+                if child is None:
+                    child = len(self.children)
+                    self.children[node][ch] = child
+                    self.children.append({})
+                    self.token_ids.append([])
+                node = child
+            self.token_ids[node].append(token_id)
+
+    def containing(self, chars: FrozenSet[str]) -> np.ndarray:
+        """Which tokens contain any of `chars`"""
+        found = np.zeros(len(self.token_strings), dtype=np.bool_)
+        for ch in chars:
+            if ch not in self._containing:
+                self._containing[ch] = np.array(
+                    [bool(text) and ch in text for text in self.token_strings]
+                )
+            found |= self._containing[ch]
+        return found
+
+
+class _MaskCache:
+    """LRU of per-state token masks, shared by the grammars of the last peer"""
+
+    def __init__(self, max_masks: int = MAX_CACHED_MASKS):
+        self.max_masks = max_masks
+        self._masks: "OrderedDict[Tuple[Any, ...], np.ndarray]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._masks)
+
+    def get(self, key: Tuple[Any, ...]) -> Optional[np.ndarray]:
+        mask = self._masks.get(key)
+        if mask is not None:
+            self._masks.move_to_end(key)
+        return mask
+
+    def put(self, key: Tuple[Any, ...], mask: np.ndarray) -> None:
+        self._masks[key] = mask
+        if len(self._masks) > self.max_masks:
+            self._masks.popitem(last=False)
+
+
+class TokenGrammar:
+    """Allowed tokens per DFA state of one automaton, shared by its requests."""
+
+    def __init__(
+        self,
+        automaton: JSONSchemaAutomaton,
+        trie: _TokenTrie,
+        token_strings: Sequence[Optional[str]],
+        eos_token_ids: Sequence[int],
+        mask_cache: Optional[_MaskCache] = None,
+    ):
+        self.automaton = automaton
+        self.trie = trie
+        self.token_strings = token_strings
+        self.eos_token_ids = list(eos_token_ids)
+        self._masks = mask_cache if mask_cache is not None else _MaskCache()
+
+    def allowed_token_ids(self, state: int) -> List[int]:
+        """Tokens whose text keeps the automaton alive; EOS once the document is complete."""
+        return np.flatnonzero(self.mask(state, len(self.token_strings))).tolist()
+
+    def _walk_trie(self, state: int) -> np.ndarray:
+        """Which tokens keep the automaton alive from `state`, by a walk of the whole trie"""
+        alive = np.zeros(len(self.token_strings), dtype=np.bool_)
+        stack = [(0, state)]
+        while stack:
+            node, node_state = stack.pop()
+            for ch, child in self.trie.children[node].items():
+                child_state = self.automaton.step(node_state, ch)
+                if child_state == DEAD_STATE:
+                    continue
+                alive[self.trie.token_ids[child]] = True
+                stack.append((child, child_state))
+        return alive
+
+    def _alive(self, state: int) -> np.ndarray:
+        """Which tokens keep the automaton alive from `state` (cached)"""
+        key = (self, state)
+        alive = self._masks.get(key)
+        if alive is not None:
+            return alive
+        relaxation = self.automaton.relax(state)
+        if relaxation is None:
+            alive = self._walk_trie(state)
+        else:
+            # Only tokens long enough to run into a bound can tell the state from its twin
+            alive = self._alive(relaxation.state).copy()
+            lengths = self.trie.token_lengths
+            recheck = lengths >= relaxation.max_horizon
+            if relaxation.min_horizon != math.inf:
+                leaving = lengths >= relaxation.min_horizon
+                if relaxation.exit_chars is not None:
+                    leaving &= self.trie.containing(relaxation.exit_chars)
+                recheck |= leaving
+            for token_id in np.flatnonzero(alive & recheck).tolist():
+                if self.automaton.walk(state, self.token_strings[token_id]) == DEAD_STATE:
+                    alive[token_id] = False
+        self._masks.put(key, alive)
+        return alive
+
+    def mask(self, state: int, vocab_size: int) -> np.ndarray:
+        """Tokens allowed next; EOS once the document is complete or when nothing fits."""
+        mask = np.zeros(vocab_size, dtype=np.bool_)
+        if state != DEAD_STATE:
+            alive = self._alive(state)[:vocab_size]
+            mask[: len(alive)] = alive
+        if state == DEAD_STATE or self.automaton.accepting[state] or not mask.any():
+            # Nothing fits e.g. when the vocabulary cannot spell the next character
+            mask[[i for i in self.eos_token_ids if i < vocab_size]] = True
+        return mask
+
+    def advance(self, state: int, token_id: int) -> int:
+        if token_id in self.eos_token_ids:
+            return state
+        text = self.token_strings[token_id] if token_id < len(self.token_strings) else None
+        return self.automaton.walk(state, text) if text else DEAD_STATE
+
+
+@dataclasses.dataclass
+class GrammarBatchInfo:
+    """Constrained rows of a batch and the automaton states of their requests"""
+
+    constraints: "GrammarConstraints"
+    rows: List[int]
+    request_ids: List[str]
+    grammars: List[TokenGrammar]
+
+    def apply(self, logits: mx.array) -> mx.array:
+        """Sets the logits of tokens the schema does not allow next to -inf."""
+        vocab_size = logits.shape[-1]
+        states = self.constraints.states
+        masks = mx.array(
+            np.stack(
+                [g.mask(states[rid], vocab_size) for g, rid in zip(self.grammars, self.request_ids)]
+            )
+        )
+        rows = mx.array(self.rows, dtype=mx.int32)
+        logits = mx.array(logits)
+        logits[rows] = mx.where(masks, logits[rows], mx.array(-float("inf"), logits.dtype))
+        return logits
+
+    def record(self, next_token_ids: mx.array) -> None:
+        """Advances the automaton states with the sampled tokens."""
+        tokens = next_token_ids.reshape(-1)[mx.array(self.rows, dtype=mx.int32)].tolist()
+        states = self.constraints.states
+        for grammar, rid, token_id in zip(self.grammars, self.request_ids, tokens):
+            states[rid] = grammar.advance(states[rid], token_id)
+
+
+class GrammarConstraints:
+    """Automaton states of the schema-constrained requests on the last peer."""
+
+    def __init__(self, tokenizer: Any, eos_token_ids: Optional[Sequence[int]] = None):
+        self.tokenizer = tokenizer
+        # Resolved from the tokenizer on the first constrained request
+        self.eos_token_ids = eos_token_ids
+        self.states: Dict[str, int] = {}
+        self._request_grammars: Dict[str, TokenGrammar] = {}
+        self._grammars: "OrderedDict[str, TokenGrammar]" = OrderedDict()
+        self._token_strings: Optional[List[Optional[str]]] = None
+        self._trie: Optional[_TokenTrie] = None
+        self._masks = _MaskCache()
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def prepare(self, reqs: List[Request]) -> Optional[GrammarBatchInfo]:
+        """Returns the constrained rows of a batch, or None if no request has a schema.
+
+        Rows of prompt chunks that do not end the prompt produce no token and are left out.
+        """
+        rows, request_ids, grammars = [], [], []
+        for i, req in enumerate(reqs):
+            params = req.sampling_params
+            if params is None or not params.json_schema:
+                continue
+            if req.is_prefill and not req.is_last_prefill_chunk:
+                continue
+            grammar = self._request_grammars.get(req.request_id)
+            if grammar is None:
+                grammar = self._grammar(params.json_schema)
+                self._request_grammars[req.request_id] = grammar
+                self.states[req.request_id] = grammar.automaton.start
+            rows.append(i)
+            request_ids.append(req.request_id)
+            grammars.append(grammar)
+        if not rows:
+            return None
+        return GrammarBatchInfo(self, rows, request_ids, grammars)
+
+    def release(self, request_id: str) -> None:
+        """Drops the state of a finished or aborted request."""
+        self.states.pop(request_id, None)
+        self._request_grammars.pop(request_id, None)
+
+    def _grammar(self, json_schema: str) -> TokenGrammar:
+        grammar = self._grammars.get(json_schema)
+        if grammar is not None:
+            self._grammars.move_to_end(json_schema)
+            return grammar
+        if self._trie is None:
+            if self.eos_token_ids is None:
+                self.eos_token_ids = sorted(
+                    getattr(self.tokenizer, "eos_token_ids", None) or [self.tokenizer.eos_token_id]
+                )
+            self._token_strings = get_token_strings(self.tokenizer)
+            self._trie = _TokenTrie(self._token_strings)
+        grammar = TokenGrammar(
+            compile_json_schema(json_schema),
+            self._trie,
+            self._token_strings,
+            self.eos_token_ids,
+            self._masks,
+        )
+        self._grammars[json_schema] = grammar
+        if len(self._grammars) > MAX_CACHED_GRAMMARS:
+            self._grammars.popitem(last=False)
+        return grammar
+
+
+def _byte_level_decoder() -> Dict[str, int]:
+    """Inverse of the GPT-2 byte to unicode mapping used by byte-level BPE vocabularies"""
+    mapping, num_shifted = {}, 0
+    for b in range(256):
+        if ord("!") <= b <= ord("~") or ord("¡") <= b <= ord("¬") or ord("®") <= b <= ord("ÿ"):
+            mapping[chr(b)] = b
+        else:
+            # Other bytes are mapped to 256, 257, ... in order
+            mapping[chr(256 + num_shifted)] = b
+            num_shifted += 1
+    return mapping
+
+
+def get_token_strings(tokenizer: Any) -> List[Optional[str]]:
+    """Text each token id adds to the output; None for special tokens and for tokens that
+    are not valid UTF-8 on their own (byte fallback pieces of multi-byte characters)."""
+    vocab = tokenizer.get_vocab()
+    special_ids = set(getattr(tokenizer, "all_special_ids", []) or [])
+    tokens = sorted(vocab.items(), key=lambda item: item[1])
+    byte_decoder = _byte_level_decoder()
+    byte_level = any(token.startswith("Ġ") for token, _ in tokens)
+    sentencepiece = not byte_level and any(token.startswith("▁") for token, _ in tokens)
+
+    strings: List[Optional[str]] = [None] * (max(vocab.values()) + 1)
+    for token, token_id in tokens:
+        if token_id in special_ids:
+            continue
+        if byte_level:
+            if any(ch not in byte_decoder for ch in token):
+                continue
+            data = bytes(byte_decoder[ch] for ch in token)
+        elif sentencepiece:
+            if len(token) == 6 and token.startswith("<0x") and token.endswith(">"):
+                data = bytes([int(token[3:5], 16)])
+            else:
+                data = token.replace("▁", " ").encode("utf-8")
+        else:
+            strings[token_id] = tokenizer.decode([token_id]) or None
+            continue
+        try:
+            strings[token_id] = data.decode("utf-8")
+        except UnicodeDecodeError:
+            pass
+    return strings
@@ -0,0 +1,165 @@
+"""
+Repetition, presence and frequency penalties for batched sampling on the last peer.
+
+Components:
+    Penalizer: Per-request token statistics, kept across steps by the executor.
+    PenaltyBatchInfo: The penalized rows of one batch; applies the penalties to logits and
+        records the sampled tokens.
+
+Each penalized request owns a row of two (capacity, vocab_size) buffers: how often every
+token was generated so far, and which tokens occur in the prompt. Sampled tokens are
+added with one scatter per step, and a batch is penalized with one gather of its rows and
+elementwise ops, so the cost of a step grows with the batch size but not with the output
+length.
+"""
+
+import dataclasses
+from typing import Dict, List, Optional
+
+import mlx.core as mx
+
+from parallax.server.request import Request
+from parallax.server.sampling.sampling_params import SamplingParams
+
+
+def needs_penalties(params: SamplingParams) -> bool:
+    """Whether any of the penalties of a request changes the logits."""
+    return (
+        params.repetition_penalty != 1.0
+        or params.presence_penalty != 0.0
+        or params.frequency_penalty != 0.0
+    )
+
+
+@dataclasses.dataclass
+class PenaltyBatchInfo:
+    """Penalized rows of a batch and their penalties"""
+
+    penalizer: "Penalizer"
+    # Rows of the batch with penalties, and their rows in the penalizer's buffers
+    rows: mx.array
+    slots: mx.array
+    # Shape (num_rows, 1)
+    repetition_penalties: mx.array
+    presence_penalties: mx.array
+    frequency_penalties: mx.array
+
+    def apply(self, logits: mx.array) -> mx.array:
+        """Penalizes the logits of the batch.
+
+        Tokens seen in the prompt or the output have positive logits divided by and
+        negative logits multiplied by the repetition penalty. Generated tokens then lose
+        the presence penalty once and the frequency penalty per occurrence.
+        """
+        self.penalizer.ensure_buffers(logits.shape[-1])
+        counts = self.penalizer.output_counts[self.slots]
+        generated = counts > 0
+        repeated = generated | self.penalizer.prompt_mask[self.slots]
+        rows = logits[self.rows].astype(mx.float32)
+        rp = self.repetition_penalties
+        rows = mx.where(repeated, mx.where(rows > 0, rows / rp, rows * rp), rows)
+        rows = rows - self.frequency_penalties * counts - self.presence_penalties * generated
+        # Leaves the caller's logits untouched
+        logits = mx.array(logits)
+        logits[self.rows] = rows.astype(logits.dtype)
+        return logits
+
+    def record(self, next_token_ids: mx.array) -> None:
+        """Counts the tokens sampled for the penalized rows."""
+        tokens = next_token_ids.reshape(-1)[self.rows]
+        penalizer = self.penalizer
+        penalizer.output_counts = penalizer.output_counts.at[self.slots, tokens].add(1)
+
+
+class Penalizer:
+    """Token statistics of the penalized requests on the last peer."""
+
+    def __init__(self, initial_capacity: int = 8):
+        self.capacity = initial_capacity
+        # (capacity, vocab_size); allocated once the vocabulary size is known
+        self.output_counts: Optional[mx.array] = None
+        self.prompt_mask: Optional[mx.array] = None
+        self._slots: Dict[str, int] = {}
+        self._free_slots: List[int] = []
+        # Slots (re)assigned since the last step, with the prompt to write into them
+        self._pending_prompts: Dict[int, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def prepare(self, reqs: List[Request]) -> Optional[PenaltyBatchInfo]:
+        """Returns the penalized rows of a batch, or None if no request has penalties.
+
+        Requests are assigned a slot the first time they are sampled. Rows of prompt
+        chunks that do not end the prompt produce no token and are left out.
+        """
+        rows, slots, repetition, presence, frequency = [], [], [], [], []
+        for i, req in enumerate(reqs):
+            params = req.sampling_params
+            if params is None or not needs_penalties(params):
+                continue
+            if req.is_prefill and not req.is_last_prefill_chunk:
+                continue
+            slot = self._slots.get(req.request_id)
+            if slot is None:
+                slot = self._assign_slot(req)
+            rows.append(i)
+            slots.append(slot)
+            repetition.append(params.repetition_penalty)
+            presence.append(params.presence_penalty)
+            frequency.append(params.frequency_penalty)
+        if not rows:
+            return None
+        return PenaltyBatchInfo(
+            penalizer=self,
+            rows=mx.array(rows, dtype=mx.int32),
+            slots=mx.array(slots, dtype=mx.int32),
+            repetition_penalties=mx.array(repetition, dtype=mx.float32).reshape(-1, 1),
+            presence_penalties=mx.array(presence, dtype=mx.float32).reshape(-1, 1),
+            frequency_penalties=mx.array(frequency, dtype=mx.float32).reshape(-1, 1),
+        )
+
+    def release(self, request_id: str) -> None:
+        """Frees the slot of a finished or aborted request."""
+        slot = self._slots.pop(request_id, None)
+        if slot is not None:
+            self._pending_prompts.pop(slot, None)
+            self._free_slots.append(slot)
+
+    def _assign_slot(self, req: Request) -> int:
+        if self._free_slots:
+            slot = self._free_slots.pop()
+        else:
+            slot = len(self._slots)
+            if slot >= self.capacity:
+                self.capacity *= 2
+        self._slots[req.request_id] = slot
+        self._pending_prompts[slot] = list(req.input_ids or [])
+        return slot
+
+    def ensure_buffers(self, vocab_size: int) -> None:
+        """Allocates or grows the buffers and initializes newly assigned slots."""
+        if self.output_counts is None or self.output_counts.shape[1] != vocab_size:
+            self.output_counts = mx.zeros((self.capacity, vocab_size), dtype=mx.int32)
+            self.prompt_mask = mx.zeros((self.capacity, vocab_size), dtype=mx.bool_)
+        elif self.output_counts.shape[0] < self.capacity:
+            extra = self.capacity - self.output_counts.shape[0]
+            self.output_counts = mx.concatenate(
+                [self.output_counts, mx.zeros((extra, vocab_size), dtype=mx.int32)]
+            )
+            self.prompt_mask = mx.concatenate(
+                [self.prompt_mask, mx.zeros((extra, vocab_size), dtype=mx.bool_)]
+            )
+        if not self._pending_prompts:
+            return
+
+        new_slots = mx.array(list(self._pending_prompts), dtype=mx.int32)
+        self.output_counts[new_slots] = 0
+        self.prompt_mask[new_slots] = False
+        prompt_slots = [s for s, ids in self._pending_prompts.items() for _ in ids]
+        if prompt_slots:
+            prompt_ids = [t for ids in self._pending_prompts.values() for t in ids]
+            self.prompt_mask[
+                mx.array(prompt_slots, dtype=mx.int32), mx.array(prompt_ids, dtype=mx.int32)
+            ] = True
+        self._pending_prompts.clear()
@@ -5,18 +5,26 @@ specified by requests.
 Components:
     SamplingBatchInfo: Sampling info for a batch of requests
     Sampler: Module class for sampling.
-TODO: Add penalizer support.
 """
 
 import dataclasses
 from functools import partial
+from typing import Optional
 
 import mlx.core as mx
 from mlx import nn
 
 from parallax.server.request import Request
+from parallax.server.sampling.grammar import GrammarBatchInfo, GrammarConstraints
+from parallax.server.sampling.penalizer import Penalizer, PenaltyBatchInfo
 from parallax.server.sampling.sampling_params import SamplingParams
 
+# Candidates kept by partial selection when some request's top_k does not bound the sample
+TOP_P_CANDIDATES = 256
+
+# Slack for float32 sums when checking that the candidates hold a row's top_p mass
+TOP_P_TOLERANCE = 1e-5
+
 
 @dataclasses.dataclass
 class SamplingBatchInfo:
@@ -34,9 +42,33 @@ class SamplingBatchInfo:
     # Whether any request needs min_p sampling
     need_min_p_sampling: bool
 
+    # Largest top_k in the batch, or None if some request has no top_k limit. Requests
+    # sampling from the full distribution are left out.
+    max_top_k: Optional[int] = None
+
+    # Requests without top_k and top_p truncation, which sample from the full distribution
+    # without sorting it; None if there are none
+    untruncated: Optional[mx.array] = None
+    is_all_untruncated: bool = False
+
+    # Repetition/presence/frequency penalties, or None if no request has any
+    penalties: Optional[PenaltyBatchInfo] = None
+
+    # JSON schema constraints, or None if no request has a json_schema
+    grammars: Optional[GrammarBatchInfo] = None
+
     @classmethod
-    def from_reqs(cls, reqs: list[Request]):
-        """Retrieves sampling infos from a list of requests"""
+    def from_reqs(
+        cls,
+        reqs: list[Request],
+        penalizer: Optional[Penalizer] = None,
+        grammar_constraints: Optional[GrammarConstraints] = None,
+    ):
+        """Retrieves sampling infos from a list of requests
+
+        Penalties and JSON schemas are only applied when a penalizer / grammar constraints
+        track the requests' tokens.
+        """
         for r in reqs:
             if r.sampling_params is None:
                 r.sampling_params = SamplingParams()
@@ -50,6 +82,13 @@ class SamplingBatchInfo:
         top_ps = mx.array([r.sampling_params.top_p for r in reqs], dtype=mx.float32)
         top_ks = mx.array([r.sampling_params.top_k for r in reqs], dtype=mx.int32)
         min_ps = mx.array([r.sampling_params.min_p for r in reqs], dtype=mx.float32)
+        untruncated = [
+            r.sampling_params.top_k <= 0 and r.sampling_params.top_p >= 1.0 for r in reqs
+        ]
+        truncated = [r for r, full in zip(reqs, untruncated) if not full]
+        max_top_k = None
+        if truncated and all(r.sampling_params.top_k > 0 for r in truncated):
+            max_top_k = max(r.sampling_params.top_k for r in truncated)
 
         ret = cls(
             temperatures=temperatures,
@@ -58,12 +97,29 @@ class SamplingBatchInfo:
             min_ps=min_ps,
             is_all_greedy=is_all_greedy,
             need_min_p_sampling=need_min_p_sampling,
+            max_top_k=max_top_k,
+            untruncated=mx.array(untruncated) if any(untruncated) else None,
+            is_all_untruncated=all(untruncated),
+            penalties=penalizer.prepare(reqs) if penalizer is not None else None,
+            grammars=(
+                grammar_constraints.prepare(reqs) if grammar_constraints is not None else None
+            ),
         )
         return ret
 
 
 class Sampler(nn.Module):
-    """Sampler that completes Topk/Topp sampling for logits"""
+    """Sampler that completes Topk/Topp sampling for logits
+
+    Only the most probable tokens are sorted: partial selection keeps the largest top_k
+    of the batch, or `TOP_P_CANDIDATES` tokens when some request has no top_k limit. The
+    full vocabulary is sorted only when those candidates do not hold every request's
+    top_p mass. Requests with neither top_k nor top_p sample from the full distribution,
+    which needs no sorting at all.
+
+    Penalties and JSON schema masks are applied to the logits before sampling, and the
+    sampled tokens are recorded for the following steps.
+    """
 
     def __call__(self, logits: mx.array, sampling_info: SamplingBatchInfo):
         """Run a sampler & compute logprobs and update logits accordingly
@@ -74,6 +130,20 @@ class Sampler(nn.Module):
         Returns:
             next_token_ids: next token IDs.
         """
+        penalties = sampling_info.penalties
+        grammars = sampling_info.grammars
+        if penalties is not None:
+            logits = penalties.apply(logits)
+        if grammars is not None:
+            logits = grammars.apply(logits)
+        batch_next_token_ids = self._sample(logits, sampling_info)
+        if penalties is not None:
+            penalties.record(batch_next_token_ids)
+        if grammars is not None:
+            grammars.record(batch_next_token_ids)
+        return batch_next_token_ids
+
+    def _sample(self, logits: mx.array, sampling_info: SamplingBatchInfo) -> mx.array:
         batch_next_token_ids = None
         if sampling_info.is_all_greedy:
             # Use argmax if all requests use greedy sampling
@@ -81,29 +151,55 @@ class Sampler(nn.Module):
         else:
             logits = logits / sampling_info.temperatures.reshape(-1, 1)
             logits[:] = mx.softmax(logits, axis=-1)
-            batch_next_token_ids = apply_top_k_top_p_min_p_sampling(
-                logits,
-                sampling_info.top_ks,
-                sampling_info.top_ps,
-                sampling_info.min_ps,
-                sampling_info.need_min_p_sampling,
-            )
+            untruncated = sampling_info.untruncated
+            full_next_token_ids = None
+            if untruncated is not None:
+                full_next_token_ids = apply_min_p_sampling(
+                    logits, sampling_info.min_ps, sampling_info.need_min_p_sampling
+                )
+                if sampling_info.is_all_untruncated:
+                    return full_next_token_ids
+            num_candidates = sampling_info.max_top_k or TOP_P_CANDIDATES
+            if num_candidates < logits.shape[-1]:
+                batch_next_token_ids, covered = apply_partial_top_k_top_p_min_p_sampling(
+                    logits,
+                    sampling_info.top_ks,
+                    sampling_info.top_ps,
+                    sampling_info.min_ps,
+                    sampling_info.need_min_p_sampling,
+                    num_candidates,
+                )
+                if sampling_info.max_top_k is None and not covered.item():
+                    batch_next_token_ids = None
+            if batch_next_token_ids is None:
+                batch_next_token_ids = apply_top_k_top_p_min_p_sampling(
+                    logits,
+                    sampling_info.top_ks,
+                    sampling_info.top_ps,
+                    sampling_info.min_ps,
+                    sampling_info.need_min_p_sampling,
+                )
+            if full_next_token_ids is not None:
+                batch_next_token_ids = mx.where(
+                    untruncated.reshape(-1, 1), full_next_token_ids, batch_next_token_ids
+                )
         return batch_next_token_ids
 
 
-@partial(mx.compile, inputs=mx.random.state, outputs=mx.random.state)
-def apply_top_k_top_p_min_p_sampling(
-    logits: mx.array,
+def _mask_sorted_probs(
+    probs_sort: mx.array,
     top_ks: mx.array,
     top_ps: mx.array,
     min_ps: mx.array,
     need_min_p_sampling: bool,
-):
-    """Mlx compiled kernel for calculating topk/topp/minp sampling"""
-    probs_idx = mx.argsort(-logits, axis=-1)
-    probs_sort = mx.take_along_axis(logits, probs_idx, axis=-1)
+) -> mx.array:
+    """Applies top-k, top-p and min-p to rows of probabilities sorted in descending order.
+
+    A non-positive top_k does not limit the row.
+    """
     probs_sum = mx.cumsum(probs_sort, axis=-1)
-    top_k_mask = mx.arange(0, logits.shape[-1]).reshape(1, -1) < top_ks.reshape(-1, 1)
+    top_ks = mx.where(top_ks > 0, top_ks, probs_sort.shape[-1])
+    top_k_mask = mx.arange(0, probs_sort.shape[-1]).reshape(1, -1) < top_ks.reshape(-1, 1)
     probs_sort = probs_sort * top_k_mask
     top_p_mask = (probs_sum - probs_sort) <= top_ps.reshape(-1, 1)
     probs_sort = probs_sort * top_p_mask
@@ -111,9 +207,71 @@ def apply_top_k_top_p_min_p_sampling(
         min_p_thresholds = probs_sort[:, 0] * min_ps
         min_p_mask = probs_sort >= min_p_thresholds.reshape(-1, 1)
         probs_sort = probs_sort * min_p_mask
+    return probs_sort
+
+
+@partial(mx.compile, inputs=mx.random.state, outputs=mx.random.state)
+def apply_top_k_top_p_min_p_sampling(
+    logits: mx.array,
+    top_ks: mx.array,
+    top_ps: mx.array,
+    min_ps: mx.array,
+    need_min_p_sampling: bool,
+):
+    """Mlx compiled kernel for calculating topk/topp/minp sampling"""
+    probs_idx = mx.argsort(-logits, axis=-1)
+    probs_sort = mx.take_along_axis(logits, probs_idx, axis=-1)
+    probs_sort = _mask_sorted_probs(probs_sort, top_ks, top_ps, min_ps, need_min_p_sampling)
 
     probs_sort = mx.log(probs_sort)
     sampled_index = mx.random.categorical(probs_sort, num_samples=1)
     batch_next_token_ids = mx.take_along_axis(probs_idx, indices=sampled_index, axis=1)
 
     return batch_next_token_ids
+
+
+@partial(mx.compile, inputs=mx.random.state, outputs=mx.random.state)
+def apply_min_p_sampling(
+    logits: mx.array,
+    min_ps: mx.array,
+    need_min_p_sampling: bool,
+):
+    """Mlx compiled kernel for sampling from the full distribution with only min_p"""
+    if need_min_p_sampling:
+        min_p_thresholds = mx.max(logits, axis=-1, keepdims=True) * min_ps.reshape(-1, 1)
+        logits = logits * (logits >= min_p_thresholds)
+    return mx.random.categorical(mx.log(logits), num_samples=1)
+
+
+@partial(mx.compile, inputs=mx.random.state, outputs=mx.random.state)
+def apply_partial_top_k_top_p_min_p_sampling(
+    logits: mx.array,
+    top_ks: mx.array,
+    top_ps: mx.array,
+    min_ps: mx.array,
+    need_min_p_sampling: bool,
+    num_candidates: int,
+):
+    """Mlx compiled kernel for topk/topp/minp sampling among the most probable tokens
+
+    Partially selects the `num_candidates` most probable tokens of each row, then sorts
+    and masks only those. Besides the sampled token ids, returns whether the candidates
+    hold every row that is not bounded by its top_k: such a row must have its top_p mass
+    among the candidates, otherwise the full vocabulary has to be sorted. Rows with
+    neither top_k nor top_p are sampled from the full distribution instead and ignored.
+    """
+    cand_idx = mx.argpartition(-logits, kth=num_candidates - 1, axis=-1)[:, :num_candidates]
+    cand_probs = mx.take_along_axis(logits, cand_idx, axis=-1)
+    order = mx.argsort(-cand_probs, axis=-1)
+    probs_idx = mx.take_along_axis(cand_idx, order, axis=-1)
+    probs_sort = mx.take_along_axis(cand_probs, order, axis=-1)
+
+    unbounded = ((top_ks <= 0) & (top_ps < 1.0)) | (top_ks > num_candidates)
+    covered = mx.all(~unbounded | (mx.sum(probs_sort, axis=-1) >= top_ps - TOP_P_TOLERANCE))
+
+    probs_sort = _mask_sorted_probs(probs_sort, top_ks, top_ps, min_ps, need_min_p_sampling)
+    probs_sort = mx.log(probs_sort)
+    sampled_index = mx.random.categorical(probs_sort, num_samples=1)
+    batch_next_token_ids = mx.take_along_axis(probs_idx, indices=sampled_index, axis=1)
+
+    return batch_next_token_ids, covered
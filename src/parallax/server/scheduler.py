@@ -2,8 +2,13 @@
 Continuous Batching Scheduler.
 
 State managed by the scheduler:
-    1. Prefill Wait Queue (FIFO): incoming prefill requests waiting for admission;
+    1. Prefill Wait Queue (FIFO per priority class): incoming prefill requests waiting for admission;
     2. Running Requests: inflight requests with KV-cache residency;
+    3. Swapped Requests: preempted requests whose KV blocks were moved out of the pool;
+    4. Ready Queues: running prefills and decodes that can join the next batch, kept up to
+        date by `enque_request` so that batch formation only looks at ready requests;
+    5. Timers: a min-heap of request deadlines, so that finding timed out requests only
+        touches the expired ones (see `get_timed_out_requests`).
 Main `form_batch` function will return the concrete batch chosen for the next model forward.
 
 We use an explicit 2-Phase approach:
@@ -12,17 +17,43 @@ We use an explicit 2-Phase approach:
         allows (e.g., max concurrent requests, memory availability). Admitted
         requests get KV-cache residency and become inflight.
     * Phase 2 (Batching): running requests -> active batch for actual forward
-        Implemented by `form_batch`. We prioritize PREFILL requests
-        first within `max_num_tokens_per_batch` and `micro_batch_size`,
-        then include DECODE requests that are marked ready for the next decode step.
+        Implemented by `form_batch`. A `BatchingPolicy` (see batching_policy.py) splits
+        `max_num_tokens_per_batch` and `micro_batch_size` between PREFILL requests and
+        DECODE requests that are marked ready for the next decode step, and decides which
+        of the two goes first. By default prefills go first.
+
+Priority classes: requests with a higher `priority` are admitted and batched ahead of
+lower classes (FIFO within a class), and are the last to be preempted.
+
+Chunked prefill (optional): instead of charging a whole prompt against the token budget,
+the First Peer splits it into chunks that fit the budget left after reserving one token per
+ready decode, so long prompts neither get skipped nor stall decodes. Each chunk travels down
+the pipeline as its own prefill packet; downstream peers run chunks in arrival order and only
+the final chunk is sampled by the Last Peer.
+
+Preemption: when a ready decode needs a new KV block and the pool is exhausted, the most
+recently admitted requests outside the batch are preempted. A request without computed KV
+(an admitted prefill that hasn't run yet) releases its blocks and goes back to the front of
+the wait queue to be recomputed; any other request is swapped out to host memory and swapped
+back in, ahead of new admissions, once enough blocks are free again.
+
+Prefix caching (optional, see cache/prefix_cache.py): the First Peer admits a request whose
+prompt starts with cached KV blocks as if that prefix had been prefilled already, so only the
+rest of the prompt is computed and sent downstream as a chunk. Downstream peers admit such a
+first chunk as a new request and reuse exactly that prefix from their own cache. Peers evict
+independently, so a downstream peer missing the prefix reports the miss upstream and the First
+Peer prefills the whole prompt again without its cache (see `restart_prefill`).
 
 Our scheduler also handles tokenization and pre-processing for the First Peer's requests.
 """
 
+import heapq
+import math
 import time
 from collections import OrderedDict, deque
-from typing import Deque, Dict, List, Optional
+from typing import Deque, Dict, List, Optional, Set, Tuple
 
+from parallax.server.batching_policy import BatchingPolicy, create_batching_policy
 from parallax.server.cache_manager import CacheManager
 from parallax.server.request import InitialRequest, Request, RequestStatus
 from parallax.utils.shared_state import SharedState
@@ -48,23 +79,35 @@ class Scheduler:
         cache_manager: Optional[CacheManager] = None,
         request_timeout_s: Optional[int] = 600,
         shared_state: Optional[SharedState] = None,
+        enable_chunked_prefill: bool = False,
+        prefill_priority: int = 0,
+        batching_policy: Optional[BatchingPolicy] = None,
         **kwargs,
     ):
         """
         Args:
             max_batch_size: Maximum number of running / inflight requests;
             max_num_tokens_per_batch: Maxmimum number of prefill + decode tokens in a single batch;
-            scheduler_wait_ms: The minimum time to wait before dispatching a batch;
+            scheduler_wait_ms: Longest time an idle executor loop blocks waiting for input;
             micro_batch_ratio: micro_batch_size = max_batch_size // micro_batch_ratio;
             tokenizer: The tokenizer to use for the model;
             cache_manager: The KV cache manager to use for the scheduler.
             request_timeout_s: timeout for each inflight request (default 10mins).
+            enable_chunked_prefill: Split prompts into token-budgeted chunks (requires an
+                executor that can extend a partially prefilled KV cache).
+            prefill_priority: Picks the default batching policy, 0: prefill first, 1: decode first;
+            batching_policy: Policy splitting each batch between prefills and decodes,
+                overrides `prefill_priority`.
         """
         self.max_batch_size = max_batch_size
         self.max_num_tokens_per_batch = max_num_tokens_per_batch
         self.micro_batch_size = max(1, max_batch_size // micro_batch_ratio)
         self.scheduler_wait_ms = scheduler_wait_ms
         self.is_first_peer = is_first_peer
+        self.enable_chunked_prefill = enable_chunked_prefill
+        if batching_policy is None:
+            batching_policy = create_batching_policy(prefill_priority=prefill_priority)
+        self.batching_policy = batching_policy
         if is_first_peer:
             # Load configs for building InitialRequest
             self.tokenizer = kwargs.get("tokenizer", None)
@@ -72,10 +115,37 @@ class Scheduler:
             self.max_new_tokens = kwargs.get("max_new_tokens", 512)
             self.max_total_length = kwargs.get("max_total_length", 1024)
 
-        # Prefill wait queue (FIFO) for admission
+        # Prefill wait queue for admission, FIFO within each priority class
         self._wait_queue: Deque[Request] = deque()
+        # Request id -> number of its packets in the wait queue, for O(1) membership tests
+        self._waiting_ids: Dict[str, int] = {}
+        # While set, new requests stay in the wait queue (e.g. draining for a layer reload)
+        self.admission_paused = False
         # Keeps track of all in-flight requests
         self._running_requests: Dict[str, Request] = OrderedDict()
+        # Follow-up prefill chunks that arrived before the previous chunk of the same request ran
+        self._pending_prefill_chunks: Dict[str, Deque[Request]] = {}
+        # Downstream requests whose cached prefix is missing here, until the First Peer
+        # restarts or aborts them; the misses not reported upstream yet are kept in order
+        self._missed_prefixes: Set[str] = set()
+        self._unreported_misses: List[Request] = []
+        # Requests the First Peer prefills again from the start, bypassing its prefix cache
+        self._full_prefills: Set[str] = set()
+        # Preempted requests whose KV is swapped out, in preemption order
+        self._swapped_requests: Dict[str, Request] = OrderedDict()
+        # Admission sequence numbers, used to preempt the youngest requests first
+        self._admission_order: Dict[str, int] = {}
+        self._num_admitted = 0
+        # Running requests ready for their next step: prefills by request id, decodes in
+        # the order they became ready
+        self._ready_prefills: Dict[str, Request] = {}
+        self._ready_decodes: Dict[str, Request] = OrderedDict()
+        # Timeout timers (deadline, timer id, request id). A timer is dropped lazily once
+        # its request leaves the scheduler, and pushed back when the request was updated
+        # after the timer was armed, so each request keeps a single entry in the heap.
+        self._timers: List[Tuple[float, int, str]] = []
+        self._timer_ids: Dict[str, int] = {}
+        self._num_timers = 0
 
         self.cache_manager = cache_manager
         self.shared_state = shared_state
@@ -83,6 +153,8 @@ class Scheduler:
         self.request_timeout_s = request_timeout_s
 
         self._last_dispatch_ts = time.time()
+        # Prefill tokens and decodes of the last formed batch, for step latency feedback
+        self._last_batch_shape = (0, 0)
         # Track last reported running requests to avoid redundant metric updates
         self._last_reported_running_requests: int = 0
         logger.debug(
@@ -100,9 +172,17 @@ class Scheduler:
         """Get the number of requests currently being processed."""
         return len(self._running_requests)
 
+    @property
+    def num_swapped_requests(self) -> int:
+        """Get the number of preempted requests whose KV is swapped out."""
+        return len(self._swapped_requests)
+
     def get_running_request(self, request_id: str) -> Optional[Request]:
-        """Gets a request that is currently in the running state."""
-        return self._running_requests.get(request_id)
+        """Gets a request that is currently in the running state (or swapped out)."""
+        req = self._running_requests.get(request_id)
+        if req is None:
+            req = self._swapped_requests.get(request_id)
+        return req
 
     def _prompt_string_to_request(self, request_str: str) -> InitialRequest:
         """Convert the prompt string to InitialRequest."""
@@ -126,29 +206,116 @@ class Scheduler:
 
         request.ready_for_next_step = True
         request.last_updated_time = time.time()
-        # TODO: Handle chunked prefill.
         if request.is_decoding:
             rid = request.request_id
+            if rid in self._swapped_requests:
+                # Resumes once the request is swapped back in
+                self._swapped_requests[rid] = request
+                logger.debug(f"Decode request {rid} marked ready while swapped out.")
+                return
             if rid not in self._running_requests:
                 raise ValueError(
                     f"Decode request {rid} must already be admitted (in running requests)."
                 )
             # Merge incoming decode readiness/state into the existing running request
             self._running_requests[rid] = request
-            # Update recency ordering so earlier-ready decodes are encountered first during batching
-            self._running_requests.move_to_end(rid)
+            self._ready_prefills.pop(rid, None)
+            # Earlier-ready decodes are encountered first during batching
+            self._ready_decodes.pop(rid, None)
+            self._ready_decodes[rid] = request
             logger.debug(f"Decode request {rid} marked ready for next decode.")
             return
 
-        self._wait_queue.append(request)
+        rid = request.request_id
+        if rid in self._missed_prefixes:
+            if request.prefill_offset > 0:
+                logger.debug(f"Dropped prefill chunk of {rid}, its cached prefix is missing.")
+                return
+            # The First Peer restarted the prompt from the beginning
+            self._missed_prefixes.discard(rid)
+
+        if request.prefill_offset > 0 and not self._is_first_packet(rid):
+            # Follow-up chunk of a prompt that the First Peer prefills in chunks.
+            running = self._running_requests.get(rid)
+            if (
+                running is not None
+                and not running.ready_for_next_step
+                and rid not in self._pending_prefill_chunks
+            ):
+                self._running_requests[rid] = request
+                self._ready_prefills[rid] = request
+            else:
+                # The previous chunk is still waiting for admission or for its forward pass
+                self._pending_prefill_chunks.setdefault(rid, deque()).append(request)
+            logger.debug(
+                f"Prefill chunk of {rid} at offset {request.prefill_offset} "
+                f"(len={request.prefill_chunk_len}) enqueued."
+            )
+            return
+
+        self._enqueue_waiting(request)
         logger.debug(
             f"Prefill request {request.request_id} added to the prefill wait queue (size={len(self._wait_queue)})."
         )
 
+    def _is_first_packet(self, request_id: str) -> bool:
+        """Whether no earlier packet of a request is waiting, running or swapped out here.
+
+        The first prefill packet of a request starts past the prefix the First Peer found in
+        its prefix cache, so it can't be told from a follow-up chunk by its offset alone.
+        """
+        return (
+            request_id not in self._running_requests
+            and request_id not in self._swapped_requests
+            and request_id not in self._pending_prefill_chunks
+            and request_id not in self._waiting_ids
+        )
+
+    def _enqueue_waiting(self, request: Request, front: bool = False):
+        """Inserts a prefill request into the wait queue behind higher priority classes.
+
+        Requests go to the back of their class, or to its front with `front` (e.g. when
+        preempted for recompute).
+        """
+        pos = len(self._wait_queue)
+        while pos > 0:
+            queued = self._wait_queue[pos - 1]
+            if queued.priority > request.priority or (
+                not front and queued.priority == request.priority
+            ):
+                break
+            pos -= 1
+        self._wait_queue.insert(pos, request)
+        self._waiting_ids[request.request_id] = self._waiting_ids.get(request.request_id, 0) + 1
+
+    def _pop_waiting(self) -> Request:
+        """Removes and returns the request at the head of the wait queue."""
+        request = self._wait_queue.popleft()
+        count = self._waiting_ids.pop(request.request_id) - 1
+        if count:
+            self._waiting_ids[request.request_id] = count
+        return request
+
+    def _requeue_waiting(self, request: Request):
+        """Puts a request just taken by `_pop_waiting` back at the head of the wait queue."""
+        self._wait_queue.appendleft(request)
+        self._waiting_ids[request.request_id] = self._waiting_ids.get(request.request_id, 0) + 1
+
     def evict_request(self, request_id: str):
         """Removes a request from the scheduler's running queue."""
-        if request_id in self._running_requests:
-            self._running_requests.pop(request_id)
+        if request_id in self._missed_prefixes:
+            # Never admitted, see admit_requests
+            self._missed_prefixes.discard(request_id)
+            return
+        self._full_prefills.discard(request_id)
+        if request_id in self._running_requests or request_id in self._swapped_requests:
+            self._running_requests.pop(request_id, None)
+            self._swapped_requests.pop(request_id, None)
+            self._pending_prefill_chunks.pop(request_id, None)
+            self._admission_order.pop(request_id, None)
+            self._ready_prefills.pop(request_id, None)
+            self._ready_decodes.pop(request_id, None)
+            self._timer_ids.pop(request_id, None)
             logger.debug(f"Evicted request {request_id} from scheduler.")
             # Update metrics only if running count changed since last report
             try:
@@ -160,10 +327,22 @@ class Scheduler:
         else:
             raise ValueError(f"Attempted to evict non-existent request {request_id}.")
 
+    def drain(self) -> List[Request]:
+        """Removes every waiting, running and swapped out request and returns them."""
+        requests = list(self._wait_queue)
+        self._wait_queue.clear()
+        self._waiting_ids.clear()
+        for request_id in list(self._running_requests) + list(self._swapped_requests):
+            requests.append(
+                self._running_requests.get(request_id) or self._swapped_requests[request_id]
+            )
+            self.evict_request(request_id)
+        return requests
+
     def cancel_request(self, request_id: str):
         """Cancels a request from the scheduler."""
-        if request_id in self._running_requests:
-            req = self._running_requests[request_id]
+        req = self.get_running_request(request_id)
+        if req is not None:
             req.abort = True
             logger.debug(f"Cancelled request {request_id} from scheduler.")
         else:
@@ -215,28 +394,88 @@ class Scheduler:
     def admit_requests(self):
         """Move requests from wait queue into running (inflight) set, up to capacity.
 
-        Pushes admitted requests directly into the running set.
+        Pushes admitted requests directly into the running set. Swapped out requests are
+        resumed first; new requests are only admitted once none are left and admission is
+        not paused.
         """
-        while self._wait_queue and len(self._running_requests) < self.max_batch_size:
-            req = self._wait_queue.popleft()
+        if self._swapped_requests:
+            self._swap_in_requests()
+        while (
+            self._wait_queue
+            and not self.admission_paused
+            and not self._swapped_requests
+            and len(self._running_requests) < self.max_batch_size
+        ):
+            req = self._pop_waiting()
             rid = req.request_id
             if rid in self._running_requests:
                 continue
 
-            # Check kv cache pool
+            # Check kv cache pool. Blocks for the whole prompt are reserved up front so
+            # that later chunks of a chunked prefill never fail allocation.
             if self.cache_manager is not None:
                 if not self.cache_manager.has_request(req.request_id):
-                    # TODO: Handle chunked prefill, and support preemption.
-                    if not self.cache_manager.allocate_request(req.request_id, req.total_length):
-                        logger.warning(
+                    num_tokens = max(req.total_length, req.prompt_len)
+                    # Leave the free-block watermark to the running requests' decodes
+                    watermark = self.cache_manager.get_free_block_watermark()
+                    if (
+                        watermark > 0
+                        and self._running_requests
+                        and not self.cache_manager.can_allocate(
+                            num_tokens, num_reserved_blocks=watermark
+                        )
+                    ):
+                        self._requeue_waiting(req)
+                        logger.debug(f"Request {rid} waits for the KV cache watermark.")
+                        break
+                    # With a prefix cache, the First Peer reuses as much of the prompt as is
+                    # cached; downstream peers reuse exactly the prefix the First Peer skipped
+                    if not self.is_first_peer:
+                        max_cached_tokens = req.prefill_offset
+                    elif rid in self._full_prefills:
+                        max_cached_tokens = 0
+                    else:
+                        max_cached_tokens = None
+                    if not self.cache_manager.allocate_request(
+                        req.request_id,
+                        num_tokens,
+                        prompt_ids=req.input_ids,
+                        max_cached_tokens=max_cached_tokens,
+                        lora_path=req.lora_path,
+                    ):
+                        # Keep FIFO order and retry once running requests release blocks
+                        self._requeue_waiting(req)
+                        logger.debug(
                             f"Request {rid} can't be admit to running batch due to KV cache size."
                         )
+                        break
+                    cached = self.cache_manager.get_num_computed_tokens(rid)
+                    if self.is_first_peer and cached > req.prefill_offset:
+                        # Prefill resumes after the cached prefix, like a follow-up chunk
+                        req.prefill_offset = cached
+                        logger.debug(f"Request {rid} reuses {cached} cached prompt tokens.")
+                    elif not self.is_first_peer and cached < req.prefill_offset:
+                        # The skipped prefix was evicted here, and its hidden states never
+                        # reach this peer, so only the First Peer can compute it again
+                        self.cache_manager.free_request(rid)
+                        self._pending_prefill_chunks.pop(rid, None)
+                        self._missed_prefixes.add(rid)
+                        self._unreported_misses.append(req)
+                        logger.debug(
+                            f"Request {rid} skips {req.prefill_offset} prompt tokens, "
+                            f"but only {cached} are cached here."
+                        )
                         continue
 
             # Add request to running requests
             self._running_requests[rid] = req
+            if req.ready_for_next_step:
+                self._ready_prefills[rid] = req
+            self._admission_order[rid] = self._num_admitted
+            self._num_admitted += 1
             # Initialize timing for timeout enforcement
             req.last_updated_time = time.time()
+            self._arm_timer(req)
             logger.debug(
                 f"Admitted to running: rid={rid}, status={req.status}, running_size={len(self._running_requests)}, ready={req.ready_for_next_step}"
             )
@@ -253,78 +492,339 @@ class Scheduler:
 
         return
 
+    def pop_prefix_cache_misses(self) -> List[Request]:
+        """Returns the requests whose cached prefix was missing on admission since last call."""
+        misses, self._unreported_misses = self._unreported_misses, []
+        return misses
+
+    def restart_prefill(self, request_id: str) -> bool:
+        """Sends a prefilling request back to the wait queue to prefill its whole prompt.
+
+        Called on the First Peer when a downstream peer misses the prefix it skipped. The
+        prefix cache is bypassed for the rest of the request. The executor releases the KV
+        cache first. Returns False if the request is not prefilling here anymore.
+        """
+        req = self.get_running_request(request_id)
+        if req is None or not req.is_prefill:
+            return False
+        self._running_requests.pop(request_id, None)
+        self._swapped_requests.pop(request_id, None)
+        self._ready_prefills.pop(request_id, None)
+        self._admission_order.pop(request_id, None)
+        self._timer_ids.pop(request_id, None)
+        req.prefill_offset = 0
+        req.prefill_chunk_len = None
+        req.ready_for_next_step = True
+        self._full_prefills.add(request_id)
+        self._enqueue_waiting(req, front=True)
+        logger.debug(f"Restarting the prefill of {request_id} without the prefix cache.")
+        return True
+
+    def _arm_timer(self, req: Request):
+        """Starts tracking the timeout of a newly admitted request."""
+        if self.request_timeout_s is None:
+            return
+        timer_id = self._num_timers
+        self._num_timers += 1
+        self._timer_ids[req.request_id] = timer_id
+        deadline = req.last_updated_time + self.request_timeout_s
+        heapq.heappush(self._timers, (deadline, timer_id, req.request_id))
+
+    def _peek_timer(self) -> Optional[Tuple[float, Request]]:
+        """Returns the earliest request deadline and its request.
+
+        Timers of requests that left the scheduler are dropped, and timers of requests
+        updated since they were armed are pushed back to the actual deadline.
+        """
+        while self._timers:
+            deadline, timer_id, rid = self._timers[0]
+            req = self.get_running_request(rid)
+            if req is None or self._timer_ids.get(rid) != timer_id:
+                heapq.heappop(self._timers)
+                continue
+            if req.last_updated_time is not None:
+                actual_deadline = req.last_updated_time + self.request_timeout_s
+                if actual_deadline > deadline:
+                    heapq.heapreplace(self._timers, (actual_deadline, timer_id, rid))
+                    continue
+            return deadline, req
+        return None
+
     def get_timed_out_requests(self) -> List[Request]:
         """Return running requests that exceeded their timeout and mark them aborted.
 
-        This does not evict or release resources; callers must handle cleanup.
+        Each timed out request is returned once. This does not evict or release
+        resources; callers must handle cleanup.
         """
         timed_out: List[Request] = []
+        if self.request_timeout_s is None:
+            return timed_out
         now = time.time()
-        for req in list(self._running_requests.values()):
-            try:
-                if req.last_updated_time is None:
-                    raise ValueError("Requests should have last updated time set.")
-                if now - req.last_updated_time > self.request_timeout_s:
-                    req.abort = True
-                    timed_out.append(req)
-            except Exception:
-                continue
+        while True:
+            timer = self._peek_timer()
+            if timer is None or timer[0] >= now:
+                break
+            heapq.heappop(self._timers)
+            req = timer[1]
+            self._timer_ids.pop(req.request_id, None)
+            req.abort = True
+            timed_out.append(req)
         return timed_out
 
-    def form_batch(self) -> List[Request]:
-        """Form the active batch for the next forward pass.
+    def get_next_timeout_deadline(self) -> Optional[float]:
+        """Returns the earliest time at which an inflight request times out, if any."""
+        if self.request_timeout_s is None:
+            return None
+        timer = self._peek_timer()
+        return timer[0] if timer is not None else None
 
-        - Select prefills first (FIFO by admission), then decodes that are ready
-          following the OrderedDict iteration order where ready decodes are
-          moved-to-end upon readiness, while respecting micro_batch_size and
-          max_num_tokens_per_batch.
-        """
-        self.admit_requests()
-        if not self._running_requests:
-            return []
-
-        inflight_tokens = 0
-        batch: List[Request] = []
+    def get_idle_timeout_ms(self) -> int:
+        """How long the executor may block on its sockets when no batch can be formed.
 
-        # Prefill candidates: preserve admission order via OrderedDict iteration
-        prefill_candidates = []
-        decode_candidates = []
-        for req in self._running_requests.values():
+        Bounded by the `scheduler_wait_ms` window and by the next request timeout.
+        """
+        timeout_ms = self.scheduler_wait_ms
+        deadline = self.get_next_timeout_deadline()
+        if deadline is not None:
+            timeout_ms = min(timeout_ms, max(0.0, (deadline - time.time()) * 1000.0))
+        return int(math.ceil(timeout_ms))
+
+    def _swap_in_requests(self):
+        """Moves swapped out requests back into the running set, oldest preemption first."""
+        while self._swapped_requests and len(self._running_requests) < self.max_batch_size:
+            rid, req = next(iter(self._swapped_requests.items()))
+            # Keep a block spare so the resumed request can decode right away
+            if not self.cache_manager.can_swap_in(rid, num_reserved_blocks=1):
+                break
+            self.cache_manager.swap_in(rid)
+            del self._swapped_requests[rid]
+            self._running_requests[rid] = req
             if req.ready_for_next_step:
                 if req.is_prefill:
-                    prefill_candidates.append(req)
-                elif req.is_decoding:
-                    decode_candidates.append(req)
+                    self._ready_prefills[rid] = req
+                else:
+                    self._ready_decodes[rid] = req
+            logger.debug(f"Swapped in request {rid}, swapped_size={len(self._swapped_requests)}")
+
+    def _preempt_request(self, req: Request) -> bool:
+        """Frees the KV blocks of a running request by recompute or swap.
+
+        Returns False if the request could not be preempted (swap space exhausted).
+        """
+        rid = req.request_id
+        if req.is_prefill and self.cache_manager.get_num_computed_tokens(rid) == 0:
+            # Nothing computed yet: recomputing is free, so give the blocks back
+            self.cache_manager.free_request(rid)
+            self._running_requests.pop(rid)
+            self._ready_prefills.pop(rid, None)
+            self._admission_order.pop(rid, None)
+            self._timer_ids.pop(rid, None)
+            self._enqueue_waiting(req, front=True)
+            logger.debug(f"Preempted request {rid} for recompute.")
+            return True
+        if not self.cache_manager.swap_out(rid):
+            return False
+        self._running_requests.pop(rid)
+        self._ready_prefills.pop(rid, None)
+        self._ready_decodes.pop(rid, None)
+        self._swapped_requests[rid] = req
+        logger.debug(f"Preempted request {rid} by swapping out its KV cache.")
+        return True
+
+    def _reserve_blocks(self, num_blocks: int, protected: List[Request]) -> bool:
+        """Preempts running requests outside `protected` until `num_blocks` blocks are free.
+
+        Victims are preempted lowest priority class first, then youngest admission first;
+        requests without computed KV are preferred since they are free to recompute.
+        """
+        if self.cache_manager.get_num_free_blocks() >= num_blocks:
+            return True
+        protected_ids = {r.request_id for r in protected}
+        victims = sorted(
+            (r for rid, r in self._running_requests.items() if rid not in protected_ids),
+            key=lambda r: (
+                r.priority,
+                self.cache_manager.get_num_computed_tokens(r.request_id) > 0,
+                -self._admission_order.get(r.request_id, 0),
+            ),
+        )
+        for victim in victims:
+            if self._preempt_request(victim):
+                if self.cache_manager.get_num_free_blocks() >= num_blocks:
+                    return True
+        return False
+
+    def commit_prefill_chunk(self, request: Request):
+        """Advances a request whose current (non-final) prefill chunk has been computed.
 
-        # 1) Fill with prefills first
-        for req in prefill_candidates:
+        The First Peer re-arms the request for its next chunk; other peers receive
+        the next chunk from upstream instead.
+        """
+        request.prefill_offset = request.prefill_chunk_end
+        request.prefill_chunk_len = None
+        if self.is_first_peer and request.prefill_offset < len(request.input_ids):
+            request.ready_for_next_step = True
+            if request.request_id in self._running_requests:
+                self._ready_prefills[request.request_id] = request
+
+    def _promote_pending_prefill_chunks(self):
+        """Replaces running requests whose chunk has been computed with their next chunk."""
+        for rid in list(self._pending_prefill_chunks):
+            running = self._running_requests.get(rid)
+            if running is None or running.ready_for_next_step:
+                continue
+            chunks = self._pending_prefill_chunks[rid]
+            self._running_requests[rid] = chunks.popleft()
+            self._ready_prefills[rid] = self._running_requests[rid]
+            if not chunks:
+                del self._pending_prefill_chunks[rid]
+
+    def _plan_prefill_chunk(self, req: Request, budget: int, batch_empty: bool) -> int:
+        """Picks the prompt chunk `req` computes this step and returns its token cost.
+
+        Returns 0 if the request should be skipped for this batch.
+        """
+        if self.is_first_peer:
+            chunk = min(len(req.input_ids) - req.prefill_offset, budget)
+            if chunk <= 0:
+                return 0
+            req.prefill_chunk_len = chunk
+            return chunk
+
+        # Downstream chunk sizes are fixed by the First Peer. A chunk larger than this
+        # peer's whole budget would never fit, so it runs as the batch's only prefill.
+        cost = req.prefill_chunk_end - req.prefill_offset
+        if cost <= budget or (batch_empty and cost > self.max_num_tokens_per_batch):
+            return cost
+        return 0
+
+    def record_step_latency(self, elapsed_s: float):
+        """Reports how long the last formed batch took, for latency-aware batching policies."""
+        num_prefill_tokens, num_decodes = self._last_batch_shape
+        self.batching_policy.observe_step(num_prefill_tokens, num_decodes, elapsed_s)
+
+    def _add_prefills(
+        self, batch: List[Request], candidates: List[Request], max_num_tokens: int
+    ) -> int:
+        """Adds prefill candidates to `batch` within `max_num_tokens` prompt tokens.
+
+        Returns the number of prompt tokens added.
+        """
+        num_tokens = 0
+        num_prefills = 0
+        for req in candidates:
             if len(batch) >= self.micro_batch_size:
                 break
-            cost = req.prompt_len
-            if cost + inflight_tokens > self.max_num_tokens_per_batch:
+            if req.request_id not in self._running_requests:
+                # Preempted for recompute while making room for a decode
                 continue
+            if self.enable_chunked_prefill:
+                cost = self._plan_prefill_chunk(req, max_num_tokens - num_tokens, num_prefills == 0)
+                if cost == 0:
+                    continue
+            else:
+                cost = req.prompt_len
+                if cost + num_tokens > max_num_tokens:
+                    continue
             batch.append(req)
-            inflight_tokens += cost
+            num_tokens += cost
+            num_prefills += 1
+        return num_tokens
 
-        # 2) Fill remaining with ready decodes
-        for req in decode_candidates:
-            if len(batch) >= self.micro_batch_size:
+    def _add_decodes(
+        self, batch: List[Request], candidates: List[Request], max_num_decodes: int
+    ) -> int:
+        """Adds up to `max_num_decodes` ready decodes to `batch`, reserving their KV blocks.
+
+        Returns the number of decodes added.
+        """
+        num_decodes = 0
+        reserved_blocks = 0
+        for req in candidates:
+            if len(batch) >= self.micro_batch_size or num_decodes >= max_num_decodes:
                 break
-            cost = 1
-            if cost + inflight_tokens > self.max_num_tokens_per_batch:
+            if req.request_id not in self._running_requests:
+                # Preempted while making room for an earlier decode
                 continue
+            if self.cache_manager is not None:
+                num_blocks = self.cache_manager.num_blocks_for_next_token(req.request_id)
+                if num_blocks > 0:
+                    if not self._reserve_blocks(reserved_blocks + num_blocks, batch + [req]):
+                        logger.warning(
+                            f"No KV blocks left to decode request {req.request_id}; "
+                            "deferring it to a later batch."
+                        )
+                        continue
+                    reserved_blocks += num_blocks
             batch.append(req)
-            inflight_tokens += cost
+            num_decodes += 1
+        return num_decodes
+
+    def form_batch(self) -> List[Request]:
+        """Form the active batch for the next forward pass.
 
-        # Clear ready flags for decodes included in this batch
+        - Candidates come from the ready queues and are ordered by priority class, then
+          FIFO by admission for prefills and by readiness for decodes.
+        - The batching policy splits max_num_tokens_per_batch and micro_batch_size between
+          prefills and decodes and decides which of the two is picked first.
+        - With chunked prefill, prompts are split to fit the prefill token budget.
+        """
+        self.admit_requests()
+        if not self._running_requests:
+            return []
+        if self._pending_prefill_chunks:
+            self._promote_pending_prefill_chunks()
+
+        batch: List[Request] = []
+
+        prefill_candidates = sorted(
+            self._ready_prefills.values(),
+            key=lambda r: (-r.priority, self._admission_order.get(r.request_id, 0)),
+        )
+        # Stable sort keeps the readiness order within a priority class
+        decode_candidates = sorted(self._ready_decodes.values(), key=lambda r: -r.priority)
+
+        split = self.batching_policy.split(
+            prefill_candidates,
+            len(decode_candidates),
+            self.max_num_tokens_per_batch,
+            self.micro_batch_size,
+            self.enable_chunked_prefill,
+        )
+        max_prefill_tokens = split.max_prefill_tokens
+        if not self.is_first_peer:
+            # Downstream peers run the chunks the First Peer already sized for its budget
+            max_prefill_tokens = max(
+                max_prefill_tokens,
+                self.max_num_tokens_per_batch - min(len(decode_candidates), split.max_decode_slots),
+            )
+
+        if split.prefill_first:
+            num_prefill_tokens = self._add_prefills(batch, prefill_candidates, max_prefill_tokens)
+            max_decodes = min(
+                split.max_decode_slots, self.max_num_tokens_per_batch - num_prefill_tokens
+            )
+            num_decodes = self._add_decodes(batch, decode_candidates, max_decodes)
+        else:
+            num_decodes = self._add_decodes(batch, decode_candidates, split.max_decode_slots)
+            max_prefill_tokens = min(
+                max_prefill_tokens, self.max_num_tokens_per_batch - num_decodes
+            )
+            num_prefill_tokens = self._add_prefills(batch, prefill_candidates, max_prefill_tokens)
+        self._last_batch_shape = (num_prefill_tokens, num_decodes)
+
+        # Clear ready flags for requests included in this batch
+        now = time.time()
         for r in batch:
             r.ready_for_next_step = False
-            r.last_updated_time = time.time()
+            r.last_updated_time = now
+            self._ready_prefills.pop(r.request_id, None)
+            self._ready_decodes.pop(r.request_id, None)
 
         if batch:
             logger.debug(
                 "Form batch selected=%s inflight_tokens=%d",
                 [f"{r.request_id}:{r.status}, ready:{r.ready_for_next_step}" for r in batch],
-                inflight_tokens,
+                num_prefill_tokens + num_decodes,
             )
         return batch
@@ -129,7 +129,29 @@ def parse_args() -> argparse.Namespace:
         type=int,
         default=0,
         choices=[0, 1],
-        help="Priority for prefill requests (0 or 1)",
+        help="Priority for prefill requests (0: prefill first, 1: decode first)",
+    )
+
+    parser.add_argument(
+        "--batching-policy",
+        type=str,
+        default=None,
+        choices=["prefill_first", "decode_first", "slo"],
+        help="Policy splitting each batch between prefills and decodes (overrides --prefill-priority)",
+    )
+
+    parser.add_argument(
+        "--ttft-slo-ms",
+        type=float,
+        default=1000.0,
+        help="Time-to-first-token target for the slo batching policy",
+    )
+
+    parser.add_argument(
+        "--tpot-slo-ms",
+        type=float,
+        default=100.0,
+        help="Time-per-output-token target for the slo batching policy",
     )
 
     parser.add_argument(
@@ -319,6 +341,9 @@ def validate_args(args: argparse.Namespace) -> None:
     if args.micro_batch_ratio <= 0:
         raise ValueError("micro_batch_ratio must be positive")
 
+    if getattr(args, "ttft_slo_ms", 1.0) <= 0 or getattr(args, "tpot_slo_ms", 1.0) <= 0:
+        raise ValueError("ttft_slo_ms and tpot_slo_ms must be positive")
+
     if args.scheduler_wait_ms < 0:
         raise ValueError("scheduler_wait_ms must be non-negative")
 
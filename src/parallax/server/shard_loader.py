@@ -5,15 +5,18 @@ Loads sharded MLX models from Hugging Face Hub or local paths.
 import glob
 import importlib
 import json
+import mmap
 import pathlib
+import struct
 import types
-from typing import Any, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import mlx.core as mx
-import safetensors
+import numpy as np
 from huggingface_hub import snapshot_download
 from mlx import nn
-from mlx.utils import tree_unflatten
+from mlx.utils import tree_flatten, tree_unflatten
 from mlx_lm.models.switch_layers import QuantizedSwitchLinear, SwitchLinear
 from mlx_lm.tuner.dora import DoRAEmbedding, DoRALinear
 from mlx_lm.tuner.lora import LoRAEmbedding, LoRALinear, LoRASwitchLinear
@@ -29,6 +32,136 @@ MODEL_CLASS_MAP = {
     "kimi_k2": "mlx_lm.models.deepseek_v3",
 }
 
+# safetensors dtype -> (numpy dtype of the raw buffer, MLX dtype to view it as)
+_SAFETENSORS_DTYPES = {
+    "BF16": (np.uint16, mx.bfloat16),
+    "F16": (np.float16, None),
+    "F32": (np.float32, None),
+    "I64": (np.int64, None),
+    "I32": (np.int32, None),
+    "U32": (np.uint32, None),
+    "I16": (np.int16, None),
+    "I8": (np.int8, None),
+    "U8": (np.uint8, None),
+    "BOOL": (np.bool_, None),
+}
+
+
+def remap_shard_weight_key(
+    key: str,
+    start_layer: int,
+    end_layer: int,
+    is_first_shard: bool,
+    is_last_shard: bool,
+    tie_word_embeddings: bool = False,
+) -> List[str]:
+    """Names a checkpoint tensor takes in the shard, empty if the shard does not own it.
+
+    Layer indices are made local to the shard and the "model." prefix is dropped. With tied
+    embeddings the embedding also serves as the last shard's lm_head.
+    """
+    remapped = []
+    if is_first_shard and "embed_tokens" in key and key.startswith("model."):
+        remapped.append(key.replace("model.", "", 1))
+        if is_last_shard and tie_word_embeddings:
+            remapped.append(remapped[0].replace("embed_tokens", "lm_head"))
+    elif is_last_shard:
+        if "model.norm" in key:
+            remapped.append(key.replace("model.", "", 1))
+        if "lm_head" in key:
+            remapped.append(key)
+        elif tie_word_embeddings and key.startswith("model.embed_tokens"):
+            remapped.append(key.replace("model.", "", 1).replace("embed_tokens", "lm_head"))
+    if "model.layers" in key:
+        parts = key.split(".")
+        try:
+            layer_idx = int(parts[2])
+        except (ValueError, IndexError):
+            return []
+        if start_layer <= layer_idx < end_layer:
+            remapped = [f"layers.{layer_idx - start_layer}.{'.'.join(parts[3:])}"]
+    return remapped
+
+
+def read_safetensors_header(path: str) -> Tuple[Dict[str, Any], int]:
+    """Returns the tensor table of a safetensors file and the offset its data starts at."""
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    return header, 8 + header_size
+
+
+def plan_shard_weights(
+    model_path: pathlib.Path,
+    weight_files: List[str],
+    start_layer: int,
+    end_layer: int,
+    is_first_shard: bool,
+    is_last_shard: bool,
+    tie_word_embeddings: bool = False,
+) -> Dict[str, Dict[str, List[str]]]:
+    """Maps each weight file the shard needs to {checkpoint key: remapped keys}.
+
+    Uses the weight map of model.safetensors.index.json when there is one, so files holding
+    only other shards' layers are never opened; otherwise reads each file's header.
+    """
+    index_file = pathlib.Path(model_path) / "model.safetensors.index.json"
+    weight_map = {}
+    if index_file.exists():
+        with open(index_file, "r") as f:
+            weight_map = json.load(f).get("weight_map", {})
+    files_by_name = {pathlib.Path(wf).name: wf for wf in weight_files}
+    if not weight_map:
+        weight_map = {
+            key: pathlib.Path(wf).name
+            for wf in weight_files
+            for key in read_safetensors_header(wf)[0]
+        }
+
+    plan: Dict[str, Dict[str, List[str]]] = {}
+    for key, filename in weight_map.items():
+        remapped = remap_shard_weight_key(
+            key, start_layer, end_layer, is_first_shard, is_last_shard, tie_word_embeddings
+        )
+        if remapped and filename in files_by_name:
+            plan.setdefault(files_by_name[filename], {})[key] = remapped
+    return {wf: plan[wf] for wf in weight_files if wf in plan}
+
+
+def load_safetensors_tensors(path: str, keys: Iterable[str]) -> Dict[str, mx.array]:
+    """Reads `keys` from a safetensors file through a read-only memory map.
+
+    The byte range covering the requested tensors is prefetched in one go, then each tensor
+    is copied straight from the mapping into an MLX array.
+    """
+    header, data_start = read_safetensors_header(path)
+    spans = [header[key]["data_offsets"] for key in keys]
+    tensors = {}
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if spans and hasattr(mapped, "madvise"):
+        begin = (data_start + min(s[0] for s in spans)) // mmap.PAGESIZE * mmap.PAGESIZE
+        end = data_start + max(s[1] for s in spans)
+        mapped.madvise(mmap.MADV_WILLNEED, begin, end - begin)
+    for key in keys:
+        info = header[key]
+        if info["dtype"] not in _SAFETENSORS_DTYPES:
+            raise ValueError(f"Unsupported dtype {info['dtype']} for tensor {key} in {path}")
+        np_dtype, mx_dtype = _SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        array = np.frombuffer(
+            mapped,
+            dtype=np_dtype,
+            count=(end - begin) // np.dtype(np_dtype).itemsize,
+            offset=data_start + begin,
+        ).reshape(info["shape"])
+        tensor = mx.array(array)
+        tensors[key] = tensor.view(mx_dtype) if mx_dtype is not None else tensor
+        del array
+    mapped.close()
+    return tensors
+
 
 class MLXModelLoader:
     """
@@ -43,6 +176,7 @@ class MLXModelLoader:
         start_layer: Optional[int] = None,
         end_layer: Optional[int] = None,
         use_hfcache: bool = False,
+        num_load_workers: int = 4,
     ):
         """
         Initializes the model loader.
@@ -55,11 +189,13 @@ class MLXModelLoader:
             end_layer (Optional[int]): The ending layer index for the shard (exclusive).
                                        Defaults to the end of the model.
             use_hfcache (bool): If True, use local Hugging Face cache only (no network download).
+            num_load_workers (int): Number of weight files read concurrently.
         """
         self.model_path_str = model_path_or_hf_repo
         self.start_layer = start_layer
         self.end_layer = end_layer
         self.use_hfcache = use_hfcache
+        self.num_load_workers = num_load_workers
         self.register_block_class()
 
     def register_block_class(self):
@@ -207,8 +343,39 @@ class MLXModelLoader:
         base_model.load_weights(str(adapter_path / "adapters.safetensors"), strict=False)
         return base_model
 
+    def checkpoint_weights(
+        self, model_shard: ShardedModel, start_layer: int, end_layer: int
+    ) -> Dict[str, mx.array]:
+        """Weights of `model_shard` that a shard for [start_layer, end_layer) also needs.
+
+        Keys are checkpoint names, as `load` expects them in `reuse_weights`.
+        """
+        is_first_shard = start_layer == 0
+        is_last_shard = end_layer == model_shard.config.num_hidden_layers
+        tie_word_embeddings = getattr(model_shard.config, "tie_word_embeddings", False)
+        weights = {}
+        for name, weight in tree_flatten(model_shard.parameters()):
+            if name.startswith("layers."):
+                _, local_idx, rest = name.split(".", 2)
+                key = f"model.layers.{int(local_idx) + model_shard.start_layer}.{rest}"
+            elif name.startswith("lm_head."):
+                key = name
+            else:
+                key = f"model.{name}"
+            if remap_shard_weight_key(
+                key, start_layer, end_layer, is_first_shard, is_last_shard, tie_word_embeddings
+            ):
+                weights[key] = weight
+        return weights
+
     def load(
-        self, lazy: bool = False, strict: bool = True, use_selective_download: bool = True
+        self,
+        lazy: bool = False,
+        strict: bool = True,
+        use_selective_download: bool = True,
+        *,
+        reuse_weights: Optional[Dict[str, mx.array]] = None,
+        tokenizer: Any = None,
     ) -> Tuple[nn.Module, Dict[str, Any], Any]:
         """
         Loads the specified model shard by loading only the necessary weights
@@ -221,6 +388,10 @@ class MLXModelLoader:
                            Defaults to True.
             use_selective_download (bool): If True, only download necessary weight files
                                           from Hugging Face. Defaults to True.
+            reuse_weights (Optional[Dict[str, mx.array]]): Tensors already in memory, by
+                                          checkpoint key, e.g. from `checkpoint_weights`.
+                                          They are not read again.
+            tokenizer (Any): Tokenizer to return instead of loading it again.
         Returns:
             A tuple containing the loaded sharded MLX model and its configuration dictionary.
         """
@@ -242,7 +413,8 @@ class MLXModelLoader:
             model_path = _download(self.model_path_str)
 
         config = load_config(model_path)
-        tokenizer = load_tokenizer(model_path, eos_token_ids=config.get("eos_token_id", None))
+        if tokenizer is None:
+            tokenizer = load_tokenizer(model_path, eos_token_ids=config.get("eos_token_id", None))
 
         architectures = config.get("architectures", None)
         if architectures is None:
@@ -301,91 +473,48 @@ class MLXModelLoader:
         # Sort weight files by name for consistent loading order
         weight_files = sorted(weight_files)
 
-        # Use shared utility to filter weight files
-        from parallax.utils.weight_filter_utils import (
-            filter_weight_files_by_layer_range_for_load,
-        )
-
-        weight_files = filter_weight_files_by_layer_range_for_load(
-            model_path=model_path,
-            weight_files=weight_files,
+        # Only the files and tensors owned by this shard are touched
+        plan = plan_shard_weights(
+            model_path,
+            weight_files,
             start_layer=current_start_layer,
             end_layer=current_end_layer,
             is_first_shard=model_shard.is_first_shard,
             is_last_shard=model_shard.is_last_shard,
-            config=config,
+            tie_word_embeddings=config.get("tie_word_embeddings", False),
         )
 
-        if not weight_files and strict:
+        if not plan and strict:
             raise FileNotFoundError(f"No safetensors found in {model_path}")
 
-        # Instead of loading all weights, we iterate through files and keys,
-        # loading only what we need.
         shard_weights = {}
-        layer_key_prefix = "model.layers"  # Common prefix
-
-        for file_idx, wf in enumerate(weight_files):
-            logger.debug(
-                f"Scanning weight file {file_idx + 1}/{len(weight_files)}: {pathlib.Path(wf).name}"
+        if reuse_weights:
+            for weight_file in list(plan):
+                for key in [key for key in plan[weight_file] if key in reuse_weights]:
+                    for remapped_key in plan[weight_file].pop(key):
+                        shard_weights[remapped_key] = reuse_weights[key]
+                if not plan[weight_file]:
+                    del plan[weight_file]
+            logger.debug(f"Reusing {len(shard_weights)} tensors already in memory")
+
+        num_workers = max(1, min(self.num_load_workers, len(plan)))
+        logger.debug(
+            f"Loading {sum(len(keys) for keys in plan.values())} tensors from {len(plan)} "
+            f"weight files with {num_workers} workers"
+        )
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            loaded = pool.map(
+                lambda item: (item[1], load_safetensors_tensors(item[0], item[1])), plan.items()
             )
-
-            with safetensors.safe_open(wf, framework="pt") as f:
-                for key in f.keys():
-                    is_needed = False
-                    remapped_key = None
-
-                    # Check if the key belongs to the shard and remap it
-                    if (
-                        model_shard.is_first_shard
-                        and "embed_tokens" in key
-                        and key.startswith("model.")
-                    ):
-                        is_needed = True
-                        remapped_key = key.replace("model.", "", 1)
-                        if model_shard.is_last_shard and config.get("tie_word_embeddings", False):
-                            # Also add lm_head mapping for tied embeddings
-                            lm_head_key = remapped_key.replace("embed_tokens", "lm_head")
-                            shard_weights[lm_head_key] = mx.array(f.get_tensor(key))
-                    elif model_shard.is_last_shard:
-                        if "model.norm" in key:
-                            is_needed = True
-                            remapped_key = key.replace("model.", "", 1)
-                        if "lm_head" in key:
-                            is_needed = True
-                            remapped_key = key
-                        elif (
-                            config.get("tie_word_embeddings", False)
-                            and "embed_tokens" in key
-                            and key.startswith("model.embed_tokens")
-                        ):
-                            is_needed = True
-                            remapped_key = key.replace("model.", "", 1).replace(
-                                "embed_tokens", "lm_head"
-                            )
-                    if layer_key_prefix in key:
-                        try:
-                            parts = key.split(".")
-                            layer_idx = int(parts[2])
-                            if current_start_layer <= layer_idx < current_end_layer:
-                                is_needed = True
-                                local_layer_idx = layer_idx - current_start_layer
-                                remapped_key = f"layers.{local_layer_idx}.{'.'.join(parts[3:])}"
-                        except (ValueError, IndexError):
-                            continue
-
-                    # If the key is needed, load only that tensor from the file
-                    if is_needed:
-                        # Load tensor
-                        tensor = f.get_tensor(key)
-                        weight_array = mx.array(tensor)
-
-                        # Only convert dtype for non-quantized weights
-                        # Quantized weights (uint32, int32) and their scales/biases should keep their original dtype
-                        # Scales are typically float32 and should not be downcast to bfloat16
-                        is_quantized_param = weight_array.dtype in (mx.uint32, mx.int32, mx.uint8)
-                        if not is_quantized_param:
-                            weight_array = weight_array.astype(dtype)
-
+            for remapped, tensors in loaded:
+                for key, weight_array in tensors.items():
+                    # Only convert dtype for non-quantized weights
+                    # Quantized weights (uint32, int32) and their scales/biases should keep their original dtype
+                    # Scales are typically float32 and should not be downcast to bfloat16
+                    is_quantized_param = weight_array.dtype in (mx.uint32, mx.int32, mx.uint8)
+                    if not is_quantized_param:
+                        weight_array = weight_array.astype(dtype)
+                    for remapped_key in remapped[key]:
                         shard_weights[remapped_key] = weight_array
 
         if (quantization := config.get("quantization", None)) is not None:
@@ -1,82 +1,181 @@
 """
-Inter-process communication utilities using multiprocessing.Manager().
+Inter-process communication utilities using a fixed-layout shared memory block.
 
 Provides a clean abstraction for sharing state between processes (executor, P2P server, etc.)
 with dict-like interface and get/set methods.
+
+Every field lives at a fixed offset of one `multiprocessing.RawArray`, so reads and writes are
+plain memory accesses instead of round-trips to a Manager server process. Writers serialize on
+a lock and bump a sequence counter around each write (a seqlock); readers never take the lock,
+they retry when the counter was odd or changed while they copied the fields.
 """
 
 from __future__ import annotations
 
+import ctypes
+import math
 import multiprocessing
+import struct
 import time
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+MAX_STATUS_BYTES = 32
+MAX_MODEL_NAME_BYTES = 1024
+
+# (name, struct format); ints use -1, floats NaN and strings b"" for None
+_FIELDS = [
+    ("block_start_index", "i"),
+    ("block_end_index", "i"),
+    ("tp_size", "i"),
+    ("_layer_allocation_changed", "?"),
+    ("current_requests", "q"),
+    ("layer_latency_ms", "d"),
+    ("_last_update_ts", "d"),
+    ("status", f"{MAX_STATUS_BYTES}s"),
+    ("model_name", f"{MAX_MODEL_NAME_BYTES}s"),
+]
+METRICS_KEYS = ("current_requests", "layer_latency_ms", "_last_update_ts")
+
+_SEQ = struct.Struct("<Q")
+
+
+def _build_layout() -> Dict[str, Tuple[int, struct.Struct]]:
+    layout = {}
+    offset = _SEQ.size
+    for name, fmt in _FIELDS:
+        field = struct.Struct("<" + fmt)
+        layout[name] = (offset, field)
+        offset += field.size
+    return layout
+
+
+_LAYOUT = _build_layout()
+_SIZE = max(offset + field.size for offset, field in _LAYOUT.values())
+
+
+def _encode(name: str, value: Any) -> Any:
+    fmt = _LAYOUT[name][1].format
+    if fmt.endswith("s"):
+        data = b"" if value is None else str(value).encode("utf-8")
+        if len(data) > _LAYOUT[name][1].size:
+            raise ValueError(f"{name} is longer than {_LAYOUT[name][1].size} bytes: {value!r}")
+        return data
+    if fmt.endswith("d"):
+        return math.nan if value is None else float(value)
+    if fmt.endswith("?"):
+        return bool(value)
+    return -1 if value is None else int(value)
+
+
+def _decode(name: str, value: Any) -> Any:
+    if isinstance(value, bytes):
+        value = value.rstrip(b"\0")
+        return value.decode("utf-8") if value else None
+    if isinstance(value, float):
+        return None if math.isnan(value) else value
+    if isinstance(value, bool):
+        return value
+    if name == "current_requests":
+        return value
+    return None if value < 0 else value
 
 
 class SharedState:
-    """Wrapper for multiprocessing.Manager().dict() with dict-like interface.
+    """Fixed-layout shared memory block with dict-like interface.
 
     Supports both dict-like access (shared_state['key']) and method access (shared_state.get('key')).
-    Automatically handles conversion from dict to SharedState.
+    Only the keys in `_FIELDS` exist. Pass the SharedState itself to `multiprocessing.Process`
+    arguments to share it with a subprocess.
     """
 
-    def __init__(self, manager_dict: Optional[Union[Dict[str, Any], "SharedState"]] = None):
-        """Initialize SharedState with a Manager().dict(), dict, SharedState, or None.
+    def __init__(self, shared_state: Optional["SharedState"] = None):
+        """Initialize SharedState.
 
         Args:
-            manager_dict: A Manager().dict(), regular dict, SharedState instance, or None.
-                         If None, creates a new Manager().dict().
-                         If dict, wraps it (assumes it's a Manager().dict()).
-                         If SharedState, uses its underlying dict.
+            shared_state: A SharedState to attach to, or None to allocate a new block with
+                          default values.
         """
-        if manager_dict is None:
-            manager = multiprocessing.Manager()
-            self._dict = manager.dict()
-        elif isinstance(manager_dict, SharedState):
-            self._dict = manager_dict._dict
+        if shared_state is None:
+            self._raw = multiprocessing.RawArray(ctypes.c_char, _SIZE)
+            self._lock = multiprocessing.Lock()
         else:
-            self._dict = manager_dict
+            self._raw = shared_state._raw
+            self._lock = shared_state._lock
+        self._buf = memoryview(self._raw).cast("B")
+        if shared_state is None:
+            self.update(**{name: None for name, _ in _FIELDS})
+            self.update(_layer_allocation_changed=False, current_requests=0, _last_update_ts=0.0)
+
+    def __getstate__(self):
+        return self._raw, self._lock
+
+    def __setstate__(self, state):
+        self._raw, self._lock = state
+        self._buf = memoryview(self._raw).cast("B")
+
+    def _read(self, names: Iterable[str]) -> Dict[str, Any]:
+        """Consistent snapshot of `names`, retried while a write is in progress."""
+        fields = [(name, *_LAYOUT[name]) for name in names]
+        while True:
+            seq = _SEQ.unpack_from(self._buf)[0]
+            if seq & 1:
+                continue
+            values = {
+                name: _decode(name, field.unpack_from(self._buf, offset)[0])
+                for name, offset, field in fields
+            }
+            if _SEQ.unpack_from(self._buf)[0] == seq:
+                return values
+
+    def _write_locked(self, values: Dict[str, Any]) -> None:
+        """Writes `values` between two sequence bumps; the caller holds the lock."""
+        encoded = [(*_LAYOUT[name], _encode(name, value)) for name, value in values.items()]
+        seq = _SEQ.unpack_from(self._buf)[0]
+        _SEQ.pack_into(self._buf, 0, seq + 1)
+        for offset, field, value in encoded:
+            field.pack_into(self._buf, offset, value)
+        _SEQ.pack_into(self._buf, 0, seq + 2)
 
     def get(self, key: str, default: Any = None) -> Any:
         """Get a value from shared state."""
-        return self._dict.get(key, default)
+        if key not in _LAYOUT:
+            return default
+        value = self._read([key])[key]
+        return default if value is None else value
 
     def set(self, key: str, value: Any) -> None:
         """Set a value in shared state."""
-        self._dict[key] = value
+        self.update(**{key: value})
 
     def update(self, **kwargs) -> None:
-        """Batch update multiple values in shared state.
+        """Atomically update multiple values in shared state.
 
         Args:
             **kwargs: Key-value pairs to update.
         """
-        for key, value in kwargs.items():
-            self._dict[key] = value
+        for key in kwargs:
+            if key not in _LAYOUT:
+                raise KeyError(key)
+        with self._lock:
+            self._write_locked(kwargs)
 
     def __getitem__(self, key: str) -> Any:
         """Dict-like access: shared_state['key']"""
-        return self._dict[key]
+        if key not in _LAYOUT:
+            raise KeyError(key)
+        return self._read([key])[key]
 
     def __setitem__(self, key: str, value: Any) -> None:
         """Dict-like access: shared_state['key'] = value"""
-        self._dict[key] = value
+        self.set(key, value)
 
     def __contains__(self, key: str) -> bool:
         """Check if key exists: 'key' in shared_state"""
-        return key in self._dict
-
-    @property
-    def dict(self) -> Dict[str, Any]:
-        """Get the underlying Manager().dict() for multiprocessing serialization."""
-        return self._dict
+        return key in _LAYOUT
 
     def get_metrics(self) -> Dict[str, Any]:
-        """Get a shallow copy of current metrics suitable for JSON serialization."""
-        metrics_dict = self._dict.get("metrics")
-        if not metrics_dict:
-            return {}
-        # For Manager().dict(), create a copy by accessing each key explicitly
-        return {k: metrics_dict[k] for k in metrics_dict.keys()}
+        """Get a snapshot of current metrics suitable for JSON serialization."""
+        return self._read(METRICS_KEYS)
 
     def update_metrics(
         self,
@@ -92,44 +191,60 @@ class SharedState:
             layer_latency_ms_sample: A new sample of per-layer latency in ms.
             ewma_alpha: Smoothing factor in [0, 1] for latency EWMA.
         """
-        metrics_dict = self._dict.get("metrics")
-        if not metrics_dict:
-            raise RuntimeError("metrics not initialized in shared_state")
-
-        # Update metrics
+        values: Dict[str, Any] = {"_last_update_ts": time.time()}
         if current_requests is not None:
-            metrics_dict["current_requests"] = int(current_requests)
-        if layer_latency_ms_sample is not None:
-            prev = metrics_dict.get("layer_latency_ms")
-            if prev is None:
-                metrics_dict["layer_latency_ms"] = float(layer_latency_ms_sample)
-            else:
-                metrics_dict["layer_latency_ms"] = float(
-                    (1.0 - ewma_alpha) * float(prev) + ewma_alpha * float(layer_latency_ms_sample)
-                )
-        metrics_dict["_last_update_ts"] = time.time()
+            values["current_requests"] = int(current_requests)
+        with self._lock:
+            if layer_latency_ms_sample is not None:
+                # Writers are serialized, so the previous value cannot change under us
+                prev = self._read(["layer_latency_ms"])["layer_latency_ms"]
+                if prev is None:
+                    values["layer_latency_ms"] = float(layer_latency_ms_sample)
+                else:
+                    values["layer_latency_ms"] = (1.0 - ewma_alpha) * prev + ewma_alpha * float(
+                        layer_latency_ms_sample
+                    )
+            self._write_locked(values)
 
     def get_model_info(self) -> Dict[str, Any]:
         """Get model and layer allocation information."""
-        return {
-            "model_name": self._dict.get("model_name"),
-            "block_start_index": self._dict.get("block_start_index"),
-            "block_end_index": self._dict.get("block_end_index"),
-            "tp_size": self._dict.get("tp_size"),
-            "_layer_allocation_changed": self._dict.get("_layer_allocation_changed", False),
-        }
+        return self._read(
+            [
+                "model_name",
+                "block_start_index",
+                "block_end_index",
+                "tp_size",
+                "_layer_allocation_changed",
+            ]
+        )
 
     def get_layer_allocation_changed(self) -> bool:
         """Check if layer allocation has changed."""
-        return self._dict.get("_layer_allocation_changed", False)
+        return self._read(["_layer_allocation_changed"])["_layer_allocation_changed"]
+
+    def finish_layer_reallocation(self, start_layer: int, end_layer: int, status: str) -> bool:
+        """Clears the layer allocation change flag once [start_layer, end_layer) is loaded.
+
+        Does nothing and returns False if the allocation has moved on meanwhile, so a change
+        published while the previous one was being applied is not lost.
+        """
+        with self._lock:
+            current = self._read(["block_start_index", "block_end_index"])
+            if (current["block_start_index"], current["block_end_index"]) != (
+                start_layer,
+                end_layer,
+            ):
+                return False
+            self._write_locked({"_layer_allocation_changed": False, "status": status})
+            return True
 
     def get_status(self) -> Optional[str]:
         """Get current status."""
-        return self._dict.get("status")
+        return self._read(["status"])["status"]
 
     def set_status(self, status: str) -> None:
         """Set current status."""
-        self._dict["status"] = status
+        self.update(status=status)
 
     @classmethod
     def create(cls) -> "SharedState":
@@ -138,21 +253,4 @@ class SharedState:
         Returns:
             A new SharedState instance with initialized default values.
         """
-        manager = multiprocessing.Manager()
-        shared_dict = manager.dict()
-
-        # Initialize default values
-        shared_dict["block_start_index"] = None
-        shared_dict["block_end_index"] = None
-        shared_dict["model_name"] = None
-        shared_dict["tp_size"] = None
-        shared_dict["_layer_allocation_changed"] = False
-        shared_dict["status"] = None
-
-        # Create nested shared dict for metrics
-        shared_dict["metrics"] = manager.dict()
-        shared_dict["metrics"]["current_requests"] = 0
-        shared_dict["metrics"]["layer_latency_ms"] = None
-        shared_dict["metrics"]["_last_update_ts"] = 0.0
-
-        return cls(shared_dict)
+        return cls()
@@ -0,0 +1,107 @@
+"""
+Incremental stop-string matching on detokenized output.
+
+Components:
+    StopStringAutomaton: Aho-Corasick automaton over a request's stop strings.
+    StopStringMatcher: Feeds text segments through the automaton as they are detokenized,
+        holding back text that may still turn out to be the start of a stop string.
+
+The automaton state carries partial matches across segment boundaries, so each character
+is examined a constant number of times (amortized) however many stop strings there are.
+"""
+
+from typing import Dict, List, Optional, Tuple, Union
+
+
+def parse_stop_strs(raw_request: Dict) -> Optional[List[str]]:
+    """Stop strings of a chat completion request, or None if it has none.
+
+    Accepts the OpenAI `stop` field, or `stop` inside the request's `sampling_params`.
+    """
+    stop = (raw_request.get("sampling_params") or {}).get("stop", raw_request.get("stop"))
+    if isinstance(stop, str):
+        stop = [stop]
+    stop = [s for s in stop or [] if s]
+    return stop or None
+
+
+class StopStringAutomaton:
+    """Aho-Corasick automaton; state 0 is the root and states are trie prefixes."""
+
+    def __init__(self, stop_strs: List[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.depth: List[int] = [0]
+        # Longest stop string ending at each state, following suffix links
+        self.output: List[Optional[str]] = [None]
+        for stop in stop_strs:
+            state = 0
+            for ch in stop:
+                if ch not in self.goto[state]:
+                    self.goto.append({})
+                    self.depth.append(self.depth[state] + 1)
+                    self.output.append(None)
+                    self.goto[state][ch] = len(self.goto) - 1
+                state = self.goto[state][ch]
+            self.output[state] = stop
+
+        # Breadth-first, so the suffix link of every shallower state is already known
+        self.fail: List[int] = [0] * len(self.goto)
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for ch, child in self.goto[state].items():
+                queue.append(child)
+                if state == 0:
+                    continue
+                self.fail[child] = self.step(self.fail[state], ch)
+                if self.output[child] is None:
+                    self.output[child] = self.output[self.fail[child]]
+
+    def step(self, state: int, ch: str) -> int:
+        """The state after reading `ch` in `state`."""
+        while ch not in self.goto[state]:
+            if state == 0:
+                return 0
+            state = self.fail[state]
+        return self.goto[state][ch]
+
+
+class StopStringMatcher:
+    """Per-request matching state over a shared or private automaton."""
+
+    def __init__(self, stop_strs: Union[StopStringAutomaton, List[str]]):
+        if isinstance(stop_strs, StopStringAutomaton):
+            self.automaton = stop_strs
+        else:
+            self.automaton = StopStringAutomaton(stop_strs)
+        self.state = 0
+        # Text not emitted yet because it is a prefix of some stop string
+        self.pending = ""
+
+    def feed(self, text: str) -> Tuple[str, Optional[str]]:
+        """Consumes the next detokenized segment.
+
+        Returns:
+            The text that can be emitted, and the matched stop string or None. On a match,
+            the emitted text ends right before the stop string and later segments must not
+            be fed.
+        """
+        automaton = self.automaton
+        state = self.state
+        for i, ch in enumerate(text):
+            state = automaton.step(state, ch)
+            matched = automaton.output[state]
+            if matched is not None:
+                consumed = self.pending + text[: i + 1]
+                self.pending = ""
+                return consumed[: len(consumed) - len(matched)], matched
+        self.state = state
+        consumed = self.pending + text
+        held = automaton.depth[state]
+        self.pending = consumed[len(consumed) - held :] if held else ""
+        return consumed[: len(consumed) - held], None
+
+    def flush(self) -> str:
+        """Returns the held back text once the output ended without a match."""
+        pending, self.pending = self.pending, ""
+        self.state = 0
+        return pending
@@ -252,6 +252,38 @@ def create_causal_mask(seq_len: int, total_len: int, dtype=mx.bfloat16) -> mx.ar
     return final_mask
 
 
+def create_prefix_causal_mask(
+    prefix_lens: List[int], input_lengths: List[int], dtype=mx.bfloat16
+) -> mx.array:
+    """
+    Creates the attention mask for prefill chunks that follow an already cached prefix.
+
+    Query `t` of sequence `i` sits at position `prefix_lens[i] + t` and may attend to every
+    cached or new key up to that position. Keys past `prefix_lens[i] + input_lengths[i]`
+    (other sequences' longer contexts) are masked, and padded queries keep at least one
+    visible key so softmax stays finite.
+
+    Args:
+        prefix_lens: Number of tokens already in the KV cache for each sequence.
+        input_lengths: Number of new tokens in the current chunk for each sequence.
+        dtype: The data type for the mask.
+
+    Returns:
+        mx.array: Additive mask of shape (B, 1, max_input_len, max_context_len).
+    """
+    inf_value = get_infinite_value_by_dtype(dtype)
+    prefix = mx.array(prefix_lens, dtype=mx.int32)
+    context = prefix + mx.array(input_lengths, dtype=mx.int32)
+    target_len = max(input_lengths)
+    source_len = max(p + n for p, n in zip(prefix_lens, input_lengths))
+
+    query_pos = prefix[:, None] + mx.arange(target_len, dtype=mx.int32)[None, :]
+    key_pos = mx.arange(source_len, dtype=mx.int32)[None, None, :]
+    visible = (key_pos <= query_pos[:, :, None]) & (key_pos < context[:, None, None])
+    mask = mx.where(visible, mx.array(0, dtype), mx.array(-inf_value, dtype))
+    return mask[:, None, :, :]
+
+
 def combine_padding_and_causal_masks(
     padding_mask: mx.array, causal_mask: mx.array, dtype=mx.bfloat16
 ) -> mx.array:
@@ -9,7 +9,9 @@ Key components:
   number of pipelines, then rebalances each pipeline in-place;
 - DynamicProgrammingLayerAllocator: explores pipeline construction via DP to balance
   concurrency (pipelines) and latency (stages per pipeline), then rebalances each pipeline
-  in-place.
+  in-place;
+- BeamSearchLayerAllocator: explores the same constructions with a bounded beam, so it scales
+  to large clusters, and scores the resulting plans by roofline latency and RTTs.
 
 All allocators assign contiguous layer ranges directly on `Node` instances and maintain
 per-layer load state. Water-filling allocates decoder layers proportional to node compute
@@ -18,6 +20,7 @@ embedding/LM head endpoints on the first/last nodes of a pipeline.
 """
 
 import heapq
+from bisect import bisect_left
 from dataclasses import dataclass, field
 from functools import lru_cache
 from math import floor
@@ -358,13 +361,48 @@ class BaseLayerAllocator:
             if assume_sorted
             else sorted(pipeline_nodes, key=lambda n: n.get_decoder_layer_capacity(), reverse=True)
         )
-        n = len(nodes)
 
         # Clear previous allocations for participating nodes (avoid double counting loads)
         for node in nodes:
             if node.start_layer is not None and node.end_layer is not None:
                 self.deallocate(node)
 
+        stage_layer_counts = self.water_filling_layer_counts(nodes, power_type)
+
+        # Apply contiguous assignments in stage order directly to nodes
+        start_layer = 0
+        for idx, node in enumerate(nodes):
+            layers = stage_layer_counts[idx]
+            if layers <= 0:
+                # TODO(chris-t): should we deallocate the node?
+                continue
+            end_layer = start_layer + layers
+            self.allocate(node, start_layer, end_layer)
+            start_layer = end_layer
+
+        # Sanity check: ensure coverage from 0..num_total_layers
+        if start_layer != total_layers:
+            raise ValueError(
+                f"Assignment did not cover all layers: assigned {start_layer} of {total_layers}"
+            )
+
+    def water_filling_layer_counts(
+        self,
+        nodes: List[Node],
+        power_type: Literal["flops", "bandwidth"] = "flops",
+    ) -> List[int]:
+        """Split the decoder layers across the stages of a pipeline using water-filling.
+
+        Args:
+            nodes: Pipeline stages in order; the first hosts the input embedding and the last
+                the LM head.
+            power_type: Type of compute power the layers are split by.
+
+        Returns:
+            Number of decoder layers per stage, summing to the total number of layers.
+        """
+        total_layers = self.num_total_layers
+        n = len(nodes)
         caps: List[int] = []
         compute_powers: List[float] = []
         for i, node in enumerate(nodes):
@@ -432,23 +470,7 @@ class BaseLayerAllocator:
                 take = min(room, extra)
                 stage_layer_counts[i] += take
                 extra -= take
-
-        # Apply contiguous assignments in stage order directly to nodes
-        start_layer = 0
-        for idx, node in enumerate(nodes):
-            layers = stage_layer_counts[idx]
-            if layers <= 0:
-                # TODO(chris-t): should we deallocate the node?
-                continue
-            end_layer = start_layer + layers
-            self.allocate(node, start_layer, end_layer)
-            start_layer = end_layer
-
-        # Sanity check: ensure coverage from 0..num_total_layers
-        if start_layer != total_layers:
-            raise ValueError(
-                f"Assignment did not cover all layers: assigned {start_layer} of {total_layers}"
-            )
+        return stage_layer_counts
 
     def adjust_pipeline_layers_greedy(self, pipeline_nodes: List[Node]) -> None:
         """Greedily assign contiguous layers to `pipeline_nodes` from 0 to L.
@@ -817,6 +839,7 @@ class DynamicProgrammingLayerAllocator(BaseLayerAllocator):
             nodes,
             rebalance_threshold=rebalance_threshold,
             water_filling_max_iterations=water_filling_max_iterations,
+            assign_left_over_nodes=assign_left_over_nodes,
         )
         # Sort GPUs by layer capacity descending for stronger pruning
         self.alpha = alpha
@@ -1020,3 +1043,291 @@ class DynamicProgrammingLayerAllocator(BaseLayerAllocator):
                 i += 1
 
         return pipelines
+
+
+@dataclass(frozen=True)
+class _BeamState:
+    """Partial pipeline construction explored by `BeamSearchLayerAllocator`."""
+
+    # (remaining layers, node indices) of unfinished pipelines, sorted by remaining layers
+    open_pipelines: Tuple[Tuple[int, Tuple[int, ...]], ...] = ()
+    closed_pipelines: Tuple[Tuple[int, ...], ...] = ()
+    num_stages: int = 0
+    # Sum of RTTs between consecutive nodes added to the pipelines so far
+    rtt_ms: float = 0.0
+
+
+class BeamSearchLayerAllocator(BaseLayerAllocator):
+    """
+    Beam search allocator that scales to large clusters.
+
+    Explores the same pipeline constructions as `DynamicProgrammingLayerAllocator` (nodes in
+    capacity order are skipped, appended to an open pipeline, or start a new one), but keeps
+    only the `beam_width` most promising partial constructions per node instead of every
+    distinct set of open residuals, which grows exponentially with the number of nodes.
+
+    For each target number of pipelines k:
+        - States are ranked by stages used so far plus a lower bound on the stages still
+          needed, from the capacity of the remaining nodes. Ties go to the state that
+          placed more nodes, then to the one with shorter hops;
+        - A node is appended to at most three open pipelines: the best fit it can close,
+          the one with the most layers left, and the one whose tail is nearest in RTT;
+        - Cost is O(N * beam_width * k) per k, so O(N^3 * beam_width) overall.
+
+    Finished plans are scored with the roofline model instead of the stage count:
+        Z(k) = k^alpha / avg pipeline latency
+    where a pipeline's latency sums its water-filled stages (layers x per-layer roofline
+    latency) and the RTTs between consecutive stages. Unknown RTTs count as `unknown_rtt_ms`.
+    """
+
+    def __init__(
+        self,
+        model_info: ModelInfo,
+        nodes: List[Node],
+        alpha: float = 2.0,
+        beam_width: int = 8,
+        unknown_rtt_ms: float = 10.0,
+        *,
+        assign_left_over_nodes: bool = True,
+        rebalance_threshold: float = 0.25,
+        water_filling_max_iterations: int = 40,
+    ) -> None:
+        super().__init__(
+            model_info,
+            nodes,
+            rebalance_threshold=rebalance_threshold,
+            water_filling_max_iterations=water_filling_max_iterations,
+            assign_left_over_nodes=assign_left_over_nodes,
+        )
+        if beam_width <= 0:
+            raise ValueError(f"beam_width must be positive, got {beam_width}")
+        self.alpha = alpha
+        self.beam_width = beam_width
+        self.unknown_rtt_ms = unknown_rtt_ms
+
+    def global_allocation(self) -> bool:
+        logger.debug(
+            "[Beam] Starting global_allocation with %d nodes for %d layers",
+            len(self.nodes),
+            self.model_info.num_layers,
+        )
+        num_nodes = len(self.nodes)
+        num_layers = int(self.model_info.num_layers)
+        caps = [node.get_decoder_layer_capacity() for node in self.nodes]
+        total_cap = sum(caps)
+        if num_layers <= 0 or num_nodes == 0 or total_cap < num_layers:
+            logger.warning(
+                "[Beam] Insufficient resources: nodes=%d, layers=%d, total_cap=%d",
+                num_nodes,
+                num_layers,
+                total_cap,
+            )
+            return False
+
+        self._caps = caps
+        self._start_caps = [
+            node.get_decoder_layer_capacity(include_input_embed=True) for node in self.nodes
+        ]
+        self._close_caps = [
+            node.get_decoder_layer_capacity(include_lm_head=True) for node in self.nodes
+        ]
+        self._prefix_caps = [0]
+        for cap in caps:
+            self._prefix_caps.append(self._prefix_caps[-1] + cap)
+        self._layer_latency_ms = [
+            node.roofline_model(batch_size=1).roofline_layer_latency_ms() for node in self.nodes
+        ]
+        self._pipeline_latency_cache: Dict[Tuple[int, ...], float] = {}
+
+        best_plan: Optional[Tuple[Tuple[int, ...], ...]] = None
+        best_score = float("-inf")
+        for k_target in range(1, min(num_nodes, total_cap // num_layers) + 1):
+            plans = self._search(k_target)
+            if not plans:
+                # k pipelines contain k - 1 pipelines, so larger targets fail as well
+                break
+            for plan in plans:
+                score = self.score_plan(plan)
+                if score > best_score:
+                    best_score, best_plan = score, plan
+
+        if best_plan is None:
+            logger.debug("[Beam] Could not find a feasible number of pipelines")
+            return False
+        logger.debug(
+            "[Beam] Best plan has %d pipelines with %d stages (score %.4f)",
+            len(best_plan),
+            sum(len(p) for p in best_plan),
+            best_score,
+        )
+        for pipeline in best_plan:
+            self.adjust_pipeline_layers([self.nodes[i] for i in pipeline], assume_sorted=False)
+        if self.assign_left_over_nodes:
+            logger.debug("[Beam] Assigning left-over nodes")
+            self.allocate_left_over_nodes()
+        if not self.has_full_pipeline():
+            logger.debug("[Beam] Allocation did not produce a full pipeline")
+            return False
+        logger.debug("[Beam] global_allocation completed successfully")
+        return True
+
+    def score_plan(self, plan: Tuple[Tuple[int, ...], ...]) -> float:
+        """Objective Z(k) = k^alpha / avg pipeline latency of a plan (node indices)."""
+        latencies = [self._pipeline_latency_ms(pipeline) for pipeline in plan]
+        avg_latency = sum(latencies) / len(latencies)
+        if avg_latency == float("inf"):
+            return float("-inf")
+        return len(plan) ** self.alpha / max(avg_latency, 1e-9)
+
+    def _pipeline_latency_ms(self, pipeline: Tuple[int, ...]) -> float:
+        """Roofline latency of one pass through a pipeline, including hops between stages."""
+        cached = self._pipeline_latency_cache.get(pipeline)
+        if cached is not None:
+            return cached
+        # Same stage order as `adjust_pipeline_layers`
+        order = sorted(pipeline, key=lambda i: self._caps[i], reverse=True)
+        try:
+            counts = self.water_filling_layer_counts([self.nodes[i] for i in order])
+        except ValueError:
+            latency = float("inf")
+        else:
+            stages = [i for i, count in zip(order, counts) if count > 0]
+            latency = sum(
+                count * self._layer_latency_ms[i] for i, count in zip(order, counts) if count > 0
+            )
+            for prev, cur in zip(stages, stages[1:]):
+                latency += self._rtt_ms(prev, cur)
+        self._pipeline_latency_cache[pipeline] = latency
+        return latency
+
+    def _rtt_ms(self, i: int, j: int) -> float:
+        # Read the cache directly: `get_rtt_to` warns about every missing measurement
+        rtts = self.nodes[i].rtt_to_nodes or {}
+        return rtts.get(self.nodes[j].node_id, self.unknown_rtt_ms)
+
+    def _stages_lower_bound(self, state: _BeamState, i: int, k_target: int) -> Optional[int]:
+        """Lower bound on the nodes from index `i` on that finish `state`, None if none can."""
+        num_layers = self.num_total_layers
+        num_nodes = len(self.nodes)
+        num_new = k_target - len(state.closed_pipelines) - len(state.open_pipelines)
+        if num_new < 0:
+            return None
+        if num_new == 0 and not state.open_pipelines:
+            return 0
+        if i == num_nodes:
+            return None
+        need = sum(r for r, _ in state.open_pipelines) + num_new * num_layers
+        if self._prefix_caps[num_nodes] - self._prefix_caps[i] < need:
+            return None
+        # Nodes are sorted by capacity, so the next ones cover the need with the fewest stages
+        bound = bisect_left(self._prefix_caps, self._prefix_caps[i] + need) - i
+        # Each pipeline is finished separately, by nodes no larger than the next one
+        max_cap = self._caps[i]
+        per_pipeline = sum(-(-r // max_cap) for r, _ in state.open_pipelines)
+        per_pipeline += num_new * -(-num_layers // max_cap)
+        bound = max(bound, per_pipeline)
+        return bound if bound <= num_nodes - i else None
+
+    def _expand(self, state: _BeamState, i: int, k_target: int) -> List[_BeamState]:
+        """Successors of `state` when deciding on node `i`."""
+        num_layers = self.num_total_layers
+        children = [state]  # skip node i
+
+        open_pipelines = state.open_pipelines
+        if len(state.closed_pipelines) + len(open_pipelines) < k_target:
+            residual = num_layers - self._start_caps[i]
+            if residual <= 0:
+                children.append(
+                    _BeamState(
+                        open_pipelines,
+                        state.closed_pipelines + ((i,),),
+                        state.num_stages + 1,
+                        state.rtt_ms,
+                    )
+                )
+            else:
+                children.append(
+                    _BeamState(
+                        tuple(sorted(open_pipelines + ((residual, (i,)),))),
+                        state.closed_pipelines,
+                        state.num_stages + 1,
+                        state.rtt_ms,
+                    )
+                )
+
+        if not open_pipelines:
+            return children
+
+        candidates = {len(open_pipelines) - 1}  # most layers left
+        closable = [j for j, (r, _) in enumerate(open_pipelines) if r <= self._close_caps[i]]
+        if closable:
+            candidates.add(closable[-1])  # best fit
+        rtts = self.nodes[i].rtt_to_nodes
+        if rtts:
+            nearest_rtt, nearest = min(
+                (rtts.get(self.nodes[p[-1]].node_id, float("inf")), j)
+                for j, (_, p) in enumerate(open_pipelines)
+            )
+            if nearest_rtt != float("inf"):
+                candidates.add(nearest)
+
+        for j in sorted(candidates):
+            residual, pipeline = open_pipelines[j]
+            rtt_ms = state.rtt_ms + self._rtt_ms(pipeline[-1], i)
+            pipeline = pipeline + (i,)
+            rest = open_pipelines[:j] + open_pipelines[j + 1 :]
+            after = residual - self._caps[i]
+            if after <= 0:
+                after = residual - self._close_caps[i]
+            if after <= 0:
+                children.append(
+                    _BeamState(
+                        rest,
+                        state.closed_pipelines + (pipeline,),
+                        state.num_stages + 1,
+                        rtt_ms,
+                    )
+                )
+            else:
+                children.append(
+                    _BeamState(
+                        tuple(sorted(rest + ((after, pipeline),))),
+                        state.closed_pipelines,
+                        state.num_stages + 1,
+                        rtt_ms,
+                    )
+                )
+        return children
+
+    def _search(self, k_target: int) -> List[Tuple[Tuple[int, ...], ...]]:
+        """Beam search for plans with exactly `k_target` pipelines, fewest stages first."""
+        beam = [_BeamState()]
+        finished: Dict[Tuple[Tuple[int, ...], ...], int] = {}
+        for i in range(len(self.nodes)):
+            ranked: Dict[Tuple[Tuple[int, ...], int], Tuple[Tuple[int, int, float], _BeamState]] = (
+                {}
+            )
+            for state in beam:
+                for child in self._expand(state, i, k_target):
+                    if len(child.closed_pipelines) == k_target:
+                        plan = tuple(sorted(child.closed_pipelines))
+                        finished[plan] = child.num_stages
+                        continue
+                    bound = self._stages_lower_bound(child, i + 1, k_target)
+                    if bound is None:
+                        continue
+                    rank = (child.num_stages + bound, -child.num_stages, child.rtt_ms)
+                    # States with equal residuals finish alike; keep the better ranked one
+                    key = (
+                        tuple(r for r, _ in child.open_pipelines),
+                        len(child.closed_pipelines),
+                    )
+                    if key not in ranked or rank < ranked[key][0]:
+                        ranked[key] = (rank, child)
+            beam = [
+                state
+                for _, state in sorted(ranked.values(), key=lambda item: item[0])[: self.beam_width]
+            ]
+            if not beam:
+                break
+        return sorted(finished, key=finished.get)[: self.beam_width]
@@ -12,7 +12,7 @@ Scheduling primitives for distributed LLM inference.
 import time
 from dataclasses import dataclass, field
 from math import floor
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 
 from parallax_utils.logging_config import get_logger
 from parallax_utils.utils import bytes_per_element, compute_max_batch_size
@@ -48,11 +48,21 @@ class RequestSignal:
     - received_ts: UNIX timestamp (seconds) when the request was received
     - routing_table: Set by the scheduler when a path is assigned. Semantics:
         None -> not assigned yet; [] -> all pipelines full at the moment; [..] -> route
+    - on_routed: Optional callback invoked from the dispatch thread once routing_table is set
     """
 
     request_id: str
     received_ts: float = field(default_factory=time.time)
     routing_table: Optional[List[str]] = None
+    on_routed: Optional[Callable[["RequestSignal"], None]] = field(
+        default=None, repr=False, compare=False
+    )
+
+    def set_routing_table(self, routing_table: List[str]) -> None:
+        """Record the scheduler's decision and notify the waiting caller, if any."""
+        self.routing_table = routing_table
+        if self.on_routed is not None:
+            self.on_routed(self)
 
 
 class RooflinePerformanceModel:
@@ -331,8 +341,12 @@ class Node:
         """Update the layer latency for this node."""
         self.avg_layer_latency_ms = latency_ms
 
-    def roofline_layer_latency_ms(self) -> float:
-        """Get the roofline layer latency for this node."""
+    def roofline_model(self, batch_size: Optional[int] = None) -> RooflinePerformanceModel:
+        """Build the roofline performance model of this node.
+
+        Args:
+            batch_size: Batch size to model; defaults to the current number of requests.
+        """
         # Compute an effective compute speedup due to quantization.
         bytes_per_elem = float(self.model_info.param_bytes_per_element)
         # bf16/fp16 baseline ~2 bytes
@@ -340,16 +354,19 @@ class Node:
         # Empirical efficiency factor: int8 often achieves ~80% of theoretical 2x
         efficiency = 0.8 if bytes_per_elem < 2.0 else 1.0
         quantization_speedup = max(0.1, base * efficiency)
-        perf_model = RooflinePerformanceModel(
+        return RooflinePerformanceModel(
             hardware=self.hardware,
             model_info=self.model_info,
             quantization_speedup=quantization_speedup,
-            batch_size=self.current_requests,
+            batch_size=self.current_requests if batch_size is None else batch_size,
             target_seq_len=1,
             source_seq_len=self.max_sequence_length,
             using_mlx=self.hardware.device == "mlx",
         )
-        return perf_model.roofline_layer_latency_ms(
+
+    def roofline_layer_latency_ms(self) -> float:
+        """Get the roofline layer latency for this node."""
+        return self.roofline_model().roofline_layer_latency_ms(
             include_input_embed=self.has_embedding,
             include_lm_head=self.has_lm_head,
             num_current_layers=self.num_current_layers,
@@ -402,5 +419,8 @@ class Node:
         self.current_requests += 1
 
     def remove_request(self):
-        """Remove a request from this node."""
-        self.current_requests -= 1
+        """Remove a request from this node.
+
+        Never goes below zero: a heartbeat may already have reported the request as gone.
+        """
+        self.current_requests = max(0, self.current_requests - 1)
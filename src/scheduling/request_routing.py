@@ -10,6 +10,10 @@ Routing is at node granularity: once a request enters a node, it runs all layers
 hosted by that node. We can optionally compute layer-level turning points for a
 warm-up phase (to inform rebalancing), then perform shard-level DP to produce the
 final node path and total latency.
+
+Node allocations only change on join, leave or rebalance. The scheduler counts those
+events in a topology epoch and hands it to the router before each request, so routers
+can keep the pipelines they discovered until the epoch moves on.
 """
 
 from abc import ABC, abstractmethod
@@ -21,9 +25,65 @@ from scheduling.node import Node
 logger = get_logger(__name__)
 
 
+def enumerate_pipelines(
+    nodes: List[Node], num_layers: int, limit: Optional[int] = None
+) -> Optional[List[List[Node]]]:
+    """Enumerate complete pipelines, i.e. node chains exactly covering [0, num_layers).
+
+    Chains are explored depth-first from every node starting at layer 0, trying shorter
+    segments first. Nodes without a layer allocation are ignored.
+
+    Args:
+        nodes: Candidate nodes.
+        num_layers: Number of layers a pipeline must cover.
+        limit: Give up and return None once more than `limit` pipelines are found.
+    """
+    start_to_nodes: Dict[int, List[Node]] = {}
+    for n in nodes:
+        if n.start_layer is None or n.end_layer is None:
+            continue
+        start_to_nodes.setdefault(n.start_layer, []).append(n)
+    for candidates in start_to_nodes.values():
+        candidates.sort(key=lambda n: n.end_layer)  # type: ignore[arg-type,return-value]
+
+    pipelines: List[List[Node]] = []
+
+    def dfs(current_end: int, path: List[Node]) -> bool:
+        if current_end == num_layers:
+            pipelines.append(list(path))
+            return limit is None or len(pipelines) <= limit
+        for nxt in start_to_nodes.get(current_end, []):
+            if nxt.end_layer <= current_end:  # type: ignore[operator]
+                continue
+            path.append(nxt)
+            ok = dfs(int(nxt.end_layer), path)  # type: ignore[arg-type]
+            path.pop()
+            if not ok:
+                return False
+        return True
+
+    # Heads keep the node order; DFS from each one in turn
+    for head in [n for n in nodes if n.start_layer == 0 and n.end_layer is not None]:
+        if not dfs(int(head.end_layer), [head]):  # type: ignore[arg-type]
+            return None
+    return pipelines
+
+
 class RequestRoutingStrategy(ABC):
     """Base abstract class for request routing strategies."""
 
+    # Topology epoch of the cached routes; None means the owner does not track epochs
+    topology_epoch: Optional[int] = None
+
+    def set_topology_epoch(self, epoch: int) -> None:
+        """Record the scheduler's topology epoch, dropping routes cached under another one."""
+        if epoch != self.topology_epoch:
+            self.reset_routes()
+            self.topology_epoch = epoch
+
+    def reset_routes(self) -> None:
+        """Drop cached routes. Strategies without a cache have nothing to do."""
+
     @abstractmethod
     def find_turning_points(self, nodes: List[Node], num_layers: int) -> List[Tuple[str, int, str]]:
         """Find truncation points.
@@ -50,8 +110,24 @@ class DynamicProgrammingRouting(RequestRoutingStrategy):
     - Routing: run a shard-level DP over node assignments (contiguous layer ranges),
       using per-node execution latency and RTT via `Node.get_rtt_to`, to obtain a
       minimum-latency node sequence and total latency.
+
+    Within a topology epoch the complete pipelines are enumerated once and cached;
+    each request then re-scores the cached candidates with current latency and RTT.
+    When there are more than `max_candidate_pipelines` of them, or no epoch is set,
+    every request runs the shard-level DP instead.
     """
 
+    def __init__(self, max_candidate_pipelines: int = 256) -> None:
+        self.max_candidate_pipelines = max_candidate_pipelines
+        # None: not discovered for this epoch; empty: too many candidates, use the DP
+        self._candidates: Optional[List[List[Node]]] = None
+        self._candidates_num_layers: Optional[int] = None
+
+    def reset_routes(self) -> None:
+        """Forget the candidate pipelines discovered for the previous epoch."""
+        self._candidates = None
+        self._candidates_num_layers = None
+
     @staticmethod
     def find_turning_points(nodes: List[Node], num_layers: int) -> List[Tuple[str, int, str]]:
         """Find shard truncation points via layer-level DP.
@@ -144,7 +220,59 @@ class DynamicProgrammingRouting(RequestRoutingStrategy):
         return turning
 
     def find_optimal_path(self, nodes: List[Node], num_layers: int) -> Tuple[List[str], float]:
-        """Shard-level DP path across node ranges using `Node` APIs."""
+        """Minimum-latency path across node ranges using `Node` APIs."""
+        if num_layers <= 0 or not nodes:
+            return [], 0.0
+        if self.topology_epoch is None:
+            return self.shard_dp_path(nodes, num_layers)
+
+        if self._candidates is None or self._candidates_num_layers != num_layers:
+            candidates = enumerate_pipelines(nodes, num_layers, self.max_candidate_pipelines)
+            if candidates is None:
+                logger.debug(
+                    f"More than {self.max_candidate_pipelines} pipelines in topology epoch "
+                    f"{self.topology_epoch}; routing with the shard-level DP"
+                )
+            self._candidates = candidates or []
+            self._candidates_num_layers = num_layers
+        if not self._candidates:
+            return self.shard_dp_path(nodes, num_layers)
+        return self._score_candidates(self._candidates)
+
+    @staticmethod
+    def _score_candidates(candidates: List[List[Node]]) -> Tuple[List[str], float]:
+        """Pick the cheapest candidate pipeline under current latency and RTT.
+
+        Pipelines through inactive nodes are skipped; each node's latency is evaluated
+        once per call, and a candidate is abandoned as soon as it exceeds the best one.
+        """
+        node_latency: Dict[str, float] = {}
+        best_path: Optional[List[Node]] = None
+        best_latency = float("inf")
+        for path in candidates:
+            total = 0.0
+            prev: Optional[Node] = None
+            for n in path:
+                if n.is_active is False:
+                    total = float("inf")
+                    break
+                latency = node_latency.get(n.node_id)
+                if latency is None:
+                    latency = node_latency[n.node_id] = float(n.layer_latency_ms)
+                total += latency
+                if prev is not None and prev.node_id != n.node_id:
+                    total += float(prev.get_rtt_to(n))
+                if total >= best_latency:
+                    break
+                prev = n
+            if total < best_latency:
+                best_path, best_latency = path, total
+        if best_path is None:
+            return [], float("inf")
+        return [n.node_id for n in best_path], best_latency
+
+    def shard_dp_path(self, nodes: List[Node], num_layers: int) -> Tuple[List[str], float]:
+        """Shard-level DP path across node ranges, recomputed from scratch."""
         if num_layers <= 0 or not nodes:
             return [], 0.0
 
@@ -224,9 +352,8 @@ class RoundRobinPipelineRouting(RequestRoutingStrategy):
     dispatch requests by rotating among the remaining pipelines.
 
     This implementation discovers all complete pipelines once, caches them as
-    node-id sequences sorted by their estimated end-to-end latency (including
-    RTT), and then round-robins over that cached list. Use `reset_pipelines()`
-    to force rediscovery if allocations change.
+    node-id sequences, and then round-robins over that cached list. The cache is
+    dropped whenever the topology epoch changes, or by calling `reset_routes()`.
     """
 
     def __init__(self) -> None:
@@ -253,40 +380,9 @@ class RoundRobinPipelineRouting(RequestRoutingStrategy):
         if not nodes or num_layers <= 0:
             return []
 
-        # Index nodes by start layer
-        start_to_nodes: Dict[int, List[Node]] = {}
-        for n in nodes:
-            if n.start_layer is None or n.end_layer is None:
-                continue
-            start_to_nodes.setdefault(n.start_layer, []).append(n)
-
-        heads = start_to_nodes.get(0, [])
-        pipelines: List[List[str]] = []
-
-        def dfs(current_end: Optional[int], path_ids: List[str]) -> None:
-            if current_end is None:
-                return
-            if current_end == num_layers:
-                pipelines.append(list(path_ids))
-                return
-            candidates = [
-                n
-                for n in start_to_nodes.get(int(current_end), [])
-                if n.end_layer is not None and n.end_layer > current_end
-            ]
-            # Deterministic order: try shorter segments first
-            candidates.sort(key=lambda n: n.end_layer)  # type: ignore[arg-type]
-            for nxt in candidates:
-                path_ids.append(nxt.node_id)
-                dfs(int(nxt.end_layer), path_ids)  # type: ignore[arg-type]
-                path_ids.pop()
-
-        for head in heads:
-            if head.end_layer is None:
-                continue
-            path_ids: List[str] = [head.node_id]
-            dfs(int(head.end_layer), path_ids)  # type: ignore[arg-type]
-
+        pipelines = [
+            [n.node_id for n in path] for path in enumerate_pipelines(nodes, num_layers) or []
+        ]
         logger.debug(f"Discovered {len(pipelines)} pipelines")
         logger.debug(f"Pipelines: {pipelines}")
         return pipelines
@@ -295,9 +391,14 @@ class RoundRobinPipelineRouting(RequestRoutingStrategy):
         """No warm-up/truncation in the baseline; return no turning points."""
         return []
 
+    def reset_routes(self) -> None:
+        """Forget the cached pipelines so the next request rediscovers them."""
+        self._pipelines = None
+
     def _ensure_pipelines(self, nodes: List[Node], num_layers: int) -> None:
         """Ensure cached pipelines exist; discover and cache if missing."""
-        if self._pipelines is None:
+        # An empty result is not cached: routing may start before the first allocation
+        if not self._pipelines:
             self._pipelines = self.pipeline_discovery(nodes, num_layers)
 
     def _build_start_index(self, nodes: List[Node]) -> Dict[int, List[Node]]:
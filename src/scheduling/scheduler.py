@@ -8,10 +8,11 @@ import queue
 import threading
 import time
 from collections import deque
-from typing import Deque, Dict, List, Literal, Optional, Tuple
+from typing import Callable, Deque, Dict, List, Literal, Optional, Tuple
 
 from parallax_utils.logging_config import get_logger
 from scheduling.layer_allocation import (
+    BeamSearchLayerAllocator,
     DynamicProgrammingLayerAllocator,
     GreedyLayerAllocator,
 )
@@ -33,7 +34,7 @@ class Scheduler:
         model_info: ModelInfo,
         nodes: List[Node],
         min_nodes_bootstrapping: int = 1,
-        strategy: Literal["greedy", "dp"] = "dp",
+        strategy: Literal["greedy", "dp", "beam"] = "beam",
         routing_strategy: Literal["rr", "dp"] = "rr",
         *,
         request_arrival_horizon_sec: float = 600.0,
@@ -41,6 +42,8 @@ class Scheduler:
         water_filling_max_iterations: int = 40,
         request_warm_up_for_reshard: int = 0,
         heartbeat_timeout: float = 60.0,
+        latency_feedback_alpha: float = 0.2,
+        clock: Callable[[], float] = time.time,
     ) -> None:
         """Initialize the scheduler.
 
@@ -48,7 +51,8 @@ class Scheduler:
             model_info: Model architecture information used by allocators and routers.
             nodes: Initial list of candidate nodes.
             min_nodes_bootstrapping: Minimum nodes required to attempt initial allocation.
-            strategy: Layer allocation strategy ("dp" or "greedy").
+            strategy: Layer allocation strategy ("beam", "dp" or "greedy"). The exact "dp"
+                search is exponential in the number of nodes; "beam" scales to large clusters.
             routing_strategy: Request routing strategy ("dp" for dynamic programming, or
                 "greedy" for round-robin over complete pipelines skipping overloaded ones).
             request_arrival_horizon_sec: Sliding window horizon for arrival-rate tracking.
@@ -56,13 +60,18 @@ class Scheduler:
             water_filling_max_iterations: Max iterations for water-filling allocation.
             request_warm_up_for_reshard: Number of warm-up requests to detect truncation.
             heartbeat_timeout: Time in seconds to consider node heartbeat stale.
+            latency_feedback_alpha: EWMA weight of the decode latency observed on finished
+                requests when it is fed back into node latencies; 0 disables the feedback.
+            clock: Source of the current time in seconds, e.g. a simulator's virtual clock.
         """
         self.model_info = model_info
         self.num_layers = model_info.num_layers
 
-        allocator_class = (
-            GreedyLayerAllocator if strategy == "greedy" else DynamicProgrammingLayerAllocator
-        )
+        allocator_class = {
+            "greedy": GreedyLayerAllocator,
+            "dp": DynamicProgrammingLayerAllocator,
+            "beam": BeamSearchLayerAllocator,
+        }[strategy]
         self.layer_allocator = allocator_class(
             model_info,
             nodes,
@@ -82,12 +91,17 @@ class Scheduler:
         self._request_queue: "queue.Queue[RequestSignal]" = queue.Queue()
         self.request_arrival_horizon_sec = request_arrival_horizon_sec
         self.heartbeat_timeout = heartbeat_timeout
+        self.latency_feedback_alpha = latency_feedback_alpha
+        self.clock = clock
         self._arrival_ts: Deque[float] = deque()
 
         # Event queues for main loop orchestration (thread-safe)
         self._pending_joins: "queue.Queue[Node]" = queue.Queue()
         self._pending_leaves: "queue.Queue[str]" = queue.Queue()
         self._pending_node_updates: "queue.Queue[Tuple[str, Optional[int], Optional[float], Optional[Dict[str, float]], Optional[bool]]]" = (queue.Queue())
+        self._pending_request_finishes: (
+            "queue.Queue[Tuple[str, List[str], Optional[int], Optional[float], bool]]"
+        ) = queue.Queue()
 
         # Concurrency controls
         self._stop_event: threading.Event = threading.Event()
@@ -99,6 +113,10 @@ class Scheduler:
         # Thread-safe bootstrap state
         self._bootstrapped: bool = False
         self._bootstrapped_event: threading.Event = threading.Event()
+        # Number of global rebalances, i.e. re-bootstraps clearing existing allocations
+        self.num_global_rebalances: int = 0
+        # Bumped whenever nodes join, leave or change layer ranges; routers cache per epoch
+        self.topology_epoch: int = 0
         logger.debug(
             f"Scheduler initialized, min_nodes_bootstrapping {self.min_nodes_bootstrapping}, "
             f"strategy {strategy}, rebalance threshold {rebalance_threshold}"
@@ -141,6 +159,7 @@ class Scheduler:
         # Clear existing allocations if this is a rebalance
         if clear_existing:
             logger.debug("Performing global rebalance (clearing existing allocations)")
+            self.num_global_rebalances += 1
             self._bootstrapped = False
             self._bootstrapped_event.clear()
             for n in self.nodes:
@@ -151,6 +170,7 @@ class Scheduler:
 
         # Perform global allocation
         success = self.layer_allocator.global_allocation()
+        self._bump_topology_epoch()
         if not success:
             logger.warning("Global allocation failed to produce a full pipeline")
             return False
@@ -179,6 +199,15 @@ class Scheduler:
         """List the allocations of all nodes."""
         return self.layer_allocator.list_node_allocations()
 
+    def _bump_topology_epoch(self) -> None:
+        """Invalidate routes cached by the request router; call after allocations change."""
+        self.topology_epoch += 1
+
+    def _find_path(self) -> Tuple[List[str], float]:
+        """Route one request over the current nodes, reusing routes cached for this epoch."""
+        self.request_router.set_topology_epoch(self.topology_epoch)
+        return self.request_router.find_optimal_path(self.nodes, self.num_layers)
+
     # Warm-up and re-shard
     def _run_warmup_and_truncate(self, override_warmup_count: int = 0) -> None:
         """Run a brief warm-up to detect truncation points and shrink shards.
@@ -226,6 +255,7 @@ class Scheduler:
             elif kind == "head":
                 if layer_idx > start:
                     self.layer_allocator.reallocate(node, layer_idx, end)
+        self._bump_topology_epoch()
 
     def update_node_info(
         self,
@@ -245,7 +275,7 @@ class Scheduler:
             node.rtt_to_nodes = new_rtt_to_nodes
         if is_active is not None:
             node.is_active = is_active
-        node.last_heartbeat = time.time()
+        node.last_heartbeat = self.clock()
         # logger.debug(
         #     "Node updated: %s (requests=%s, latency_ms=%s, rtt_updates=%s)",
         #     node.node_id,
@@ -281,12 +311,104 @@ class Scheduler:
         )
         self._wake_event.set()
 
+    def enqueue_request_finished(
+        self,
+        request_id: str,
+        path: List[str],
+        *,
+        num_output_tokens: Optional[int] = None,
+        tpot_ms: Optional[float] = None,
+        aborted: bool = False,
+    ) -> None:
+        """Enqueue a request finish or abort event."""
+        self._pending_request_finishes.put((request_id, path, num_output_tokens, tpot_ms, aborted))
+        self._wake_event.set()
+
+    def request_finished(
+        self,
+        request_id: str,
+        path: List[str],
+        *,
+        num_output_tokens: Optional[int] = None,
+        tpot_ms: Optional[float] = None,
+        aborted: bool = False,
+    ) -> None:
+        """Release the slots a finished or aborted request held on its path.
+
+        Heartbeats report each node's own request count, but only periodically; releasing
+        here keeps routing from seeing requests that are already gone in the meantime.
+        The time per output token of a completed request is fed back into the latency
+        estimates of its nodes.
+
+        Args:
+            request_id: The finished request.
+            path: Node ids the request was routed through.
+            num_output_tokens: Number of generated tokens, if known.
+            tpot_ms: Observed mean time per output token in ms, if known.
+            aborted: Whether the request stopped before completing.
+        """
+        nodes = [self.node_id_to_node.get(node_id) for node_id in path]
+        for node in nodes:
+            if node is not None:
+                node.remove_request()
+        logger.debug(
+            "Request %s %s on %s (output_tokens=%s, tpot_ms=%s)",
+            request_id,
+            "aborted" if aborted else "finished",
+            path,
+            num_output_tokens,
+            tpot_ms,
+        )
+        if (
+            not aborted
+            and tpot_ms is not None
+            and self.latency_feedback_alpha > 0
+            and nodes
+            and all(node is not None for node in nodes)
+        ):
+            self._observe_path_latency(nodes, tpot_ms)
+
+    def _observe_path_latency(self, nodes: List[Node], tpot_ms: float) -> None:
+        """Scale the latency estimates of the nodes on a path towards an observed TPOT.
+
+        RTTs are taken as measured; the remaining time is split among the nodes in
+        proportion to their estimated time per token (per-layer latency times the number
+        of layers they host), and each node moves its per-layer latency towards its share
+        divided by its layer count by an EWMA step.
+        """
+        if any(node.num_current_layers <= 0 for node in nodes):
+            return
+        rtt_ms = 0.0
+        for prev, node in zip(nodes, nodes[1:]):
+            if prev.node_id != node.node_id:
+                rtt_ms += float(prev.get_rtt_to(node))
+        layer_estimates = [
+            (
+                node.avg_layer_latency_ms
+                if node.avg_layer_latency_ms is not None
+                else node.roofline_layer_latency_ms()
+            )
+            for node in nodes
+        ]
+        node_estimates = [
+            layer_ms * node.num_current_layers for node, layer_ms in zip(nodes, layer_estimates)
+        ]
+        estimated_ms = sum(node_estimates)
+        compute_ms = tpot_ms - rtt_ms
+        if not (0 < compute_ms < float("inf")) or not (0 < estimated_ms < float("inf")):
+            return
+        alpha = self.latency_feedback_alpha
+        for node, layer_ms, node_ms in zip(nodes, layer_estimates, node_estimates):
+            share_ms = compute_ms * node_ms / estimated_ms
+            observed_layer_ms = share_ms / node.num_current_layers
+            node.set_layer_latency_ms((1.0 - alpha) * layer_ms + alpha * observed_layer_ms)
+
     def checking_node_heartbeat(self) -> None:
         """Check the heartbeat of all nodes."""
         for node in self.nodes:
             if not node.is_active:
                 continue
-            if time.time() - node.last_heartbeat > self.heartbeat_timeout:
+            if self.clock() - node.last_heartbeat > self.heartbeat_timeout:
                 logger.debug(f"Node {node.node_id} heartbeat timeout")
                 self.leave(node.node_id)
 
@@ -330,6 +452,7 @@ class Scheduler:
             # Automatic layer assignment (only after bootstrap)
             self.layer_allocator.join(node)
         # If bootstrap=True and not manual, node is only declared (allocation deferred to bootstrap())
+        self._bump_topology_epoch()
 
         # Notify waiters that node count changed
         with self._node_count_cv:
@@ -344,6 +467,7 @@ class Scheduler:
             "Leaving node %s (start=%s, end=%s)", node_id, node.start_layer, node.end_layer
         )
         self.layer_allocator.leave(node_id)
+        self._bump_topology_epoch()
         if self.layer_allocator.should_global_rebalance():
             logger.debug("Global rebalance triggered due to node leave")
 
@@ -382,7 +506,7 @@ class Scheduler:
         """Add a request to the wait pool."""
         self._request_queue.put(request)
         self._wake_event.set()
-        now = time.time()
+        now = self.clock()
         self._arrival_ts.append(now)
         logger.debug(
             "Received request %s (queue_size=%d)", request.request_id, self._request_queue.qsize()
@@ -400,8 +524,8 @@ class Scheduler:
             req = None
         if req is None:
             return None
-        path, latency = self.request_router.find_optimal_path(self.nodes, self.num_layers)
-        req.routing_table = path
+        path, latency = self._find_path()
+        req.set_routing_table(path)
         # Update simple load counters
         for node_id in path:
             n = self.node_id_to_node[node_id]
@@ -499,9 +623,7 @@ class Scheduler:
         """Process joins/leaves/updates and perform heartbeat checks."""
         last_hb_check = 0.0
         while not self._stop_event.is_set():
-            self._process_node_updates()
-            self._process_joins()
-            self._process_leaves()
+            self.process_events()
             now = time.time()
             if now - last_hb_check >= max(0.5, poll_interval):
                 self.checking_node_heartbeat()
@@ -516,9 +638,9 @@ class Scheduler:
                 req = self._request_queue.get(timeout=poll_interval)
                 if req is None:
                     continue
-                path, path_rtt = self.request_router.find_optimal_path(self.nodes, self.num_layers)
+                path, path_rtt = self._find_path()
                 logger.debug(f"Path RTT: {path_rtt}")
-                req.routing_table = path
+                req.set_routing_table(path)
                 for node_id in path:
                     n = self.node_id_to_node[node_id]
                     if n is not None:
@@ -532,6 +654,17 @@ class Scheduler:
             except queue.Empty:
                 continue
 
+    def process_events(self) -> None:
+        """Apply pending node updates, request finishes, joins and leaves, in that order.
+
+        Called by the event loop; drivers that do not `run()` the scheduler (e.g. a
+        simulator) call it after enqueueing events.
+        """
+        self._process_node_updates()
+        self._process_request_finishes()
+        self._process_joins()
+        self._process_leaves()
+
     def _wait_for_bootstrap(self, poll_interval: float) -> bool:
         """Wait until enough nodes then run bootstrap. Returns False if stopped."""
         logger.debug("Waiting for bootstrap")
@@ -565,6 +698,23 @@ class Scheduler:
                 is_active=is_active,
             )
 
+    def _process_request_finishes(self) -> None:
+        """Apply pending request finish and abort events from the queue."""
+        while True:
+            try:
+                request_id, path, num_output_tokens, tpot_ms, aborted = (
+                    self._pending_request_finishes.get_nowait()
+                )
+            except queue.Empty:
+                break
+            self.request_finished(
+                request_id,
+                path,
+                num_output_tokens=num_output_tokens,
+                tpot_ms=tpot_ms,
+                aborted=aborted,
+            )
+
     def _process_joins(self) -> None:
         """Handle pending join events, honoring bootstrap state for assignment."""
         joined_any = False
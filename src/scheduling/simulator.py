@@ -0,0 +1,422 @@
+"""
+Discrete-event simulator for the global scheduler.
+
+Drives the real `Scheduler` (layer allocator and request router included) against
+synthetic nodes on a virtual clock, so allocation and routing policies can be compared
+without GPUs or a live mesh:
+    - Nodes join, leave gracefully, or fail silently and are evicted once their
+      heartbeats go stale;
+    - Requests arrive like in `benchmark_serving.get_request` (Poisson, or gamma
+      distributed gaps for bursty traffic) and are routed by the scheduler. Requests that
+      find every pipeline full wait in FIFO order until a request finishes or a node joins;
+    - Prefill and every decode step take the roofline latency of each stage on the routed
+      path, at the stage's current batch size, plus the one-way network hops around the
+      pipeline (half the RTT between consecutive stages, and back to the first stage).
+
+In-flight requests are aborted when a node on their path goes away, and all of them when
+a global rebalance reshuffles the layers, as a live mesh reloads its shards. Requests the
+scheduler routes through a silently failed node hang until the node is evicted.
+
+Example:
+    sim = ClusterSimulator(Scheduler(model_info, [], min_nodes_bootstrapping=4))
+    for node in nodes:
+        sim.add_node(node)
+    sim.fail_node(nodes[0].node_id, at_s=30.0)
+    sim.add_requests(poisson_arrivals(500, request_rate=8.0), prompt_len=512, output_len=128)
+    print(sim.run().summary())
+"""
+
+import heapq
+import itertools
+import random
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from parallax_utils.logging_config import get_logger
+from scheduling.node import Node, RequestSignal
+from scheduling.scheduler import Scheduler
+
+logger = get_logger(__name__)
+
+_PERIODIC_EVENTS = ("heartbeat", "heartbeat_check")
+
+
+def poisson_arrivals(
+    num_requests: int,
+    request_rate: float,
+    burstiness: float = 1.0,
+    start_s: float = 0.0,
+    seed: Optional[int] = None,
+) -> List[float]:
+    """Arrival times with gamma distributed gaps, as `benchmark_serving.get_request`.
+
+    Args:
+        num_requests: Number of arrivals;
+        request_rate: Mean arrival rate in requests/s; inf sends everything at `start_s`;
+        burstiness: Gamma shape; 1 is a Poisson process, lower values are burstier;
+        start_s: Time of the first arrival;
+        seed: Seed of the sampler.
+    """
+    if burstiness <= 0:
+        raise ValueError(f"A positive burstiness factor is expected, but given {burstiness}.")
+    if request_rate == float("inf"):
+        return [start_s] * num_requests
+    rng = np.random.default_rng(seed)
+    theta = 1.0 / (request_rate * burstiness)
+    gaps = rng.gamma(shape=burstiness, scale=theta, size=max(0, num_requests - 1))
+    return (start_s + np.concatenate([[0.0], np.cumsum(gaps)]))[:num_requests].tolist()
+
+
+@dataclass
+class SimRequest:
+    """A synthetic request and its timeline in virtual seconds."""
+
+    request_id: str
+    arrival_s: float
+    prompt_len: int
+    output_len: int
+    path: List[str] = field(default_factory=list)
+    dispatched_s: Optional[float] = None
+    first_token_s: Optional[float] = None
+    finish_s: Optional[float] = None
+    num_output_tokens: int = 0
+    aborted: bool = False
+
+    @property
+    def ttft_ms(self) -> float:
+        return (self.first_token_s - self.arrival_s) * 1000.0
+
+    @property
+    def tpot_ms(self) -> Optional[float]:
+        if self.num_output_tokens <= 1:
+            return None
+        return (self.finish_s - self.first_token_s) * 1000.0 / (self.num_output_tokens - 1)
+
+
+@dataclass
+class SimulationReport:
+    """Aggregate results of a simulation run."""
+
+    duration_s: float
+    num_requests: int
+    num_completed: int
+    num_aborted: int
+    num_unserved: int
+    output_tokens: int
+    num_global_rebalances: int
+    num_joins: int
+    num_leaves: int
+    ttft_ms: Dict[str, float]
+    tpot_ms: Dict[str, float]
+
+    @property
+    def request_throughput(self) -> float:
+        return self.num_completed / self.duration_s if self.duration_s > 0 else 0.0
+
+    @property
+    def output_throughput(self) -> float:
+        return self.output_tokens / self.duration_s if self.duration_s > 0 else 0.0
+
+    def summary(self) -> str:
+        lines = [
+            f"Duration (s):               {self.duration_s:.2f}",
+            f"Requests completed/total:   {self.num_completed}/{self.num_requests}",
+            f"Requests aborted:           {self.num_aborted}",
+            f"Requests never served:      {self.num_unserved}",
+            f"Request throughput (req/s): {self.request_throughput:.2f}",
+            f"Output throughput (tok/s):  {self.output_throughput:.2f}",
+            f"Joins / leaves:             {self.num_joins} / {self.num_leaves}",
+            f"Global rebalances:          {self.num_global_rebalances}",
+        ]
+        for name, stats in (("TTFT", self.ttft_ms), ("TPOT", self.tpot_ms)):
+            lines.append(
+                f"{name} (ms):                  "
+                + " ".join(f"{key}={value:.2f}" for key, value in stats.items())
+            )
+        return "\n".join(lines)
+
+
+def _percentiles(values: Sequence[float], percentiles: Sequence[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    stats = {"mean": float(np.mean(values))}
+    for p in percentiles:
+        stats[f"p{p:g}"] = float(np.percentile(values, p))
+    return stats
+
+
+class ClusterSimulator:
+    """Replays node and request events against a `Scheduler` on a virtual clock."""
+
+    def __init__(
+        self,
+        scheduler: Scheduler,
+        *,
+        heartbeat_interval_s: float = 1.0,
+        unknown_rtt_ms: float = 10.0,
+        percentiles: Sequence[float] = (50, 90, 99),
+    ):
+        """
+        Args:
+            scheduler: Scheduler under test; its clock is replaced by the simulator's.
+                It must not be `run()`, the simulator processes its events;
+            heartbeat_interval_s: Interval of node heartbeats and of the scheduler's
+                stale-heartbeat check;
+            unknown_rtt_ms: RTT assumed between nodes without a measurement;
+            percentiles: TTFT / TPOT percentiles to report.
+        """
+        self.scheduler = scheduler
+        self.scheduler.clock = lambda: self.now
+        self.heartbeat_interval_s = heartbeat_interval_s
+        self.unknown_rtt_ms = unknown_rtt_ms
+        self.percentiles = percentiles
+
+        self.now = 0.0
+        self._events: List[Tuple[float, int, str, object]] = []
+        self._seq = itertools.count()
+        # Pending events other than the periodic heartbeats
+        self._num_pending = 0
+        self._nodes: Dict[str, Node] = {}
+        # Nodes that serve and heartbeat, i.e. joined and neither left nor failed
+        self._alive: Set[str] = set()
+        self.requests: List[SimRequest] = []
+        self._in_flight: Dict[str, SimRequest] = {}
+        self._waiting: Deque[SimRequest] = deque()
+        self._num_rebalances_seen = scheduler.num_global_rebalances
+        self.num_joins = 0
+        self.num_leaves = 0
+
+    # Scenario
+    def add_node(self, node: Node, at_s: float = 0.0) -> None:
+        """Schedules `node` to join the cluster at `at_s`."""
+        self._push(at_s, "join", node)
+
+    def remove_node(self, node_id: str, at_s: float) -> None:
+        """Schedules a graceful leave: the scheduler is told right away."""
+        self._push(at_s, "leave", node_id)
+
+    def fail_node(self, node_id: str, at_s: float) -> None:
+        """Schedules a silent failure: the node stops serving and heartbeating, and the
+        scheduler only notices once its heartbeat times out."""
+        self._push(at_s, "fail", node_id)
+
+    def add_requests(
+        self,
+        arrival_times: Sequence[float],
+        prompt_len: int = 512,
+        output_len: int = 128,
+        range_ratio: float = 0.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        """Schedules requests with lengths drawn uniformly within +/- `range_ratio`."""
+        rng = random.Random(seed)
+
+        def draw(length: int) -> int:
+            low = max(1, int(length * (1.0 - range_ratio)))
+            return rng.randint(low, max(low, int(length * (1.0 + range_ratio))))
+
+        for arrival_s in arrival_times:
+            request = SimRequest(
+                request_id=f"sim-{len(self.requests)}",
+                arrival_s=float(arrival_s),
+                prompt_len=draw(prompt_len),
+                output_len=draw(output_len),
+            )
+            self.requests.append(request)
+            self._push(request.arrival_s, "arrival", request)
+
+    # Event loop
+    def run(self, until_s: Optional[float] = None) -> SimulationReport:
+        """Processes events until all requests are done or `until_s` is reached."""
+        self._push(self.now, "heartbeat_check", None)
+        while self._events:
+            at_s, _, kind, payload = self._events[0]
+            if until_s is not None and at_s > until_s:
+                self.now = until_s
+                break
+            if kind in _PERIODIC_EVENTS and self._num_pending == 0 and not self._in_flight:
+                # Only heartbeats are left and nothing can make progress anymore
+                break
+            heapq.heappop(self._events)
+            if kind not in _PERIODIC_EVENTS:
+                self._num_pending -= 1
+            self.now = at_s
+            getattr(self, f"_on_{kind}")(payload)
+        return self.report()
+
+    def report(self) -> SimulationReport:
+        completed = [r for r in self.requests if r.finish_s is not None]
+        ttfts = [r.ttft_ms for r in self.requests if r.first_token_s is not None]
+        tpots = [r.tpot_ms for r in completed if r.tpot_ms is not None]
+        start_s = min((r.arrival_s for r in self.requests), default=0.0)
+        end_s = max((r.finish_s for r in completed), default=self.now)
+        return SimulationReport(
+            duration_s=end_s - start_s,
+            num_requests=len(self.requests),
+            num_completed=len(completed),
+            num_aborted=sum(r.aborted for r in self.requests),
+            num_unserved=sum(r.dispatched_s is None for r in self.requests),
+            output_tokens=sum(r.num_output_tokens for r in completed),
+            num_global_rebalances=self.scheduler.num_global_rebalances,
+            num_joins=self.num_joins,
+            num_leaves=self.num_leaves,
+            ttft_ms=_percentiles(ttfts, self.percentiles),
+            tpot_ms=_percentiles(tpots, self.percentiles),
+        )
+
+    def _push(self, at_s: float, kind: str, payload: object) -> None:
+        if kind not in _PERIODIC_EVENTS:
+            self._num_pending += 1
+        heapq.heappush(self._events, (at_s, next(self._seq), kind, payload))
+
+    def _process_scheduler_events(self) -> None:
+        self.scheduler.process_events()
+        self._check_rebalance()
+
+    def _check_rebalance(self) -> None:
+        if self.scheduler.num_global_rebalances != self._num_rebalances_seen:
+            self._num_rebalances_seen = self.scheduler.num_global_rebalances
+            # Layers moved: every node reloads its shard
+            for request in list(self._in_flight.values()):
+                self._abort(request)
+
+    # Node events
+    def _on_join(self, node: Node) -> None:
+        node.last_heartbeat = self.now
+        self._nodes[node.node_id] = node
+        self._alive.add(node.node_id)
+        self.num_joins += 1
+        self.scheduler.enqueue_join(node)
+        self._process_scheduler_events()
+        self._push(self.now + self.heartbeat_interval_s, "heartbeat", node.node_id)
+        self._dispatch_waiting()
+
+    def _on_leave(self, node_id: str) -> None:
+        self._on_fail(node_id)
+        self.scheduler.enqueue_leave(node_id)
+        self._process_scheduler_events()
+        self._dispatch_waiting()
+
+    def _on_fail(self, node_id: str) -> None:
+        if node_id not in self._alive:
+            return
+        self._alive.discard(node_id)
+        self.num_leaves += 1
+        for request in list(self._in_flight.values()):
+            if node_id in request.path:
+                self._abort(request)
+
+    def _on_heartbeat(self, node_id: str) -> None:
+        if node_id not in self._alive:
+            return
+        node = self._nodes[node_id]
+        self.scheduler.enqueue_node_update(
+            node_id, current_requests=node.current_requests, is_active=True
+        )
+        self._process_scheduler_events()
+        self._push(self.now + self.heartbeat_interval_s, "heartbeat", node_id)
+
+    def _on_heartbeat_check(self, _) -> None:
+        self.scheduler.checking_node_heartbeat()
+        self._check_rebalance()
+        for request in list(self._in_flight.values()):
+            if any(node_id not in self.scheduler.node_id_to_node for node_id in request.path):
+                self._abort(request)
+        self._dispatch_waiting()
+        self._push(self.now + self.heartbeat_interval_s, "heartbeat_check", None)
+
+    # Request events
+    def _on_arrival(self, request: SimRequest) -> None:
+        if self._waiting:
+            # Earlier requests are still waiting for capacity
+            self._waiting.append(request)
+            return
+        if not self._dispatch(request):
+            self._waiting.append(request)
+
+    def _dispatch(self, request: SimRequest) -> bool:
+        self.scheduler.receive_request(RequestSignal(request.request_id, self.now))
+        dispatched = self.scheduler.dispatch_next_request()
+        path = dispatched[1] if dispatched is not None else []
+        if not path:
+            return False
+        request.path = path
+        request.dispatched_s = self.now
+        self._in_flight[request.request_id] = request
+        if all(node_id in self._alive for node_id in path):
+            self._push(self.now + self._prefill_latency_s(request), "token", request)
+        # Otherwise it was routed through a node that failed silently: the request hangs,
+        # holding its slots, until the scheduler evicts the node
+        return True
+
+    def _dispatch_waiting(self) -> None:
+        while self._waiting and self._dispatch(self._waiting[0]):
+            self._waiting.popleft()
+
+    def _on_token(self, request: SimRequest) -> None:
+        if request.aborted:
+            return
+        request.num_output_tokens += 1
+        if request.first_token_s is None:
+            request.first_token_s = self.now
+        if request.num_output_tokens < request.output_len:
+            self._push(self.now + self._decode_latency_s(request), "token", request)
+            return
+        request.finish_s = self.now
+        self._release(request)
+        self._dispatch_waiting()
+
+    def _abort(self, request: SimRequest) -> None:
+        request.aborted = True
+        self._release(request)
+
+    def _release(self, request: SimRequest) -> None:
+        self._in_flight.pop(request.request_id, None)
+        # As the backend gateway does; the latency model stays fixed, so no TPOT is reported
+        self.scheduler.request_finished(
+            request.request_id,
+            request.path,
+            num_output_tokens=request.num_output_tokens,
+            aborted=request.aborted,
+        )
+
+    # Latency model
+    def _path_nodes(self, request: SimRequest) -> List[Node]:
+        return [self._nodes[node_id] for node_id in request.path]
+
+    def _hops_ms(self, nodes: List[Node]) -> float:
+        """One-way hops through the pipeline and back to its first stage."""
+        total = 0.0
+        for prev, cur in zip(nodes, nodes[1:] + nodes[:1]):
+            if prev is cur:
+                continue
+            rtt = (prev.rtt_to_nodes or {}).get(cur.node_id, self.unknown_rtt_ms)
+            total += rtt / 2.0
+        return total
+
+    def _stage_latency_ms(self, node: Node, batch_size: int, prompt_len: int = 0) -> float:
+        num_layers = node.num_current_layers
+        if num_layers <= 0:
+            return 0.0
+        model = node.roofline_model(batch_size=max(1, batch_size))
+        if prompt_len > 0:
+            model.set_sequence_shape(target_seq_len=prompt_len, source_seq_len=prompt_len)
+        per_layer_ms = model.roofline_layer_latency_ms(
+            include_input_embed=node.has_embedding,
+            include_lm_head=node.has_lm_head,
+            num_current_layers=num_layers,
+        )
+        return per_layer_ms * num_layers
+
+    def _prefill_latency_s(self, request: SimRequest) -> float:
+        nodes = self._path_nodes(request)
+        latency_ms = sum(self._stage_latency_ms(n, 1, request.prompt_len) for n in nodes)
+        return (latency_ms + self._hops_ms(nodes)) / 1000.0
+
+    def _decode_latency_s(self, request: SimRequest) -> float:
+        nodes = self._path_nodes(request)
+        latency_ms = sum(self._stage_latency_ms(n, n.current_requests) for n in nodes)
+        return (latency_ms + self._hops_ms(nodes)) / 1000.0
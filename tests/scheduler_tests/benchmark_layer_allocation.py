@@ -0,0 +1,158 @@
+"""
+Benchmark layer allocation strategies on large heterogeneous clusters.
+
+Builds clusters of 8 to 256 nodes from the GPU presets in `test_utils`, spread over a few
+regions with RTTs derived from their coordinates, and compares for each strategy:
+    - runtime of `global_allocation`;
+    - pipelines formed and total stages;
+    - average pipeline latency (roofline layer latency plus RTTs between stages);
+    - score k^2 / avg latency, the objective both DP and beam search maximize.
+
+The exact DP search grows exponentially with the cluster, so every run is bounded by a
+timeout and reported as such when it does not finish.
+
+Run from the repository root:
+    PYTHONPATH=src python -m tests.scheduler_tests.benchmark_layer_allocation \
+        --num-nodes 8 16 32 64 128 256 --strategies greedy dp beam
+"""
+
+import argparse
+import multiprocessing
+import random
+import time
+from typing import Dict, List, Optional
+
+from scheduling.layer_allocation import (
+    BeamSearchLayerAllocator,
+    DynamicProgrammingLayerAllocator,
+    GreedyLayerAllocator,
+)
+from scheduling.node import Node
+
+from .test_utils import (
+    A100_40G,
+    A100_80G,
+    RTX4090,
+    RTX5090,
+    build_model_info,
+    build_node,
+    set_rtt_from_coords,
+)
+
+ALLOCATORS = {
+    "greedy": GreedyLayerAllocator,
+    "dp": DynamicProgrammingLayerAllocator,
+    "beam": BeamSearchLayerAllocator,
+}
+PRESETS = [A100_80G, A100_40G, RTX5090, RTX4090]
+
+
+def build_cluster(num_nodes: int, num_layers: int, num_regions: int, seed: int) -> List[Node]:
+    """Random mix of preset GPUs scattered around `num_regions` region centers."""
+    rng = random.Random(seed)
+    model = build_model_info(num_layers)
+    centers = [(rng.uniform(0, 1000), rng.uniform(0, 1000)) for _ in range(num_regions)]
+    nodes = []
+    for i in range(num_nodes):
+        hw = rng.choice(PRESETS)
+        cx, cy = rng.choice(centers)
+        nodes.append(
+            build_node(
+                f"{hw.node_id}-{i}",
+                model,
+                tflops=hw.tflops_fp16,
+                mem_gb=hw.memory_gb,
+                x=cx + rng.gauss(0, 10),
+                y=cy + rng.gauss(0, 10),
+                mem_bandwidth_gbps=hw.memory_bandwidth_gbps,
+            )
+        )
+    set_rtt_from_coords(nodes)
+    return nodes
+
+
+def pipeline_latency_ms(pipeline: List[Node]) -> float:
+    """Roofline latency of one pass through an allocated pipeline, including hops."""
+    stages = sorted(pipeline, key=lambda n: n.start_layer)
+    latency = sum(
+        n.num_current_layers * n.roofline_model(batch_size=1).roofline_layer_latency_ms()
+        for n in stages
+    )
+    for prev, cur in zip(stages, stages[1:]):
+        latency += prev.get_rtt_to(cur)
+    return latency
+
+
+def run_allocator(
+    strategy: str, num_nodes: int, num_layers: int, num_regions: int, seed: int
+) -> Dict[str, float]:
+    nodes = build_cluster(num_nodes, num_layers, num_regions, seed)
+    allocator = ALLOCATORS[strategy](nodes[0].model_info, nodes, assign_left_over_nodes=False)
+
+    # Record the pipelines the allocator hands to in-place rebalancing
+    pipelines: List[List[Node]] = []
+    adjust = allocator.adjust_pipeline_layers
+
+    def record(pipeline_nodes, *args, **kwargs):
+        pipelines.append(list(pipeline_nodes))
+        return adjust(pipeline_nodes, *args, **kwargs)
+
+    allocator.adjust_pipeline_layers = record
+
+    start = time.perf_counter()
+    ok = allocator.global_allocation()
+    elapsed = time.perf_counter() - start
+    if not ok or not pipelines:
+        return {"runtime_s": elapsed, "pipelines": 0, "stages": 0, "latency_ms": 0.0, "score": 0.0}
+    latencies = [pipeline_latency_ms(p) for p in pipelines]
+    avg_latency = sum(latencies) / len(latencies)
+    return {
+        "runtime_s": elapsed,
+        "pipelines": len(pipelines),
+        "stages": sum(len(p) for p in pipelines),
+        "latency_ms": avg_latency,
+        "score": len(pipelines) ** 2 / avg_latency,
+    }
+
+
+def run_with_timeout(timeout_s: float, *args) -> Optional[Dict[str, float]]:
+    """Runs `run_allocator` in a worker process, None if it does not finish in time."""
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply_async(run_allocator, args).get(timeout_s)
+    except multiprocessing.TimeoutError:
+        return None
+    finally:
+        pool.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--num-nodes", type=int, nargs="+", default=[8, 16, 32, 64, 128, 256])
+    parser.add_argument("--num-layers", type=int, default=36)
+    parser.add_argument("--num-regions", type=int, default=4)
+    parser.add_argument("--strategies", nargs="+", default=list(ALLOCATORS), choices=ALLOCATORS)
+    parser.add_argument("--timeout-s", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    header = f"{'nodes':>6} {'strategy':>8} {'runtime_s':>10} {'pipes':>6} {'stages':>7} "
+    header += f"{'latency_ms':>11} {'score':>8}"
+    print(header)
+    for num_nodes in args.num_nodes:
+        for strategy in args.strategies:
+            result = run_with_timeout(
+                args.timeout_s, strategy, num_nodes, args.num_layers, args.num_regions, args.seed
+            )
+            if result is None:
+                print(f"{num_nodes:>6} {strategy:>8} {'> ' + str(args.timeout_s):>10}  timed out")
+                continue
+            print(
+                f"{num_nodes:>6} {strategy:>8} {result['runtime_s']:>10.3f} "
+                f"{result['pipelines']:>6} {result['stages']:>7} "
+                f"{result['latency_ms']:>11.2f} {result['score']:>8.4f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
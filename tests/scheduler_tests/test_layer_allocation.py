@@ -5,7 +5,7 @@ Covers:
 - Capacity sanity for `Node`
 - Water-filling rebalancing within a pipeline (stage splits across heterogeneous nodes)
 - Gap-patch dynamic rebalancing (join/leave behavior)
-- Greedy and DP allocators producing contiguous [start, end) layer ranges
+- Greedy, DP and beam search allocators producing contiguous [start, end) layer ranges
 """
 
 from collections import Counter
@@ -15,13 +15,20 @@ import pytest
 
 from scheduling.layer_allocation import (
     BaseLayerAllocator,
+    BeamSearchLayerAllocator,
     DynamicProgrammingLayerAllocator,
     GreedyLayerAllocator,
 )
 from scheduling.model_info import ModelInfo
 from scheduling.node import Node, NodeHardwareInfo
 
-from .test_utils import build_model_info
+from .test_utils import build_model_info, build_node, set_rtt_from_coords
+
+ALLOCATORS = {
+    "greedy": GreedyLayerAllocator,
+    "dp": DynamicProgrammingLayerAllocator,
+    "beam": BeamSearchLayerAllocator,
+}
 
 
 def _build_node(gpu_type: str, model: ModelInfo, id_suffix: str = "") -> Node:
@@ -132,6 +139,7 @@ def _test_gap_patch_rebalance(allocator: BaseLayerAllocator):
         # Six A100-80g: expect two pipelines, 12 each per stage in creation order
         (36, (6, 0, 0, 0), [(0, 12), (12, 24), (24, 36), (0, 12), (12, 24), (24, 36)], "greedy"),
         (36, (6, 0, 0, 0), [(0, 12), (12, 24), (24, 36), (0, 12), (12, 24), (24, 36)], "dp"),
+        (36, (6, 0, 0, 0), [(0, 12), (12, 24), (24, 36), (0, 12), (12, 24), (24, 36)], "beam"),
         # 22 Layers, capacity (13, 13, 6, 6, 3, 3) -> greedy assigns (11, 11)
         (
             22,
@@ -156,6 +164,30 @@ def _test_gap_patch_rebalance(allocator: BaseLayerAllocator):
             ],
             "dp",
         ),
+        # Beam search finds the same two pipelines
+        (
+            22,
+            (2, 2, 0, 2),
+            [
+                (0, 13),
+                (13, 19),
+                (19, 22),
+                (0, 13),
+                (13, 19),
+                (19, 22),
+            ],
+            "beam",
+        ),
+        # Beam search scores by latency: the faster RTX5090 closes the single pipeline
+        (
+            14,
+            (1, 0, 2, 2),
+            [
+                (0, 10),
+                (10, 14),
+            ],
+            "beam",
+        ),
         # 14 Layers, capacity (13, 5, 5, 3, 3) -> greedy assigns (10, 4)
         (
             14,
@@ -184,7 +216,7 @@ def test_allocator(
     num_layers: int,
     counts: tuple[int, int, int, int],
     expected_ranges: list[tuple[int, int]],
-    strategy: Literal["greedy", "dp"],
+    strategy: Literal["greedy", "dp", "beam"],
 ):
     """Test allocator with greedy and dp strategies."""
     model = build_model_info(num_layers)
@@ -201,11 +233,7 @@ def test_allocator(
     for i in range(n_4090):
         nodes.append(_build_node("rtx4090", model, id_suffix=f"-{i}"))
 
-    allocator = (
-        GreedyLayerAllocator(model, nodes, assign_left_over_nodes=False)
-        if strategy == "greedy"
-        else DynamicProgrammingLayerAllocator(model, nodes, assign_left_over_nodes=False)
-    )
+    allocator = ALLOCATORS[strategy](model, nodes, assign_left_over_nodes=False)
     allocator.global_allocation()
     _test_gap_patch_rebalance(allocator)
 
@@ -227,34 +255,26 @@ def test_allocator(
     ), f"Stage ranges mismatch (order-insensitive):\nactual={actual_trimmed}\nexpected={expected_ranges}"
 
 
-@pytest.mark.parametrize("strategy", ["greedy", "dp"])
-def test_single_node_can_host_all_layers_greedy(strategy: Literal["greedy", "dp"]):
+@pytest.mark.parametrize("strategy", ["greedy", "dp", "beam"])
+def test_single_node_can_host_all_layers_greedy(strategy: Literal["greedy", "dp", "beam"]):
     """Small model fully hosted by a single strong node (A100-80g)."""
     model = build_model_info(5)
     node = _build_node("a100-80g", model)
-    alloc = (
-        GreedyLayerAllocator(model, [node])
-        if strategy == "greedy"
-        else DynamicProgrammingLayerAllocator(model, [node])
-    )
+    alloc = ALLOCATORS[strategy](model, [node])
     initialized = alloc.global_allocation()
     assert initialized is True
     assert alloc.has_full_pipeline() is True
     assert node.start_layer == 0 and node.end_layer == model.num_layers
 
 
-@pytest.mark.parametrize("strategy", ["greedy", "dp"])
-def test_mixed_pool_single_host_available(strategy: Literal["greedy", "dp"]):
+@pytest.mark.parametrize("strategy", ["greedy", "dp", "beam"])
+def test_mixed_pool_single_host_available(strategy: Literal["greedy", "dp", "beam"]):
     """Intermediate model: one A100 can host alone; others (4090) remain unused."""
     model = build_model_info(6)
     a100 = _build_node("a100-80g", model, id_suffix="-a")
     r1 = _build_node("rtx4090", model, id_suffix="-1")
     r2 = _build_node("rtx4090", model, id_suffix="-2")
-    alloc = (
-        GreedyLayerAllocator(model, [a100, r1, r2])
-        if strategy == "greedy"
-        else DynamicProgrammingLayerAllocator(model, [a100, r1, r2])
-    )
+    alloc = ALLOCATORS[strategy](model, [a100, r1, r2])
     initialized = alloc.global_allocation()
     assert initialized is True
     # A100 should cover entire model
@@ -263,16 +283,12 @@ def test_mixed_pool_single_host_available(strategy: Literal["greedy", "dp"]):
     assert r2.start_layer == 3 and r2.end_layer == model.num_layers
 
 
-@pytest.mark.parametrize("strategy", ["greedy", "dp"])
-def test_pipeline_required_with_midrange_only(strategy: Literal["greedy", "dp"]):
+@pytest.mark.parametrize("strategy", ["greedy", "dp", "beam"])
+def test_pipeline_required_with_midrange_only(strategy: Literal["greedy", "dp", "beam"]):
     """Model requires pipeline across multiple mid-range GPUs (RTX4090)."""
     model = build_model_info(7)
     nodes = [_build_node("rtx4090", model, id_suffix=f"-{i}") for i in range(3)]
-    alloc = (
-        GreedyLayerAllocator(model, nodes)
-        if strategy == "greedy"
-        else DynamicProgrammingLayerAllocator(model, nodes)
-    )
+    alloc = ALLOCATORS[strategy](model, nodes)
     ok = alloc.global_allocation()
     assert ok is True
     # At least two nodes should be assigned to cover 7 layers
@@ -282,8 +298,8 @@ def test_pipeline_required_with_midrange_only(strategy: Literal["greedy", "dp"])
     assert total == model.num_layers
 
 
-@pytest.mark.parametrize("strategy", ["greedy", "dp"])
-def test_allocator_does_not_duplicate_leftover_nodes(strategy: Literal["greedy", "dp"]):
+@pytest.mark.parametrize("strategy", ["greedy", "dp", "beam"])
+def test_allocator_does_not_duplicate_leftover_nodes(strategy: Literal["greedy", "dp", "beam"]):
     """Both allocators should not duplicate self.nodes when left over after allocation.
 
     Greedy: builds multiple pipelines, leaves nodes that can't form another pipeline
@@ -307,11 +323,40 @@ def test_allocator_does_not_duplicate_leftover_nodes(strategy: Literal["greedy",
         nodes = [a100, r1]
         expected_node_count = 2
 
-    alloc = (
-        GreedyLayerAllocator(model, nodes)
-        if strategy == "greedy"
-        else DynamicProgrammingLayerAllocator(model, nodes)
-    )
+    alloc = ALLOCATORS[strategy](model, nodes)
     ok = alloc.global_allocation()
     assert ok is True
     assert len(alloc.nodes) == expected_node_count, "Should not duplicate nodes during allocation"
+
+
+def test_beam_search_keeps_pipelines_within_a_region():
+    """Beam search pairs up nearby nodes when every pairing needs the same stages."""
+    model = build_model_info(12)
+    nodes = [
+        build_node("a0", model, mem_gb=40.0, x=0.0),
+        build_node("b0", model, mem_gb=40.0, x=100.0),
+        build_node("a1", model, mem_gb=40.0, x=1.0),
+        build_node("b1", model, mem_gb=40.0, x=101.0),
+    ]
+    set_rtt_from_coords(nodes)
+    alloc = BeamSearchLayerAllocator(model, nodes)
+    assert alloc.global_allocation() is True
+
+    ranges = {n.node_id: (n.start_layer, n.end_layer) for n in nodes}
+    assert {ranges["a0"], ranges["a1"]} == {(0, 6), (6, 12)}
+    assert {ranges["b0"], ranges["b1"]} == {(0, 6), (6, 12)}
+
+
+@pytest.mark.parametrize("counts", [(4, 4, 0, 4), (2, 3, 3, 4), (0, 4, 4, 4)])
+def test_beam_search_matches_dp_plan(counts: tuple[int, int, int, int]):
+    """On clusters small enough for the exact DP, beam search forms as many pipelines."""
+    model = build_model_info(36)
+    plans = {}
+    for strategy in ("dp", "beam"):
+        nodes: list[Node] = []
+        for gpu_type, count in zip(("a100-80g", "a100-40g", "rtx5090", "rtx4090"), counts):
+            nodes.extend(_build_node(gpu_type, model, id_suffix=f"-{i}") for i in range(count))
+        alloc = ALLOCATORS[strategy](model, nodes, assign_left_over_nodes=False)
+        assert alloc.global_allocation() is True
+        plans[strategy] = len(alloc.embedding_node_ids)
+    assert plans["beam"] == plans["dp"]
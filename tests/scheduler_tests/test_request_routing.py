@@ -6,6 +6,7 @@ Covers:
 - Turning point detection via layer-level DP
 - Parametrized scenarios with different splits/overlaps
 - Round-robin baseline pipeline routing and overload skipping
+- Candidate pipelines cached per topology epoch
 """
 
 import pytest
@@ -153,6 +154,84 @@ def test_turning_points(
     assert set(turns) == set(expected_turns)
 
 
+def _two_pipeline_nodes(num_layers: int = 12) -> list[Node]:
+    model = build_model(num_layers)
+    nodes = []
+    for nid, s, e, x, y in [
+        ("a", 0, 6, 0.0, 0.0),
+        ("b", 6, 12, 1.0, 0.0),
+        ("c", 0, 4, 0.0, 1.0),
+        ("d", 4, 12, 1.0, 1.0),
+    ]:
+        n = build_node(nid, model, tflops=200.0, x=x, y=y)
+        n.set_layer_allocation(s, e)
+        n.set_layer_latency_ms(10.0)
+        nodes.append(n)
+    set_rtt_from_coords(nodes)
+    return nodes
+
+
+def test_optimal_path_rescores_cached_candidates():
+    """Within an epoch, cached pipelines are re-scored with current latency and activity."""
+    num_layers = 12
+    nodes = _two_pipeline_nodes(num_layers)
+    a, b, c, d = nodes
+    c.set_layer_latency_ms(100.0)
+
+    router = DynamicProgrammingRouting()
+    router.set_topology_epoch(1)
+    assert router.find_optimal_path(nodes, num_layers)[0] == ["a", "b"]
+    assert router.find_optimal_path(nodes, num_layers) == router.shard_dp_path(nodes, num_layers)
+
+    # Load shifts are picked up without rediscovery
+    c.set_layer_latency_ms(10.0)
+    b.set_layer_latency_ms(100.0)
+    node_ids, latency = router.find_optimal_path(nodes, num_layers)
+    assert node_ids == ["c", "d"]
+    expected = float(c.layer_latency_ms) + float(c.get_rtt_to(d)) + float(d.layer_latency_ms)
+    assert latency == pytest.approx(expected, rel=1e-6)
+
+    # Inactive nodes are skipped, and nothing is left once both pipelines are down
+    d.is_active = False
+    assert router.find_optimal_path(nodes, num_layers)[0] == ["a", "b"]
+    a.is_active = False
+    assert router.find_optimal_path(nodes, num_layers) == ([], float("inf"))
+
+
+def test_optimal_path_rediscovers_on_new_epoch():
+    """Allocation changes are only seen once the topology epoch moves on."""
+    num_layers = 12
+    nodes = _two_pipeline_nodes(num_layers)
+    a, b, c, d = nodes
+
+    router = DynamicProgrammingRouting()
+    router.set_topology_epoch(1)
+    assert router.find_optimal_path(nodes, num_layers)[0] in (["a", "b"], ["c", "d"])
+
+    # A single node now holds the whole model; cached candidates do not include it yet
+    solo = build_node("solo", a.model_info, tflops=200.0, x=0.0, y=0.0)
+    solo.set_layer_allocation(0, num_layers)
+    solo.set_layer_latency_ms(1.0)
+    nodes.append(solo)
+    set_rtt_from_coords(nodes)
+    assert router.find_optimal_path(nodes, num_layers)[0] != ["solo"]
+
+    router.set_topology_epoch(2)
+    assert router.find_optimal_path(nodes, num_layers)[0] == ["solo"]
+
+
+def test_optimal_path_falls_back_to_dp_with_many_candidates():
+    """Too many complete pipelines to cache: every request runs the shard-level DP."""
+    num_layers = 12
+    nodes = _two_pipeline_nodes(num_layers)
+    nodes[0].set_layer_latency_ms(100.0)
+
+    router = DynamicProgrammingRouting(max_candidate_pipelines=1)
+    router.set_topology_epoch(1)
+    assert router.find_optimal_path(nodes, num_layers) == router.shard_dp_path(nodes, num_layers)
+    assert router.find_optimal_path(nodes, num_layers)[0] == ["c", "d"]
+
+
 def test_round_robin_pipelines_cycle_between_two_complete_paths():
     """Two complete pipelines -> round-robin alternates between them deterministically."""
     num_layers = 12
@@ -281,3 +360,20 @@ def test_round_robin_pipeline_discovery_overlapping_heads_and_tails():
     )
     has_expected2 = any(matches_path(r, expected2) for r in ranges)
     assert has_expected1 and has_expected2
+
+
+def test_round_robin_rediscovers_pipelines_on_new_epoch():
+    """Cached pipelines are dropped when the topology epoch changes."""
+    num_layers = 12
+    nodes = _two_pipeline_nodes(num_layers)
+    rr = RoundRobinPipelineRouting()
+    rr.set_topology_epoch(1)
+    rr.find_optimal_path(nodes, num_layers)
+
+    # "c" and "d" are reassigned to split [0, 12) at a different layer
+    nodes[2].set_layer_allocation(0, 5)
+    nodes[3].set_layer_allocation(5, 12)
+    rr.set_topology_epoch(2)
+    paths = {tuple(rr.find_optimal_path(nodes, num_layers)[0]) for _ in range(2)}
+    assert paths == {("a", "b"), ("c", "d")}
+    assert rr.pipeline_discovery(nodes, num_layers) == [["a", "b"], ["c", "d"]]
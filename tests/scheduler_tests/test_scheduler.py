@@ -4,6 +4,8 @@ Minimal tests for the Scheduler orchestrator.
 
 from __future__ import annotations
 
+import pytest
+
 from scheduling.node import RequestSignal
 from scheduling.scheduler import Scheduler
 
@@ -54,6 +56,33 @@ def test_scheduler_join_and_leave():
     assert n3 not in sched.nodes
 
 
+def test_scheduler_topology_epoch_invalidates_routes():
+    """Joins and leaves bump the topology epoch so routers stop using departed nodes."""
+    model = build_model_info(12)
+    n1 = build_node("a100-0", model, tflops=312.0, mem_gb=80.0, x=0, y=0)
+    n2 = build_node("a100-1", model, tflops=312.0, mem_gb=80.0, x=1, y=0)
+    set_rtt_from_coords([n1, n2])
+    sched = Scheduler(
+        model, [], strategy="greedy", routing_strategy="dp", min_nodes_bootstrapping=2
+    )
+    sched.join(n1, bootstrap=True)
+    sched.join(n2, bootstrap=True)
+    assert sched.bootstrap()
+    epoch = sched.topology_epoch
+
+    sched.receive_request(RequestSignal(request_id="req-1"))
+    _, path, _ = sched.dispatch_next_request()
+    assert path
+    assert sched.request_router.topology_epoch == epoch
+
+    departed = path[0]
+    sched.leave(departed)
+    assert sched.topology_epoch > epoch
+    sched.receive_request(RequestSignal(request_id="req-2"))
+    _, path, _ = sched.dispatch_next_request()
+    assert departed not in path
+
+
 def test_scheduler_bootstrap_wait_and_dynamic_events():
     """Scheduler waits for min nodes, bootstraps, then handles join/leave events."""
     model = build_model_info(12)
@@ -239,3 +268,40 @@ def test_scheduler_three_nodes_sequential_join_leave_rejoin():
     # Verify full pipeline coverage
     total_covered = sum(e - s for _, s, e in allocations)
     assert total_covered >= model.num_layers, "All layers should be covered"
+
+
+def test_scheduler_request_finished_releases_load_and_feeds_latency():
+    """Finish events free the slots taken at dispatch and nudge node latencies."""
+    model = build_model_info(12)
+    n1 = build_node("n1", model, tflops=200.0, x=0.0, y=0.0)
+    n2 = build_node("n2", model, tflops=200.0, x=1.0, y=0.0)
+    n1.set_layer_allocation(0, 6)
+    n2.set_layer_allocation(6, 12)
+    set_rtt_from_coords([n1, n2])
+    sched = Scheduler(model, [n1, n2], min_nodes_bootstrapping=3, latency_feedback_alpha=0.5)
+    for n in (n1, n2):
+        n.set_layer_latency_ms(10.0)
+
+    for i in range(2):
+        sched.receive_request(RequestSignal(request_id=f"req-{i}"))
+        _, path, _ = sched.dispatch_next_request()
+        assert path == ["n1", "n2"]
+    assert n1.current_requests == n2.current_requests == 2
+
+    # Aborts release slots without touching latency estimates
+    sched.enqueue_request_finished("req-0", path, aborted=True, tpot_ms=1000.0)
+    sched.process_events()
+    assert n1.current_requests == n2.current_requests == 1
+    assert n1.avg_layer_latency_ms == n2.avg_layer_latency_ms == 10.0
+
+    # 2 nodes x 6 layers x 10 ms estimate 120 ms of compute per token; observing 40 ms
+    # means 10/3 ms per layer, and each node moves halfway towards it
+    tpot_ms = n1.get_rtt_to(n2) + 40.0
+    sched.request_finished("req-1", path, num_output_tokens=16, tpot_ms=tpot_ms)
+    assert n1.current_requests == n2.current_requests == 0
+    assert n1.avg_layer_latency_ms == pytest.approx(20.0 / 3)
+    assert n2.avg_layer_latency_ms == pytest.approx(20.0 / 3)
+
+    # A heartbeat may already have reported the request as gone
+    sched.request_finished("req-1", path + ["departed"], aborted=True)
+    assert n1.current_requests == n2.current_requests == 0
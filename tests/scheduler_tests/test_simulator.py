@@ -0,0 +1,100 @@
+"""
+Tests for the discrete-event scheduler simulator.
+"""
+
+import numpy as np
+import pytest
+
+from scheduling.node import Node
+from scheduling.scheduler import Scheduler
+from scheduling.simulator import ClusterSimulator, poisson_arrivals
+
+from .test_utils import build_model_info, build_node, set_rtt_from_coords
+
+
+def _build_cluster(num_nodes: int, num_layers: int = 36) -> list[Node]:
+    model = build_model_info(num_layers)
+    nodes = [
+        build_node(f"n{i}", model, tflops=312.0, mem_gb=80.0, x=i, y=0.0, mem_bandwidth_gbps=2039)
+        for i in range(num_nodes)
+    ]
+    set_rtt_from_coords(nodes)
+    return nodes
+
+
+def _build_simulator(nodes: list[Node], **scheduler_kwargs) -> ClusterSimulator:
+    scheduler = Scheduler(
+        nodes[0].model_info, [], min_nodes_bootstrapping=len(nodes), **scheduler_kwargs
+    )
+    sim = ClusterSimulator(scheduler)
+    for node in nodes:
+        sim.add_node(node)
+    return sim
+
+
+def test_poisson_arrivals():
+    arrivals = poisson_arrivals(2000, request_rate=10.0, seed=0)
+    assert arrivals[0] == 0.0
+    assert np.all(np.diff(arrivals) >= 0)
+    assert len(arrivals) / arrivals[-1] == pytest.approx(10.0, rel=0.1)
+    assert poisson_arrivals(3, request_rate=float("inf"), start_s=5.0) == [5.0, 5.0, 5.0]
+
+
+def test_steady_cluster_serves_every_request():
+    sim = _build_simulator(_build_cluster(6))
+    sim.add_requests(poisson_arrivals(40, request_rate=2.0, seed=0), prompt_len=128, output_len=16)
+    report = sim.run()
+
+    assert report.num_completed == 40
+    assert report.num_aborted == 0 and report.num_unserved == 0
+    assert report.output_tokens == 40 * 16
+    assert report.num_global_rebalances == 0
+    assert 0 < report.ttft_ms["p50"] <= report.ttft_ms["p99"]
+    assert 0 < report.tpot_ms["p50"] <= report.tpot_ms["p99"]
+    # Every slot taken by a request was released
+    assert all(node.current_requests == 0 for node in sim.scheduler.nodes)
+
+
+def test_full_pipelines_queue_requests():
+    nodes = _build_cluster(3)
+    for node in nodes:
+        node.max_concurrent_requests = 2
+    sim = _build_simulator(nodes)
+    sim.add_requests([0.0] * 8, prompt_len=128, output_len=8)
+    report = sim.run()
+
+    assert report.num_completed == 8
+    # One pipeline with two slots: the last requests waited for three batches to finish
+    ttfts = sorted(r.ttft_ms for r in sim.requests)
+    assert ttfts[-1] > 3 * ttfts[0]
+
+
+def test_silent_failure_is_detected_by_heartbeat_timeout():
+    nodes = _build_cluster(6)
+    sim = _build_simulator(nodes, heartbeat_timeout=3.0)
+    sim.fail_node("n2", at_s=5.0)
+    sim.add_requests(poisson_arrivals(60, request_rate=2.0, seed=0), prompt_len=128, output_len=16)
+    report = sim.run()
+
+    assert report.num_leaves == 1
+    assert "n2" not in sim.scheduler.node_id_to_node
+    assert report.num_aborted > 0
+    assert report.num_completed + report.num_aborted == 60
+    # Requests arriving once the node is evicted avoid it
+    late = [r for r in sim.requests if r.arrival_s > 10.0]
+    assert late and all(r.finish_s is not None and "n2" not in r.path for r in late)
+
+
+def test_join_after_start_bootstraps_the_scheduler():
+    nodes = _build_cluster(3)
+    scheduler = Scheduler(nodes[0].model_info, [], min_nodes_bootstrapping=3)
+    sim = ClusterSimulator(scheduler)
+    for i, node in enumerate(nodes):
+        sim.add_node(node, at_s=2.0 * i)
+    sim.add_requests([0.0, 1.0], prompt_len=64, output_len=4)
+    report = sim.run()
+
+    assert report.num_joins == 3
+    assert report.num_completed == 2
+    # Nothing could be served before the third node joined
+    assert all(r.dispatched_s == 4.0 for r in sim.requests)
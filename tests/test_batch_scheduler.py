@@ -1,4 +1,15 @@
-from parallax.server.request import InitialRequest, Request, RequestStatus
+import time
+
+import mlx.core as mx
+
+from parallax.server.batching_policy import SLOAwarePolicy
+from parallax.server.cache_manager import CacheManager
+from parallax.server.request import (
+    InitialRequest,
+    IntermediateRequest,
+    Request,
+    RequestStatus,
+)
 from parallax.server.scheduler import Scheduler
 
 
@@ -10,13 +21,19 @@ class FakeCacheManager:
     def has_request(self, request_id: str) -> bool:
         return request_id in self._reqs
 
-    def allocate_request(self, request_id: str, num_tokens: int) -> bool:
+    def allocate_request(self, request_id: str, num_tokens: int, **kwargs) -> bool:
         """PagedKV interface."""
         if not self.allow:
             return False
         self._reqs.add(request_id)
         return True
 
+    def get_num_computed_tokens(self, request_id: str) -> int:
+        return 0
+
+    def get_free_block_watermark(self) -> int:
+        return 0
+
 
 def make_prefill(rid: str, prompt_len: int) -> InitialRequest:
     return InitialRequest(request_id=rid, input_ids=[0] * prompt_len)
@@ -106,3 +123,382 @@ def test_kv_cache_admission_guard_blocks_prefill():
     batch = sched.form_batch()
     assert len(batch) == 0
     assert sched.num_running_requests == 0
+
+
+def test_chunked_prefill_splits_prompt_and_keeps_decodes():
+    sched = Scheduler(
+        max_batch_size=4,
+        max_num_tokens_per_batch=8,
+        micro_batch_ratio=1,
+        is_first_peer=True,
+        enable_chunked_prefill=True,
+    )
+    p = make_prefill("p", 20)
+    sched.enque_request(p)
+    d = make_decode("d")
+    sched._running_requests[d.request_id] = d
+    sched.enque_request(d)
+
+    # One token is reserved for the ready decode, the prompt gets the rest of the budget
+    batch = sched.form_batch()
+    assert [r.request_id for r in batch] == ["p", "d"]
+    assert (p.prefill_offset, p.prefill_chunk_len) == (0, 7)
+    assert not p.is_last_prefill_chunk
+
+    sched.commit_prefill_chunk(p)
+    assert p.prefill_offset == 7 and p.ready_for_next_step
+
+    offsets = []
+    while not p.is_last_prefill_chunk or p.ready_for_next_step:
+        batch = sched.form_batch()
+        assert batch == [p]
+        offsets.append((p.prefill_offset, p.prefill_chunk_len))
+        if p.is_last_prefill_chunk:
+            break
+        sched.commit_prefill_chunk(p)
+    assert offsets == [(7, 8), (15, 5)]
+
+
+def test_chunked_prefill_downstream_chunks_run_in_order():
+    sched = Scheduler(
+        max_batch_size=4,
+        max_num_tokens_per_batch=16,
+        micro_batch_ratio=1,
+        enable_chunked_prefill=True,
+    )
+
+    def chunk(offset: int, length: int) -> Request:
+        r = Request(request_id="c", status=RequestStatus.PREFILLING, input_ids=[0] * 12)
+        r.prefill_offset = offset
+        r.prefill_chunk_len = length
+        return r
+
+    first, second, third = chunk(0, 4), chunk(4, 4), chunk(8, 4)
+    # All chunks arrive before the first one runs
+    sched.enque_request(first)
+    sched.enque_request(second)
+    sched.enque_request(third)
+
+    seen = []
+    for _ in range(3):
+        batch = sched.form_batch()
+        assert len(batch) == 1
+        seen.append(batch[0])
+    assert seen == [first, second, third]
+    assert sched.form_batch() == []
+
+
+def test_idle_timeout_bounded_by_wait_window_and_request_deadline(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    sched = Scheduler(scheduler_wait_ms=200, request_timeout_s=10)
+    assert sched.get_next_timeout_deadline() is None
+    assert sched.get_idle_timeout_ms() == 200
+
+    sched.enque_request(make_prefill("p", 4))
+    sched.admit_requests()
+    now[0] += 9.95
+    assert 0 < sched.get_idle_timeout_ms() <= 50
+
+    now[0] += 10
+    assert sched.get_idle_timeout_ms() == 0
+
+
+def test_timed_out_requests_follow_their_latest_update(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    sched = Scheduler(max_batch_size=4, micro_batch_ratio=1, request_timeout_s=10)
+    a = make_prefill("a", 4)
+    b = make_prefill("b", 4)
+    sched.enque_request(a)
+    sched.enque_request(b)
+    sched.admit_requests()
+
+    # "a" runs a step later, which pushes its deadline back
+    now[0] += 5
+    a.ready_for_next_step = False
+    b.ready_for_next_step = False
+    a.last_updated_time = now[0]
+    now[0] += 6
+    assert sched.get_timed_out_requests() == [b]
+    assert b.abort and not a.abort
+    # Reported once; the caller evicts it
+    assert sched.get_timed_out_requests() == []
+    sched.evict_request("b")
+    assert sched.get_next_timeout_deadline() == 1015.0
+
+    now[0] += 5
+    assert sched.get_timed_out_requests() == [a]
+    assert sched.get_next_timeout_deadline() is None
+
+
+def make_paged_cache(
+    num_blocks: int, block_size: int = 4, enable_prefix_cache: bool = False
+) -> CacheManager:
+    return CacheManager(
+        num_layers=1,
+        num_kv_heads=1,
+        head_dim=2,
+        dtype=mx.float32,
+        block_size=block_size,
+        num_gpu_blocks=num_blocks,
+        enable_prefix_cache=enable_prefix_cache,
+    )
+
+
+def admit_as_decode(sched: Scheduler, rid: str, prompt_len: int) -> InitialRequest:
+    """Admits a prompt, marks its KV as computed and makes it ready to decode."""
+    req = make_prefill(rid, prompt_len)
+    sched.enque_request(req)
+    sched.admit_requests()
+    sched.cache_manager.commit_prefill_tokens(rid, prompt_len)
+    req.update_status(RequestStatus.DECODING)
+    sched.enque_request(req)
+    return req
+
+
+def test_admission_waits_for_kv_blocks_instead_of_dropping():
+    cache = make_paged_cache(num_blocks=2)
+    sched = Scheduler(max_batch_size=4, micro_batch_ratio=1, cache_manager=cache)
+    sched.enque_request(make_prefill("a", 8))
+    sched.enque_request(make_prefill("b", 4))
+
+    assert [r.request_id for r in sched.form_batch()] == ["a"]
+    # "b" does not fit yet but stays queued
+    assert sched.num_queued_requests == 1
+    assert sched._waiting_ids == {"b": 1}
+    assert not sched._is_first_packet("b")
+
+    sched.evict_request("a")
+    cache.release_request("a")
+    assert [r.request_id for r in sched.form_batch()] == ["b"]
+    assert sched._waiting_ids == {}
+
+
+def test_admission_keeps_free_block_watermark_for_running_requests():
+    cache = CacheManager(
+        num_layers=1,
+        num_kv_heads=1,
+        head_dim=2,
+        dtype=mx.float32,
+        block_size=4,
+        num_gpu_blocks=10,
+        block_watermark=0.2,
+    )
+    sched = Scheduler(max_batch_size=4, micro_batch_ratio=1, cache_manager=cache)
+    sched.enque_request(make_prefill("a", 20))
+    sched.enque_request(make_prefill("b", 20))
+
+    # "b" would fit, but only by eating into the 2 blocks kept for "a" to decode
+    assert [r.request_id for r in sched.form_batch()] == ["a"]
+    assert sched.num_queued_requests == 1
+    assert cache.get_num_free_blocks() == 5
+
+    sched.evict_request("a")
+    cache.release_request("a")
+    assert [r.request_id for r in sched.form_batch()] == ["b"]
+
+
+def test_decode_preempts_youngest_request_by_swapping_kv():
+    cache = make_paged_cache(num_blocks=4)
+    sched = Scheduler(max_batch_size=4, micro_batch_ratio=1, cache_manager=cache)
+    old = admit_as_decode(sched, "old", 8)
+    admit_as_decode(sched, "young", 8)
+    assert cache.get_num_free_blocks() == 0
+
+    young_blocks = cache.get_block_table("young")
+    kv_cache = cache.get_caches()[0]
+    kv_cache.key_cache[:, mx.array(young_blocks)] = 7.0
+
+    # Both decodes need a new block; the older one wins and the younger one is swapped out
+    batch = sched.form_batch()
+    assert batch == [old]
+    assert cache.is_swapped("young") and sched.num_swapped_requests == 1
+    assert sched.get_running_request("young") is not None
+
+    # Once blocks are back the swapped request resumes with its KV intact
+    sched.evict_request("old")
+    cache.release_request("old")
+    batch = sched.form_batch()
+    assert [r.request_id for r in batch] == ["young"]
+    assert not cache.is_swapped("young")
+    assert cache.get_context_length("young") == 8
+    restored = kv_cache.key_cache[:, mx.array(cache.get_block_table("young")[:2])]
+    assert mx.all(restored == 7.0).item()
+
+
+def test_drain_removes_waiting_running_and_swapped_requests():
+    cache = make_paged_cache(num_blocks=4)
+    sched = Scheduler(max_batch_size=4, micro_batch_ratio=1, cache_manager=cache)
+    admit_as_decode(sched, "old", 8)
+    admit_as_decode(sched, "young", 8)
+    sched.form_batch()  # swaps "young" out
+    sched.enque_request(make_prefill("queued", 4))
+    assert sched.num_swapped_requests == 1 and sched.num_queued_requests == 1
+
+    drained = sched.drain()
+    assert sorted(r.request_id for r in drained) == ["old", "queued", "young"]
+    assert sched.num_running_requests == 0
+    assert sched.num_swapped_requests == 0 and sched.num_queued_requests == 0
+    assert sched.form_batch() == []
+
+
+def test_prefix_cache_hit_across_two_peers():
+    """Downstream peers admit a first chunk that starts past a cached prefix.
+
+    A peer that has the prefix cached reuses it; a peer that evicted it reports the miss
+    and the First Peer prefills the whole prompt again.
+    """
+    prompt = list(range(10))
+
+    def make_peer(is_first_peer: bool, warm: bool) -> Scheduler:
+        cache = make_paged_cache(num_blocks=8, enable_prefix_cache=True)
+        if warm:
+            # Caches the first two blocks of the prompt
+            cache.allocate_request("warmup", len(prompt), prompt_ids=prompt)
+            cache.append_slot("warmup")
+            cache.release_request("warmup")
+        return Scheduler(
+            max_batch_size=4,
+            max_num_tokens_per_batch=16,
+            micro_batch_ratio=1,
+            is_first_peer=is_first_peer,
+            enable_chunked_prefill=True,
+            cache_manager=cache,
+        )
+
+    def forward(req: Request) -> IntermediateRequest:
+        """The prefill packet the First Peer sends downstream for the current chunk."""
+        hidden_states = mx.zeros((req.prefill_chunk_end - req.prefill_offset, 8))
+        return IntermediateRequest(
+            request_id=req.request_id,
+            current_position=req.prefill_chunk_end,
+            input_ids=req.input_ids,
+            hidden_states=hidden_states,
+        )
+
+    first, warm, cold = make_peer(True, True), make_peer(False, True), make_peer(False, False)
+    req = InitialRequest(request_id="r", input_ids=prompt)
+    first.enque_request(req)
+    assert first.form_batch() == [req]
+    assert (req.prefill_offset, req.prefill_chunk_len) == (8, 2)
+
+    packet = forward(req)
+    warm.enque_request(packet)
+    assert warm.form_batch() == [packet]
+    assert warm.cache_manager.get_num_computed_tokens("r") == 8
+
+    cold.enque_request(forward(req))
+    assert cold.form_batch() == []
+    assert [r.request_id for r in cold.pop_prefix_cache_misses()] == ["r"]
+    assert not cold.cache_manager.has_request("r")
+
+    # The miss reaches the First Peer, which releases the request and starts over
+    first.cache_manager.release_request("r")
+    assert first.restart_prefill("r")
+    assert first.form_batch() == [req]
+    assert (req.prefill_offset, req.prefill_chunk_len) == (0, 10)
+    assert first.cache_manager.get_num_computed_tokens("r") == 0
+
+    packet = forward(req)
+    cold.enque_request(packet)
+    assert cold.form_batch() == [packet]
+    assert cold.pop_prefix_cache_misses() == []
+
+
+def test_paused_admission_keeps_new_requests_waiting():
+    sched = Scheduler(max_batch_size=4, micro_batch_ratio=1)
+    d = make_decode("d")
+    sched._running_requests[d.request_id] = d
+    sched.enque_request(d)
+
+    # Requests that arrive while draining wait, running ones keep going
+    sched.admission_paused = True
+    sched.enque_request(make_prefill("new", 4))
+    sched.admit_requests()
+    assert sched.form_batch() == [d]
+    assert sched.num_queued_requests == 1 and sched.num_running_requests == 1
+
+    sched.admission_paused = False
+    assert [r.request_id for r in sched.form_batch()] == ["new"]
+
+
+def test_decode_preempts_unstarted_prefill_for_recompute():
+    cache = make_paged_cache(num_blocks=3)
+    # The token budget leaves no room for the prefill next to the decode
+    sched = Scheduler(
+        max_batch_size=4, max_num_tokens_per_batch=1, micro_batch_ratio=1, cache_manager=cache
+    )
+    d = admit_as_decode(sched, "d", 8)
+    sched.enque_request(make_prefill("p", 4))
+    sched.admit_requests()
+    assert cache.get_num_free_blocks() == 0
+
+    # The idle prefill has no computed KV, so it gives its blocks back and is requeued
+    batch = sched.form_batch()
+    assert batch == [d]
+    assert not cache.has_request("p")
+    assert sched.num_queued_requests == 1 and sched.num_swapped_requests == 0
+
+
+def test_priority_class_admitted_and_batched_first():
+    sched = Scheduler(max_batch_size=8, max_num_tokens_per_batch=10_000, micro_batch_ratio=1)
+    low = make_prefill("low", 4)
+    high1 = InitialRequest(request_id="high1", input_ids=[0] * 4, priority=1)
+    high2 = InitialRequest(request_id="high2", input_ids=[0] * 4, priority=1)
+    for r in (low, high1, high2):
+        sched.enque_request(r)
+
+    assert [r.request_id for r in sched._wait_queue] == ["high1", "high2", "low"]
+    batch = sched.form_batch()
+    assert [r.request_id for r in batch] == ["high1", "high2", "low"]
+
+
+def test_decode_first_keeps_decode_slots_under_prefill_burst():
+    # prefill_priority=1 selects the decode-first policy; micro_batch_size = 3
+    sched = Scheduler(
+        max_batch_size=3, max_num_tokens_per_batch=10_000, micro_batch_ratio=1, prefill_priority=1
+    )
+    d1 = make_decode("d1")
+    d2 = make_decode("d2")
+    sched._running_requests[d1.request_id] = d1
+    sched._running_requests[d2.request_id] = d2
+    sched.enque_request(d1)
+    sched.enque_request(d2)
+    for i in range(3):
+        sched.enque_request(make_prefill(f"p{i}", 8))
+
+    batch = sched.form_batch()
+    assert [r.request_id for r in batch] == ["d1", "d2", "p0"]
+
+
+def test_slo_policy_caps_prefill_tokens_until_ttft_is_due():
+    policy = SLOAwarePolicy(ttft_slo_ms=1000.0, tpot_slo_ms=50.0)
+    # Decode-only steps take 20ms, each prompt token adds 1ms: 30 prompt tokens fit
+    policy.observe_step(0, 2, 0.020)
+    policy.observe_step(100, 2, 0.120)
+    sched = Scheduler(
+        max_batch_size=4,
+        max_num_tokens_per_batch=1000,
+        micro_batch_ratio=1,
+        is_first_peer=True,
+        enable_chunked_prefill=True,
+        batching_policy=policy,
+    )
+    d1 = make_decode("d1")
+    sched._running_requests[d1.request_id] = d1
+    sched.enque_request(d1)
+    p1 = make_prefill("p1", 100)
+    sched.enque_request(p1)
+
+    batch = sched.form_batch()
+    assert [r.request_id for r in batch] == ["d1", "p1"]
+    assert p1.prefill_chunk_len == 30
+
+    # Once the prompt reaches its TTFT target it gets the whole budget
+    sched.commit_prefill_chunk(p1)
+    sched.enque_request(d1)
+    p1.arrival_time -= 2.0
+    batch = sched.form_batch()
+    assert [r.request_id for r in batch] == ["p1", "d1"]
+    assert p1.prefill_chunk_len == 70
@@ -0,0 +1,213 @@
+"""
+Tests for JSON-schema constrained decoding.
+"""
+
+import json
+import random
+
+import mlx.core as mx
+import numpy as np
+import pytest
+
+from parallax.server.request import InitialRequest, RequestStatus
+from parallax.server.sampling.grammar import (
+    DEAD_STATE,
+    GrammarConstraints,
+    TokenGrammar,
+    _MaskCache,
+    _TokenTrie,
+    compile_json_schema,
+    get_token_strings,
+    parse_json_schema,
+)
+from parallax.server.sampling.sampler import Sampler, SamplingBatchInfo
+from parallax.server.sampling.sampling_params import SamplingParams
+
+PERSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string", "maxLength": 4},
+        "age": {"type": "integer"},
+        "role": {"enum": ["admin", "user"]},
+        "tags": {"type": "array", "items": {"type": "boolean"}, "maxItems": 2},
+    },
+    "required": ["name", "role"],
+}
+
+
+class _ByteLevelTokenizer:
+    """Byte-level BPE style vocabulary: spaces are spelled 'Ġ'."""
+
+    def __init__(self):
+        pieces = list('{}[]":, 0123456789-.abdefgilmnorstu') + [
+            '{"',
+            '":',
+            '",',
+            'Ġ"',
+            "Ġ{",
+            "true",
+            "false",
+            "admin",
+            '"name',
+            '"role',
+            '"tags',
+            '"age',
+            "ĠĠ",
+        ]
+        self.vocab = {piece.replace(" ", "Ġ"): i for i, piece in enumerate(pieces)}
+        self.vocab["<eos>"] = len(self.vocab)
+        self.all_special_ids = [self.vocab["<eos>"]]
+        self.eos_token_ids = [self.vocab["<eos>"]]
+
+    def get_vocab(self):
+        return self.vocab
+
+
+def _accepts(schema, text: str) -> bool:
+    automaton = compile_json_schema(json.dumps(schema))
+    state = automaton.walk(automaton.start, text)
+    return state != DEAD_STATE and automaton.accepting[state]
+
+
+def test_schema_automaton():
+    assert _accepts(PERSON_SCHEMA, '{"name": "bob", "role": "user"}')
+    assert _accepts(PERSON_SCHEMA, '{"name":"bo","age":-12,"role":"admin","tags":[true, false]}')
+    # Missing required property, too long string, unknown enum value, too many items
+    assert not _accepts(PERSON_SCHEMA, '{"name": "bob"}')
+    assert not _accepts(PERSON_SCHEMA, '{"name": "bobby", "role": "user"}')
+    assert not _accepts(PERSON_SCHEMA, '{"name": "bob", "role": "root"}')
+    assert not _accepts(PERSON_SCHEMA, '{"name":"b","role":"user","tags":[true,true,true]}')
+
+    referenced = {
+        "$defs": {"point": {"type": "array", "items": {"type": "number"}, "minItems": 2}},
+        "anyOf": [{"$ref": "#/$defs/point"}, {"type": "null"}],
+    }
+    assert _accepts(referenced, "[1.5, -2e3]")
+    assert _accepts(referenced, "null")
+    assert not _accepts(referenced, "[1]")
+    assert _accepts({"type": "object"}, '{"a": [1, {"b": null}], "c": "x\\n"}')
+    assert not _accepts({"type": "object"}, '{"a": }')
+
+    with pytest.raises(ValueError):
+        compile_json_schema(json.dumps({"type": "string", "pattern": "^a+$"}))
+    with pytest.raises(ValueError):
+        compile_json_schema("{not json")
+
+
+@pytest.mark.parametrize(
+    "schema",
+    [
+        {"type": "string", "minLength": 3, "maxLength": 9},
+        {
+            "type": "array",
+            "items": {"type": "string", "maxLength": 3},
+            "minItems": 2,
+            "maxItems": 4,
+        },
+        {
+            "type": "array",
+            "items": {"type": "array", "items": {"type": "integer"}, "maxItems": 2},
+            "minItems": 1,
+            "maxItems": 3,
+        },
+    ],
+)
+def test_bounded_masks_match_trie_walk(schema):
+    """Masks derived from the unbounded twin of a repetition equal a full walk"""
+    rng = random.Random(0)
+    alphabet = 'ab1 ",[]'
+    strings = list(alphabet) + [
+        "".join(rng.choice(alphabet) for _ in range(rng.randint(2, 7))) for _ in range(2000)
+    ]
+    automaton = compile_json_schema(json.dumps(schema))
+    grammar = TokenGrammar(automaton, _TokenTrie(strings), strings, [])
+    seen, frontier = {automaton.start}, [automaton.start]
+    relaxed = 0
+    while frontier and len(seen) < 200:
+        state = frontier.pop()
+        relaxed += automaton.relax(state) is not None
+        alive = grammar._walk_trie(state)
+        assert np.array_equal(grammar._alive(state), alive)
+        for token_id in np.flatnonzero(alive)[:20].tolist():
+            nxt = automaton.walk(state, strings[token_id])
+            if nxt not in seen:
+                seen.add(nxt)
+                frontier.append(nxt)
+    assert relaxed > 0
+
+
+def test_mask_cache_evicts_least_recently_used():
+    cache = _MaskCache(max_masks=2)
+    for key in "abc":
+        cache.put((key,), np.ones(4, dtype=np.bool_))
+        cache.get(("a",))
+    assert len(cache) == 2
+    assert cache.get(("a",)) is not None
+    assert cache.get(("b",)) is None
+
+
+def test_parse_json_schema():
+    assert parse_json_schema({}) is None
+    assert parse_json_schema({"sampling_params": {"json_schema": '{"type": "null"}'}}) == (
+        '{"type": "null"}'
+    )
+    response_format = {"type": "json_schema", "json_schema": {"schema": {"type": "integer"}}}
+    assert json.loads(parse_json_schema({"response_format": response_format})) == {
+        "type": "integer"
+    }
+    assert json.loads(parse_json_schema({"response_format": {"type": "json_object"}})) == {
+        "type": "object"
+    }
+
+
+def test_token_strings():
+    tokenizer = _ByteLevelTokenizer()
+    strings = get_token_strings(tokenizer)
+    assert strings[tokenizer.vocab['Ġ"']] == ' "'
+    assert strings[tokenizer.vocab["ĠĠ"]] == "  "
+    assert strings[tokenizer.vocab["<eos>"]] is None
+
+
+def test_constrained_sampling():
+    """Random logits only ever produce documents valid under the schema"""
+    tokenizer = _ByteLevelTokenizer()
+    strings = get_token_strings(tokenizer)
+    eos = tokenizer.eos_token_ids[0]
+    constraints = GrammarConstraints(tokenizer)
+    params = SamplingParams(temperature=1.0, top_k=-1, json_schema=json.dumps(PERSON_SCHEMA))
+    reqs = [
+        InitialRequest(
+            request_id=f"r{i}", input_ids=[0], status=RequestStatus.DECODING, sampling_params=params
+        )
+        for i in range(16)
+    ]
+    # Requests that do not use a schema are left alone
+    reqs.append(InitialRequest(request_id="free", input_ids=[0], status=RequestStatus.DECODING))
+
+    sampler = Sampler()
+    mx.random.seed(0)
+    outputs = {req.request_id: "" for req in reqs[:-1]}
+    finished = set()
+    for _ in range(200):
+        info = SamplingBatchInfo.from_reqs(reqs, grammar_constraints=constraints)
+        logits = mx.random.normal((len(reqs), len(tokenizer.vocab) + 3)) * 4
+        next_token_ids = sampler(logits, info).tolist()
+        for req, token_id in zip(reqs[:-1], next_token_ids):
+            if req.request_id in finished:
+                continue
+            if token_id == eos:
+                finished.add(req.request_id)
+            else:
+                outputs[req.request_id] += strings[token_id]
+        if len(finished) == len(outputs):
+            break
+
+    assert len(finished) == len(outputs)
+    for text in outputs.values():
+        assert _accepts(PERSON_SCHEMA, text)
+        assert json.loads(text)["role"] in ("admin", "user")
+    # All requests share one compiled grammar and its masks
+    assert len(constraints._grammars) == 1
+    for req in reqs[:-1]:
+        constraints.release(req.request_id)
+    assert len(constraints) == 0
@@ -23,7 +23,10 @@ except Exception:  # pragma: no cover - torch might be unavailable in CI
     torch_stub.float32 = "float32"
     sys.modules.setdefault("torch", torch_stub)
 
+from parallax.p2p.message_util import FINISH_NONE
+from parallax.server import http_server
 from parallax.server.http_server import HTTPHandler, HTTPRequestInfo
+from parallax.utils.stop_strings import StopStringMatcher
 
 
 def test_http_handler_marks_non_stream_error():
@@ -84,3 +87,122 @@ def test_http_handler_stream_error_pushes_queue_event():
     assert error_chunk["payload"]["type"] == "InternalServerError"
     assert error_chunk["payload"]["code"] == HTTPStatus.INTERNAL_SERVER_ERROR.value
     assert sentinel is None
+
+
+class _ListDetokenizer:
+    """Detokenizes token ids as indices into a list of segments."""
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.last_segment = ""
+
+    def add_token(self, token_id):
+        self.last_segment = self.segments[token_id]
+
+
+class _RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    def send_pyobj(self, obj):
+        self.sent.append(obj)
+
+
+def test_http_handler_stop_string_finishes_and_aborts():
+    async def scenario():
+        handler = HTTPHandler.__new__(HTTPHandler)
+        handler.processing_requests = {}
+        handler.send_to_executor = _RecordingSocket()
+
+        rid = "req-stop"
+        request_info = HTTPRequestInfo(id=rid, stream=True)
+        request_info.token_queue = asyncio.Queue()
+        request_info.detokenizer = _ListDetokenizer(["Hello", " wor", "ld###", "ignored"])
+        request_info.stop_matcher = StopStringMatcher(["###"])
+        handler.processing_requests[rid] = request_info
+
+        for token_id in range(3):
+            handler._add_token(request_info, token_id, FINISH_NONE)
+
+        chunks = []
+        while not request_info.token_queue.empty():
+            chunks.append(request_info.token_queue.get_nowait())
+        return handler, request_info, chunks
+
+    handler, request_info, chunks = asyncio.run(scenario())
+
+    assert chunks == ["Hello", " wor", "ld", None]
+    assert request_info.text == "Hello world"
+    assert request_info.is_finish is True
+    assert request_info.finish_reason == "stop"
+    assert request_info.matched_stop == "###"
+    assert handler.send_to_executor.sent == [{"type": "abort", "rid": "req-stop"}]
+
+
+class _FakeRawRequest:
+    def __init__(self, body):
+        self.body = body
+        self.disconnected = False
+        self.disconnect_checks = 0
+
+    async def json(self):
+        return self.body
+
+    async def is_disconnected(self):
+        self.disconnect_checks += 1
+        return self.disconnected
+
+
+def _non_stream_handler():
+    handler = HTTPHandler.__new__(HTTPHandler)
+    handler.processing_requests = {}
+    handler.send_to_executor = _RecordingSocket()
+    handler.detokenizer_class = lambda tokenizer, tokenmap: _ListDetokenizer([])
+    handler.tokenizer = handler.tokenmap = None
+    handler.model_path_str = "default"
+    http_server.app.state.http_handler = handler
+    return handler
+
+
+def test_non_stream_request_wakes_on_finish():
+    async def scenario():
+        handler = _non_stream_handler()
+        raw_request = _FakeRawRequest({"rid": "req-wait", "messages": []})
+        task = asyncio.create_task(http_server.v1_chat_completions(raw_request))
+        await asyncio.sleep(0)
+
+        request_info = handler.processing_requests["req-wait"]
+        request_info.text = "done"
+        request_info.finish_reason = "eos"
+        request_info.is_finish = True
+        request_info.finished.set()
+        response = await asyncio.wait_for(task, timeout=0.5)
+        return handler, raw_request, response
+
+    handler, raw_request, response = asyncio.run(scenario())
+
+    assert response.status_code == 200
+    assert b'"content":"done"' in response.body
+    # Finishing does not wait for a disconnect check, and the request was released
+    assert raw_request.disconnect_checks == 1
+    assert handler.processing_requests == {}
+
+
+def test_non_stream_request_aborts_on_disconnect(monkeypatch):
+    monkeypatch.setattr(http_server, "DISCONNECT_CHECK_INTERVAL_S", 0.01)
+
+    async def scenario():
+        handler = _non_stream_handler()
+        raw_request = _FakeRawRequest({"rid": "req-gone", "messages": []})
+        task = asyncio.create_task(http_server.v1_chat_completions(raw_request))
+        await asyncio.sleep(0.05)
+        assert not task.done()
+        raw_request.disconnected = True
+        response = await asyncio.wait_for(task, timeout=0.5)
+        return handler, response
+
+    handler, response = asyncio.run(scenario())
+
+    assert b"ClientDisconnectedError" in response.body
+    assert handler.send_to_executor.sent[-1] == {"type": "abort", "rid": "req-gone"}
+    assert handler.processing_requests == {}
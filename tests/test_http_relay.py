@@ -0,0 +1,177 @@
+"""
+Tests for the pooled HTTP relay and the backend stream relay.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from backend.server.constants import NODE_STATUS_AVAILABLE
+from backend.server.request_handler import RequestHandler, relay_stream
+from parallax.p2p.utils import HTTPRelay
+
+
+class _ChunkedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+
+    def do_GET(self):
+        _ChunkedHandler.connections.add(self.client_address)
+        self.send_response(200)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i in range(3):
+            data = f"data: {i}\n\n".encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ChunkedHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    _ChunkedHandler.connections.clear()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_http_relay_streams_and_reuses_connections(http_url):
+    relay = HTTPRelay(timeout=5)
+    for _ in range(3):
+        body = b"".join(relay.stream("GET", f"{http_url}/stream"))
+        assert body == b"data: 0\n\ndata: 1\n\ndata: 2\n\n"
+    # Keep-alive: every stream went over the same pooled connection
+    assert len(_ChunkedHandler.connections) == 1
+
+    assert relay.request("POST", f"{http_url}/echo", json={"a": 1}).json() == {"a": 1}
+
+
+def test_http_relay_closes_abandoned_streams(http_url):
+    relay = HTTPRelay(timeout=5)
+    chunks = relay.stream("GET", f"{http_url}/stream")
+    assert next(chunks) == b"data: 0\n\n"
+    chunks.close()
+    assert b"".join(relay.stream("GET", f"{http_url}/stream")).count(b"data") == 3
+
+
+def test_relay_stream_is_not_capped_by_the_shared_threadpool():
+    num_streams = 64  # More than Starlette's default 40 threadpool tokens
+    started = threading.Barrier(num_streams, timeout=10)
+
+    def blocking_chunks():
+        # Every stream blocks until all of them are being read concurrently
+        started.wait()
+        yield b"chunk"
+
+    limiter = RequestHandler().stream_relay_limiter
+
+    async def read_all():
+        async def read(iterator):
+            return [chunk async for chunk in relay_stream(iterator, limiter)]
+
+        return await asyncio.gather(*(read(blocking_chunks()) for _ in range(num_streams)))
+
+    start = time.monotonic()
+    assert asyncio.run(read_all()) == [[b"chunk"]] * num_streams
+    assert time.monotonic() - start < 10
+    assert RequestHandler(stream_relay_limit=8).stream_relay_limiter.total_tokens == 8
+
+
+class _FakeSchedulerManage:
+    def __init__(self):
+        self.finished = []
+
+    def get_schedule_status(self):
+        return NODE_STATUS_AVAILABLE
+
+    async def route_request(self, request_id, received_ts):
+        return ["node"]
+
+    def notify_request_finished(self, request_id, routing_table, **kwargs):
+        self.finished.append((request_id, kwargs))
+
+
+class _FakeStream:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.cancelled = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.chunks)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class _FakeStub:
+    def __init__(self, chunks=None):
+        self.chunks = chunks
+        self.stream = None
+
+    def chat_completion(self, request_data):
+        if self.chunks is None:
+            raise ConnectionError("peer unreachable")
+        self.stream = _FakeStream(self.chunks)
+        return self.stream
+
+
+def _stream(stub):
+    """Streams a request through a handler forwarding to `stub`; returns the scheduler."""
+    scheduler_manage = _FakeSchedulerManage()
+    handler = RequestHandler()
+    handler.set_scheduler_manage(scheduler_manage)
+    handler.stubs["node"] = stub
+
+    async def run():
+        response = await handler._forward_request({"stream": True}, "rid", 0)
+        return [chunk async for chunk in response.body_iterator]
+
+    return scheduler_manage, run
+
+
+def test_stream_notifies_abort_when_first_hop_fails():
+    scheduler_manage, run = _stream(_FakeStub())
+    with pytest.raises(ConnectionError):
+        asyncio.run(run())
+    assert scheduler_manage.finished == [
+        ("rid", {"num_output_tokens": None, "tpot_ms": None, "aborted": True})
+    ]
+
+
+def test_stream_tpot_excludes_prefill(monkeypatch):
+    usage = {"prompt_tokens": 5, "completion_tokens": 3}
+    stub = _FakeStub(
+        [b"data: {}", b"data: {}", b"data: " + json.dumps({"usage": usage}).encode()]
+        + [b"data: [DONE]"]
+    )
+    # First token after 10 s of prefill, then one token per second
+    clock = iter([0.0, 10.0, 11.0, 12.0, 12.0] + [12.0] * 10)
+    monkeypatch.setattr(time, "time", lambda: next(clock))
+    scheduler_manage, run = _stream(stub)
+    assert len(asyncio.run(run())) == 4
+    assert stub.stream.cancelled
+
+    ((rid, info),) = scheduler_manage.finished
+    assert info["aborted"] is False and info["num_output_tokens"] == 3
+    assert info["tpot_ms"] == pytest.approx(1000.0)
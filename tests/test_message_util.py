@@ -5,14 +5,27 @@ Test the message utility functions.
 import mlx.core as mx
 import numpy as np
 import pytest
+import zmq
 
 from parallax.p2p.message_util import (
+    FINISH_EOS,
+    FINISH_LENGTH,
+    FINISH_NONE,
+    TOKEN_BATCH,
+    TOKEN_ERROR,
+    TokenBatch,
     abort_request_to_proto,
     bytes_to_tensor,
+    decode_token_message,
+    encode_token_error,
+    extract_tensor_frames,
+    inline_tensor_frames,
+    multipart_to_requests,
     proto_to_abort_request,
     proto_to_request,
     proto_to_sampling_params,
     request_to_proto,
+    requests_to_multipart,
     sampling_params_to_proto,
     tensor_to_bytes,
 )
@@ -105,6 +118,7 @@ class TestMessageUtil:
             sampling_params=self.sampling_params,
             routing_table=["nodeA"],
             lora_path=None,
+            priority=2,
         )
 
         proto_request = request_to_proto([original_request])
@@ -116,6 +130,7 @@ class TestMessageUtil:
         assert converted_request.request_id == original_request.request_id
         assert converted_request.status == original_request.status
         assert converted_request.input_ids == original_request.input_ids
+        assert converted_request.priority == 2
         # current_position = output_length + len(input_ids)
         assert converted_request.current_position == original_request.current_position
         assert converted_request.next_token_id == original_request.next_token_id
@@ -175,11 +190,45 @@ class TestMessageUtil:
             np.array(deserialized_reqs[1].hidden_states.tolist()), np.array([[2.0]])
         )
 
+    def test_mixed_requests(self):
+        """Test that prefill and decode requests share one MIXED message."""
+        prefill = IntermediateRequest(
+            request_id="prefill",
+            input_ids=[1, 2, 3],
+            current_position=2,
+            status=RequestStatus.PREFILLING,
+            hidden_states=mx.array([[1.0], [2.0]], dtype=mx.float32),
+            lora_path=None,
+        )
+        decode = IntermediateRequest(
+            request_id="decode",
+            input_ids=[4],
+            current_position=2,
+            status=RequestStatus.DECODING,
+            hidden_states=mx.array([[3.0]], dtype=mx.float32),
+            lora_path=None,
+        )
+
+        forward_request = request_to_proto([prefill, decode])
+        assert forward_request.forward_mode == forward_pb2.ForwardMode.MIXED
+
+        deserialized_reqs = proto_to_request(forward_request)
+        assert [r.status for r in deserialized_reqs] == [
+            RequestStatus.PREFILLING,
+            RequestStatus.DECODING,
+        ]
+        assert (deserialized_reqs[0].prefill_offset, deserialized_reqs[0].prefill_chunk_len) == (
+            0,
+            2,
+        )
+        assert deserialized_reqs[1].current_position == 2
+
     @pytest.mark.parametrize(
         "dtype,shape",
         [
             (mx.float32, (2, 2)),
             (mx.bfloat16, (1, 8)),
+            (mx.float16, (2, 3, 4)),
             (mx.int32, (5,)),
         ],
     )
@@ -197,6 +246,59 @@ class TestMessageUtil:
             np.array(original_tensor.tolist()),
         )
 
+    def test_multipart_tensor_frames(self):
+        """Hidden states travel as raw ZMQ frames and can be inlined for the RPC hop."""
+        prefill = IntermediateRequest(
+            request_id="p",
+            input_ids=[1, 2, 3],
+            current_position=3,
+            status=RequestStatus.PREFILLING,
+            hidden_states=mx.arange(24, dtype=mx.bfloat16).reshape(3, 8),
+            routing_table=["nodeA"],
+        )
+        decode = IntermediateRequest(
+            request_id="d",
+            input_ids=[1],
+            current_position=2,
+            status=RequestStatus.DECODING,
+            hidden_states=mx.ones((1, 8), dtype=mx.bfloat16),
+            routing_table=["nodeA"],
+        )
+        frames = requests_to_multipart([prefill, decode])
+        # ForwardRequest, then a header and a buffer per request
+        assert len(frames) == 5
+
+        ctx = zmq.Context()
+        sender, receiver = ctx.socket(zmq.PAIR), ctx.socket(zmq.PAIR)
+        sender.bind("inproc://test_multipart_tensor_frames")
+        receiver.connect("inproc://test_multipart_tensor_frames")
+        try:
+            sender.send_multipart([b"forward", *frames], copy=False)
+            received = receiver.recv_multipart(copy=False)
+        finally:
+            sender.close()
+            receiver.close()
+            ctx.term()
+
+        requests = multipart_to_requests(received[1:])
+        assert [r.request_id for r in requests] == ["p", "d"]
+        assert [r.status for r in requests] == [RequestStatus.PREFILLING, RequestStatus.DECODING]
+        for original, converted in zip([prefill, decode], requests):
+            assert converted.hidden_states.dtype == mx.bfloat16
+            assert mx.array_equal(converted.hidden_states, original.hidden_states).item()
+
+        # Inline for the RPC to the next peer, then split out again on arrival
+        forward_request = forward_pb2.ForwardRequest()
+        forward_request.ParseFromString(received[1].buffer)
+        inline_tensor_frames(forward_request, received[2:])
+        assert all(r.hidden_states_frame == 0 and r.hidden_states for r in forward_request.reqs)
+        inlined = proto_to_request(forward_request)
+        assert mx.array_equal(inlined[0].hidden_states, prefill.hidden_states).item()
+
+        tensor_frames = extract_tensor_frames(forward_request)
+        requests = multipart_to_requests([forward_request.SerializeToString(), *tensor_frames])
+        assert mx.array_equal(requests[1].hidden_states, decode.hidden_states).item()
+
     def test_sampling_params_conversion(self):
         """Test SamplingParams conversion to and from proto."""
         params = SamplingParams(
@@ -248,3 +350,35 @@ class TestMessageUtil:
         assert intermediate_reqs[0].status == RequestStatus.FINISHED_EOS
         assert intermediate_reqs[0].routing_table == ["nodeA", "nodeB"]
         assert intermediate_reqs[1].request_id == "abort2"
+
+    def test_token_batch(self):
+        """Test the per-step token batch sent to the http server."""
+        batch = TokenBatch()
+        batch.append("req1", 42, 7)
+        batch.append("req2", 151643, 12, FINISH_EOS)
+        batch.append("req3", 0, 3, FINISH_LENGTH)
+        assert len(batch) == 3
+
+        kind, tokens = decode_token_message(batch.encode())
+        assert kind == TOKEN_BATCH
+        assert tokens == [
+            ("req1", 42, 7, FINISH_NONE),
+            ("req2", 151643, 12, FINISH_EOS),
+            ("req3", 0, 3, FINISH_LENGTH),
+        ]
+
+        batch.clear()
+        assert len(batch) == 0
+        assert decode_token_message(batch.encode()) == (TOKEN_BATCH, [])
+
+    def test_token_error(self):
+        """Test request errors on the token stream."""
+        kind, error = decode_token_message(encode_token_error("req1", "bad", "ValueError", 400))
+        assert kind == TOKEN_ERROR
+        assert error == {
+            "type": "error",
+            "rid": "req1",
+            "error": "bad",
+            "error_type": "ValueError",
+            "status_code": 400,
+        }
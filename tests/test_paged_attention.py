@@ -2,10 +2,15 @@ import math
 import time
 
 import mlx.core as mx
+import mlx.nn as nn
 import numpy as np
 import pytest
 
-from parallax.metal.paged_attention.kernel import paged_attention, reshape_and_cache
+from parallax.metal.paged_attention.kernel import (
+    apply_batched_rope,
+    paged_attention,
+    reshape_and_cache,
+)
 
 
 def ref_masked_attention(q, k, v, scale):
@@ -274,6 +279,33 @@ class TestPagedAttention:
             max_diff < 1e-2
         ), f"Large scale test failed for {params['desc']}, max_diff: {max_diff}"
 
+    def test_batched_rope_positions(self):
+        """Rows and mixed-batch segments are rotated at their own positions"""
+        rope = nn.RoPE(8)
+        mx.random.seed(0)
+        queries = mx.random.normal((2, 4, 3, 8))
+        keys = mx.random.normal((2, 2, 3, 8))
+        prefix_lens = mx.array([0, 5], dtype=mx.int32)
+        context_lengths = mx.array([3, 8], dtype=mx.int32)
+
+        q_rot, k_rot = apply_batched_rope(rope, queries, keys, context_lengths, prefix_lens)
+        assert mx.allclose(q_rot[1:], rope(queries[1:], offset=5)).item()
+        assert mx.allclose(k_rot[:1], rope(keys[:1], offset=0)).item()
+
+        # The same two prefill chunks flattened into one row of a mixed batch
+        def flat(x):
+            return x.transpose(1, 0, 2, 3).reshape(1, x.shape[1], -1, x.shape[-1])
+
+        q_mixed, k_mixed = apply_batched_rope(
+            rope, flat(queries), flat(keys), context_lengths, prefix_lens, query_lens=[3, 3]
+        )
+        assert mx.allclose(q_mixed, flat(q_rot)).item()
+        assert mx.allclose(k_mixed, flat(k_rot)).item()
+
+        # Decodes are rotated at their last context position
+        q_dec, _ = apply_batched_rope(rope, queries[:, :, :1], keys[:, :, :1], context_lengths)
+        assert mx.allclose(q_dec[1:], rope(queries[1:, :, :1], offset=7)).item()
+
     def test_benchmark_paged_vs_native(self):
         """
         Benchmark PagedAttention vs Native MLX SDPA.
@@ -4,6 +4,7 @@ import mlx.core as mx
 import numpy as np
 
 from parallax.metal.paged_attention.kernel import reshape_and_cache
+from parallax.server.cache.allocator import BlockAllocator, SlotAllocator
 from parallax.server.cache_manager import CacheManager
 
 
@@ -158,5 +159,164 @@ class TestPagedKVIntegration(unittest.TestCase):
         )
 
 
+class TestBlockTableBuffers(unittest.TestCase):
+    def setUp(self):
+        self.block_size = 16
+        self.cache_manager = CacheManager(
+            num_layers=1,
+            num_kv_heads=4,
+            head_dim=16,
+            dtype=mx.float32,
+            block_size=self.block_size,
+            num_gpu_blocks=32,
+        )
+
+    def test_slot_mapping_from_block_table_buffers(self):
+        """Padded block tables and slot mappings follow blocks appended during decode."""
+        req_ids = ["req1", "req2"]
+        for rid, slen in zip(req_ids, [10, 16]):
+            self.cache_manager.allocate_request(rid, slen)
+        # req2 crosses into its second and third block while decoding
+        for _ in range(17):
+            self.cache_manager.append_slot("req2")
+
+        block_tables = [self.cache_manager.get_block_table(rid) for rid in req_ids]
+        self.assertEqual([len(bt) for bt in block_tables], [1, 3])
+        padded = self.cache_manager.get_padded_block_tables(req_ids)
+        np.testing.assert_array_equal(padded, [block_tables[0] + [0, 0], block_tables[1]])
+
+        # Prefill layout: 4 tokens of req1 from position 8, padded to 6 per request
+        slots = self.cache_manager.get_slot_mapping(padded, [8, 30], [4, 3], padded_len=6)
+        bs = self.block_size
+        req1 = [block_tables[0][0] * bs + p for p in range(8, 12)] + [-1, -1]
+        req2 = [block_tables[1][p // bs] * bs + p % bs for p in range(30, 33)] + [-1] * 3
+        np.testing.assert_array_equal(slots, req1 + req2)
+
+        # Ragged layout: the same tokens back to back
+        slots = self.cache_manager.get_slot_mapping(padded, [8, 30], [4, 3])
+        np.testing.assert_array_equal(slots, req1[:4] + req2[:3])
+
+
+class TestAllocators(unittest.TestCase):
+    def test_block_allocator_bulk_and_refcounts(self):
+        allocator = BlockAllocator(num_blocks=8, block_size=4)
+        blocks = allocator.allocate(5)
+        self.assertEqual(len(set(blocks)), 5)
+        self.assertEqual(allocator.get_num_free_blocks(), 3)
+        self.assertEqual(allocator.allocate(4), [])
+
+        allocator.incref(blocks[:2])
+        allocator.free(blocks)
+        # Shared blocks stay allocated until their last reference is dropped
+        self.assertEqual(allocator.get_num_free_blocks(), 6)
+        self.assertTrue(allocator.is_allocated(blocks[0]))
+        allocator.free(blocks[:2])
+        self.assertEqual(allocator.get_num_free_blocks(), 8)
+        self.assertEqual(sorted(allocator.allocate(8)), list(range(8)))
+
+    def test_block_allocator_detects_double_free(self):
+        allocator = BlockAllocator(num_blocks=4, block_size=4)
+        blocks = allocator.allocate(2)
+        allocator.free(blocks)
+        with self.assertRaises(ValueError):
+            allocator.free(blocks)
+        self.assertEqual(allocator.get_num_free_blocks(), 4)
+        with self.assertRaises(ValueError):
+            allocator.incref(blocks)
+
+        # Listing a block twice in one call drops two references
+        block = allocator.allocate(1)[0]
+        with self.assertRaises(ValueError):
+            allocator.free([block, block])
+        self.assertTrue(allocator.is_allocated(block))
+        self.assertEqual(allocator.get_num_free_blocks(), 3)
+        allocator.incref([block])
+        allocator.free([block, block])
+        self.assertEqual(allocator.get_num_free_blocks(), 4)
+        self.assertEqual(len(set(allocator.allocate(4))), 4)
+
+    def test_slot_allocator(self):
+        allocator = SlotAllocator(num_slots=2)
+        slots = [allocator.allocate(), allocator.allocate()]
+        self.assertEqual(sorted(slots), [0, 1])
+        self.assertEqual(allocator.allocate(), -1)
+        allocator.free(slots[0])
+        with self.assertLogs("parallax.server.cache.allocator", level="WARNING"):
+            allocator.free(slots[0])
+        self.assertEqual(allocator.get_num_free_slots(), 1)
+        self.assertEqual(allocator.allocate(), slots[0])
+
+    def test_watermark(self):
+        self.assertEqual(BlockAllocator(200, 4, watermark=0.05).watermark_blocks, 10)
+        with self.assertRaises(ValueError):
+            BlockAllocator(200, 4, watermark=1.0)
+
+
+class TestBlockPrefixCache(unittest.TestCase):
+    def setUp(self):
+        self.block_size = 4
+        self.cache_manager = CacheManager(
+            num_layers=1,
+            num_kv_heads=2,
+            head_dim=8,
+            dtype=mx.float32,
+            block_size=self.block_size,
+            num_gpu_blocks=8,
+            enable_prefix_cache=True,
+        )
+
+    def _run(self, rid, prompt):
+        """Allocates a request, decodes one token and returns its cached prefix length."""
+        self.cache_manager.allocate_request(rid, len(prompt), prompt_ids=prompt)
+        cached = self.cache_manager.get_num_computed_tokens(rid)
+        self.cache_manager.append_slot(rid)
+        return cached
+
+    def test_shared_prefix_blocks(self):
+        """A repeated prompt reuses the full blocks of the first one."""
+        cm = self.cache_manager
+        prompt = list(range(10))
+        self.assertEqual(self._run("req1", prompt), 0)
+        # Only the two full blocks are shared; the last token is always recomputed
+        self.assertEqual(self._run("req2", prompt), 8)
+        bt1, bt2 = cm.get_block_table("req1"), cm.get_block_table("req2")
+        self.assertEqual(bt1[:2], bt2[:2])
+        self.assertNotEqual(bt1[2], bt2[2])
+        self.assertEqual(cm.allocator.get_ref_count(bt1[0]), 3)
+
+        # A prompt equal to whole blocks still leaves its last token to compute
+        self.assertEqual(self._run("req3", prompt[:8]), 4)
+
+        for rid in ["req1", "req2", "req3"]:
+            cm.release_request(rid)
+        self.assertEqual(cm.prefix_cache.num_evictable_blocks, 2)
+        self.assertEqual(cm.get_num_free_blocks(), 8)
+
+    def test_evicts_unreferenced_blocks_under_pressure(self):
+        """Unreferenced cached blocks are reclaimed once free blocks run out."""
+        cm = self.cache_manager
+        self._run("req1", list(range(9)))
+        cm.release_request("req1")
+        self.assertEqual(cm.prefix_cache.num_cached_blocks, 2)
+
+        # Needs all 8 blocks, so both cached blocks must be evicted
+        self.assertTrue(cm.can_allocate(32))
+        self.assertTrue(cm.allocate_request("req2", 32, prompt_ids=list(range(100, 132))))
+        self.assertEqual(cm.prefix_cache.num_cached_blocks, 0)
+        self.assertEqual(cm.get_num_computed_tokens("req2"), 0)
+
+    def test_swapped_request_still_caches_its_prompt(self):
+        """A prompt swapped out before its first decode is cached once it decodes."""
+        cm = self.cache_manager
+        prompt = list(range(10))
+        cm.allocate_request("req1", len(prompt), prompt_ids=prompt)
+        cm.commit_prefill_tokens("req1", len(prompt))
+        self.assertTrue(cm.swap_out("req1"))
+        self.assertTrue(cm.swap_in("req1"))
+        self.assertTrue(cm.append_slot("req1"))
+        self.assertEqual(cm.prefix_cache.num_cached_blocks, 2)
+        self.assertEqual(self._run("req2", prompt), 8)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,97 @@
+"""
+Tests for the gateway's awaitable routing queue.
+"""
+
+import asyncio
+import threading
+
+from backend.server.routing_queue import RoutingQueue
+
+
+class FakeDispatcher:
+    """Answers request signals from another thread, like the scheduler's dispatch loop."""
+
+    def __init__(self):
+        self.capacity = 0
+        self.submitted = []
+
+    def submit(self, signal):
+        self.submitted.append(signal.request_id)
+        if self.capacity > 0:
+            self.capacity -= 1
+            path = ["node-0", "node-1"]
+        else:
+            path = []
+        threading.Thread(target=signal.set_routing_table, args=(path,)).start()
+
+
+def test_route_resolves_without_blocking_the_event_loop():
+    async def scenario():
+        dispatcher = FakeDispatcher()
+        dispatcher.capacity = 1
+        queue = RoutingQueue(dispatcher.submit)
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        task = asyncio.create_task(ticker())
+        path = await queue.route("r1", 0.0)
+        task.cancel()
+        return path, ticks
+
+    path, ticks = asyncio.run(scenario())
+    assert path == ["node-0", "node-1"]
+    assert ticks > 0
+
+
+def test_full_pipelines_are_served_in_arrival_order():
+    async def scenario():
+        dispatcher = FakeDispatcher()
+        queue = RoutingQueue(dispatcher.submit, max_waiting=2, retry_interval_s=10.0)
+        served = []
+
+        async def client(rid):
+            path = await queue.route(rid, 0.0)
+            served.append((rid, path))
+
+        tasks = []
+        for rid in ["r1", "r2", "r3"]:
+            tasks.append(asyncio.create_task(client(rid)))
+            await asyncio.sleep(0.05)
+        # The queue holds two waiters, the third request is turned away
+        assert queue.num_waiting == 2
+        assert served == [("r3", [])]
+        # Requests arriving behind a waiter queue up without asking the scheduler
+        assert dispatcher.submitted == ["r1"]
+
+        for _ in range(2):
+            dispatcher.capacity += 1
+            queue.notify_capacity()
+            await asyncio.sleep(0.05)
+        await asyncio.gather(*tasks)
+        return served, queue.num_waiting
+
+    served, num_waiting = asyncio.run(scenario())
+    assert [rid for rid, _ in served] == ["r3", "r1", "r2"]
+    assert all(path for rid, path in served if rid != "r3")
+    assert num_waiting == 0
+
+
+def test_gives_up_after_wait_timeout():
+    async def scenario():
+        queue = RoutingQueue(FakeDispatcher().submit, wait_timeout_s=0.1, retry_interval_s=0.02)
+        return await queue.route("r1", 0.0), queue.num_waiting
+
+    assert asyncio.run(scenario()) == ([], 0)
+
+
+def test_undecided_route_times_out():
+    async def scenario():
+        queue = RoutingQueue(lambda signal: None, decision_timeout_s=0.05)
+        return await queue.route("r1", 0.0)
+
+    assert asyncio.run(scenario()) is None
@@ -3,11 +3,21 @@ Test for the Sampler class
 """
 
 import unittest
+from unittest import mock
 
 import mlx.core as mx
 from mlx_lm.sample_utils import apply_min_p, apply_top_k, apply_top_p
 
-from parallax.server.sampling.sampler import Sampler, SamplingBatchInfo
+from parallax.server.request import InitialRequest, RequestStatus
+from parallax.server.sampling import sampler as sampler_module
+from parallax.server.sampling.penalizer import Penalizer
+from parallax.server.sampling.sampler import (
+    TOP_P_CANDIDATES,
+    Sampler,
+    SamplingBatchInfo,
+    apply_partial_top_k_top_p_min_p_sampling,
+)
+from parallax.server.sampling.sampling_params import SamplingParams
 
 
 class TestSampler(unittest.TestCase):
@@ -48,6 +58,153 @@ class TestSampler(unittest.TestCase):
 
         mx.allclose(batch_next_token_ids, next_token_ids_ref)
 
+    def _sampling_info(self, num_rows, top_k, top_p, max_top_k):
+        return SamplingBatchInfo(
+            temperatures=mx.ones((num_rows, 1), dtype=mx.float32),
+            top_ps=mx.full((num_rows,), top_p, dtype=mx.float32),
+            top_ks=mx.full((num_rows,), top_k, dtype=mx.int32),
+            min_ps=mx.zeros((num_rows,), dtype=mx.float32),
+            is_all_greedy=False,
+            need_min_p_sampling=False,
+            max_top_k=max_top_k,
+        )
+
+    def test_partial_top_k_sampling(self):
+        """Top-k over partial selection only samples the k most probable tokens"""
+        vocab_size, num_rows = 2000, 512
+        mx.random.seed(0)
+        row = mx.random.normal((vocab_size,))
+        logits = mx.broadcast_to(row, (num_rows, vocab_size))
+        top5 = set(mx.argsort(-row)[:5].tolist())
+
+        sampler = Sampler()
+        next_token_ids = sampler(logits, self._sampling_info(num_rows, 5, 1.0, max_top_k=5))
+        sampled = next_token_ids.reshape(-1).tolist()
+        self.assertTrue(set(sampled) <= top5)
+        # The most probable token is drawn most often
+        self.assertEqual(max(set(sampled), key=sampled.count), int(mx.argmax(row)))
+
+    def test_partial_top_p_sampling(self):
+        """Top-p without top-k uses the candidates only when they hold the top-p mass"""
+        vocab_size, num_rows = 2000, 256
+        top_ks = mx.full((num_rows,), -1, dtype=mx.int32)
+        top_ps = mx.full((num_rows,), 0.9, dtype=mx.float32)
+        min_ps = mx.zeros((num_rows,), dtype=mx.float32)
+
+        # Peaked: three tokens hold 99% of the mass
+        probs = mx.full((vocab_size,), 0.01 / (vocab_size - 3))
+        probs[mx.array([7, 42, 1999])] = mx.array([0.5, 0.3, 0.19])
+        peaked = mx.broadcast_to(probs, (num_rows, vocab_size))
+        next_token_ids, covered = apply_partial_top_k_top_p_min_p_sampling(
+            peaked, top_ks, top_ps, min_ps, False, 16
+        )
+        self.assertTrue(covered.item())
+        self.assertTrue(set(next_token_ids.reshape(-1).tolist()) <= {7, 42, 1999})
+
+        # Flat: the nucleus is far larger than the candidates, fall back to the full sort
+        flat = mx.full((num_rows, vocab_size), 1.0 / vocab_size)
+        _, covered = apply_partial_top_k_top_p_min_p_sampling(
+            flat, top_ks, top_ps, min_ps, False, 16
+        )
+        self.assertFalse(covered.item())
+        sampler = Sampler()
+        next_token_ids = sampler(mx.log(flat), self._sampling_info(num_rows, -1, 0.9, None))
+        self.assertGreater(len(set(next_token_ids.reshape(-1).tolist())), 16)
+
+    def test_untruncated_rows_skip_full_sort(self):
+        """Rows without top_k and top_p sample the full distribution next to top_k rows"""
+        vocab_size, num_rows = 2000, 256
+        mx.random.seed(0)
+        row = mx.random.normal((vocab_size,))
+        logits = mx.broadcast_to(row, (num_rows, vocab_size))
+        order = mx.argsort(-row).tolist()
+
+        reqs = [
+            InitialRequest(
+                request_id=f"r{i}",
+                input_ids=[0],
+                sampling_params=SamplingParams(top_k=5 if i % 2 else -1, top_p=1.0),
+            )
+            for i in range(num_rows)
+        ]
+        sampling_info = SamplingBatchInfo.from_reqs(reqs)
+        self.assertEqual(sampling_info.max_top_k, 5)
+
+        with mock.patch.object(
+            sampler_module, "apply_top_k_top_p_min_p_sampling", side_effect=AssertionError
+        ):
+            sampled = Sampler()(logits, sampling_info).reshape(-1).tolist()
+        self.assertTrue(set(sampled[1::2]) <= set(order[:5]))
+        # Not limited to the candidates of partial selection
+        self.assertTrue(set(sampled[::2]) - set(order[:TOP_P_CANDIDATES]))
+
+    @staticmethod
+    def _request(rid, input_ids, **params):
+        return InitialRequest(
+            request_id=rid,
+            status=RequestStatus.DECODING,
+            input_ids=input_ids,
+            sampling_params=SamplingParams(temperature=1.0, top_k=1, **params),
+        )
+
+    def test_penalties(self):
+        """Penalties use the prompt and the tokens sampled in previous steps"""
+        penalizer = Penalizer(initial_capacity=1)
+        reqs = [
+            self._request("rep", [0], repetition_penalty=2.0),
+            self._request("plain", [0]),
+            self._request("freq", [5], frequency_penalty=0.5, presence_penalty=1.0),
+        ]
+        sampler = Sampler()
+        logits = mx.array(
+            [
+                [4.0, 3.0, -1.0, 0.0, 0.0, 0.0],
+                [4.0, 3.0, -1.0, 0.0, 0.0, 0.0],
+                [0.0, 0.0, 0.0, 4.0, 3.0, 3.5],
+            ]
+        )
+
+        info = SamplingBatchInfo.from_reqs(reqs, penalizer)
+        self.assertEqual(info.penalties.rows.tolist(), [0, 2])
+        # The prompt token of "rep" is halved; repetition_penalty does not apply to "freq"
+        self.assertEqual(sampler(logits, info).tolist(), [1, 0, 3])
+        self.assertEqual(len(penalizer), 2)
+        self.assertEqual(penalizer.capacity, 2)
+
+        # Sampled tokens are penalized in the following steps
+        self.assertEqual(
+            sampler(logits, SamplingBatchInfo.from_reqs(reqs, penalizer)).tolist(), [0, 0, 5]
+        )
+        penalized = SamplingBatchInfo.from_reqs(reqs, penalizer).penalties.apply(logits)
+        self.assertTrue(mx.allclose(penalized[0], mx.array([2.0, 1.5, -1.0, 0.0, 0.0, 0.0])))
+        self.assertTrue(mx.allclose(penalized[2], mx.array([0.0, 0.0, 0.0, 2.5, 3.0, 2.0])))
+        # The caller's logits are left unchanged
+        self.assertEqual(logits[0, 0].item(), 4.0)
+
+        # A released slot is reused with fresh statistics
+        penalizer.release("rep")
+        reqs[0] = self._request("rep2", [2], repetition_penalty=2.0)
+        info = SamplingBatchInfo.from_reqs(reqs, penalizer)
+        self.assertEqual(info.penalties.slots.tolist(), [0, 1])
+        self.assertTrue(
+            mx.allclose(info.penalties.apply(logits)[0], mx.array([4.0, 3.0, -2.0, 0.0, 0.0, 0.0]))
+        )
+
+    def test_penalties_skip_intermediate_prefill_chunks(self):
+        """Prompt chunks that do not end the prompt sample no token"""
+        penalizer = Penalizer()
+        req = self._request("chunked", [1, 2, 3, 4], presence_penalty=1.0)
+        req.status = RequestStatus.PREFILLING
+        req.prefill_chunk_len = 2
+        self.assertIsNone(SamplingBatchInfo.from_reqs([req], penalizer).penalties)
+        self.assertEqual(len(penalizer), 0)
+        req.prefill_offset = 2
+        self.assertIsNotNone(SamplingBatchInfo.from_reqs([req], penalizer).penalties)
+        # Requests without penalties are not tracked
+        self.assertIsNone(
+            SamplingBatchInfo.from_reqs([self._request("x", [1])], penalizer).penalties
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
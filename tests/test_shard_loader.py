@@ -2,9 +2,20 @@
 Tests for the shard_loader module.
 """
 
+import json
+import pathlib
 from unittest.mock import Mock, patch
 
-from parallax.server.shard_loader import MLXModelLoader
+import mlx.core as mx
+from mlx.utils import tree_flatten
+from mlx_lm.models import qwen3
+
+from parallax.server.shard_loader import (
+    MLXModelLoader,
+    load_safetensors_tensors,
+    plan_shard_weights,
+    remap_shard_weight_key,
+)
 
 
 class TestMLXModelLoader:
@@ -165,3 +176,133 @@ class TestMLXModelLoader:
                 # This should not raise an exception, just log a warning
                 loader = MLXModelLoader("test_model_path")
                 assert not loader.block_class_map
+
+
+def _write_checkpoint(model_path, num_layers, layers_per_file, with_index=True):
+    """Writes a tiny sharded checkpoint, `layers_per_file` decoder layers per file."""
+    weight_map = {}
+    num_files = (num_layers + layers_per_file - 1) // layers_per_file
+    for file_idx in range(num_files):
+        filename = f"model-{file_idx + 1:05d}-of-{num_files:05d}.safetensors"
+        tensors = {}
+        for layer in range(file_idx * layers_per_file, (file_idx + 1) * layers_per_file):
+            tensors[f"model.layers.{layer}.mlp.weight"] = mx.full((2, 3), layer, dtype=mx.bfloat16)
+            tensors[f"model.layers.{layer}.mlp.scales"] = mx.array([layer, 7], dtype=mx.uint32)
+        if file_idx == 0:
+            tensors["model.embed_tokens.weight"] = mx.ones((4, 3), dtype=mx.float16)
+        if file_idx == num_files - 1:
+            tensors["model.norm.weight"] = mx.ones((3,), dtype=mx.float32)
+        mx.save_safetensors(str(model_path / filename), tensors)
+        weight_map.update({key: filename for key in tensors})
+    if with_index:
+        with open(model_path / "model.safetensors.index.json", "w") as f:
+            json.dump({"weight_map": weight_map}, f)
+    return sorted(str(path) for path in model_path.glob("model*.safetensors"))
+
+
+class TestShardWeightLoading:
+    """Test planning and reading the tensors of a shard."""
+
+    def test_remap_shard_weight_key(self):
+        """Test checkpoint keys are mapped to shard-local names."""
+        assert remap_shard_weight_key("model.layers.5.mlp.weight", 4, 8, False, False) == [
+            "layers.1.mlp.weight"
+        ]
+        assert remap_shard_weight_key("model.layers.8.mlp.weight", 4, 8, False, False) == []
+        assert remap_shard_weight_key("model.embed_tokens.weight", 0, 4, True, False) == [
+            "embed_tokens.weight"
+        ]
+        assert remap_shard_weight_key("model.embed_tokens.weight", 0, 4, True, True, True) == [
+            "embed_tokens.weight",
+            "lm_head.weight",
+        ]
+        assert remap_shard_weight_key("model.embed_tokens.weight", 4, 8, False, True, True) == [
+            "lm_head.weight"
+        ]
+        assert remap_shard_weight_key("model.norm.weight", 4, 8, False, True) == ["norm.weight"]
+        assert remap_shard_weight_key("lm_head.weight", 4, 8, False, True) == ["lm_head.weight"]
+        assert remap_shard_weight_key("lm_head.weight", 0, 4, True, False) == []
+
+    def test_plan_uses_index(self, tmp_path):
+        """Test files holding only other shards' layers are left out of the plan."""
+        weight_files = _write_checkpoint(tmp_path, num_layers=8, layers_per_file=2)
+        # Unreadable, so the plan must not open it
+        pathlib.Path(weight_files[0]).write_bytes(b"")
+
+        plan = plan_shard_weights(tmp_path, weight_files, 3, 6, False, False)
+        assert list(plan) == weight_files[1:3]
+        assert plan[weight_files[1]] == {
+            "model.layers.3.mlp.weight": ["layers.0.mlp.weight"],
+            "model.layers.3.mlp.scales": ["layers.0.mlp.scales"],
+        }
+        assert sum(len(keys) for keys in plan.values()) == 6
+
+    def test_plan_without_index(self, tmp_path):
+        """Test the plan falls back to reading safetensors headers."""
+        weight_files = _write_checkpoint(tmp_path, 4, layers_per_file=2, with_index=False)
+        plan = plan_shard_weights(tmp_path, weight_files, 2, 4, False, True)
+        assert list(plan) == weight_files[1:]
+        assert plan[weight_files[1]]["model.norm.weight"] == ["norm.weight"]
+
+    def test_load_safetensors_tensors(self, tmp_path):
+        """Test tensors read through the memory map match what was saved."""
+        weight_files = _write_checkpoint(tmp_path, num_layers=2, layers_per_file=2)
+        keys = ["model.layers.1.mlp.weight", "model.layers.1.mlp.scales", "model.norm.weight"]
+        tensors = load_safetensors_tensors(weight_files[0], keys)
+
+        assert list(tensors) == keys
+        expected = mx.load(weight_files[0])
+        for key in keys:
+            assert tensors[key].dtype == expected[key].dtype
+            assert tensors[key].shape == expected[key].shape
+            assert mx.array_equal(tensors[key], expected[key])
+
+    def test_reload_reuses_kept_layers(self, tmp_path):
+        """Test moving a shard to a new layer range reads only the layers it gains."""
+        config = {
+            "model_type": "qwen3",
+            "architectures": ["Qwen3ForCausalLM"],
+            "hidden_size": 32,
+            "num_hidden_layers": 6,
+            "intermediate_size": 64,
+            "num_attention_heads": 2,
+            "num_key_value_heads": 1,
+            "head_dim": 16,
+            "rms_norm_eps": 1e-6,
+            "vocab_size": 64,
+            "max_position_embeddings": 128,
+            "rope_theta": 10000.0,
+            "tie_word_embeddings": False,
+            "torch_dtype": "bfloat16",
+        }
+        with open(tmp_path / "config.json", "w") as f:
+            json.dump(config, f)
+        model = qwen3.Model(qwen3.ModelArgs.from_dict(config))
+        mx.save_safetensors(
+            str(tmp_path / "model.safetensors"), dict(tree_flatten(model.parameters()))
+        )
+
+        loader = MLXModelLoader(str(tmp_path), start_layer=0, end_layer=3)
+        shard, _, _ = loader.load(use_selective_download=False, tokenizer="tokenizer")
+        kept = loader.checkpoint_weights(shard, 2, 6)
+        assert {key.split(".")[2] for key in kept} == {"2"}
+
+        loader.start_layer, loader.end_layer = 2, 6
+        with patch(
+            "parallax.server.shard_loader.load_safetensors_tensors",
+            wraps=load_safetensors_tensors,
+        ) as read:
+            new_shard, _, tokenizer = loader.load(
+                use_selective_download=False, reuse_weights=kept, tokenizer="tokenizer"
+            )
+        read_keys = {key for call in read.call_args_list for key in call.args[1]}
+        assert tokenizer == "tokenizer"
+        assert not any(key.startswith("model.layers.2.") for key in read_keys)
+        assert "model.layers.3.mlp.gate_proj.weight" in read_keys
+
+        old_params = dict(tree_flatten(shard.parameters()))
+        new_params = dict(tree_flatten(new_shard.parameters()))
+        assert mx.array_equal(
+            new_params["layers.0.mlp.gate_proj.weight"], old_params["layers.2.mlp.gate_proj.weight"]
+        )
+        assert "lm_head.weight" in new_params and "embed_tokens.weight" not in new_params
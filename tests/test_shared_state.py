@@ -0,0 +1,92 @@
+"""
+Tests for the shared memory SharedState.
+"""
+
+import multiprocessing
+
+import pytest
+
+from parallax.utils.shared_state import MAX_STATUS_BYTES, SharedState
+
+
+def _report_from_child(shared_state: SharedState):
+    shared_state.update(block_start_index=4, block_end_index=12, model_name="Qwen/Qwen3-0.6B")
+    for _ in range(3):
+        shared_state.update_metrics(current_requests=2, layer_latency_ms_sample=10.0)
+    shared_state.set("_layer_allocation_changed", True)
+
+
+def test_defaults():
+    shared_state = SharedState.create()
+    assert shared_state.get_model_info() == {
+        "model_name": None,
+        "block_start_index": None,
+        "block_end_index": None,
+        "tp_size": None,
+        "_layer_allocation_changed": False,
+    }
+    assert shared_state.get_status() is None
+    assert shared_state.get_metrics() == {
+        "current_requests": 0,
+        "layer_latency_ms": None,
+        "_last_update_ts": 0.0,
+    }
+
+
+def test_dict_interface():
+    shared_state = SharedState.create()
+    shared_state["tp_size"] = 2
+    shared_state.set_status("ready")
+    shared_state.update(block_start_index=0, block_end_index=28)
+
+    assert shared_state["tp_size"] == 2
+    assert shared_state.get("status") == "ready"
+    assert shared_state.get("model_name", "default") == "default"
+    assert "block_end_index" in shared_state and "unknown" not in shared_state
+    # Views of the same block see each other's writes
+    assert SharedState(shared_state).get("block_end_index") == 28
+
+    shared_state.set("block_start_index", None)
+    assert shared_state["block_start_index"] is None
+    with pytest.raises(KeyError):
+        shared_state.set("unknown", 1)
+    with pytest.raises(ValueError):
+        shared_state.set_status("x" * (MAX_STATUS_BYTES + 1))
+
+
+def test_latency_ewma():
+    shared_state = SharedState.create()
+    shared_state.update_metrics(layer_latency_ms_sample=10.0)
+    shared_state.update_metrics(layer_latency_ms_sample=20.0, ewma_alpha=0.5)
+    shared_state.update_metrics(current_requests=3)
+
+    metrics = shared_state.get_metrics()
+    assert metrics["layer_latency_ms"] == pytest.approx(15.0)
+    assert metrics["current_requests"] == 3
+    assert metrics["_last_update_ts"] > 0
+
+
+def test_finish_layer_reallocation():
+    shared_state = SharedState.create()
+    shared_state.update(block_start_index=0, block_end_index=8, _layer_allocation_changed=True)
+    assert shared_state.finish_layer_reallocation(0, 8, "ready")
+    assert not shared_state.get_layer_allocation_changed()
+    assert shared_state.get_status() == "ready"
+
+    # A newer allocation published while the previous one was loading is kept
+    shared_state.update(block_start_index=0, block_end_index=12, _layer_allocation_changed=True)
+    assert not shared_state.finish_layer_reallocation(0, 8, "ready")
+    assert shared_state.get_layer_allocation_changed()
+
+
+def test_shared_with_subprocess():
+    shared_state = SharedState.create()
+    process = multiprocessing.Process(target=_report_from_child, args=(shared_state,))
+    process.start()
+    process.join(timeout=30)
+
+    assert process.exitcode == 0
+    assert shared_state.get_layer_allocation_changed()
+    assert shared_state.get_model_info()["model_name"] == "Qwen/Qwen3-0.6B"
+    assert shared_state.get_metrics()["current_requests"] == 2
+    assert shared_state.get_metrics()["layer_latency_ms"] == pytest.approx(10.0)
@@ -0,0 +1,45 @@
+"""
+Tests for incremental stop-string matching.
+"""
+
+from parallax.utils.stop_strings import StopStringMatcher, parse_stop_strs
+
+
+def _feed_all(matcher: StopStringMatcher, segments):
+    emitted = ""
+    for segment in segments:
+        text, matched = matcher.feed(segment)
+        emitted += text
+        if matched is not None:
+            return emitted, matched
+    return emitted + matcher.flush(), None
+
+
+def test_parse_stop_strs():
+    assert parse_stop_strs({}) is None
+    assert parse_stop_strs({"stop": "END"}) == ["END"]
+    assert parse_stop_strs({"stop": ["a", ""]}) == ["a"]
+    assert parse_stop_strs({"stop": "x", "sampling_params": {"stop": ["y"]}}) == ["y"]
+    assert parse_stop_strs({"sampling_params": None}) is None
+
+
+def test_match_across_segments():
+    matcher = StopStringMatcher(["</answer>", "\n\nUser:"])
+    emitted, matched = _feed_all(matcher, ["The answer", " is 42</an", "swer", "> ignored"])
+    assert (emitted, matched) == ("The answer is 42", "</answer>")
+
+    # A partial match is held back, then released once it cannot complete
+    matcher = StopStringMatcher(["</answer>"])
+    assert matcher.feed("a </ans") == ("a ", None)
+    assert matcher.feed("x") == ("</ansx", None)
+    assert matcher.feed("</") == ("", None)
+    assert matcher.flush() == "</"
+
+
+def test_overlapping_stop_strings():
+    # The stop string ending first wins, even inside a longer partial match
+    assert _feed_all(StopStringMatcher(["abcd", "bc"]), ["xab", "cd"]) == ("xa", "bc")
+    # Falling back along suffix links keeps matches that restart inside a failed one
+    assert _feed_all(StopStringMatcher(["aab"]), ["aa", "aab"]) == ("aa", "aab")
+    assert _feed_all(StopStringMatcher(["he", "she", "hers"]), ["us", "hers"]) == ("u", "she")
+    assert _feed_all(StopStringMatcher(["needle"]), ["no match here"]) == ("no match here", None)